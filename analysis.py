@@ -1,261 +1,502 @@
+import io
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, date
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import seaborn as sns
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 import logging
-from utils import ResourceCalculator, Formatter
+from utils import Formatter
+from metrics import REGISTRY
+
+# pyarrow необязателен: без него выгрузка читается pandas.read_csv с теми же типами колонок
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Обращения к кэшу отчетов: result=hit/miss
+REPORT_CACHE_REQUESTS = REGISTRY.counter("datacenter_report_cache_total", "Обращения к кэшу отчетов",
+                                         ("report", "result"))
+
 
 class DataAnalyzer:
     """Класс для анализа данных кластера"""
     
+    RENDER_CACHE_SIZE = 4
+    FORECAST_HORIZON_DAYS = 90  # Горизонт, в пределах которого прогноз попадает в рекомендации
+    # Кэш отчетов по версии данных хранилища: не более REPORT_CACHE_SIZE отчетов
+    # и REPORT_CACHE_BYTES памяти под их DataFrame, вытесняются давно не использованные
+    REPORT_CACHE_SIZE = 16
+    REPORT_CACHE_BYTES = 256 * 2 ** 20
+    
     def __init__(self, db):
         self.db = db
+        self._render_cache: Dict[str, bytes] = {}
+        self._render_lock = threading.Lock()
+        self._report_cache: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        self._report_cache_bytes = 0
+        self._report_version = None
+        self._report_lock = threading.Lock()
+    
+    # Типы колонок выгрузки хранилища (StorageBackend.export_csv): имена гипервизоров и типы ВМ -
+    # категории, целые уменьшенной разрядности, даты - datetime64
+    FRAME_TYPES = {
+        'hypervisors': {'hv_name': 'category', 'cpu': 'int32', 'ram': 'int32', 'free_cpu': 'int32',
+                        'free_ram': 'int32', 'num_vms': 'int32', 'cpu_capacity': 'int32', 'ram_capacity': 'int32'},
+        'vms': {'vm_name': 'string', 'vcpu': 'int16', 'vram': 'int32', 'vhdd': 'int32',
+                'hv_name': 'category', 'vm_type': 'category'}
+    }
+    FRAME_DATES = {'hypervisors': ['created_at'], 'vms': ['creation_date']}
+    
+    def _load_frame(self, kind: str) -> pd.DataFrame:
+        """Таблица хранилища в типизированный DataFrame через CSV-выгрузку.
+        С pyarrow CSV разбирается в буферы Arrow и передается в pandas без построчных объектов Python"""
+        data = self.db.export_csv(kind)
+        if data is None:
+            raise RuntimeError(f"не удалось выгрузить {kind}")
+        types = self.FRAME_TYPES[kind]
+        
+        if pa is not None:
+            arrow_types = {'category': pa.dictionary(pa.int32(), pa.string()), 'string': pa.string(),
+                           'int16': pa.int16(), 'int32': pa.int32()}
+            column_types = {column: arrow_types[dtype] for column, dtype in types.items()}
+            column_types.update({column: pa.timestamp('us') for column in self.FRAME_DATES[kind]})
+            table = pa_csv.read_csv(pa.BufferReader(data),
+                                    convert_options=pa_csv.ConvertOptions(column_types=column_types))
+            # Строки остаются в буфере Arrow (string[pyarrow]), словари становятся категориями
+            df = table.to_pandas(types_mapper=lambda t: pd.StringDtype("pyarrow") if t == pa.string() else None)
+        else:
+            df = pd.read_csv(io.BytesIO(data), dtype=types, parse_dates=self.FRAME_DATES[kind],
+                             keep_default_na=False, na_values=[''])
+        return df if len(df) else pd.DataFrame()
+    
+    @staticmethod
+    def _usage_percent(capacity: pd.Series, free: pd.Series) -> pd.Series:
+        """Использование в процентах от емкости (0 при нулевой емкости), как ResourceCalculator"""
+        return ((capacity - free) / capacity.where(capacity != 0) * 100).fillna(0.0)
+    
+    @staticmethod
+    def _load_status(usage: pd.Series) -> np.ndarray:
+        return np.select([usage > 80, usage > 50], ['Высокая', 'Средняя'], 'Низкая')
+    
+    @staticmethod
+    def _report_size(value: Any) -> int:
+        """Объем DataFrame отчета в памяти (словари отчетов малы и не учитываются)"""
+        frames = value if isinstance(value, tuple) else (value,)
+        return sum(int(frame.memory_usage(index=True, deep=True).sum())
+                   for frame in frames if isinstance(frame, pd.DataFrame))
+    
+    def _cached_report(self, name: str, build, *key) -> Any:
+        """Отчет из кэша по версии данных хранилища или построенный заново.
+        Версия читается до построения: запись во время построения даст новую версию, и отчет
+        не попадет в кэш. Ошибки построения не кэшируются"""
+        version = self.db.get_data_version()
+        if version is None:
+            return build()
+        cache_key = (name,) + key
+        with self._report_lock:
+            # Отчеты по прежней версии данных больше не понадобятся
+            if version != self._report_version:
+                self._report_cache.clear()
+                self._report_cache_bytes = 0
+                self._report_version = version
+            entry = self._report_cache.get(cache_key)
+            if entry is not None:
+                self._report_cache.move_to_end(cache_key)
+                REPORT_CACHE_REQUESTS.inc(name, "hit")
+                return entry[0]
+        
+        REPORT_CACHE_REQUESTS.inc(name, "miss")
+        value = build()
+        size = self._report_size(value)
+        if size > self.REPORT_CACHE_BYTES:
+            return value
+        with self._report_lock:
+            # Пока отчет строился, данные изменились - он уже устарел
+            if version != self._report_version:
+                return value
+            if cache_key not in self._report_cache:
+                self._report_cache[cache_key] = (value, size)
+                self._report_cache_bytes += size
+            while (len(self._report_cache) > self.REPORT_CACHE_SIZE
+                   or self._report_cache_bytes > self.REPORT_CACHE_BYTES):
+                self._report_cache_bytes -= self._report_cache.popitem(last=False)[1][1]
+        return value
+    
+    def clear_report_cache(self):
+        """Сброс кэша отчетов (например, после изменения данных в обход хранилища)"""
+        with self._report_lock:
+            self._report_cache.clear()
+            self._report_cache_bytes = 0
+            self._report_version = None
     
     def get_resource_usage_report(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        """Отчет об использовании ресурсов в кластере"""
+        """Отчет об использовании ресурсов в кластере.
+        Таблицы общие с кэшем: возвращаются поверхностные копии, добавление колонок кэш не меняет"""
         try:
-            # Получаем данные
-            hypervisors = self.db.get_all_hypervisors()
-            vms = self.db.get_all_vms()
-            
-            # Создаем DataFrame
-            hv_df = pd.DataFrame(hypervisors)
-            vm_df = pd.DataFrame(vms)
-            
-            # Анализ использования ресурсов
-            if not hv_df.empty:
-                # Добавляем расчет использования в процентах
-                hv_df['cpu_usage_percent'] = hv_df.apply(
-                    lambda row: ResourceCalculator.calculate_cpu_usage(row['cpu'], row['free_cpu']), 
-                    axis=1
-                )
-                hv_df['ram_usage_percent'] = hv_df.apply(
-                    lambda row: ResourceCalculator.calculate_ram_usage(row['ram'], row['free_ram']), 
-                    axis=1
-                )
-                
-                # Добавляем статус загрузки
-                hv_df['cpu_status'] = hv_df['cpu_usage_percent'].apply(
-                    lambda x: 'Высокая' if x > 80 else 'Средняя' if x > 50 else 'Низкая'
-                )
-                hv_df['ram_status'] = hv_df['ram_usage_percent'].apply(
-                    lambda x: 'Высокая' if x > 80 else 'Средняя' if x > 50 else 'Низкая'
-                )
-            
-            if not vm_df.empty:
-                # Добавляем тип ВМ
-                vm_df['vm_type'] = vm_df['vm_name'].apply(Formatter.format_vm_type)
-                
-                # Форматируем дату
-                vm_df['creation_date_str'] = vm_df['creation_date'].apply(
-                    lambda x: Formatter.format_datetime(x) if pd.notnull(x) else ''
-                )
-            
-            return hv_df, vm_df
-            
+            hv_df, vm_df = self._cached_report("resource_usage", self._build_resource_usage_report)
+            return hv_df.copy(deep=False), vm_df.copy(deep=False)
         except Exception as e:
             logger.error(f"Ошибка при получении отчета об использовании ресурсов: {e}")
             return pd.DataFrame(), pd.DataFrame()
     
-    def generate_visualizations(self, save_path: str = None):
-        """Генерация визуализаций для кластера"""
+    def _build_resource_usage_report(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Построение отчета об использовании ресурсов"""
+        # Получаем данные (тип ВМ вычисляется хранилищем при выгрузке)
+        hv_df = self._load_frame('hypervisors')
+        vm_df = self._load_frame('vms')
+        
+        # Анализ использования ресурсов
+        if not hv_df.empty:
+            # Добавляем расчет использования в процентах от емкости с учетом переподписки
+            hv_df['cpu_usage_percent'] = self._usage_percent(hv_df['cpu_capacity'], hv_df['free_cpu'])
+            hv_df['ram_usage_percent'] = self._usage_percent(hv_df['ram_capacity'], hv_df['free_ram'])
+            
+            # Занятые физические ресурсы
+            overcommit_cpu, overcommit_ram = self.db.get_overcommit()
+            hv_df['used_physical_cpu'] = ((hv_df['cpu_capacity'] - hv_df['free_cpu']) / overcommit_cpu).round(1)
+            hv_df['used_physical_ram'] = ((hv_df['ram_capacity'] - hv_df['free_ram']) / overcommit_ram).round(1)
+            
+            # Добавляем статус загрузки
+            hv_df['cpu_status'] = self._load_status(hv_df['cpu_usage_percent'])
+            hv_df['ram_status'] = self._load_status(hv_df['ram_usage_percent'])
+        
+        if not vm_df.empty:
+            # Форматируем дату
+            vm_df['creation_date_str'] = vm_df['creation_date'].dt.strftime("%Y-%m-%d %H:%M:%S").fillna('')
+        
+        return hv_df, vm_df
+    
+    @staticmethod
+    def _snapshot_hash(hv_df: pd.DataFrame, vm_df: pd.DataFrame, dpi: int, fmt: str) -> str:
+        """Хэш данных, от которых зависит изображение"""
+        digest = hashlib.sha1(f"{dpi}|{fmt}".encode())
+        columns = ['hv_name', 'cpu_usage_percent', 'ram_usage_percent', 'num_vms']
+        digest.update(pd.util.hash_pandas_object(hv_df[columns], index=False).values.tobytes())
+        if not vm_df.empty and 'vm_type' in vm_df.columns:
+            digest.update(str(sorted(vm_df['vm_type'].value_counts().items())).encode())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _is_headless() -> bool:
+        """Нет возможности показать окно с графиками"""
+        backend = matplotlib.get_backend().lower()
+        if backend in ('agg', 'pdf', 'ps', 'svg', 'cairo', 'template') or backend.startswith('module://'):
+            return True
+        return os.name != 'nt' and sys.platform != 'darwin' and not os.environ.get('DISPLAY')
+    
+    @staticmethod
+    def _plot_usage_bars(ax, names, values, colors, title: str, ylabel: str, thresholds: bool = True, 
+                         label_fmt: str = '%.1f%%'):
+        """Столбчатая диаграмма с подписями значений"""
+        bars = ax.bar(names, values, color=colors, edgecolor='black', linewidth=1)
+        ax.set_title(title, fontsize=14, fontweight='bold', pad=15)
+        ax.set_ylabel(ylabel, fontsize=12)
+        ax.set_xlabel('Гипервизоры', fontsize=12)
+        ax.tick_params(axis='x', rotation=45, labelsize=10)
+        ax.tick_params(axis='y', labelsize=10)
+        ax.grid(axis='y', alpha=0.3, linestyle='--')
+        
+        if thresholds:
+            # Линии порогов
+            ax.axhline(y=80, color='darkred', linestyle='--', 
+                       alpha=0.7, linewidth=2, label='Критический порог (80%)')
+            ax.axhline(y=50, color='darkorange', linestyle='--', 
+                       alpha=0.7, linewidth=2, label='Средний порог (50%)')
+            ax.legend(fontsize=9)
+        
+        # Подписи значений одним вызовом вместо текста для каждого столбца
+        ax.bar_label(bars, fmt=label_fmt, padding=2, fontsize=9, fontweight='bold')
+    
+    def _draw_figure(self, fig, hv_df: pd.DataFrame, vm_df: pd.DataFrame):
+        """Построение графиков на переданной фигуре"""
+        axes = fig.subplots(2, 2)
+        fig.suptitle('Анализ использования ресурсов кластера Москва', 
+                     fontsize=18, fontweight='bold', y=0.98)
+        
+        # 1. Использование CPU по гипервизорам
+        cpu_usage = hv_df['cpu_usage_percent'].to_numpy()
+        colors = np.where(cpu_usage > 80, 'red', np.where(cpu_usage > 50, 'orange', 'green'))
+        self._plot_usage_bars(axes[0, 0], hv_df['hv_name'], cpu_usage, colors,
+                              'Использование CPU по гипервизорам', 'Использование CPU (%)')
+        
+        # 2. Использование RAM по гипервизорам
+        ram_usage = hv_df['ram_usage_percent'].to_numpy()
+        colors = np.where(ram_usage > 80, 'red', np.where(ram_usage > 50, 'orange', 'blue'))
+        self._plot_usage_bars(axes[0, 1], hv_df['hv_name'], ram_usage, colors,
+                              'Использование RAM по гипервизорам', 'Использование RAM (%)')
+        
+        # 3. Количество ВМ на гипервизорах
+        num_vms = hv_df['num_vms'].to_numpy()
+        colors = matplotlib.cm.summer(num_vms / max(num_vms.max(), 1))
+        self._plot_usage_bars(axes[1, 0], hv_df['hv_name'], num_vms, colors,
+                              'Количество ВМ на гипервизорах', 'Количество ВМ', 
+                              thresholds=False, label_fmt='%d')
+        
+        # 4. Распределение ВМ по типам (если есть данные)
+        vm_type_counts = vm_df['vm_type'].value_counts() if not vm_df.empty and 'vm_type' in vm_df.columns else None
+        if vm_type_counts is not None and not vm_type_counts.empty:
+            colors = matplotlib.cm.Set3(range(len(vm_type_counts)))
+            wedges, texts, autotexts = axes[1, 1].pie(
+                vm_type_counts.values, 
+                labels=vm_type_counts.index, 
+                autopct='%1.1f%%',
+                startangle=90,
+                colors=colors,
+                textprops={'fontsize': 10}
+            )
+            # Делаем подписи более читаемыми
+            for autotext in autotexts:
+                autotext.set_color('white')
+                autotext.set_fontweight('bold')
+        else:
+            axes[1, 1].text(0.5, 0.5, 'Нет данных о ВМ', 
+                            ha='center', va='center', fontsize=12)
+        axes[1, 1].set_title('Распределение ВМ по типам', 
+                             fontsize=14, fontweight='bold', pad=15)
+        
+        fig.tight_layout()
+    
+    def draw_visualizations(self, fig) -> bool:
+        """Построение графиков кластера на переданной фигуре (для окна GUI).
+        Возвращает False, если нет данных для визуализации"""
+        hv_df, vm_df = self.get_resource_usage_report()
+        if hv_df.empty:
+            return False
+        self._draw_figure(fig, hv_df, vm_df)
+        return True
+    
+    def generate_visualizations(self, save_path: str = None, dpi: int = 300, 
+                                fmt: Optional[str] = None, show: Optional[bool] = None) -> Optional[str]:
+        """Генерация визуализаций для кластера.
+        Рендеринг выполняется через Agg без pyplot, поэтому метод можно вызывать не из потока GUI.
+        show=None - показать окно только при наличии дисплея"""
         try:
             hv_df, vm_df = self.get_resource_usage_report()
             
             if hv_df.empty:
                 logger.warning("Нет данных для визуализации")
-                return
-            
-            # Создаем фигуру с несколькими графиками
-            fig, axes = plt.subplots(2, 2, figsize=(16, 12))
-            fig.suptitle('Анализ использования ресурсов кластера Москва', 
-                        fontsize=18, fontweight='bold', y=0.98)
+                return None
             
-            # 1. Использование CPU по гипервизорам
-            if not hv_df.empty and 'cpu_usage_percent' in hv_df.columns:
-                colors = ['red' if x > 80 else 'orange' if x > 50 else 'green' 
-                         for x in hv_df['cpu_usage_percent']]
-                
-                bars = axes[0, 0].bar(hv_df['hv_name'], hv_df['cpu_usage_percent'], 
-                                     color=colors, edgecolor='black', linewidth=1)
-                axes[0, 0].set_title('Использование CPU по гипервизорам', 
-                                    fontsize=14, fontweight='bold', pad=15)
-                axes[0, 0].set_ylabel('Использование CPU (%)', fontsize=12)
-                axes[0, 0].set_xlabel('Гипервизоры', fontsize=12)
-                axes[0, 0].tick_params(axis='x', rotation=45, labelsize=10)
-                axes[0, 0].tick_params(axis='y', labelsize=10)
-                axes[0, 0].grid(axis='y', alpha=0.3, linestyle='--')
-                
-                # Линия порога
-                axes[0, 0].axhline(y=80, color='darkred', linestyle='--', 
-                                  alpha=0.7, linewidth=2, label='Критический порог (80%)')
-                axes[0, 0].axhline(y=50, color='darkorange', linestyle='--', 
-                                  alpha=0.7, linewidth=2, label='Средний порог (50%)')
-                axes[0, 0].legend(fontsize=9)
-                
-                # Добавляем значения на столбцы
-                for bar, value in zip(bars, hv_df['cpu_usage_percent']):
-                    height = bar.get_height()
-                    axes[0, 0].text(bar.get_x() + bar.get_width()/2, height + 1, 
-                                   f'{value:.1f}%', ha='center', va='bottom', 
-                                   fontsize=9, fontweight='bold')
+            if fmt is None:
+                fmt = os.path.splitext(save_path)[1].lstrip('.') if save_path else 'png'
+                fmt = fmt or 'png'
+            if show is None:
+                show = not self._is_headless()
             
-            # 2. Использование RAM по гипервизорам
-            if not hv_df.empty and 'ram_usage_percent' in hv_df.columns:
-                colors = ['red' if x > 80 else 'orange' if x > 50 else 'blue' 
-                         for x in hv_df['ram_usage_percent']]
-                
-                bars = axes[0, 1].bar(hv_df['hv_name'], hv_df['ram_usage_percent'], 
-                                     color=colors, edgecolor='black', linewidth=1)
-                axes[0, 1].set_title('Использование RAM по гипервизорам', 
-                                    fontsize=14, fontweight='bold', pad=15)
-                axes[0, 1].set_ylabel('Использование RAM (%)', fontsize=12)
-                axes[0, 1].set_xlabel('Гипервизоры', fontsize=12)
-                axes[0, 1].tick_params(axis='x', rotation=45, labelsize=10)
-                axes[0, 1].tick_params(axis='y', labelsize=10)
-                axes[0, 1].grid(axis='y', alpha=0.3, linestyle='--')
-                
-                # Линия порога
-                axes[0, 1].axhline(y=80, color='darkred', linestyle='--', 
-                                  alpha=0.7, linewidth=2, label='Критический порог (80%)')
-                axes[0, 1].axhline(y=50, color='darkorange', linestyle='--', 
-                                  alpha=0.7, linewidth=2, label='Средний порог (50%)')
-                axes[0, 1].legend(fontsize=9)
-                
-                # Добавляем значения на столбцы
-                for bar, value in zip(bars, hv_df['ram_usage_percent']):
-                    height = bar.get_height()
-                    axes[0, 1].text(bar.get_x() + bar.get_width()/2, height + 1, 
-                                   f'{value:.1f}%', ha='center', va='bottom', 
-                                   fontsize=9, fontweight='bold')
+            snapshot = self._snapshot_hash(hv_df, vm_df, dpi, fmt)
             
-            # 3. Количество ВМ на гипервизорах
-            if not hv_df.empty and 'num_vms' in hv_df.columns:
-                colors = plt.cm.summer(hv_df['num_vms'] / max(hv_df['num_vms'].max(), 1))
-                
-                bars = axes[1, 0].bar(hv_df['hv_name'], hv_df['num_vms'], 
-                                     color=colors, edgecolor='black', linewidth=1)
-                axes[1, 0].set_title('Количество ВМ на гипервизорах', 
-                                    fontsize=14, fontweight='bold', pad=15)
-                axes[1, 0].set_ylabel('Количество ВМ', fontsize=12)
-                axes[1, 0].set_xlabel('Гипервизоры', fontsize=12)
-                axes[1, 0].tick_params(axis='x', rotation=45, labelsize=10)
-                axes[1, 0].tick_params(axis='y', labelsize=10)
-                axes[1, 0].grid(axis='y', alpha=0.3, linestyle='--')
-                
-                # Добавляем значения на столбцы
-                for bar, value in zip(bars, hv_df['num_vms']):
-                    height = bar.get_height()
-                    axes[1, 0].text(bar.get_x() + bar.get_width()/2, height + 0.1, 
-                                   f'{value}', ha='center', va='bottom', 
-                                   fontsize=9, fontweight='bold')
-            
-            # 4. Распределение ВМ по типам (если есть данные)
-            if not vm_df.empty and 'vm_type' in vm_df.columns:
-                vm_type_counts = vm_df['vm_type'].value_counts()
-                
-                if not vm_type_counts.empty:
-                    colors = plt.cm.Set3(range(len(vm_type_counts)))
-                    wedges, texts, autotexts = axes[1, 1].pie(
-                        vm_type_counts.values, 
-                        labels=vm_type_counts.index, 
-                        autopct='%1.1f%%',
-                        startangle=90,
-                        colors=colors,
-                        textprops={'fontsize': 10}
-                    )
-                    axes[1, 1].set_title('Распределение ВМ по типам', 
-                                        fontsize=14, fontweight='bold', pad=15)
+            if save_path:
+                with self._render_lock:
+                    image = self._render_cache.get(snapshot)
+                if image is None:
+                    fig = Figure(figsize=(16, 12))
+                    FigureCanvasAgg(fig)
+                    self._draw_figure(fig, hv_df, vm_df)
                     
-                    # Делаем подписи более читаемыми
-                    for autotext in autotexts:
-                        autotext.set_color('white')
-                        autotext.set_fontweight('bold')
+                    buffer = io.BytesIO()
+                    fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches='tight')
+                    image = buffer.getvalue()
+                    
+                    # Храним только несколько последних изображений
+                    with self._render_lock:
+                        if len(self._render_cache) >= self.RENDER_CACHE_SIZE:
+                            self._render_cache.pop(next(iter(self._render_cache)))
+                        self._render_cache[snapshot] = image
                 else:
-                    axes[1, 1].text(0.5, 0.5, 'Нет данных о ВМ', 
-                                   ha='center', va='center', fontsize=12)
-                    axes[1, 1].set_title('Распределение ВМ по типам', 
-                                        fontsize=14, fontweight='bold', pad=15)
-            else:
-                axes[1, 1].text(0.5, 0.5, 'Нет данных о ВМ', 
-                               ha='center', va='center', fontsize=12)
-                axes[1, 1].set_title('Распределение ВМ по типам', 
-                                    fontsize=14, fontweight='bold', pad=15)
-            
-            plt.tight_layout()
-            
-            if save_path:
-                plt.savefig(save_path, dpi=300, bbox_inches='tight')
+                    logger.info("Данные не изменились, используется ранее построенное изображение")
+                
+                with open(save_path, 'wb') as f:
+                    f.write(image)
                 logger.info(f"Графики сохранены в {save_path}")
             
-            plt.show()
+            if show:
+                import matplotlib.pyplot as plt
+                fig = plt.figure(figsize=(16, 12))
+                self._draw_figure(fig, hv_df, vm_df)
+                plt.show()
+            
+            return save_path
             
         except Exception as e:
             logger.error(f"Ошибка при генерации визуализаций: {e}")
+            return None
     
     def generate_cluster_report(self) -> Dict[str, Any]:
-        """Генерация комплексного отчета по кластеру"""
+        """Генерация комплексного отчета по кластеру (из кэша, пока данные и дата не изменились)"""
         try:
-            report = {}
-            
-            # Получаем конфигурацию кластера
-            config = self.db.get_cluster_config()
-            report['config'] = config
+            # Прогноз в отчете отсчитывается от текущей даты
+            return dict(self._cached_report("cluster_report", self._build_cluster_report, date.today()))
+        except Exception as e:
+            logger.error(f"Ошибка при генерации отчета по кластеру: {e}")
+            return {}
+    
+    def _build_cluster_report(self) -> Dict[str, Any]:
+        """Построение комплексного отчета по кластеру"""
+        report = {}
+        
+        # Получаем конфигурацию кластера
+        config = self.db.get_cluster_config()
+        report['config'] = config
+        
+        # Получаем статистику
+        stats = self.db.get_cluster_statistics()
+        report['statistics'] = stats
+        
+        # Получаем данные для анализа (ошибка загрузки прерывает построение, а не кэшируется)
+        hv_df, vm_df = self._cached_report("resource_usage", self._build_resource_usage_report)
+        
+        # Анализ гипервизоров
+        if not hv_df.empty:
+            report['hypervisor_analysis'] = {
+                'total': len(hv_df),
+                'high_cpu_usage': len(hv_df[hv_df['cpu_usage_percent'] > 80]),
+                'high_ram_usage': len(hv_df[hv_df['ram_usage_percent'] > 80]),
+                'avg_cpu_usage': hv_df['cpu_usage_percent'].mean(),
+                'avg_ram_usage': hv_df['ram_usage_percent'].mean(),
+                'most_loaded_hv': hv_df.loc[hv_df['cpu_usage_percent'].idxmax()]['hv_name'] 
+                                 if not hv_df.empty else None
+            }
+        
+        # Анализ ВМ
+        if not vm_df.empty:
+            report['vm_analysis'] = {
+                'total': len(vm_df),
+                'by_type': vm_df['vm_type'].value_counts().to_dict(),
+                'avg_vcpu': vm_df['vcpu'].mean(),
+                'avg_vram': vm_df['vram'].mean(),
+                'avg_vhdd': vm_df['vhdd'].mean(),
+                'total_vcpu': vm_df['vcpu'].sum(),
+                'total_vram': vm_df['vram'].sum(),
+                'total_vhdd': vm_df['vhdd'].sum()
+            }
+        
+        # Рекомендации
+        recommendations = []
+        
+        if stats.get('total_hypervisors', 0) >= int(config.get('max_hypervisors', 24)):
+            recommendations.append("Достигнуто максимальное количество гипервизоров в кластере")
+        
+        # Свободные ресурсы сравниваются с емкостью с учетом переподписки
+        if stats.get('free_cpu', 0) < stats.get('vcpu_capacity', 1) * 0.1:
+            recommendations.append("Свободных ресурсов CPU менее 10% - рассмотрите добавление гипервизора")
+        
+        if stats.get('free_ram', 0) < stats.get('vram_capacity', 1) * 0.1:
+            recommendations.append("Свободных ресурсов RAM менее 10% - рассмотрите добавление гипервизора")
+        
+        if stats.get('free_disk', 0) < stats.get('disk_pool', 1) * 0.1:
+            recommendations.append("Свободного места в дисковом пуле менее 10% - рассмотрите расширение хранилища")
+        
+        # Нарушения правил размещения (группы ВМ на одном гипервизоре, вне разрешенных и т.п.)
+        violations = self.db.get_placement_violations()
+        report['placement_violations'] = violations
+        if violations:
+            recommendations.append(f"Нарушено правил размещения: {len(violations)} - "
+                                   f"перенесите ВМ или освободите перегруженные гипервизоры")
+        
+        # Прогноз исчерпания ресурсов
+        forecast = self.forecast_capacity_exhaustion()
+        report['forecast'] = forecast
+        
+        resource_names = {
+            'cpu': "CPU",
+            'ram': "RAM",
+            'disk': "дискового пула",
+            'hypervisors': "лимита гипервизоров"
+        }
+        for key, name in resource_names.items():
+            result = forecast.get(key)
+            if not result or result['days_left'] is None:
+                continue
+            if result['days_left'] <= self.FORECAST_HORIZON_DAYS:
+                recommendations.append(
+                    f"По прогнозу ресурсы {name} закончатся через {result['days_left']:.0f} дн. "
+                    f"({result['date']}, интервал {result['date_min']} - {result['date_max']})"
+                )
+        
+        report['recommendations'] = recommendations
+        
+        return report
+    
+    def get_utilization_trend(self, hv_name: Optional[str] = None, days: float = 7,
+                              max_points: int = 500) -> pd.DataFrame:
+        """Тренд загрузки за последние days дней (прореженный ряд из истории)"""
+        try:
+            end = datetime.now()
+            rows = self.db.get_utilization_history(hv_name, end - timedelta(days=days), end, max_points)
+            trend = pd.DataFrame(rows)
+            if not trend.empty:
+                trend['ts'] = pd.to_datetime(trend['ts'])
+                trend = trend.set_index('ts')
+            return trend
             
-            # Получаем статистику
+        except Exception as e:
+            logger.error(f"Ошибка при получении тренда загрузки: {e}")
+            return pd.DataFrame()
+    
+    def draw_utilization_trend(self, fig, trend: pd.DataFrame, title: str):
+        """Построение графика тренда загрузки на переданной фигуре"""
+        ax = fig.add_subplot(1, 1, 1)
+        ax.plot(trend.index, trend['cpu_usage'], color='green', label='CPU (среднее)')
+        ax.plot(trend.index, trend['ram_usage'], color='blue', label='RAM (среднее)')
+        ax.fill_between(trend.index, trend['cpu_usage'], trend['cpu_max'], color='green', alpha=0.15)
+        ax.fill_between(trend.index, trend['ram_usage'], trend['ram_max'], color='blue', alpha=0.15)
+        ax.axhline(y=80, color='darkred', linestyle='--', alpha=0.7)
+        ax.set_ylim(0, 105)
+        ax.set_ylabel('Использование (%)')
+        ax.set_title(title, fontweight='bold')
+        ax.grid(alpha=0.3, linestyle='--')
+        ax.legend(fontsize=9)
+        fig.autofmt_xdate()
+        fig.tight_layout()
+    
+    def forecast_capacity_exhaustion(self, min_history_days: int = 7) -> Dict[str, Dict[str, Any]]:
+        """Прогноз даты исчерпания CPU, RAM, дискового пула и лимита гипервизоров"""
+        try:
+            growth = self.db.get_daily_growth()
             stats = self.db.get_cluster_statistics()
-            report['statistics'] = stats
-            
-            # Получаем данные для анализа
-            hv_df, vm_df = self.get_resource_usage_report()
-            
-            # Анализ гипервизоров
-            if not hv_df.empty:
-                report['hypervisor_analysis'] = {
-                    'total': len(hv_df),
-                    'high_cpu_usage': len(hv_df[hv_df['cpu_usage_percent'] > 80]),
-                    'high_ram_usage': len(hv_df[hv_df['ram_usage_percent'] > 80]),
-                    'avg_cpu_usage': hv_df['cpu_usage_percent'].mean(),
-                    'avg_ram_usage': hv_df['ram_usage_percent'].mean(),
-                    'most_loaded_hv': hv_df.loc[hv_df['cpu_usage_percent'].idxmax()]['hv_name'] 
-                                     if not hv_df.empty else None
-                }
-            
-            # Анализ ВМ
-            if not vm_df.empty:
-                report['vm_analysis'] = {
-                    'total': len(vm_df),
-                    'by_type': vm_df['vm_type'].value_counts().to_dict(),
-                    'avg_vcpu': vm_df['vcpu'].mean(),
-                    'avg_vram': vm_df['vram'].mean(),
-                    'avg_vhdd': vm_df['vhdd'].mean(),
-                    'total_vcpu': vm_df['vcpu'].sum(),
-                    'total_vram': vm_df['vram'].sum(),
-                    'total_vhdd': vm_df['vhdd'].sum()
-                }
-            
-            # Рекомендации
-            recommendations = []
-            
-            if stats.get('total_hypervisors', 0) >= int(config.get('max_hypervisors', 24)):
-                recommendations.append("Достигнуто максимальное количество гипервизоров в кластере")
+            config = self.db.get_cluster_config()
+            today = date.today()
+            forecast = {}
             
-            if stats.get('free_cpu', 0) < stats.get('total_cpu', 1) * 0.1:
-                recommendations.append("Свободных ресурсов CPU менее 10% - рассмотрите добавление гипервизора")
+            x, series, first = CapacityForecaster.cumulative_series(growth['vms'], today)
+            if first is not None and len(x) >= min_history_days:
+                # Колонки: количество ВМ, vCPU, vRAM, vHDD - количество ВМ не прогнозируется
+                capacity = np.array([np.inf, stats.get('vcpu_capacity', 0), 
+                                     stats.get('vram_capacity', 0), 
+                                     float(stats.get('disk_pool', config.get('disk_pool', 1000000)))])
+                results = CapacityForecaster.fit(x, series, capacity)
+                for key, result in zip(('cpu', 'ram', 'disk'), results[1:]):
+                    forecast[key] = result
             
-            if stats.get('free_ram', 0) < stats.get('total_ram', 1) * 0.1:
-                recommendations.append("Свободных ресурсов RAM менее 10% - рассмотрите добавление гипервизора")
+            x, series, first = CapacityForecaster.cumulative_series(growth['hypervisors'], today)
+            if first is not None and len(x) >= min_history_days:
+                capacity = np.array([float(config.get('max_hypervisors', 24))])
+                forecast['hypervisors'] = CapacityForecaster.fit(x, series, capacity)[0]
             
-            report['recommendations'] = recommendations
+            # Даты исчерпания
+            for result in forecast.values():
+                for key in ('days_left', 'days_left_min', 'days_left_max'):
+                    days = result[key]
+                    result[key.replace('days_left', 'date')] = (
+                        today + timedelta(days=int(days)) if days is not None else None)
             
-            return report
+            return forecast
             
         except Exception as e:
-            logger.error(f"Ошибка при генерации отчета по кластеру: {e}")
+            logger.error(f"Ошибка при прогнозировании исчерпания ресурсов: {e}")
             return {}
     
     def save_report_to_csv(self, filepath: str = "cluster_report.xlsx"):
@@ -320,6 +561,13 @@ class DataAnalyzer:
                     for key, value in vm_analysis.items():
                         summary_data.append([key.replace('_', ' ').title(), value])
                     
+                    summary_data.append([])
+                    summary_data.append(["ПРОГНОЗ ИСЧЕРПАНИЯ РЕСУРСОВ", ""])
+                    
+                    # Прогноз
+                    for key, result in report.get('forecast', {}).items():
+                        summary_data.append([key.upper(), str(result['date'] or "рост не наблюдается")])
+                    
                     summary_data.append([])
                     summary_data.append(["РЕКОМЕНДАЦИИ", ""])
                     
@@ -335,4 +583,73 @@ class DataAnalyzer:
             
         except Exception as e:
             logger.error(f"Ошибка при сохранении отчета: {e}")
-            return False
\ No newline at end of file
+            return False
+
+class CapacityForecaster:
+    """Прогноз исчерпания ресурсов кластера по истории создания ВМ и гипервизоров"""
+    
+    Z_SCORE = 1.96  # 95% доверительный интервал
+    
+    @staticmethod
+    def cumulative_series(rows: List[Tuple], today: date) -> Tuple[np.ndarray, np.ndarray, Optional[date]]:
+        """Накопленные значения по дням (пропущенные дни заполняются нулевым приростом).
+        rows - (день, значение1, значение2, ...) в порядке возрастания дня"""
+        if not rows:
+            return np.empty(0), np.empty((0, 0)), None
+        
+        first = rows[0][0]
+        offsets = np.fromiter(((row[0] - first).days for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([row[1:] for row in rows], dtype=float)
+        
+        daily = np.zeros((max((today - first).days, int(offsets[-1])) + 1, values.shape[1]))
+        np.add.at(daily, offsets, values)
+        return np.arange(len(daily), dtype=float), np.cumsum(daily, axis=0), first
+    
+    @classmethod
+    def fit(cls, x: np.ndarray, series: np.ndarray, capacity: np.ndarray) -> List[Dict[str, Any]]:
+        """Линейная и экспоненциальная модели для всех рядов сразу, выбор лучшей по сумме
+        квадратов остатков и расчет дней до достижения емкости с доверительным интервалом"""
+        x_last = x[-1]
+        
+        # Линейная модель: y = a*x + b
+        lin = np.polyfit(x, series, 1)
+        lin_pred = np.outer(x, lin[0]) + lin[1]
+        lin_sigma = (series - lin_pred).std(axis=0)
+        
+        # Экспоненциальная модель: ln(y + 1) = a*x + b
+        log_series = np.log1p(series)
+        exp = np.polyfit(x, log_series, 1)
+        exp_log_pred = np.outer(x, exp[0]) + exp[1]
+        exp_sigma = (log_series - exp_log_pred).std(axis=0)
+        
+        use_exp = ((series - np.expm1(exp_log_pred)) ** 2).sum(axis=0) < ((series - lin_pred) ** 2).sum(axis=0)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lin_cross = [(capacity + shift - lin[1]) / lin[0] 
+                         for shift in (0, -cls.Z_SCORE * lin_sigma, cls.Z_SCORE * lin_sigma)]
+            log_capacity = np.log1p(capacity)
+            exp_cross = [(log_capacity + shift - exp[1]) / exp[0] 
+                         for shift in (0, -cls.Z_SCORE * exp_sigma, cls.Z_SCORE * exp_sigma)]
+        
+        slope = np.where(use_exp, exp[0], lin[0])
+        crossings = [np.where(use_exp, e, l) - x_last for l, e in zip(lin_cross, exp_cross)]
+        exhausted = series[-1] >= capacity
+        
+        results = []
+        for idx in range(series.shape[1]):
+            result = {
+                'model': 'exponential' if use_exp[idx] else 'linear',
+                'current': float(series[-1, idx]),
+                'capacity': float(capacity[idx]),
+                'growth_per_day': float(lin[0, idx])
+            }
+            if exhausted[idx]:
+                result.update(days_left=0.0, days_left_min=0.0, days_left_max=0.0)
+            elif slope[idx] <= 0 or not np.isfinite(crossings[0][idx]):
+                result.update(days_left=None, days_left_min=None, days_left_max=None)
+            else:
+                result.update(days_left=float(max(crossings[0][idx], 0)),
+                              days_left_min=float(max(crossings[1][idx], 0)),
+                              days_left_max=float(max(crossings[2][idx], 0)))
+            results.append(result)
+        return results
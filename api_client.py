@@ -0,0 +1,253 @@
+import json
+import threading
+import logging
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Tuple, Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, urlopen
+
+from storage import StorageBackend
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Поля дат в ответах API (передаются в ISO 8601)
+DATETIME_FIELDS = ('creation_date', 'created_at', 'updated_at', 'expires_at', 'ts', 'bucket')
+
+
+class RemoteStorage(StorageBackend):
+    """Хранилище через HTTP API (api_server.ApiServer) для GUI в режиме клиента сервиса.
+    Ответы чтения запоминаются с ETag: повторный запрос без изменений данных - ответ 304 без тела.
+    Массовое развертывание выполняет сервис (очередь PostgreSQL или пакетами в его процессе).
+    Операции процесса хранилища (резервы, контрольные точки, журнал, запись истории) клиенту
+    недоступны: они записываются в лог и возвращают значение отказа"""
+
+    SUPPORTS_DEPLOY_QUEUE = True
+
+    def __init__(self, url: str = "http://127.0.0.1:8077", timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Путь -> (ETag, разобранный ответ)
+        self._responses: Dict[str, Tuple[str, Any]] = {}
+
+    def _request(self, method: str, path: str, payload: Optional[Any] = None) -> Tuple[int, Any]:
+        """Запрос к сервису: (код ответа, JSON ответа или байты CSV).
+        Для GET передается If-None-Match, ответ 304 заменяется запомненным"""
+        headers = {'Accept': "application/json"}
+        with self._lock:
+            cached = self._responses.get(path) if method == "GET" else None
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+        data = None
+        if payload is not None:
+            data = json.dumps(payload, default=str).encode("utf-8")
+            headers['Content-Type'] = "application/json; charset=utf-8"
+
+        try:
+            with urlopen(Request(self.url + path, data=data, headers=headers, method=method),
+                         timeout=self.timeout) as response:
+                status, body, etag = response.status, response.read(), response.headers.get("ETag")
+                content_type = response.headers.get("Content-Type", "")
+        except HTTPError as e:
+            if e.code == 304 and cached is not None:
+                return 200, cached[1]
+            status, body, etag, content_type = e.code, e.read(), None, e.headers.get("Content-Type", "")
+
+        result = json.loads(body) if content_type.startswith("application/json") else body
+        if method == "GET" and etag and status == 200:
+            with self._lock:
+                self._responses[path] = (etag, result)
+        return status, result
+
+    def _get(self, path: str, default: Any) -> Any:
+        """Чтение с разбором дат; при недоступности сервиса - default"""
+        try:
+            status, result = self._request("GET", path)
+            if status != 200:
+                raise RuntimeError(result.get('error') if isinstance(result, dict) else status)
+            return self._parse_dates(result)
+        except (URLError, OSError, RuntimeError, ValueError) as e:
+            logger.error(f"Ошибка запроса к API {path}: {e}")
+            return default
+
+    def _change(self, method: str, path: str, payload: Optional[Any] = None) -> Dict[str, Any]:
+        """Изменение через сервис: ответ сервиса или {'error': причина}"""
+        try:
+            return self._request(method, path, payload)[1]
+        except (URLError, OSError, ValueError) as e:
+            logger.error(f"Ошибка запроса к API {path}: {e}")
+            return {'error': str(e)}
+
+    @staticmethod
+    def _service_only(operation: str, result: Any) -> Any:
+        """Операция выполняется только процессом сервиса: запись в лог и значение отказа"""
+        logger.error(f"Операция {operation} недоступна через HTTP API, она выполняется сервисом")
+        return result
+
+    @staticmethod
+    def _parse_dates(value: Any) -> Any:
+        """Даты ISO 8601 в полях DATETIME_FIELDS - datetime (как у локальных хранилищ)"""
+        if isinstance(value, list):
+            return [RemoteStorage._parse_dates(item) for item in value]
+        if isinstance(value, dict):
+            return {key: datetime.fromisoformat(item) if key in DATETIME_FIELDS and isinstance(item, str)
+                    else RemoteStorage._parse_dates(item) for key, item in value.items()}
+        return value
+
+    # Виртуальные машины
+    def try_create_vm(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        result = self._change("POST", "/api/vms", vm_data)
+        return result.get('created', False), result.get('message', result.get('error', ""))
+
+    def get_all_vms(self) -> List[Dict[str, Any]]:
+        return self._get("/api/vms", [])
+
+    def delete_vm(self, vm_name: str) -> bool:
+        return self._change("DELETE", f"/api/vms/{quote(vm_name)}").get('deleted', False)
+
+    def delete_vms_bulk(self, vm_names: List[str]) -> int:
+        return self._change("POST", "/api/vms/delete", {'vm_names': list(vm_names)}).get('deleted', 0)
+
+    def migrate_vms(self, migrations: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        result = self._change("POST", "/api/vms/migrate", {'migrations': migrations})
+        return result.get('migrated', False), result.get('message', result.get('error', ""))
+
+    def create_vms_bulk(self, vms: List[Dict[str, Any]]) -> int:
+        return self._change("POST", "/api/vms/bulk", {'vms': list(vms)}).get('created', 0)
+
+    def drain_hypervisor(self, hv_name: str, exclude: Optional[List[str]] = None) -> Tuple[bool, str]:
+        result = self._change("POST", f"/api/hypervisors/{quote(hv_name)}/drain", {'exclude': exclude})
+        return result.get('drained', False), result.get('message', result.get('error', ""))
+
+    # Гипервизоры
+    def add_hypervisor(self, hv_data: Dict[str, Any]) -> bool:
+        return self._change("POST", "/api/hypervisors", hv_data).get('added', False)
+
+    def get_all_hypervisors(self) -> List[Dict[str, Any]]:
+        return self._get("/api/hypervisors", [])
+
+    def delete_hypervisor(self, hv_name: str) -> Tuple[bool, str]:
+        result = self._change("DELETE", f"/api/hypervisors/{quote(hv_name)}")
+        return result.get('deleted', False), result.get('message', result.get('error', ""))
+
+    # Конфигурация, статистика, выгрузка
+    def get_data_version(self) -> Optional[Any]:
+        return self._get("/api/version", {}).get('version')
+
+    def export_csv(self, kind: str) -> Optional[bytes]:
+        result = self._get(f"/api/export/{quote(kind)}", None)
+        return result or None
+
+    def get_cluster_config(self) -> Dict[str, str]:
+        return self._get("/api/config", {})
+
+    def set_overcommit(self, overcommit_cpu: float, overcommit_ram: float) -> Tuple[bool, str]:
+        result = self._change("POST", "/api/config/overcommit",
+                              {'overcommit_cpu': overcommit_cpu, 'overcommit_ram': overcommit_ram})
+        return result.get('changed', False), result.get('message', result.get('error', ""))
+
+    def get_cluster_statistics(self) -> Dict[str, Any]:
+        return self._get("/api/statistics", {})
+
+    def get_daily_growth(self) -> Dict[str, List[Tuple]]:
+        growth = self._get("/api/daily-growth", {'vms': [], 'hypervisors': []})
+        return {kind: [(date.fromisoformat(row[0]),) + tuple(row[1:]) for row in rows]
+                for kind, rows in growth.items()}
+
+    def get_utilization_history(self, hv_name: Optional[str] = None, start: Optional[datetime] = None,
+                                end: Optional[datetime] = None, max_points: int = 500) -> List[Dict[str, Any]]:
+        params = {'hv_name': hv_name, 'start': start and start.isoformat(), 'end': end and end.isoformat(),
+                  'max_points': max_points}
+        return self._get("/api/history?" + urlencode({key: value for key, value in params.items() if value}), [])
+
+    def record_utilization_sample(self, ts: Optional[datetime] = None) -> int:
+        return self._service_only("записи истории загрузки", 0)
+
+    def rollup_utilization_history(self, raw_retention: timedelta = timedelta(days=2),
+                                   minute_retention: timedelta = timedelta(days=30),
+                                   hour_retention: timedelta = timedelta(days=730)) -> bool:
+        return self._service_only("свертки истории загрузки", False)
+
+    # Контрольные точки развертываний хранит процесс, выполняющий развертывание (сервис)
+    def save_deploy_checkpoint(self, run_id: str, state: Dict[str, Any]) -> bool:
+        return self._service_only("сохранения контрольной точки", False)
+
+    def get_deploy_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return self._service_only("чтения контрольной точки", None)
+
+    def get_deploy_checkpoints(self) -> List[Dict[str, Any]]:
+        return self._service_only("чтения контрольных точек", [])
+
+    # Правила размещения
+    def add_placement_rule(self, rule: Dict[str, Any]) -> Tuple[bool, str]:
+        result = self._change("POST", "/api/placement-rules", rule)
+        return result.get('added', False), result.get('message', result.get('error', ""))
+
+    def get_placement_rules(self) -> List[Dict[str, Any]]:
+        return self._get("/api/placement-rules", [])
+
+    def delete_placement_rule(self, rule_id: int) -> bool:
+        return self._change("DELETE", f"/api/placement-rules/{int(rule_id)}").get('deleted', False)
+
+    def get_placement_violations(self) -> List[str]:
+        return self._get("/api/placement-violations", [])
+
+    def get_placement_counts(self) -> Dict[Tuple[int, str], int]:
+        return {(rule_id, hv_name): count for rule_id, hv_name, count in self._get("/api/placement-counts", [])}
+
+    # Резервы емкости: создает, продлевает и освобождает процесс развертывания (сервис)
+    def reserve_capacity(self, vm_data: Dict[str, Any], count: int, ttl: Optional[float] = None,
+                         owner: str = "") -> Tuple[Optional[int], str]:
+        return self._service_only("резервирования емкости", (None, "Резервы создает сервис"))
+
+    def try_create_reserved_vm(self, reservation_id: int, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        return self._service_only("создания ВМ в резерве", (False, "Резервы создает сервис"))
+
+    def renew_reservation(self, reservation_id: int, ttl: Optional[float] = None) -> bool:
+        return self._service_only("продления резерва", False)
+
+    def release_reservation(self, reservation_id: int) -> int:
+        return self._service_only("освобождения резерва", 0)
+
+    def release_expired_reservations(self) -> int:
+        """Истекшие резервы освобождает сервис"""
+        return 0
+
+    def get_reservations(self) -> List[Dict[str, Any]]:
+        return self._get("/api/reservations", [])
+
+    # Сверка счетчиков выполняется сервисом; журнал операций читает и изменяет только он
+    def check_invariants(self) -> List[str]:
+        return self._get("/api/invariants", ["Не удалось выполнить сверку через HTTP API"])
+
+    def verify_counters(self) -> List[str]:
+        return self._get("/api/counters", ["Не удалось прочитать журнал операций через HTTP API"])
+
+    def get_journal(self, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        return self._service_only("чтения журнала операций", [])
+
+    def create_journal_snapshot(self) -> Optional[int]:
+        return self._service_only("снимка журнала операций", None)
+
+    def compact_journal(self, keep_snapshots: int = 2) -> int:
+        return self._service_only("сжатия журнала операций", 0)
+
+    def replay_journal(self) -> Optional[Dict[str, Any]]:
+        return self._service_only("восстановления счетчиков по журналу", None)
+
+    def restore_counters(self) -> Tuple[bool, str]:
+        return self._service_only("восстановления счетчиков по журналу",
+                                  (False, "Счетчики восстанавливаются на стороне сервиса"))
+
+    # Массовое развертывание (выполняет сервис)
+    def submit_deploy_job(self, base_vm_data: Dict[str, Any], count: int, priority: int = 0) -> Optional[Any]:
+        return self._change("POST", "/api/deployments",
+                            {'vm': base_vm_data, 'count': count, 'priority': priority}).get('job_id')
+
+    def get_deploy_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return self._get(f"/api/deployments?limit={int(limit)}", [])
+
+    def cancel_deploy_job(self, job_id: Any) -> bool:
+        return self._change("POST", f"/api/deployments/{quote(str(job_id))}/cancel").get('cancelled', False)
@@ -0,0 +1,411 @@
+import asyncio
+import json
+import re
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from decimal import Decimal
+from typing import List, Dict, Any, Tuple, Optional, Callable
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from storage import StorageBackend
+from async_operations import AsyncOperations
+from metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Запросы к API и результат обращения к кэшу состояния кластера
+API_REQUEST_SECONDS = REGISTRY.histogram("datacenter_api_request_seconds", "Запрос к HTTP API",
+                                         ("route", "status"))
+API_CACHE_REQUESTS = REGISTRY.counter("datacenter_api_cache_requests_total", "Чтения кэша состояния кластера",
+                                      ("result",))
+
+HTTP_REASONS = {200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+
+def to_json(value: Any) -> bytes:
+    """JSON ответа: даты в ISO 8601, Decimal (суммы PostgreSQL) - числа"""
+    def default(item):
+        if isinstance(item, (datetime, date)):
+            return item.isoformat()
+        if isinstance(item, Decimal):
+            return float(item)
+        return str(item)
+    return json.dumps(value, ensure_ascii=False, default=default).encode("utf-8")
+
+
+class ClusterStateCache:
+    """Кэш ответов чтения, общий для всех клиентов сервиса.
+    Версия данных (get_data_version) запрашивается у хранилища не чаще раза в max_age секунд
+    независимо от числа клиентов; ответ пересчитывается только при смене версии, одновременные
+    запросы одного ответа ждут одну загрузку. ETag - хэш тела ответа"""
+
+    def __init__(self, db: StorageBackend, executor: ThreadPoolExecutor, max_age: float = 1.0):
+        self.db = db
+        self.executor = executor
+        self.max_age = max_age
+        self._version = None
+        self._checked = 0.0
+        self._version_lock = asyncio.Lock()
+        # Ключ ответа -> (версия, ETag, тело)
+        self._entries: Dict[str, Tuple[Any, str, bytes]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def version(self) -> Any:
+        """Версия данных, проверенная не раньше чем max_age секунд назад"""
+        async with self._version_lock:
+            if time.monotonic() - self._checked >= self.max_age:
+                loop = asyncio.get_running_loop()
+                self._version = await loop.run_in_executor(self.executor, self.db.get_data_version)
+                self._checked = time.monotonic()
+            return self._version
+
+    def invalidate(self):
+        """Изменение через API: следующее чтение сразу проверит версию"""
+        self._checked = 0.0
+
+    async def get(self, key: str, load: Callable[[], Any]) -> Tuple[str, bytes]:
+        """(ETag, тело) ответа key: из кэша при неизменной версии, иначе load() в пуле потоков.
+        Версия читается до загрузки: изменение во время загрузки даст новую версию и перезагрузку"""
+        version = await self.version()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            # Версия неизвестна (хранилище без счетчика версий) - ответ не кэшируется
+            if entry is not None and version is not None and entry[0] == version:
+                API_CACHE_REQUESTS.inc("hit")
+                return entry[1], entry[2]
+            API_CACHE_REQUESTS.inc("miss")
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self.executor, load)
+            if not isinstance(body, bytes):
+                body = to_json(body)
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            self._entries[key] = (version, etag, body)
+            return etag, body
+
+
+class ApiError(Exception):
+    """Ошибка запроса с кодом ответа HTTP"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiServer:
+    """HTTP API хранилища для нескольких клиентов (GUI с --api-url, скрипты).
+    Все клиенты работают через одно хранилище (один пул соединений PostgreSQL) и общий кэш
+    состояния кластера: нагрузка на БД растет с числом изменений, а не с числом клиентов.
+    Чтения поддерживают If-None-Match (ответ 304 без тела). Сервер - asyncio, вызовы хранилища
+    выполняются в пуле потоков не больше пула соединений"""
+
+    def __init__(self, db: StorageBackend, host: str = "127.0.0.1", port: int = 8077,
+                 workers: int = 8, max_age: float = 1.0):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.cache = None
+        self.max_age = max_age
+        self.async_ops = AsyncOperations(db)
+        self._analyzer = None
+        self._deployments: Dict[str, asyncio.Task] = {}
+        self._server = None
+        # (метод, шаблон пути, обработчик, ключ кэша или None для изменений и некэшируемых чтений)
+        self.routes: List[Tuple[str, re.Pattern, Callable, Optional[str]]] = []
+        for method, pattern, handler, cached in (
+            ("GET", r"/api/version", self.get_version, None),
+            ("GET", r"/api/vms", lambda: self.db.get_all_vms(), "vms"),
+            ("GET", r"/api/hypervisors", lambda: self.db.get_all_hypervisors(), "hypervisors"),
+            ("GET", r"/api/statistics", lambda: self.db.get_cluster_statistics(), "statistics"),
+            ("GET", r"/api/config", lambda: self.db.get_cluster_config(), "config"),
+            ("GET", r"/api/daily-growth", lambda: self.db.get_daily_growth(), "daily-growth"),
+            ("GET", r"/api/placement-rules", lambda: self.db.get_placement_rules(), "placement-rules"),
+            ("GET", r"/api/placement-violations", lambda: self.db.get_placement_violations(),
+             "placement-violations"),
+            ("GET", r"/api/export/(hypervisors|vms)", lambda kind: self.db.export_csv(kind) or b"", "export"),
+            ("GET", r"/api/report", self.get_report, "report"),
+            ("GET", r"/api/history", self.get_history, None),
+            ("GET", r"/api/deployments", self.get_deployments, None),
+            ("GET", r"/api/placement-counts", self.get_placement_counts, None),
+            ("GET", r"/api/reservations", self.get_reservations, None),
+            ("GET", r"/api/invariants", self.check_invariants, None),
+            ("GET", r"/api/counters", self.verify_counters, None),
+            ("POST", r"/api/vms", self.create_vm, None),
+            ("POST", r"/api/vms/delete", self.delete_vms, None),
+            ("POST", r"/api/vms/migrate", self.migrate_vms, None),
+            ("POST", r"/api/vms/bulk", self.create_vms_bulk, None),
+            ("DELETE", r"/api/vms/([^/]+)", self.delete_vm, None),
+            ("POST", r"/api/hypervisors", self.add_hypervisor, None),
+            ("DELETE", r"/api/hypervisors/([^/]+)", self.delete_hypervisor, None),
+            ("POST", r"/api/hypervisors/([^/]+)/drain", self.drain_hypervisor, None),
+            ("POST", r"/api/config/overcommit", self.set_overcommit, None),
+            ("POST", r"/api/placement-rules", self.add_placement_rule, None),
+            ("DELETE", r"/api/placement-rules/(\d+)", self.delete_placement_rule, None),
+            ("POST", r"/api/deployments", self.start_deployment, None),
+            ("POST", r"/api/deployments/([^/]+)/cancel", self.cancel_deployment, None),
+        ):
+            self.routes.append((method, re.compile(pattern + "$"), handler, cached))
+
+    async def start(self):
+        """Запуск сервера в текущем цикле событий"""
+        self.cache = ClusterStateCache(self.db, self.executor, self.max_age)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP API доступен на http://{self.host}:{self.port}/api")
+
+    async def serve_forever(self):
+        """Запуск и работа до отмены"""
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        """Остановка приема соединений и ожидание развертываний, запущенных через API"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for run_id in list(self._deployments):
+            self.async_ops.cancel_deployment(run_id)
+        if self._deployments:
+            await asyncio.gather(*self._deployments.values(), return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    # Протокол HTTP/1.1 (соединения keep-alive)
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+
+                status, response_headers, payload = await self._dispatch(method, target, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                response_headers['Content-Length'] = str(len(payload))
+                response_headers['Connection'] = "keep-alive" if keep_alive else "close"
+                head = f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                head += "".join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode("latin-1") + b"\r\n" + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str],
+                        body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Выполнение запроса: (код, заголовки, тело)"""
+        started = time.perf_counter()
+        url = urlsplit(target)
+        # Метка метрик - шаблон пути (неизвестные пути не создают новых рядов)
+        route, status = "other", 404
+        response_headers = {'Content-Type': "application/json; charset=utf-8"}
+        try:
+            match = None
+            allowed = False
+            for route_method, pattern, handler, cached in self.routes:
+                match = pattern.match(url.path)
+                if match is None:
+                    continue
+                allowed = True
+                if route_method == method:
+                    route = pattern.pattern
+                    break
+            else:
+                raise ApiError(405 if allowed else 404, "Метод не поддерживается" if allowed else "Не найдено")
+
+            args = [unquote(group) for group in match.groups()]
+            if cached is not None:
+                # Ключ кэша включает параметры пути (вид выгрузки)
+                etag, payload = await self.cache.get("/".join([cached] + args), lambda: handler(*args))
+                if cached == "export":
+                    response_headers['Content-Type'] = "text/csv; charset=utf-8"
+                response_headers['ETag'] = etag
+                response_headers['Cache-Control'] = "no-cache"
+                if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+                    API_CACHE_REQUESTS.inc("not_modified")
+                    status, payload = 304, b""
+                else:
+                    status = 200
+                return status, response_headers, payload
+
+            params = json.loads(body) if body else {}
+            if method == "GET":
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            status, result = await handler(params, *args)
+            if method != "GET":
+                self.cache.invalidate()
+            return status, response_headers, to_json(result)
+
+        except ApiError as e:
+            status = e.status
+            return status, response_headers, to_json({'error': str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            status = 400
+            return status, response_headers, to_json({'error': f"Неверный запрос: {e}"})
+        except Exception as e:
+            status = 500
+            logger.error(f"Ошибка при обработке {method} {url.path}: {e}")
+            return status, response_headers, to_json({'error': str(e)})
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, route, str(status))
+
+    async def _call(self, func: Callable, *args) -> Any:
+        """Вызов хранилища в пуле потоков сервиса"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    # Чтения
+    async def get_version(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Версия данных для дешевого опроса изменений"""
+        version = await self.cache.version()
+        return 200, {'version': None if version is None else str(version)}
+
+    def get_report(self) -> Dict[str, Any]:
+        """Отчет по кластеру (анализатор со своим кэшем создается при первом запросе)"""
+        from analysis import DataAnalyzer
+
+        if self._analyzer is None:
+            self._analyzer = DataAnalyzer(self.db)
+        return self._analyzer.generate_cluster_report()
+
+    async def get_history(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """История загрузки: ?hv_name=&start=&end=&max_points= (даты ISO 8601)"""
+        start = datetime.fromisoformat(params['start']) if params.get('start') else None
+        end = datetime.fromisoformat(params['end']) if params.get('end') else None
+        return 200, await self._call(self.db.get_utilization_history, params.get('hv_name'), start, end,
+                                     int(params.get('max_points', 500)))
+
+    async def get_deployments(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Задания очереди (PostgreSQL) или развертывания, выполняемые сервисом"""
+        limit = int(params.get('limit', 50))
+        if self.db.SUPPORTS_DEPLOY_QUEUE:
+            return 200, await self._call(self.db.get_deploy_jobs, limit)
+        states = (await self._call(self.async_ops.get_deployments))[:limit]
+        # Формат заданий очереди: клиенту не важно, кто выполняет развертывание
+        return 200, [{'job_id': state['run_id'], 'base_name': state['vm']['vm_name'],
+                      'vcpu': state['vm']['vcpu'], 'vram': state['vm']['vram'], 'status': state['status'],
+                      'created': state['created'], 'total': state['count'], 'failed': len(state['failed'])}
+                     for state in states]
+
+    async def get_placement_counts(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Счетчики групп правил размещения: [[rule_id, hv_name, ВМ], ...]"""
+        counts = await self._call(self.db.get_placement_counts)
+        return 200, [[rule_id, hv_name, count] for (rule_id, hv_name), count in counts.items()]
+
+    async def get_reservations(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        return 200, await self._call(self.db.get_reservations)
+
+    async def check_invariants(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Полная сверка счетчиков с ВМ на стороне сервиса (одним набором чтений хранилища)"""
+        return 200, await self._call(self.db.check_invariants)
+
+    async def verify_counters(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Сверка счетчиков с журналом операций хранилища сервиса"""
+        return 200, await self._call(self.db.verify_counters)
+
+    # Изменения
+    async def create_vm(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        created, message = await self._call(self.db.try_create_vm, params)
+        return (201 if created else 409), {'created': created, 'message': message}
+
+    async def delete_vm(self, params: Dict[str, Any], vm_name: str) -> Tuple[int, Any]:
+        deleted = await self._call(self.db.delete_vm, vm_name)
+        return (200 if deleted else 404), {'deleted': deleted}
+
+    async def delete_vms(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        return 200, {'deleted': await self._call(self.db.delete_vms_bulk, params['vm_names'])}
+
+    async def migrate_vms(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        migrations = [tuple(migration) for migration in params['migrations']]
+        migrated, message = await self._call(self.db.migrate_vms, migrations)
+        return (200 if migrated else 409), {'migrated': migrated, 'message': message}
+
+    async def create_vms_bulk(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        vms = [dict(vm, creation_date=datetime.fromisoformat(vm['creation_date']))
+               if isinstance(vm.get('creation_date'), str) else vm for vm in params['vms']]
+        created = await self._call(self.db.create_vms_bulk, vms)
+        return (201 if created else 409), {'created': created}
+
+    async def add_hypervisor(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        added = await self._call(self.db.add_hypervisor, params)
+        return (201 if added else 409), {'added': added}
+
+    async def delete_hypervisor(self, params: Dict[str, Any], hv_name: str) -> Tuple[int, Any]:
+        deleted, message = await self._call(self.db.delete_hypervisor, hv_name)
+        return (200 if deleted else 409), {'deleted': deleted, 'message': message}
+
+    async def drain_hypervisor(self, params: Dict[str, Any], hv_name: str) -> Tuple[int, Any]:
+        drained, message = await self._call(self.db.drain_hypervisor, hv_name, params.get('exclude'))
+        return (200 if drained else 409), {'drained': drained, 'message': message}
+
+    async def set_overcommit(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        changed, message = await self._call(self.db.set_overcommit, float(params['overcommit_cpu']),
+                                            float(params['overcommit_ram']))
+        return (200 if changed else 409), {'changed': changed, 'message': message}
+
+    async def add_placement_rule(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        added, message = await self._call(self.db.add_placement_rule, params)
+        return (201 if added else 409), {'added': added, 'message': message}
+
+    async def delete_placement_rule(self, params: Dict[str, Any], rule_id: str) -> Tuple[int, Any]:
+        deleted = await self._call(self.db.delete_placement_rule, int(rule_id))
+        return (200 if deleted else 404), {'deleted': deleted}
+
+    async def start_deployment(self, params: Dict[str, Any]) -> Tuple[int, Any]:
+        """Массовое развертывание: задание очереди (PostgreSQL) или пакетами в процессе сервиса"""
+        vm_data, count = params['vm'], int(params['count'])
+        if self.db.SUPPORTS_DEPLOY_QUEUE:
+            job_id = await self._call(self.db.submit_deploy_job, vm_data, count, int(params.get('priority', 0)))
+            if job_id is None:
+                raise ApiError(500, "Не удалось поставить задание в очередь")
+            return 201, {'job_id': job_id}
+
+        state = await self._call(self.async_ops.start_deployment, vm_data, count, params.get('chunk_size'))
+        if state is None:
+            raise ApiError(500, "Не удалось сохранить контрольную точку развертывания")
+        run_id = state['run_id']
+        task = asyncio.get_running_loop().create_task(self.async_ops.run_deployment(run_id))
+        self._deployments[run_id] = task
+        task.add_done_callback(lambda _: self._deployments.pop(run_id, None))
+        return 201, {'job_id': run_id}
+
+    async def cancel_deployment(self, params: Dict[str, Any], job_id: str) -> Tuple[int, Any]:
+        if self.db.SUPPORTS_DEPLOY_QUEUE:
+            cancelled = await self._call(self.db.cancel_deploy_job, int(job_id))
+        else:
+            cancelled = self.async_ops.cancel_deployment(job_id)
+        return (200 if cancelled else 404), {'cancelled': cancelled}
+
+
+def run_server(db: StorageBackend, host: str = "127.0.0.1", port: int = 8077, workers: int = 8,
+               max_age: float = 1.0):
+    """Работа сервиса до остановки (Ctrl+C)"""
+    server = ApiServer(db, host, port, workers, max_age)
+
+    async def serve():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("HTTP API остановлен")
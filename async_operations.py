@@ -1,18 +1,34 @@
 import asyncio
+import threading
+import time
+import uuid
 import logging
-from typing import List, Dict, Any
-from database import Database
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from storage import StorageBackend
 from utils import NameGenerator
+from metrics import REGISTRY
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Пропускная способность развертывания: source=inprocess (пакеты в процессе) или queue (исполнители очереди)
+DEPLOY_VMS = REGISTRY.counter("datacenter_deploy_vms_total", "ВМ, обработанные при развертывании",
+                              ("source", "result"))
+DEPLOY_BATCH_SECONDS = REGISTRY.histogram("datacenter_deploy_batch_seconds", "Обработка пакета развертывания",
+                                          ("source",))
+
 
 class AsyncOperations:
     """Класс для асинхронных операций"""
     
-    def __init__(self, db: Database):
+    # Размер пакета массового развертывания: контрольная точка сохраняется после каждого пакета
+    DEPLOY_CHUNK_SIZE = 50
+    
+    def __init__(self, db: StorageBackend):
         self.db = db
+        # Флаги отмены выполняющихся развертываний (run_id -> событие)
+        self._cancel_events: Dict[str, threading.Event] = {}
     
     async def create_vm_async(self, vm_data: Dict[str, Any]) -> bool:
         """Асинхронное создание ВМ"""
@@ -37,56 +53,199 @@ class AsyncOperations:
             logger.error(f"Ошибка при асинхронном создании ВМ: {e}")
             return False
     
-    async def mass_deploy_vms(self, base_vm_data: Dict[str, Any], count: int) -> List[bool]:
-        """Массовое развертывание ВМ"""
+    def start_deployment(self, base_vm_data: Dict[str, Any], count: int,
+                         chunk_size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Регистрация массового развертывания: начальная контрольная точка без создания ВМ"""
+        now = datetime.now().isoformat(" ", "seconds")
+        state = {
+            'run_id': uuid.uuid4().hex[:12],
+            'vm': {key: base_vm_data[key] for key in ('vm_name', 'vcpu', 'vram', 'vhdd')},
+            'count': count,
+            'chunk_size': chunk_size or self.DEPLOY_CHUNK_SIZE,
+            'status': 'running',
+            'created': 0,
+            # Имя ВМ -> причина отказа
+            'failed': {},
+            # Имена пакета, результат которого еще не зафиксирован
+            'in_flight': [],
+            # Резерв мест под еще не созданные ВМ (продлевается после каждого пакета)
+            'reservation_id': None,
+            'message': '',
+            'started_at': now,
+            'updated_at': now
+        }
+        if not self.db.save_deploy_checkpoint(state['run_id'], state):
+            return None
+        self._cancel_events[state['run_id']] = threading.Event()
+        return state
+    
+    def cancel_deployment(self, run_id: str) -> bool:
+        """Кооперативная отмена: начатые создания ВМ завершаются, новые не начинаются"""
+        cancel_event = self._cancel_events.get(run_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        logger.info(f"Запрошена отмена развертывания {run_id}")
+        return True
+    
+    def is_deployment_active(self, run_id: str) -> bool:
+        """Выполняется ли развертывание в этом процессе"""
+        return run_id in self._cancel_events
+    
+    def get_deployments(self) -> List[Dict[str, Any]]:
+        """Контрольные точки развертываний, новые первыми"""
+        return self.db.get_deploy_checkpoints()
+    
+    async def resume_deployment(self, run_id: str,
+                                progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+                                ) -> Optional[Dict[str, Any]]:
+        """Продолжение отмененного, остановленного или прерванного развертывания с контрольной точки"""
+        self._cancel_events[run_id] = threading.Event()
+        return await self.run_deployment(run_id, progress_callback)
+    
+    async def run_deployment(self, run_id: str,
+                             progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+                             ) -> Optional[Dict[str, Any]]:
+        """Выполнение развертывания пакетами с сохранением контрольной точки после каждого пакета.
+        Места под все оставшиеся ВМ резервируются до первого пакета: при нехватке емкости
+        развертывание останавливается сразу, а не на середине"""
+        loop = asyncio.get_event_loop()
+        state = await loop.run_in_executor(None, self.db.get_deploy_checkpoint, run_id)
+        if state is None:
+            logger.error(f"Развертывание {run_id} не найдено")
+            return None
+        if state['status'] == 'done':
+            return state
+        cancel_event = self._cancel_events.setdefault(run_id, threading.Event())
+        
         try:
-            # Получаем существующие имена
-            existing_vms = self.db.get_all_vms()
-            existing_names = [vm['vm_name'] for vm in existing_vms]
+            existing_names = {vm['vm_name'] for vm in await loop.run_in_executor(None, self.db.get_all_vms)}
             
-            tasks = []
-            vms_to_create = []
+            # Процесс прервался посреди пакета: созданные ВМ этого пакета уже есть в базе
+            if state['in_flight']:
+                state['created'] += sum(1 for name in state['in_flight'] if name in existing_names)
+                state['in_flight'] = []
             
-            # Подготавливаем данные для всех ВМ
-            for i in range(count):
-                vm_data = base_vm_data.copy()
+            state['status'] = 'running'
+            state['message'] = ''
+            # Резерв прошлого запуска освобождается: места резервируются заново под оставшиеся ВМ
+            await self._release_reservation(state)
+            if state['created'] < state['count'] and not await self._reserve(state):
+                state['status'] = 'stopped'
+            while state['status'] == 'running' and state['created'] < state['count']:
+                if cancel_event.is_set():
+                    state['status'] = 'cancelled'
+                    break
                 
-                # Генерируем уникальное имя
-                vm_data['vm_name'] = NameGenerator.generate_vm_name(
-                    base_vm_data['vm_name'], 
-                    existing_names + [vm['vm_name'] for vm in vms_to_create]
-                )
+                size = min(state['chunk_size'], state['count'] - state['created'])
+                names = NameGenerator.generate_vm_names(state['vm']['vm_name'], existing_names, size)
+                existing_names.update(names)
                 
-                vms_to_create.append(vm_data)
-                existing_names.append(vm_data['vm_name'])
+                # Имена пакета фиксируются до создания ВМ - для сверки после аварийного завершения
+                state['in_flight'] = names
+                await self._save_checkpoint(state)
                 
-                # Создаем задачу для каждой ВМ
-                task = self.create_vm_async(vm_data)
-                tasks.append(task)
-            
-            # Запускаем все задачи параллельно
-            if tasks:
-                results = await asyncio.gather(*tasks, return_exceptions=True)
+                started = time.perf_counter()
+                results = await asyncio.gather(*(
+                    self._deploy_vm(state['reservation_id'], dict(state['vm'], vm_name=name), cancel_event)
+                    for name in names
+                ))
+                DEPLOY_BATCH_SECONDS.observe(time.perf_counter() - started, "inprocess")
                 
-                # Обрабатываем исключения
-                processed_results = []
-                for result in results:
-                    if isinstance(result, Exception):
-                        logger.error(f"Исключение при создании ВМ: {result}")
-                        processed_results.append(False)
+                chunk_created = 0
+                reasons = set()
+                for name, (created, message) in zip(names, results):
+                    if created is None:
+                        continue  # не начиналась из-за отмены
+                    if created:
+                        chunk_created += 1
+                        # Имя могло остаться в отказах прошлого запуска
+                        state['failed'].pop(name, None)
                     else:
-                        processed_results.append(result)
+                        state['failed'][name] = message
+                        reasons.add(message)
+                state['created'] += chunk_created
+                state['in_flight'] = []
+                DEPLOY_VMS.inc("inprocess", "created", amount=chunk_created)
+                DEPLOY_VMS.inc("inprocess", "failed", amount=len(results) - chunk_created - results.count((None, "")))
                 
-                success_count = sum(1 for r in processed_results if r is True)
-                logger.info(f"Массовое развертывание завершено. Успешно: {success_count}/{count}")
+                # Резерв истек (места освобождены очисткой) - новый резерв под оставшиеся ВМ
+                if self.db.RESERVATION_MISSING_MESSAGE in reasons or not await loop.run_in_executor(
+                        None, self.db.renew_reservation, state['reservation_id']):
+                    await self._release_reservation(state)
+                    if state['created'] < state['count'] and not await self._reserve(state):
+                        state['status'] = 'stopped'
+                elif reasons and chunk_created == 0 and not cancel_event.is_set():
+                    state['status'] = 'stopped'
+                    state['message'] = "Ни одна ВМ пакета не создана"
                 
-                return processed_results
+                await self._save_checkpoint(state)
+                if progress_callback:
+                    progress_callback(dict(state))
+            if state['status'] == 'running':
+                state['status'] = 'done'
             
-            return []
+            await self._release_reservation(state)
+            await self._save_checkpoint(state)
+            logger.info(f"Развертывание {run_id}: {state['status']}, создано {state['created']} из "
+                        f"{state['count']}, отказов {len(state['failed'])}")
+            return state
             
         except Exception as e:
-            logger.error(f"Ошибка при массовом развертывании ВМ: {e}")
+            logger.error(f"Ошибка при массовом развертывании {run_id}: {e}")
+            # Места не удерживаются до истечения резерва
+            await self._release_reservation(state)
+            return state
+        finally:
+            self._cancel_events.pop(run_id, None)
+    
+    async def _reserve(self, state: Dict[str, Any]) -> bool:
+        """Резерв мест под оставшиеся ВМ развертывания; при отказе причина - в state['message']"""
+        loop = asyncio.get_event_loop()
+        reservation_id, message = await loop.run_in_executor(
+            None, self.db.reserve_capacity, state['vm'], state['count'] - state['created'], None, state['run_id'])
+        state['reservation_id'] = reservation_id
+        state['message'] = message
+        return reservation_id is not None
+    
+    async def _release_reservation(self, state: Dict[str, Any]):
+        """Освобождение неиспользованных мест резерва развертывания"""
+        if state.get('reservation_id') is None:
+            return
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.db.release_reservation, state['reservation_id'])
+        state['reservation_id'] = None
+    
+    async def _deploy_vm(self, reservation_id: int, vm_data: Dict[str, Any],
+                         cancel_event: threading.Event) -> Tuple[Optional[bool], str]:
+        """Создание одной ВМ пакета в месте резерва: (None, '') если отменено до начала создания"""
+        def create():
+            # Проверка в потоке исполнителя: ожидающие своей очереди создания отменяются
+            if cancel_event.is_set():
+                return None, ""
+            return self.db.try_create_reserved_vm(reservation_id, vm_data)
+        
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, create)
+        except Exception as e:
+            logger.error(f"Ошибка при создании ВМ {vm_data['vm_name']}: {e}")
+            return False, str(e)
+    
+    async def _save_checkpoint(self, state: Dict[str, Any]):
+        """Сохранение контрольной точки (ошибка записи прерывает развертывание)"""
+        state['updated_at'] = datetime.now().isoformat(" ", "seconds")
+        loop = asyncio.get_event_loop()
+        if not await loop.run_in_executor(None, self.db.save_deploy_checkpoint, state['run_id'], state):
+            raise RuntimeError("не удалось сохранить контрольную точку")
+    
+    async def mass_deploy_vms(self, base_vm_data: Dict[str, Any], count: int) -> List[bool]:
+        """Массовое развертывание ВМ (результат по каждой ВМ)"""
+        state = self.start_deployment(base_vm_data, count)
+        if state is None:
             return []
+        state = await self.run_deployment(state['run_id']) or state
+        return [True] * state['created'] + [False] * (count - state['created'])
     
     async def check_resources_async(self) -> Dict[str, Any]:
         """Асинхронная проверка ресурсов кластера"""
@@ -0,0 +1,356 @@
+"""Нагрузочный и длительный (soak) тест: K параллельных клиентов над одним кластером.
+
+Каждый клиент выполняет смесь операций (создание и удаление ВМ, статистика, отчет) с заданной
+частотой. Клиенты - отдельные процессы (свои соединения с БД, как у нескольких операторов)
+или корутины одного процесса с общим хранилищем (общий пул соединений, как у GUI).
+Результат: задержки p50/p95/p99 и пропускная способность по операциям, классификация ошибок
+(нарушения CHECK, взаимные блокировки, исчерпание соединений и т.п.), динамика по интервалам
+и сверка счетчиков гипервизоров с фактическими ВМ после завершения (check_invariants).
+
+Запуск (нужна отдельная база, данные в ней удаляются):
+    python benchmarks/load_test.py --clients 16 --duration 60 --rate 20 --preload 10000
+    python benchmarks/load_test.py --mode asyncio --clients 32 --pool-size 10 --duration 30
+    python benchmarks/load_test.py --duration 3600 --rate 5 --window 60 --output soak.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+import multiprocessing
+from array import array
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteDatabase
+from benchmarks.synthetic import generate_cluster
+from benchmarks.suite import open_backend, populate
+
+OPERATIONS = ('create', 'delete', 'stats', 'report')
+
+# Классы ошибок по тексту исключения или сообщения в журнале хранилища
+ERROR_CLASSES = [
+    ('deadlock', ('deadlock detected', '40P01')),
+    ('serialization', ('could not serialize', '40001')),
+    ('check_violation', ('violates check constraint', 'CHECK constraint failed', '23514')),
+    ('duplicate', ('duplicate key', 'UNIQUE constraint failed', 'уже существует', '23505')),
+    ('pool_exhausted', ('connection pool exhausted', 'Нет свободного соединения в пуле')),
+    ('connection_limit', ('too many clients', 'too many connections', '53300')),
+    ('connection_lost', ('server closed the connection', 'could not connect', 'connection already closed')),
+    ('timeout', ('canceling statement', 'lock timeout', '57014', '55P03')),
+    ('db_locked', ('database is locked',)),
+    ('no_capacity', ('Нет доступных гипервизоров',)),
+    ('disk_full', ('Недостаточно места в дисковом пуле',)),
+    ('placement_rules', ('Правила размещения',)),
+]
+
+
+def classify(message: str) -> str:
+    """Класс ошибки по тексту"""
+    for name, markers in ERROR_CLASSES:
+        if any(marker in message for marker in markers):
+            return name
+    return 'other'
+
+
+class ErrorCapture(logging.Handler):
+    """Ошибки, которые методы хранилища записывают в журнал вместо исключения (по потокам)"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self._errors: Dict[int, str] = {}
+
+    def emit(self, record: logging.LogRecord):
+        self._errors[record.thread] = record.getMessage()
+
+    def pop(self) -> Optional[str]:
+        return self._errors.pop(threading.get_ident(), None)
+
+
+class LoadClient:
+    """Клиент нагрузки: операции по весам с заданной частотой, собственные ВМ для удаления"""
+
+    def __init__(self, db, client_id: int, weights: Dict[str, float], rate: float, seed: int,
+                 capture: ErrorCapture, analyzer=None):
+        self.db = db
+        self.client_id = client_id
+        self.weights = weights
+        self.rate = rate
+        self.rng = random.Random(seed * 1000 + client_id)
+        self.capture = capture
+        self.analyzer = analyzer
+        self.own_vms: List[str] = []
+        self.sequence = 0
+        # Время начала (с от старта теста) и длительность каждой операции
+        self.samples = {operation: (array('d'), array('d')) for operation in OPERATIONS}
+        self.errors: Dict[str, Dict[str, int]] = {operation: {} for operation in OPERATIONS}
+
+    def _execute(self, operation: str) -> Optional[str]:
+        """Одна операция, возвращает текст ошибки или None"""
+        if operation == 'create':
+            self.sequence += 1
+            name = f"vm77app{self.client_id:03d}{self.sequence:06d}"
+            vcpu, vram, vhdd = self.rng.choice([(2, 4, 40), (4, 8, 80), (8, 16, 100)])
+            created, message = self.db.try_create_vm({'vm_name': name, 'vcpu': vcpu, 'vram': vram, 'vhdd': vhdd})
+            if created:
+                self.own_vms.append(name)
+                return None
+            return message
+        if operation == 'delete':
+            name = self.own_vms.pop(self.rng.randrange(len(self.own_vms)))
+            return None if self.db.delete_vm(name) else "ВМ не удалена"
+        if operation == 'stats':
+            return None if self.db.get_cluster_statistics() else "Пустая статистика"
+        if self.analyzer is not None:
+            return None if self.analyzer.generate_cluster_report() else "Пустой отчет"
+        # Без pandas отчет заменяется чтением данных, на которых он строится
+        self.db.get_all_hypervisors()
+        self.db.get_all_vms()
+        return None
+
+    def step(self, started_at: float):
+        """Выбор и выполнение операции с учетом задержки, ошибки и журнала хранилища"""
+        operation = self.rng.choices(OPERATIONS, weights=[self.weights[name] for name in OPERATIONS])[0]
+        if operation == 'delete' and not self.own_vms:
+            operation = 'create'
+        self.capture.pop()
+        call_started = time.perf_counter()
+        try:
+            error = self._execute(operation)
+        except Exception as e:
+            error = f"{getattr(e, 'pgcode', '') or ''} {type(e).__name__}: {e}"
+        duration = time.perf_counter() - call_started
+        logged = self.capture.pop()
+        if error is not None or logged is not None:
+            # Сообщение журнала точнее общего результата (например, текст исключения PostgreSQL)
+            kind = classify(f"{error or ''} {logged or ''}")
+            self.errors[operation][kind] = self.errors[operation].get(kind, 0) + 1
+        starts, durations = self.samples[operation]
+        starts.append(call_started - started_at)
+        durations.append(duration)
+
+    def delay(self, started_at: float, done: int) -> float:
+        """Пауза до следующей операции (открытая модель: расписание не сдвигается из-за медленных операций)"""
+        if not self.rate:
+            return 0.0
+        return max(0.0, started_at + done / self.rate - time.perf_counter())
+
+    def result(self) -> Dict[str, Any]:
+        return {'samples': {operation: (starts.tobytes(), durations.tobytes())
+                            for operation, (starts, durations) in self.samples.items()},
+                'errors': self.errors}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {operation: 0.0 for operation in OPERATIONS}
+    for item in mix.split(","):
+        operation, _, weight = item.partition("=")
+        if operation.strip() not in weights:
+            raise ValueError(f"Неизвестная операция: {operation}")
+        weights[operation.strip()] = float(weight)
+    return weights
+
+
+def open_client_db(args):
+    """Хранилище клиента-процесса: собственные соединения"""
+    if args.backend == 'sqlite':
+        return SQLiteDatabase(f"{args.db_path}.{args.preload}")
+    from database import Database
+    return Database(dbname=args.dbname, user=args.user, password=args.password, host=args.host,
+                    port=args.port, pool_size=args.pool_size)
+
+
+def make_analyzer(db):
+    try:
+        from analysis import DataAnalyzer
+    except ImportError:
+        return None
+    return DataAnalyzer(db)
+
+
+def _client_process(args, client_id: int, weights: Dict[str, float], started_at: float, results):
+    """Клиент в отдельном процессе"""
+    capture = ErrorCapture()
+    logging.getLogger().addHandler(capture)
+    db = open_client_db(args)
+    client = LoadClient(db, client_id, weights, args.rate, args.seed, capture, make_analyzer(db))
+    # Единое время старта всех процессов (perf_counter в разных процессах несопоставим)
+    offset = time.time() - started_at
+    local_start = time.perf_counter() - offset
+    done = 0
+    try:
+        while time.perf_counter() - local_start < args.duration:
+            time.sleep(client.delay(local_start, done))
+            client.step(local_start)
+            done += 1
+    finally:
+        results.put(client.result())
+        db.close()
+
+
+def run_processes(args, weights: Dict[str, float]) -> List[Dict[str, Any]]:
+    results = multiprocessing.Queue()
+    started_at = time.time() + 1.0
+    workers = [multiprocessing.Process(target=_client_process, args=(args, i, weights, started_at, results))
+               for i in range(args.clients)]
+    for worker in workers:
+        worker.start()
+    # Очередь читается до join: иначе процесс с большим результатом не завершится
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return collected
+
+
+def run_asyncio(args, weights: Dict[str, float], db) -> List[Dict[str, Any]]:
+    """Клиенты-корутины над общим хранилищем; блокирующие вызовы - в пуле потоков (как в GUI)"""
+    capture = ErrorCapture()
+    logging.getLogger().addHandler(capture)
+    analyzer = make_analyzer(db)
+    clients = [LoadClient(db, i, weights, args.rate, args.seed, capture, analyzer) for i in range(args.clients)]
+
+    async def run_client(client: LoadClient, started_at: float, executor):
+        loop = asyncio.get_running_loop()
+        done = 0
+        while time.perf_counter() - started_at < args.duration:
+            await asyncio.sleep(client.delay(started_at, done))
+            await loop.run_in_executor(executor, client.step, started_at)
+            done += 1
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            started_at = time.perf_counter()
+            await asyncio.gather(*(run_client(client, started_at, executor) for client in clients))
+
+    asyncio.run(main())
+    return [client.result() for client in clients]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(results: List[Dict[str, Any]], duration: float, window: float) -> Dict[str, Any]:
+    """Сводка по операциям, ошибкам и интервалам времени"""
+    operations, errors, windows = {}, {}, {}
+    for operation in OPERATIONS:
+        starts, durations = array('d'), array('d')
+        for result in results:
+            starts.frombytes(result['samples'][operation][0])
+            durations.frombytes(result['samples'][operation][1])
+            for kind, count in result['errors'][operation].items():
+                errors.setdefault(operation, {})[kind] = errors.get(operation, {}).get(kind, 0) + count
+        if not durations:
+            continue
+        ordered = sorted(durations)
+        failed = sum(errors.get(operation, {}).values())
+        operations[operation] = {
+            'count': len(ordered), 'errors': failed, 'ops_per_s': len(ordered) / duration,
+            'p50_ms': percentile(ordered, 0.5) * 1000, 'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000, 'max_ms': ordered[-1] * 1000
+        }
+        for start, value in zip(starts, durations):
+            windows.setdefault(int(start // window), []).append(value)
+
+    timeline = []
+    for index in sorted(windows):
+        values = sorted(windows[index])
+        timeline.append({'from_s': index * window, 'ops_per_s': len(values) / window,
+                         'p95_ms': percentile(values, 0.95) * 1000, 'p99_ms': percentile(values, 0.99) * 1000})
+    return {'operations': operations, 'errors': errors, 'timeline': timeline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: параллельные клиенты над одним кластером")
+    parser.add_argument("--backend", choices=("postgresql", "sqlite", "memory"), default="postgresql")
+    parser.add_argument("--db-path", default="load_test.db", help="Файл SQLite (к имени добавляется --preload)")
+    parser.add_argument("--dbname", default="datacenter_bench")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="pass")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--pool-size", type=int, default=10, help="Размер пула соединений хранилища")
+    parser.add_argument("--mode", choices=("processes", "asyncio"), default="processes")
+    parser.add_argument("--clients", type=int, default=8, help="Количество клиентов")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность (с)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Операций в секунду на клиента (0 - без пауз)")
+    parser.add_argument("--mix", default="create=40,delete=30,stats=25,report=5", help="Веса операций")
+    parser.add_argument("--preload", type=int, default=1000, help="ВМ синтетического кластера до начала")
+    parser.add_argument("--window", type=float, default=10.0, help="Интервал динамики (с)")
+    parser.add_argument("--seed", type=int, default=77)
+    parser.add_argument("--output", help="Файл результатов JSON")
+    args = parser.parse_args()
+
+    if args.backend == 'memory' and args.mode == 'processes':
+        parser.error("Хранилище в памяти не разделяется между процессами: используйте --mode asyncio")
+    weights = parse_mix(args.mix)
+    logging.getLogger().setLevel(logging.ERROR)
+    for handler in logging.getLogger().handlers:
+        # Ошибки учитываются в сводке, вывод каждой в консоль не нужен
+        handler.setLevel(logging.CRITICAL)
+
+    # Исходное состояние: синтетический кластер с запасом емкости
+    cluster = generate_cluster(args.preload, seed=args.seed, fill=0.5)
+    db = open_backend(args, cluster, args.preload)
+    populate(db, cluster)
+    if args.backend != 'memory':
+        # Клиенты работают через собственные подключения с размером пула --pool-size
+        db.close()
+        db = open_client_db(args) if args.mode == 'asyncio' else None
+
+    print(f"{args.clients} клиентов ({args.mode}, {args.backend}), {args.duration:.0f} с, "
+          f"{args.rate or 'макс.'} оп/с на клиента, смесь {args.mix}")
+    started = time.perf_counter()
+    if args.mode == 'processes':
+        results = run_processes(args, weights)
+    else:
+        results = run_asyncio(args, weights, db)
+    elapsed = time.perf_counter() - started
+    summary = summarize(results, elapsed, args.window)
+
+    print(f"\n{'операция':<10}{'кол-во':>9}{'ошибок':>8}{'оп/с':>9}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'p99, мс':>10}{'макс, мс':>10}")
+    for operation, row in summary['operations'].items():
+        print(f"{operation:<10}{row['count']:>9}{row['errors']:>8}{row['ops_per_s']:>9.1f}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+    if summary['errors']:
+        print("\nОшибки:")
+        for operation, kinds in summary['errors'].items():
+            print(f"  {operation}: " + ", ".join(f"{kind} {count}" for kind, count in
+                                                 sorted(kinds.items(), key=lambda item: -item[1])))
+    if len(summary['timeline']) > 1:
+        print(f"\nДинамика (интервал {args.window:.0f} с):")
+        for row in summary['timeline']:
+            print(f"  {row['from_s']:>7.0f} с: {row['ops_per_s']:>8.1f} оп/с, p95 {row['p95_ms']:.2f} мс, "
+                  f"p99 {row['p99_ms']:.2f} мс")
+
+    # Сверка итогового состояния (клиенты остановлены)
+    if db is None:
+        db = open_client_db(args)
+    problems = db.check_invariants()
+    db.close()
+    print(f"\nСверка счетчиков: {'расхождений нет' if not problems else f'{len(problems)} расхождений'}")
+    for problem in problems[:20]:
+        print(f"  {problem}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({'meta': dict(vars(args), started_at=datetime.now().isoformat(timespec="seconds"),
+                                    elapsed_s=elapsed),
+                       'summary': summary, 'invariant_violations': problems}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
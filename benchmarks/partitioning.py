@@ -0,0 +1,192 @@
+"""Сравнение схем таблицы ВМ на большом инвентаре (PostgreSQL):
+без секций (heap), hash по hv_name и range по месяцам creation_date.
+
+Для каждой схемы таблица ВМ создается заново, гипервизоры и ВМ (по умолчанию 10 млн)
+генерируются на сервере (INSERT ... SELECT generate_series), затем измеряются:
+полный просмотр, ВМ гипервизора, ВМ за месяц, удаление ВМ по имени, удаление всех ВМ гипервизора
+и удаление ВМ старше периода. Для запросов выводится число затронутых секций (EXPLAIN).
+
+Запуск (нужна отдельная тестовая база, данные в ней удаляются):
+    python benchmarks/partitioning.py --dbname datacenter_bench --vms 10000000
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from database import Database
+
+# ВМ на гипервизор: 2 vCPU / 4 ГБ на гипервизоре 512 CPU / 2048 ГБ (помещается и без переподписки)
+VMS_PER_HV = 200
+MONTHS = 24
+
+QUERIES = {
+    'full_scan': "SELECT COUNT(*), SUM(vcpu), SUM(vram) FROM virtual_machines",
+    'host_vms': "SELECT vm_name, vcpu, vram FROM virtual_machines WHERE hv_name = %(hv_name)s",
+    'period_vms': """
+        SELECT COUNT(*), SUM(vhdd) FROM virtual_machines
+        WHERE creation_date >= %(start)s AND creation_date < %(end)s
+    """,
+}
+
+
+def reset(params: dict):
+    """Удаление таблицы ВМ и гипервизоров: Database создаст таблицу ВМ в нужной схеме"""
+    conn = psycopg2.connect(**params)
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS virtual_machines, vm_names CASCADE")
+    cur.execute("SELECT to_regclass('hypervisors') IS NOT NULL")
+    if cur.fetchone()[0]:
+        # Счетчики правил размещения удаляются каскадно
+        cur.execute("DELETE FROM hypervisors")
+        cur.execute("UPDATE storage_pool SET used_disk = 0")
+    conn.commit()
+    conn.close()
+
+
+def populate(db: Database, vms: int) -> float:
+    """Генерация гипервизоров и ВМ на сервере с пересчетом свободных ресурсов и дискового пула"""
+    hv_count = -(-vms // VMS_PER_HV)
+    oldest = date.today().replace(day=1) - timedelta(days=31 * (MONTHS - 1))
+    # Месячные секции за весь период до загрузки (иначе строки уйдут в секцию по умолчанию)
+    db._ensure_vm_partitions(db._vm_months_ahead(oldest))
+
+    overcommit_cpu, overcommit_ram = db.get_overcommit()
+
+    started = time.perf_counter()
+    conn = db._get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO hypervisors (hv_name, cpu, ram, free_cpu, free_ram)
+        SELECT 's77hv' || lpad(i::text, 6, '0'), 512, 2048, FLOOR(512 * %s::numeric), FLOOR(2048 * %s::numeric)
+        FROM generate_series(1, %s) AS i
+    """, (overcommit_cpu, overcommit_ram, hv_count))
+    # ВМ гипервизора созданы в разные месяцы, ВМ одного месяца - на разных гипервизорах
+    cur.execute("""
+        INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date)
+        SELECT 'vm77bench' || i, 2, 4, 40, 's77hv' || lpad((i %% %s + 1)::text, 6, '0'),
+               %s::timestamp + (i %% %s) * interval '1 day' + (i %% 86400) * interval '1 second'
+        FROM generate_series(1, %s) AS i
+    """, (hv_count, oldest, (date.today() - oldest).days + 1, vms))
+    cur.execute("""
+        UPDATE hypervisors h
+        SET free_cpu = h.free_cpu - v.vcpu, free_ram = h.free_ram - v.vram, num_vms = v.cnt
+        FROM (SELECT hv_name, SUM(vcpu) AS vcpu, SUM(vram) AS vram, COUNT(*) AS cnt
+              FROM virtual_machines GROUP BY hv_name) v
+        WHERE h.hv_name = v.hv_name
+    """)
+    cur.execute("""
+        UPDATE storage_pool
+        SET used_disk = v.vhdd, capacity = GREATEST(capacity, v.vhdd * 2)
+        FROM (SELECT COALESCE(SUM(vhdd), 0) AS vhdd FROM virtual_machines) v
+        WHERE pool_name = %s
+    """, (db.STORAGE_POOL,))
+    conn.commit()
+    cur.execute("ANALYZE hypervisors")
+    cur.execute("ANALYZE virtual_machines")
+    conn.commit()
+    cur.close()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def explain(cur, query: str, params: dict) -> int:
+    """Число секций (таблиц ВМ) в плане запроса после отсечения"""
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = json.dumps(cur.fetchone()[0])
+    return max(1, plan.count('"Relation Name": "virtual_machines'))
+
+
+def timed(func, repeat: int = 1) -> float:
+    """Среднее время вызова, мс"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(db: Database, vms: int, repeat: int) -> dict:
+    hv_count = -(-vms // VMS_PER_HV)
+    month = (date.today().replace(day=1) - timedelta(days=62)).replace(day=1)
+    params = {'hv_name': f"s77hv{hv_count // 2:06d}", 'start': month, 'end': Database._next_month(month)}
+    result = {'load_s': populate(db, vms), 'queries': {}, 'operations': {}}
+
+    conn = db._get_connection()
+    cur = conn.cursor()
+    for name, query in QUERIES.items():
+        execute = lambda: (cur.execute(query, params), cur.fetchall())
+        execute()  # прогрев кэша
+        result['queries'][name] = {'ms': timed(execute, 1 if name == 'full_scan' else repeat),
+                                   'partitions': explain(cur, query, params)}
+    conn.rollback()
+    cur.close()
+    conn.close()
+
+    operations = result['operations']
+    operations['delete_vm'] = timed(lambda: db.delete_vm(f"vm77bench{vms // 3}"))
+    operations['delete_vms_on_hypervisor'] = timed(lambda: db.delete_vms_on_hypervisor(params['hv_name']))
+    # Удаление ВМ старше года по границе месяца: при range - удаление месячных секций целиком
+    cutoff = datetime.combine((date.today() - timedelta(days=365)).replace(day=1), datetime.min.time())
+    operations['delete_vms_created_before'] = timed(lambda: db.delete_vms_created_before(cutoff))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Секционирование таблицы ВМ на большом инвентаре")
+    parser.add_argument("--dbname", default="datacenter_bench")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="pass")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--vms", type=float, default=1e7, help="Число ВМ (допускается запись 1e7)")
+    parser.add_argument("--layouts", default="heap,hash,range")
+    parser.add_argument("--hash-partitions", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Файл результатов JSON (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    params = dict(dbname=args.dbname, user=args.user, password=args.password, host=args.host, port=args.port)
+    vms = int(args.vms)
+    # Начальная конфигурация новой базы; емкость пула пересчитывается после загрузки
+    config = {'disk_pool': str(vms * 40 * 2)}
+
+    results = {}
+    for layout in args.layouts.split(","):
+        reset(params)
+        db = Database(**params, config=config, partitioning=None if layout == 'heap' else layout,
+                      hash_partitions=args.hash_partitions)
+        results[layout] = run(db, vms, args.repeat)
+        db.close()
+        print(f"{layout}: загрузка {vms} ВМ за {results[layout]['load_s']:.1f} c")
+
+    names = list(QUERIES) + ['delete_vm', 'delete_vms_on_hypervisor', 'delete_vms_created_before']
+    print(f"{'операция, мс (секций)':<28}" + "".join(f"{layout:>18}" for layout in results))
+    for name in names:
+        cells = []
+        for layout in results:
+            if name in QUERIES:
+                query = results[layout]['queries'][name]
+                cells.append(f"{query['ms']:>12.2f} ({query['partitions']:>2})")
+            else:
+                cells.append(f"{results[layout]['operations'][name]:>18.2f}")
+        print(f"{name:<28}" + "".join(cells))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"partitioning_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({'vms': vms, 'hash_partitions': args.hash_partitions, 'results': results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main()
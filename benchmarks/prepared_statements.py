@@ -0,0 +1,72 @@
+"""Сравнение накладных расходов на разбор/планирование запросов:
+обычные запросы против подготовленных (PREPARE/EXECUTE) на локальном PostgreSQL.
+
+Запуск (нужна отдельная тестовая база, данные в ней изменяются):
+    python benchmarks/prepared_statements.py --dbname datacenter_bench --ops 10000
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+def run(db: Database, ops: int) -> dict:
+    """ops операций: создание ВМ, удаление ВМ и статистика кластера по очереди"""
+    vm = {'vm_name': 'vm77bench', 'vcpu': 2, 'vram': 4, 'vhdd': 40}
+    timings = {'create_vm': [], 'delete_vm': [], 'get_cluster_statistics': []}
+
+    for i in range(ops):
+        kind = ('create_vm', 'delete_vm', 'get_cluster_statistics')[i % 3]
+        started = time.perf_counter()
+        if kind == 'create_vm':
+            db.create_vm(vm)
+        elif kind == 'delete_vm':
+            db.delete_vm(vm['vm_name'])
+        else:
+            db.get_cluster_statistics()
+        timings[kind].append(time.perf_counter() - started)
+
+    return {kind: sum(values) / len(values) * 1000 for kind, values in timings.items() if values}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк подготовленных запросов")
+    parser.add_argument("--dbname", default="datacenter_bench")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="pass")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--ops", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    params = dict(dbname=args.dbname, user=args.user, password=args.password, host=args.host, port=args.port)
+
+    results = {}
+    for prepared in (False, True):
+        db = Database(**params, prepared_statements=prepared)
+        if not db.get_all_hypervisors():
+            db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 64, 'ram': 512})
+        db.delete_vm('vm77bench')
+
+        run(db, min(args.ops, 300))  # прогрев соединения и кэшей
+        started = time.perf_counter()
+        results[prepared] = run(db, args.ops)
+        results[prepared]['total_s'] = time.perf_counter() - started
+        db.close()
+
+    print(f"{'операция':<26}{'без PREPARE, мс':>18}{'с PREPARE, мс':>18}{'выигрыш':>10}")
+    for kind in ('create_vm', 'delete_vm', 'get_cluster_statistics'):
+        plain, prepared = results[False][kind], results[True][kind]
+        print(f"{kind:<26}{plain:>18.3f}{prepared:>18.3f}{(1 - prepared / plain) * 100:>9.1f}%")
+    print(f"Всего {args.ops} операций: {results[False]['total_s']:.2f} c без PREPARE, "
+          f"{results[True]['total_s']:.2f} c с PREPARE")
+
+
+if __name__ == "__main__":
+    main()
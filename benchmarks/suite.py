@@ -0,0 +1,275 @@
+"""Набор бенчмарков основных операций на синтетическом кластере.
+
+Для каждого масштаба (количество ВМ) хранилище заполняется воспроизводимым синтетическим кластером
+(benchmarks/synthetic.py), затем измеряются операции с ВМ, статистика, отчеты, графики и генераторы имен.
+Результаты сохраняются в JSON; --compare сравнивает их с результатами предыдущей версии.
+
+Запуск:
+    python benchmarks/suite.py --backend memory --scales 100,1000,10000
+    python benchmarks/suite.py --backend sqlite --scales 1e2,1e4,1e6 --output results.json
+    python benchmarks/suite.py --backend postgresql --dbname datacenter_bench --compare old.json
+PostgreSQL: нужна отдельная пустая база (данные в ней удаляются); конфигурация кластера
+задается при первом подключении, поэтому масштабы одного запуска должны идти по возрастанию.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteDatabase, MemoryDatabase
+from async_operations import AsyncOperations
+from utils import NameGenerator
+from benchmarks.synthetic import generate_cluster
+
+# Операции набора в порядке выполнения
+OPERATIONS = ('generate_vm_name', 'generate_vm_names', 'create_vm', 'delete_vm', 'mass_deploy_vms',
+              'get_cluster_statistics', 'get_resource_usage_report', 'save_report_to_csv',
+              'generate_visualizations')
+
+
+def measure(func: Callable, iterations: int) -> Dict[str, float]:
+    """Длительность каждого вызова: среднее, p50, p95, максимум (мс) и пропускная способность"""
+    timings = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - call_started)
+    total = time.perf_counter() - started
+    timings.sort()
+    return {
+        'iterations': iterations, 'total_s': total,
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'ops_per_s': iterations / total if total else 0.0
+    }
+
+
+def peak_memory(func: Callable) -> float:
+    """Пиковый объем памяти одного вызова (МБ) по tracemalloc: объекты Python и массивы NumPy.
+    Буферы Arrow tracemalloc не видит: добавляется пик пула памяти pyarrow за время процесса"""
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    try:
+        import pyarrow
+        peak += pyarrow.default_memory_pool().max_memory() or 0
+    except ImportError:
+        pass
+    return peak / 2 ** 20
+
+
+def open_backend(args, cluster: Dict[str, Any], scale: int):
+    """Пустое хранилище с конфигурацией синтетического кластера"""
+    if args.backend == 'memory':
+        return MemoryDatabase(config=cluster['config'])
+    if args.backend == 'sqlite':
+        path = ":memory:" if args.db_path == ":memory:" else f"{args.db_path}.{scale}"
+        if path != ":memory:":
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        return SQLiteDatabase(path, config=cluster['config'])
+
+    from database import Database
+    db = Database(dbname=args.dbname, user=args.user, password=args.password, host=args.host,
+                  port=args.port, config=cluster['config'])
+    # База бенчмарка очищается перед каждым масштабом
+    db.delete_vms_bulk([vm['vm_name'] for vm in db.get_all_vms()])
+    for hv in db.get_all_hypervisors():
+        db.delete_hypervisor(hv['hv_name'])
+    return db
+
+
+def populate(db, cluster: Dict[str, Any]) -> Dict[str, float]:
+    """Загрузка синтетического кластера: гипервизоры по одному, ВМ пакетами"""
+    started = time.perf_counter()
+    for hv in cluster['hypervisors']:
+        if not db.add_hypervisor(hv):
+            raise RuntimeError(f"Не удалось добавить гипервизор {hv['hv_name']}")
+    vms = cluster['vms']
+    for offset in range(0, len(vms), 10000):
+        chunk = vms[offset:offset + 10000]
+        if db.create_vms_bulk(chunk) != len(chunk):
+            raise RuntimeError("Не удалось загрузить ВМ синтетического кластера")
+    total = time.perf_counter() - started
+    return {'iterations': len(vms), 'total_s': total, 'mean_ms': total / max(len(vms), 1) * 1000,
+            'ops_per_s': len(vms) / total if total else 0.0}
+
+
+def run_scale(args, scale: int) -> List[Dict[str, Any]]:
+    """Все операции на одном масштабе"""
+    cluster = generate_cluster(scale, seed=args.seed)
+    db = open_backend(args, cluster, scale)
+    results = []
+
+    def record(operation: str, stats: Optional[Dict[str, Any]] = None, skipped: str = ""):
+        entry = {'operation': operation, 'scale': scale, 'hypervisors': len(cluster['hypervisors'])}
+        entry.update(stats or {'skipped': skipped})
+        results.append(entry)
+        if skipped:
+            print(f"  {operation:<28} пропущено: {skipped}")
+        else:
+            print(f"  {operation:<28} {entry.get('mean_ms', 0):>10.3f} мс  "
+                  f"p95 {entry.get('p95_ms', 0):>10.3f} мс  {entry['ops_per_s']:>12.1f} оп/с"
+                  + (f"  пик {entry['peak_mb']:.1f} МБ" if 'peak_mb' in entry else ""))
+
+    def selected(operation: str) -> bool:
+        return not args.only or operation in args.only
+
+    try:
+        record('populate', populate(db, cluster))
+        existing = [vm['vm_name'] for vm in cluster['vms']]
+        ops = min(args.ops, max(scale, 10))
+
+        # Генераторы имен работают со списком всех существующих имен
+        if selected('generate_vm_name'):
+            record('generate_vm_name', measure(
+                lambda i: NameGenerator.generate_vm_name("vm77app01", existing), args.repeat))
+        if selected('generate_vm_names'):
+            record('generate_vm_names', measure(
+                lambda i: NameGenerator.generate_vm_names("vm77app01", existing, 100), args.repeat))
+
+        # Новые ВМ типового размера, имена за пределами синтетических
+        names = NameGenerator.generate_vm_names("vm77app01", existing, ops)
+        vm = {'vcpu': 2, 'vram': 4, 'vhdd': 40}
+        if selected('create_vm') or selected('delete_vm'):
+            record('create_vm', measure(lambda i: db.create_vm(dict(vm, vm_name=names[i])), ops))
+            record('delete_vm', measure(lambda i: db.delete_vm(names[i]), ops))
+        if selected('mass_deploy_vms'):
+            ops_async = AsyncOperations(db)
+            stats = measure(lambda i: asyncio.run(ops_async.mass_deploy_vms(dict(vm, vm_name=names[0]), ops)), 1)
+            # Пропускная способность - ВМ в секунду, а не запусков
+            stats['ops_per_s'] = ops / stats['total_s'] if stats['total_s'] else 0.0
+            stats['vms'] = ops
+            record('mass_deploy_vms', stats)
+            synthetic = set(existing)
+            db.delete_vms_bulk([row['vm_name'] for row in db.get_all_vms() if row['vm_name'] not in synthetic])
+
+        if selected('get_cluster_statistics'):
+            record('get_cluster_statistics', measure(lambda i: db.get_cluster_statistics(), args.repeat))
+
+        analysis_ops = [operation for operation in OPERATIONS[6:] if selected(operation)]
+        if analysis_ops:
+            try:
+                from analysis import DataAnalyzer
+            except ImportError as e:
+                for operation in analysis_ops:
+                    record(operation, skipped=f"нет зависимости ({e.name})")
+                return results
+
+            analyzer = DataAnalyzer(db)
+            with tempfile.TemporaryDirectory() as directory:
+                if selected('get_resource_usage_report'):
+                    stats = measure(lambda i: analyzer.get_resource_usage_report(), args.repeat)
+                    stats['peak_mb'] = peak_memory(analyzer.get_resource_usage_report)
+                    record('get_resource_usage_report', stats)
+                if selected('save_report_to_csv'):
+                    record('save_report_to_csv', measure(
+                        lambda i: analyzer.save_report_to_csv(os.path.join(directory, f"report{i}.xlsx")), 1))
+                if selected('generate_visualizations'):
+                    record('generate_visualizations', measure(
+                        lambda i: analyzer.generate_visualizations(os.path.join(directory, f"plot{i}.png"),
+                                                                   show=False), 1))
+        return results
+    finally:
+        db.close()
+
+
+def git_revision() -> str:
+    """Версия кода для сравнения результатов"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> int:
+    """Сравнение средней длительности с предыдущими результатами, возвращает количество регрессий"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(entry['operation'], entry['scale']): entry for entry in json.load(f)['results']}
+
+    regressions = 0
+    print(f"\nСравнение с {baseline_path} (допуск {tolerance:.0f}%):")
+    print(f"{'операция':<28}{'масштаб':>10}{'было, мс':>14}{'стало, мс':>14}{'изменение':>12}")
+    for entry in results:
+        old = baseline.get((entry['operation'], entry['scale']))
+        if old is None or 'mean_ms' not in old or 'mean_ms' not in entry:
+            continue
+        change = (entry['mean_ms'] / old['mean_ms'] - 1) * 100 if old['mean_ms'] else 0.0
+        mark = ""
+        if change > tolerance:
+            regressions += 1
+            mark = "  регрессия"
+        print(f"{entry['operation']:<28}{entry['scale']:>10}{old['mean_ms']:>14.3f}"
+              f"{entry['mean_ms']:>14.3f}{change:>+11.1f}%{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки операций на синтетическом кластере")
+    parser.add_argument("--backend", choices=("memory", "sqlite", "postgresql"), default="memory")
+    parser.add_argument("--db-path", default=":memory:", help="Файл SQLite (к имени добавляется масштаб)")
+    parser.add_argument("--dbname", default="datacenter_bench")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="pass")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--scales", default="100,1000,10000",
+                        help="Количество ВМ синтетического кластера через запятую (до 1e6)")
+    parser.add_argument("--ops", type=int, default=200, help="Созданий/удалений ВМ на масштабе")
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов операций чтения")
+    parser.add_argument("--seed", type=int, default=77)
+    parser.add_argument("--only", nargs="*", choices=OPERATIONS, help="Только указанные операции")
+    parser.add_argument("--output", help="Файл результатов JSON (по умолчанию benchmarks/results/...)")
+    parser.add_argument("--compare", help="Результаты предыдущей версии для сравнения")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="Допустимое замедление, %%")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    scales = sorted(int(float(scale)) for scale in args.scales.split(","))
+    started_at = datetime.now()
+
+    results = []
+    for scale in scales:
+        print(f"Масштаб {scale} ВМ ({args.backend}):")
+        results.extend(run_scale(args, scale))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"{args.backend}-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            'meta': {
+                'started_at': started_at.isoformat(timespec="seconds"), 'backend': args.backend,
+                'revision': git_revision(), 'python': platform.python_version(),
+                'platform': platform.platform(), 'scales': scales, 'seed': args.seed,
+                'ops': args.ops, 'repeat': args.repeat
+            },
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Воспроизводимый генератор синтетического кластера для бенчмарков и нагрузочных тестов.
+
+Одинаковые параметры и seed дают одинаковый кластер: гипервизоры разных конфигураций,
+ВМ трех типов с типовыми размерами и датами создания за указанный период (с ростом к текущей дате).
+ВМ уже размещены по гипервизорам и загружаются одной транзакцией (StorageBackend.create_vms_bulk).
+"""
+import heapq
+import math
+import random
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+# Конфигурации гипервизоров: (CPU, RAM ГБ, доля)
+HV_PROFILES = [(32, 256, 0.15), (48, 384, 0.2), (64, 512, 0.35), (96, 768, 0.2), (128, 1024, 0.1)]
+
+# Типы ВМ: доля и типовые размеры (vCPU, vRAM ГБ, vHDD ГБ, доля внутри типа)
+VM_TYPES = {
+    'app': (0.6, [(2, 4, 40, 0.3), (4, 8, 80, 0.4), (8, 16, 100, 0.2), (8, 32, 200, 0.1)]),
+    'db': (0.2, [(4, 16, 200, 0.2), (8, 32, 500, 0.4), (16, 64, 1000, 0.3), (24, 128, 2048, 0.1)]),
+    'ts': (0.2, [(4, 8, 80, 0.5), (8, 16, 120, 0.35), (8, 32, 200, 0.15)]),
+}
+
+# Целевая загрузка кластера: остаток оставляет место для операций бенчмарка
+TARGET_FILL = 0.75
+
+
+def _weighted(rng: random.Random, items: List[tuple]):
+    return rng.choices(items, weights=[item[-1] for item in items])[0]
+
+
+def generate_vms(count: int, seed: int = 77, days: int = 365,
+                 now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """count ВМ со смесью типов и размеров; номера внутри типа идут подряд (vm77app01, vm77app02, ...)"""
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    types = [(vm_type, share) for vm_type, (share, _) in VM_TYPES.items()]
+    numbers = {vm_type: 0 for vm_type in VM_TYPES}
+    vms = []
+    for _ in range(count):
+        vm_type = _weighted(rng, types)[0]
+        vcpu, vram, vhdd, _ = _weighted(rng, VM_TYPES[vm_type][1])
+        numbers[vm_type] += 1
+        # Корень из равномерного распределения: ВМ чаще создавались в последнее время
+        age = days * (1 - math.sqrt(rng.random()))
+        vms.append({
+            'vm_name': f"vm77{vm_type}{numbers[vm_type]:02d}", 'vcpu': vcpu, 'vram': vram, 'vhdd': vhdd,
+            'creation_date': now - timedelta(days=age)
+        })
+    return vms
+
+
+def generate_cluster(vm_count: int, hv_count: Optional[int] = None, seed: int = 77, days: int = 365,
+                     overcommit_cpu: float = 3.0, overcommit_ram: float = 1.0,
+                     fill: float = TARGET_FILL) -> Dict[str, Any]:
+    """Синтетический кластер: {'hypervisors', 'vms' (с hv_name), 'config'}.
+    hv_count=None - гипервизоров столько, чтобы загрузка была около fill"""
+    rng = random.Random(seed + 1)
+    vms = generate_vms(vm_count, seed, days)
+
+    def new_hypervisor(number: int) -> Dict[str, Any]:
+        cpu, ram, _ = _weighted(rng, HV_PROFILES)
+        return {'hv_name': f"s77hv{number:02d}", 'cpu': cpu, 'ram': ram,
+                'free_cpu': int(cpu * overcommit_cpu), 'free_ram': int(ram * overcommit_ram)}
+
+    if hv_count is None:
+        mean_cpu = sum(cpu * share for cpu, _, share in HV_PROFILES) * overcommit_cpu
+        mean_ram = sum(ram * share for _, ram, share in HV_PROFILES) * overcommit_ram
+        hv_count = max(1, math.ceil(max(sum(vm['vcpu'] for vm in vms) / mean_cpu,
+                                         sum(vm['vram'] for vm in vms) / mean_ram) / fill))
+    hypervisors = [new_hypervisor(i + 1) for i in range(hv_count)]
+
+    def free_share(hv: Dict[str, Any]) -> float:
+        return min(hv['free_cpu'] / (hv['cpu'] * overcommit_cpu), hv['free_ram'] / (hv['ram'] * overcommit_ram))
+
+    # Размещение: на гипервизор с наибольшей долей свободных ресурсов; если ВМ на нем не помещается,
+    # добавляется гипервизор (только на малых масштабах или при явно заданном малом hv_count)
+    heap = [(-1.0, i) for i in range(len(hypervisors))]
+    for vm in vms:
+        i = heap[0][1]
+        hv = hypervisors[i]
+        fits = hv['free_cpu'] >= vm['vcpu'] and hv['free_ram'] >= vm['vram']
+        if not fits:
+            hypervisors.append(new_hypervisor(len(hypervisors) + 1))
+            i, hv = len(hypervisors) - 1, hypervisors[-1]
+        hv['free_cpu'] -= vm['vcpu']
+        hv['free_ram'] -= vm['vram']
+        vm['hv_name'] = hv['hv_name']
+        if fits:
+            heapq.heapreplace(heap, (-free_share(hv), i))
+        else:
+            heapq.heappush(heap, (-free_share(hv), i))
+
+    disk = sum(vm['vhdd'] for vm in vms)
+    config = {
+        'overcommit_cpu': str(overcommit_cpu), 'overcommit_ram': str(overcommit_ram),
+        'max_hypervisors': str(max(24, len(hypervisors) * 2)),
+        # Запас пула под операции бенчмарка (создание и массовое развертывание поверх загрузки)
+        'disk_pool': str(max(1000000, math.ceil(disk / fill)))
+    }
+    return {
+        'hypervisors': [{'hv_name': hv['hv_name'], 'cpu': hv['cpu'], 'ram': hv['ram']} for hv in hypervisors],
+        'vms': vms,
+        'config': config
+    }
@@ -0,0 +1,207 @@
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import List, Dict, Tuple, Any, Optional, Callable
+
+from storage import StorageBackend, open_database
+from utils import PlacementPolicy, ResourceCalculator
+from metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Межкластерные операции: время до ответа всех кластеров
+CLUSTER_FANOUT_SECONDS = REGISTRY.histogram("datacenter_cluster_fanout_seconds", "Запрос ко всем кластерам",
+                                            ("operation",))
+
+# Показатели статистики, которые складываются по кластерам (проценты пересчитываются по суммам)
+ADDITIVE_STATISTICS = ('total_hypervisors', 'total_cpu', 'total_ram', 'free_cpu', 'free_ram', 'total_vms',
+                       'vm_count', 'vcpu_capacity', 'vram_capacity', 'total_vcpu', 'total_vram',
+                       'used_physical_cpu', 'used_physical_ram', 'disk_pool', 'total_vhdd', 'free_disk')
+
+
+class ClusterSet:
+    """Несколько кластеров (площадок): у каждого своя база (хранилище) со своей cluster_config.
+    Межкластерные операции выполняются одновременно на всех кластерах в пуле потоков
+    (запросы к PostgreSQL идут через пулы соединений кластеров), результаты объединяются.
+    Время запроса ко всем кластерам - время самого медленного из них, а не сумма.
+    У каждого кластера свой поток: зависший кластер не занимает потоки остальных, новые запросы
+    к нему не ставятся в очередь, пока не завершится зависший. Кластеры, к которым не удалось
+    подключиться, перечислены в unavailable и в ответах операций"""
+
+    def __init__(self, clusters: Dict[str, StorageBackend], timeout: float = 30.0,
+                 unavailable: Optional[Dict[str, str]] = None):
+        if not clusters and not unavailable:
+            raise ValueError("Не задано ни одного кластера")
+        self.clusters = dict(clusters)
+        self.unavailable = dict(unavailable or {})
+        self.timeout = timeout
+        self._executors = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cluster-{name}")
+                           for name in self.clusters}
+        # Запросы, не завершившиеся за timeout: кластер -> выполняющийся запрос
+        self._stalled: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._analyzers: Dict[StorageBackend, Any] = {}
+
+    @classmethod
+    def from_config(cls, path: str, timeout: float = 30.0) -> 'ClusterSet':
+        """Кластеры из файла JSON:
+        {"clusters": {"msk": {"backend": "postgresql", "dbname": "datacenter_msk", "host": "..."},
+                      "spb": {"backend": "sqlite", "path": "spb.db", "config": {"disk_pool": "500000"}}}}
+        Остальные ключи - параметры open_database; config - начальная конфигурация новой базы,
+        cluster_name по умолчанию - ключ кластера"""
+        with open(path, encoding="utf-8") as f:
+            settings = json.load(f)['clusters']
+
+        def connect(name: str) -> StorageBackend:
+            params = dict(settings[name])
+            backend = params.pop('backend', 'postgresql')
+            params['config'] = dict({'cluster_name': name}, **params.get('config', {}))
+            return open_database(backend, **params)
+
+        # Подключения (создание пулов и проверка схемы) тоже выполняются одновременно;
+        # недоступный кластер не мешает работе с остальными
+        clusters, unavailable = {}, {}
+        with ThreadPoolExecutor(max_workers=max(len(settings), 1)) as executor:
+            futures = {name: executor.submit(connect, name) for name in settings}
+            for name, future in futures.items():
+                try:
+                    clusters[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Кластер {name} недоступен: {e}")
+                    unavailable[name] = f"нет подключения: {e}"
+        return cls(clusters, timeout, unavailable)
+
+    def close(self):
+        """Остановка потоков и закрытие хранилищ кластеров (зависшие запросы не ожидаются)"""
+        with self._lock:
+            stalled = {name for name, future in self._stalled.items() if not future.done()}
+        for name, executor in self._executors.items():
+            executor.shutdown(wait=name not in stalled, cancel_futures=True)
+        for db in self.clusters.values():
+            db.close()
+
+    def fan_out(self, operation: str, func: Callable[[StorageBackend], Any],
+                clusters: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Выполнение func(db) на всех (или указанных) кластерах одновременно.
+        Возвращает (результаты по кластерам, ошибки по кластерам): недоступный кластер
+        или превышение timeout не прерывают операцию на остальных. Запрос, не завершившийся
+        за timeout, продолжает выполняться в потоке кластера; до его завершения кластер
+        сразу получает ошибку"""
+        started = time.perf_counter()
+        names = clusters or list(self.clusters) + list(self.unavailable)
+        futures, errors = {}, {}
+        with self._lock:
+            for name in names:
+                if name not in self.clusters:
+                    errors[name] = self.unavailable.get(name, "неизвестный кластер")
+                    continue
+                stalled = self._stalled.get(name)
+                if stalled is not None and not stalled.done():
+                    errors[name] = "не завершен предыдущий запрос"
+                    continue
+                self._stalled.pop(name, None)
+                futures[name] = self._executors[name].submit(func, self.clusters[name])
+        wait(futures.values(), timeout=self.timeout)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                # Выполняющийся запрос не отменить - кластер помечается до его завершения
+                if not future.cancel():
+                    with self._lock:
+                        self._stalled[name] = future
+                errors[name] = f"нет ответа за {self.timeout:g} с"
+            elif future.exception() is not None:
+                errors[name] = str(future.exception())
+            else:
+                results[name] = future.result()
+        for name, error in errors.items():
+            if name not in self.unavailable:
+                logger.error(f"Кластер {name}, {operation}: {error}")
+        CLUSTER_FANOUT_SECONDS.observe(time.perf_counter() - started, operation)
+        return results, errors
+
+    def get_global_statistics(self) -> Dict[str, Any]:
+        """Статистика каждого кластера и итог по всем доступным:
+        {'clusters': {имя: статистика}, 'total': сумма, 'unavailable': {имя: причина}}"""
+        results, errors = self.fan_out("statistics", lambda db: db.get_cluster_statistics())
+        # Хранилища возвращают пустую статистику при ошибке чтения
+        for name in [name for name, stats in results.items() if not stats]:
+            errors[name] = "не удалось получить статистику"
+            del results[name]
+        return {'clusters': results, 'total': self.merge_statistics(list(results.values())),
+                'unavailable': errors}
+
+    @staticmethod
+    def merge_statistics(statistics: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Сумма статистики кластеров с пересчетом процентов использования"""
+        total = {key: sum(stats.get(key, 0) for stats in statistics) for key in ADDITIVE_STATISTICS}
+        total['used_physical_cpu'] = round(total['used_physical_cpu'], 1)
+        total['used_physical_ram'] = round(total['used_physical_ram'], 1)
+        total['cpu_usage_percent'] = ResourceCalculator.calculate_cpu_usage(total['vcpu_capacity'], total['free_cpu'])
+        total['ram_usage_percent'] = ResourceCalculator.calculate_ram_usage(total['vram_capacity'], total['free_ram'])
+        total['disk_usage_percent'] = total['total_vhdd'] / total['disk_pool'] * 100 if total['disk_pool'] else 0.0
+        return total
+
+    def find_capacity(self, vcpu: int, vram: int, vhdd: int) -> List[Dict[str, Any]]:
+        """Кластеры, в которых есть место для ВМ, по убыванию доли свободного CPU.
+        Правила размещения не учитываются - их проверяет создание ВМ в кластере"""
+        def probe(db: StorageBackend) -> Dict[str, Any]:
+            hypervisors = db.get_all_hypervisors()
+            stats = db.get_cluster_statistics()
+            return {
+                'hypervisor': (PlacementPolicy.choose_hypervisor(hypervisors, vcpu, vram) or {}).get('hv_name'),
+                'fits': sum(1 for hv in hypervisors if hv['free_cpu'] >= vcpu and hv['free_ram'] >= vram),
+                'free_disk': stats.get('free_disk', 0),
+                'free_cpu_share': stats.get('free_cpu', 0) / stats['vcpu_capacity'] if stats.get('vcpu_capacity') else 0.0
+            }
+
+        results, _ = self.fan_out("find_capacity", probe)
+        candidates = [dict(result, cluster=name) for name, result in results.items()
+                      if result['hypervisor'] and result['free_disk'] >= vhdd]
+        return sorted(candidates, key=lambda result: (-result['free_cpu_share'], result['cluster']))
+
+    def create_vm_anywhere(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ в кластере с наибольшим запасом ресурсов: (True, 'кластер/гипервизор') или
+        (False, причина). При отказе (ресурсы заняты параллельно, правила размещения) - следующий кластер"""
+        candidates = self.find_capacity(vm_data['vcpu'], vm_data['vram'], vm_data['vhdd'])
+        if not candidates:
+            return False, "Ни в одном кластере нет места для ВМ"
+        reasons = []
+        for candidate in candidates:
+            db = self.clusters[candidate['cluster']]
+            try:
+                created, message = db.try_create_vm(vm_data)
+            except Exception as e:
+                created, message = False, str(e)
+            if created:
+                logger.info(f"ВМ {vm_data['vm_name']} создана в кластере {candidate['cluster']} на {message}")
+                return True, f"{candidate['cluster']}/{message}"
+            reasons.append(f"{candidate['cluster']}: {message}")
+        return False, "; ".join(reasons)
+
+    def get_reports(self) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+        """Отчеты по кластерам (DataAnalyzer.generate_cluster_report), построенные одновременно.
+        Анализатор каждого кластера сохраняется между вызовами вместе со своим кэшем отчетов"""
+        from analysis import DataAnalyzer
+
+        for db in self.clusters.values():
+            if db not in self._analyzers:
+                self._analyzers[db] = DataAnalyzer(db)
+        return self.fan_out("cluster_report", lambda db: self._analyzers[db].generate_cluster_report())
+
+    @staticmethod
+    def format_report(statistics: Dict[str, Any]) -> str:
+        """Текстовая сводка по кластерам для консоли"""
+        lines = [f"{'кластер':<16}{'гипервизоров':>14}{'ВМ':>10}{'CPU, %':>9}{'RAM, %':>9}{'диск, %':>9}"]
+        rows = sorted(statistics['clusters'].items()) + [("ИТОГО", statistics['total'])]
+        for name, stats in rows:
+            lines.append(f"{name:<16}{stats.get('total_hypervisors', 0):>14}{stats.get('total_vms', 0):>10}"
+                         f"{stats.get('cpu_usage_percent', 0):>9.1f}{stats.get('ram_usage_percent', 0):>9.1f}"
+                         f"{stats.get('disk_usage_percent', 0):>9.1f}")
+        for name, error in sorted(statistics['unavailable'].items()):
+            lines.append(f"{name:<16}недоступен: {error}")
+        return "\n".join(lines)
@@ -0,0 +1,50 @@
+import time
+import threading
+import logging
+from typing import Any, Callable, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Текст отказа по тайм-ауту (по нему классифицирует ошибки нагрузочный тест)
+POOL_TIMEOUT_MESSAGE = "Нет свободного соединения в пуле"
+
+
+class BlockingConnectionPool:
+    """Пул соединений, в котором getconn() ждет освобождения соединения.
+    ThreadedConnectionPool psycopg2 при занятых соединениях сразу выбрасывает PoolError;
+    обертка ограничивает число выданных соединений семафором размером с пул, поэтому
+    лишние потоки ждут своей очереди. timeout (с) - не ждать бесконечно, если поток,
+    держащий соединение, сам ждет второе (None - без ограничения).
+    on_wait(секунды) получает время ожидания места в пуле (метрика), в том числе неудачного"""
+
+    def __init__(self, pool: Any, size: int, timeout: Optional[float] = 30.0,
+                 on_wait: Optional[Callable[[float], None]] = None):
+        self._pool = pool
+        self._slots = threading.BoundedSemaphore(size)
+        self.size = size
+        self.timeout = timeout
+        self.on_wait = on_wait
+
+    def getconn(self) -> Any:
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout if self.timeout is not None else -1)
+        if self.on_wait is not None:
+            self.on_wait(time.perf_counter() - started)
+        if not acquired:
+            raise TimeoutError(f"{POOL_TIMEOUT_MESSAGE} за {self.timeout:g} с (размер пула {self.size})")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: Any, close: bool = False):
+        """Возврат соединения (close=True - закрыть, например после обрыва) и освобождение места в пуле"""
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
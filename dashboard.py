@@ -0,0 +1,175 @@
+import threading
+import logging
+from typing import List, Dict, Any, Optional
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from utils import ResourceCalculator
+from metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Длительность обновления представлений интерфейса (таблицы, панель мониторинга, графики)
+GUI_REFRESH_SECONDS = REGISTRY.histogram("datacenter_gui_refresh_seconds", "Обновление представления GUI", ("view",))
+
+
+class LiveDashboard:
+    """Встроенная панель мониторинга загрузки гипервизоров.
+    Фигура перестраивается только при изменении состава гипервизоров,
+    в остальных случаях меняются высоты и цвета столбцов с отрисовкой через blit"""
+
+    def __init__(self, parent, root, db, interval_ms: int = 1000):
+        self.root = root
+        self.db = db
+        self.interval_ms = interval_ms
+
+        self.figure = Figure(figsize=(12, 5))
+        self.canvas = FigureCanvasTkAgg(self.figure, master=parent)
+        self.widget = self.canvas.get_tk_widget()
+
+        grid = self.figure.add_gridspec(1, 4)
+        self.hv_axes = self.figure.add_subplot(grid[0, :3])
+        self.total_axes = self.figure.add_subplot(grid[0, 3])
+
+        self._hv_names: Optional[List[str]] = None
+        self._cpu_bars = []
+        self._ram_bars = []
+        self._total_bars = []
+        self._total_text = None
+        self._bar_colors: Dict[int, str] = {}
+        self._background = None
+        self._fetching = False
+        self._timer_id = None
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    @staticmethod
+    def _usage_color(value: float, normal: str) -> str:
+        """Цвет столбца по порогам загрузки (как в generate_visualizations)"""
+        return 'red' if value > 80 else 'orange' if value > 50 else normal
+
+    def _animated_artists(self) -> list:
+        return self._cpu_bars + self._ram_bars + self._total_bars + [self._total_text]
+
+    def _build(self, hv_names: List[str]):
+        """Полная перестройка фигуры (при изменении состава гипервизоров)"""
+        self.hv_axes.clear()
+        self.total_axes.clear()
+
+        positions = range(len(hv_names))
+        width = 0.4
+        cpu = self.hv_axes.bar([p - width / 2 for p in positions], [0] * len(hv_names), width,
+                               label='CPU', color='green', edgecolor='black', animated=True)
+        ram = self.hv_axes.bar([p + width / 2 for p in positions], [0] * len(hv_names), width,
+                               label='RAM', color='blue', edgecolor='black', animated=True)
+        self._cpu_bars = list(cpu)
+        self._ram_bars = list(ram)
+
+        self.hv_axes.set_xticks(list(positions))
+        self.hv_axes.set_xticklabels(hv_names, rotation=45, fontsize=9)
+        self.hv_axes.set_ylim(0, 105)
+        self.hv_axes.set_ylabel('Использование (%)')
+        self.hv_axes.set_title('Загрузка гипервизоров', fontweight='bold')
+        self.hv_axes.axhline(y=80, color='darkred', linestyle='--', alpha=0.7)
+        self.hv_axes.axhline(y=50, color='darkorange', linestyle='--', alpha=0.7)
+        self.hv_axes.grid(axis='y', alpha=0.3, linestyle='--')
+        self.hv_axes.legend(fontsize=9, loc='upper right')
+
+        totals = self.total_axes.bar(['CPU', 'RAM'], [0, 0], color=['green', 'blue'],
+                                     edgecolor='black', animated=True)
+        self._total_bars = list(totals)
+        self.total_axes.set_ylim(0, 105)
+        self.total_axes.set_title('Кластер', fontweight='bold')
+        self.total_axes.grid(axis='y', alpha=0.3, linestyle='--')
+        self._total_text = self.total_axes.text(0.5, 0.95, '', transform=self.total_axes.transAxes,
+                                                ha='center', va='top', fontsize=9, animated=True)
+
+        self._hv_names = hv_names
+        self._bar_colors = {}
+        self.figure.tight_layout()
+        self.canvas.draw()
+
+    def _on_draw(self, event):
+        """Сохранение фона после полной перерисовки (изменение размера, перестройка)"""
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self._animated_artists():
+            if artist is not None:
+                self.figure.draw_artist(artist)
+
+    @GUI_REFRESH_SECONDS.timed("dashboard")
+    def _apply(self, hypervisors: List[Dict[str, Any]]):
+        """Обновление столбцов по свежим данным"""
+        self._fetching = False
+        hv_names = [hv['hv_name'] for hv in hypervisors]
+        if hv_names != self._hv_names:
+            self._build(hv_names)
+
+        changed = False
+        total_capacity_cpu = total_capacity_ram = total_free_cpu = total_free_ram = 0
+        for hv, cpu_bar, ram_bar in zip(hypervisors, self._cpu_bars, self._ram_bars):
+            cpu_usage = ResourceCalculator.calculate_cpu_usage(hv['cpu_capacity'], hv['free_cpu'])
+            ram_usage = ResourceCalculator.calculate_ram_usage(hv['ram_capacity'], hv['free_ram'])
+            changed |= self._set_bar(cpu_bar, cpu_usage, self._usage_color(cpu_usage, 'green'))
+            changed |= self._set_bar(ram_bar, ram_usage, self._usage_color(ram_usage, 'blue'))
+
+            total_capacity_cpu += hv['cpu_capacity']
+            total_capacity_ram += hv['ram_capacity']
+            total_free_cpu += hv['free_cpu']
+            total_free_ram += hv['free_ram']
+
+        cpu_usage = ResourceCalculator.calculate_cpu_usage(total_capacity_cpu, total_free_cpu)
+        ram_usage = ResourceCalculator.calculate_ram_usage(total_capacity_ram, total_free_ram)
+        changed |= self._set_bar(self._total_bars[0], cpu_usage, self._usage_color(cpu_usage, 'green'))
+        changed |= self._set_bar(self._total_bars[1], ram_usage, self._usage_color(ram_usage, 'blue'))
+
+        text = f"CPU {cpu_usage:.1f}% | RAM {ram_usage:.1f}%\nВМ: {sum(hv['num_vms'] for hv in hypervisors)}"
+        if text != self._total_text.get_text():
+            self._total_text.set_text(text)
+            changed = True
+
+        # Если ничего не изменилось, перерисовка не нужна
+        if changed and self._background is not None:
+            self.canvas.restore_region(self._background)
+            for artist in self._animated_artists():
+                self.figure.draw_artist(artist)
+            self.canvas.blit(self.figure.bbox)
+
+    def _set_bar(self, bar, height: float, color: str) -> bool:
+        """Изменение высоты и цвета столбца, возвращает True при изменении"""
+        if abs(bar.get_height() - height) < 0.05 and self._bar_colors.get(id(bar)) == color:
+            return False
+        bar.set_height(height)
+        bar.set_facecolor(color)
+        self._bar_colors[id(bar)] = color
+        return True
+
+    def _fetch(self):
+        """Загрузка данных в фоновом потоке"""
+        try:
+            hypervisors = self.db.get_all_hypervisors()
+            self.root.after(0, self._apply, hypervisors)
+        except Exception as e:
+            self._fetching = False
+            logger.error(f"Ошибка при обновлении панели мониторинга: {e}")
+
+    def _tick(self):
+        """Периодическое обновление (только когда панель видна)"""
+        if self.widget.winfo_ismapped() and not self._fetching:
+            self._fetching = True
+            thread = threading.Thread(target=self._fetch)
+            thread.daemon = True
+            thread.start()
+        self._timer_id = self.root.after(self.interval_ms, self._tick)
+
+    def start(self):
+        """Запуск периодического обновления"""
+        if self._timer_id is None:
+            self._tick()
+
+    def stop(self):
+        """Остановка периодического обновления"""
+        if self._timer_id is not None:
+            self.root.after_cancel(self._timer_id)
+            self._timer_id = None
@@ -1,15 +1,210 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any, Tuple
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import datetime, timedelta, date
+from typing import List, Dict, Any, Tuple, Optional
+import io
+import re
+import sys
+import time
+import threading
 import logging
+from utils import ResourceCalculator, NameGenerator, Validator
+from storage import StorageBackend
+from metrics import REGISTRY, ROW_BUCKETS
+from slow_log import SlowQueryLog
+from connection_pool import BlockingConnectionPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Метрики работы с PostgreSQL: метка method - метод Database, получивший соединение
+DB_CONNECT_SECONDS = REGISTRY.histogram("datacenter_db_connect_seconds", "Установка соединения с PostgreSQL")
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram("datacenter_db_pool_wait_seconds", "Ожидание свободного соединения пула")
+DB_QUERY_SECONDS = REGISTRY.histogram("datacenter_db_query_seconds", "Выполнение запроса", ("method",))
+DB_COMMIT_SECONDS = REGISTRY.histogram("datacenter_db_commit_seconds", "Фиксация транзакции", ("method",))
+DB_ROWS = REGISTRY.histogram("datacenter_db_rows", "Строк возвращено или изменено запросом", ("method",),
+                             buckets=ROW_BUCKETS)
+DB_METHOD_SECONDS = REGISTRY.histogram("datacenter_db_method_seconds",
+                                       "Метод Database от получения до возврата соединения", ("method",))
+DB_SLOW_QUERIES = REGISTRY.counter("datacenter_db_slow_queries_total", "Запросов длительнее порога журнала",
+                                   ("method",))
 
-class Database:
+
+class TimedCursorMixin:
+    """Замер длительности запроса и количества строк для метрик и журнала медленных запросов"""
+    
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            method = getattr(self.connection, 'method', '')
+            DB_QUERY_SECONDS.observe(elapsed, method)
+            if self.rowcount >= 0:
+                DB_ROWS.observe(self.rowcount, method)
+            slow_log = getattr(self.connection, 'slow_log', None)
+            if slow_log is not None and slow_log.record(query, vars, elapsed, method, self.rowcount):
+                DB_SLOW_QUERIES.inc(method)
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+# Фабрика курсора из вызова conn.cursor(cursor_factory=...) -> курсор с замером
+TIMED_CURSORS = {None: TimedCursor, psycopg2.extensions.cursor: TimedCursor, RealDictCursor: TimedRealDictCursor}
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Соединение, запоминающее подготовленные на сервере запросы (PREPARE живет до закрытия сессии)"""
+    
+    def __init__(self, *args, **kwargs):
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+        self.prepared = set()
+        # Метод Database, выполняющий запросы через соединение (метка метрик)
+        self.method = ""
+        # Журнал медленных запросов хранилища (None - выключен)
+        self.slow_log = None
+    
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory')
+        kwargs['cursor_factory'] = TIMED_CURSORS.get(factory, factory)
+        return super().cursor(*args, **kwargs)
+    
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started, self.method)
+
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул, незавершенная транзакция откатывается"""
+    
+    def __init__(self, pool: BlockingConnectionPool, conn: PreparedConnection):
+        self._pool = pool
+        self._conn = conn
+        self._started = time.perf_counter()
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        DB_METHOD_SECONDS.observe(time.perf_counter() - self._started, getattr(conn, 'method', ''))
+        close = bool(conn.closed)
+        try:
+            if not close and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+        except Exception as e:
+            logger.error(f"Ошибка при возврате соединения в пул: {e}")
+            close = True
+        # Соединение возвращается ровно один раз: место в пуле освобождается для ждущих потоков
+        self._pool.putconn(conn, close=close)
+    
+    def __del__(self):
+        # Соединение, не закрытое из-за исключения, тоже возвращается в пул
+        if self.__dict__.get('_conn') is not None:
+            self.close()
+
+
+class StatementRegistry:
+    """Реестр часто выполняемых запросов.
+    Запрос готовится (PREPARE) один раз на соединение, затем выполняется через EXECUTE"""
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._statements: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+        self.executions: Dict[str, int] = {}
+        self.prepares: Dict[str, int] = {}
+    
+    def source(self, sql: str) -> str:
+        """Исходный текст для EXECUTE зарегистрированного запроса (для журнала и EXPLAIN)"""
+        match = re.match(r"\s*EXECUTE (\w+)", sql)
+        if match and match.group(1) in self._statements:
+            return self._statements[match.group(1)][0]
+        return sql
+    
+    def register(self, name: str, sql: str, types: Tuple[str, ...] = ()):
+        """Регистрация запроса: параметры %s по порядку, types - их типы в PostgreSQL"""
+        self._statements[name] = (sql, types)
+        self.executions[name] = 0
+        self.prepares[name] = 0
+    
+    def execute(self, cur, name: str, params: Tuple = ()):
+        """Выполнение зарегистрированного запроса в курсоре"""
+        sql, types = self._statements[name]
+        conn = cur.connection
+        with self._lock:
+            self.executions[name] += 1
+        
+        if not self.enabled or not isinstance(conn, PreparedConnection):
+            cur.execute(sql, params)
+            return
+        
+        if name not in conn.prepared:
+            server_sql = sql
+            for position in range(1, len(types) + 1):
+                server_sql = server_sql.replace("%s", f"${position}", 1)
+            type_list = f" ({', '.join(types)})" if types else ""
+            cur.execute(f"PREPARE {name}{type_list} AS {server_sql}")
+            conn.prepared.add(name)
+            with self._lock:
+                self.prepares[name] += 1
+        
+        if params:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+    
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Количество выполнений и подготовок каждого запроса"""
+        return [{'name': name, 'executions': self.executions[name], 'prepares': self.prepares[name]}
+                for name in sorted(self._statements)]
+
+
+class Database(StorageBackend):
+    """Хранилище PostgreSQL"""
+    
+    SUPPORTS_DEPLOY_QUEUE = True
+    # Ключ рекомендательной блокировки при распределении имен ВМ в заданиях развертывания
+    DEPLOY_NAMES_LOCK = 770001
+    # ВМ задачи развертывания уже создана: имя задачи, размер задания и создание после постановки задания
+    # (имена распределяются без занятых, поэтому такую ВМ могла создать только эта задача)
+    DEPLOY_TASK_VM = """
+        SELECT 1 FROM virtual_machines v
+        WHERE v.vm_name = t.vm_name AND v.vcpu = j.vcpu AND v.vram = j.vram AND v.vhdd = j.vhdd
+          AND v.creation_date >= j.submitted_at
+    """
+    DEPLOY_LEASE_EXPIRED_MESSAGE = "Задача не завершена исполнителем за max_attempts захватов"
+    # Секционирование таблицы ВМ: hash - по гипервизору, range - по месяцу создания
+    VM_PARTITIONING = ('hash', 'range')
+    # Месячные секции (range), создаваемые заранее
+    VM_PARTITION_MONTHS_AHEAD = 2
+    
     def __init__(self, dbname="datacenter_db2", user="postgres", 
-                 password="pass", host="localhost", port="5432"):
+                 password="pass", host="localhost", port="5432",
+                 pool_size: int = 10, pool_timeout: Optional[float] = 30.0, prepared_statements: bool = True,
+                 slow_query_ms: Optional[float] = None, slow_log_path: str = "slow_queries.log",
+                 config: Optional[Dict[str, str]] = None,
+                 partitioning: Optional[str] = None, hash_partitions: int = 16):
+        """partitioning - секционирование таблицы ВМ новой базы или перевод существующей
+        (hash по hv_name на hash_partitions секций, range по месяцам creation_date).
+        Уже секционированная таблица используется как есть.
+        При занятых соединениях пула (pool_size) вызовы ждут освобождения не дольше pool_timeout секунд"""
+        if partitioning not in (None,) + self.VM_PARTITIONING:
+            raise ValueError(f"Секционирование ВМ: {', '.join(self.VM_PARTITIONING)}")
         self.connection_params = {
             "dbname": dbname,
             "user": user,
@@ -17,11 +212,125 @@ class Database:
             "host": host,
             "port": port
         }
+        # Пул соединений: подготовленные запросы сохраняются между вызовами методов.
+        # Потоки сверх pool_size (пакеты развертывания, сервис API) ждут соединения, а не получают PoolError
+        self._pool = BlockingConnectionPool(
+            ThreadedConnectionPool(1, pool_size, connection_factory=PreparedConnection, **self.connection_params),
+            pool_size, pool_timeout, on_wait=DB_POOL_WAIT_SECONDS.observe)
+        self.statements = StatementRegistry(prepared_statements)
+        self._register_statements()
+        # Журнал медленных запросов включается порогом slow_query_ms
+        self.slow_log = None
+        if slow_query_ms is not None:
+            self.slow_log = SlowQueryLog(slow_log_path, slow_query_ms, explain=self._explain_statement,
+                                         resolve=self.statements.source)
+        self._config_cache = None
+        self._rules_cache = None
+        self._history_partitions = set()
+        self.partitioning = partitioning
+        self.hash_partitions = hash_partitions
+        self._vm_partitions = set()
         self._create_tables()
-        self._initialize_cluster()
+        self._initialize_cluster(config)
+        self._migrate_capacity_units()
+        self._migrate_partitioning()
+        self._initialize_storage_pool()
+        self._initialize_journal()
     
     def _get_connection(self):
-        return psycopg2.connect(**self.connection_params)
+        conn = self._pool.getconn()
+        # Метка метрик - имя вызвавшего метода
+        conn.method = sys._getframe(1).f_code.co_name
+        conn.slow_log = self.slow_log
+        return PooledConnection(self._pool, conn)
+    
+    def close(self):
+        """Закрытие всех соединений пула"""
+        if self.slow_log is not None:
+            self.slow_log.close()
+        self._pool.closeall()
+    
+    def _explain_statement(self, sql: str, params) -> Tuple[str, bool]:
+        """План медленного запроса для журнала: EXPLAIN (ANALYZE, BUFFERS) в откатываемой транзакции.
+        Изменяющие запросы выполняются и откатываются; при ошибке (например, ВМ уже создана)
+        строится план без выполнения. Возвращает (план, выполнен ли запрос)"""
+        conn = self._get_connection()
+        try:
+            cur = conn.cursor()
+            for analyze in (True, False):
+                # Ожидание блокировок и длительность ограничены, чтобы не мешать рабочей нагрузке
+                cur.execute("SET LOCAL lock_timeout = '1s'")
+                cur.execute("SET LOCAL statement_timeout = '30s'")
+                options = "(ANALYZE, BUFFERS) " if analyze else ""
+                try:
+                    cur.execute(f"EXPLAIN {options}{sql}", params)
+                except psycopg2.Error:
+                    conn.rollback()
+                    if not analyze:
+                        raise
+                    continue
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                return plan, analyze
+        finally:
+            conn.rollback()
+            conn.close()
+    
+    def _register_statements(self):
+        """Запросы, выполняемые при каждом создании/удалении ВМ и расчете статистики"""
+        self.statements.register("vm_place", """
+            SELECT hv_name, free_cpu, free_ram 
+            FROM hypervisors 
+            WHERE free_cpu >= %s AND free_ram >= %s
+            ORDER BY num_vms ASC, free_cpu DESC
+            LIMIT 1
+            FOR UPDATE
+        """, ("integer", "integer"))
+        self.statements.register("disk_reserve", """
+            UPDATE storage_pool 
+            SET used_disk = used_disk + %s
+            WHERE pool_name = %s AND used_disk + %s <= capacity
+            RETURNING used_disk
+        """, ("bigint", "varchar", "bigint"))
+        self.statements.register("disk_release", """
+            UPDATE storage_pool SET used_disk = used_disk - %s WHERE pool_name = %s
+        """, ("bigint", "varchar"))
+        self.statements.register("vm_insert", """
+            INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name)
+            VALUES (%s, %s, %s, %s, %s)
+        """, ("varchar", "integer", "integer", "integer", "varchar"))
+        self.statements.register("vm_delete", """
+            DELETE FROM virtual_machines WHERE vm_name = %s
+            RETURNING hv_name, vcpu, vram, vhdd
+        """, ("varchar",))
+        self.statements.register("hv_consume", """
+            UPDATE hypervisors 
+            SET free_cpu = free_cpu - %s, 
+                free_ram = free_ram - %s,
+                num_vms = num_vms + 1
+            WHERE hv_name = %s
+        """, ("integer", "integer", "varchar"))
+        self.statements.register("hv_release", """
+            UPDATE hypervisors 
+            SET free_cpu = free_cpu + %s, 
+                free_ram = free_ram + %s,
+                num_vms = num_vms - 1
+            WHERE hv_name = %s
+        """, ("integer", "integer", "varchar"))
+        self.statements.register("cluster_totals", """
+            SELECT 
+                COUNT(*) as total_hypervisors,
+                SUM(cpu) as total_cpu,
+                SUM(ram) as total_ram,
+                SUM(free_cpu) as free_cpu,
+                SUM(free_ram) as free_ram,
+                SUM(num_vms) as total_vms,
+                SUM(FLOOR(cpu * %s::numeric)) as vcpu_capacity,
+                SUM(FLOOR(ram * %s::numeric)) as vram_capacity
+            FROM hypervisors
+        """, ("numeric", "numeric"))
+        self.statements.register("storage_usage", """
+            SELECT capacity, used_disk FROM storage_pool WHERE pool_name = %s
+        """, ("varchar",))
     
     def _create_tables(self):
         """Создание таблиц в базе данных"""
@@ -31,181 +340,1743 @@ class Database:
                 hv_name VARCHAR(50) PRIMARY KEY,
                 cpu INTEGER NOT NULL CHECK (cpu > 0),
                 ram INTEGER NOT NULL CHECK (ram > 0),
-                free_cpu INTEGER NOT NULL CHECK (free_cpu >= 0 AND free_cpu <= cpu),
-                free_ram INTEGER NOT NULL CHECK (free_ram >= 0 AND free_ram <= ram),
+                free_cpu INTEGER NOT NULL CHECK (free_cpu >= 0),
+                free_ram INTEGER NOT NULL CHECK (free_ram >= 0),
                 num_vms INTEGER DEFAULT 0 CHECK (num_vms >= 0),
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """,
             """
-            CREATE TABLE IF NOT EXISTS virtual_machines (
-                vm_name VARCHAR(50) PRIMARY KEY,
-                vcpu INTEGER NOT NULL CHECK (vcpu BETWEEN 2 AND 24 AND vcpu % 2 = 0),
-                vram INTEGER NOT NULL CHECK (vram BETWEEN 4 AND 128),
-                vhdd INTEGER NOT NULL CHECK (vhdd BETWEEN 40 AND 4096),
-                hv_name VARCHAR(50) NOT NULL,
-                creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (hv_name) REFERENCES hypervisors(hv_name) ON DELETE CASCADE
-            )
-            """,
-            """
             CREATE TABLE IF NOT EXISTS cluster_config (
                 config_key VARCHAR(50) PRIMARY KEY,
                 config_value VARCHAR(200),
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
+            """,
+            # Учет дискового пула: счетчик занятого места обновляется
+            # в той же транзакции, что и создание/удаление ВМ
+            """
+            CREATE TABLE IF NOT EXISTS storage_pool (
+                pool_name VARCHAR(50) PRIMARY KEY,
+                capacity BIGINT NOT NULL CHECK (capacity > 0),
+                used_disk BIGINT NOT NULL DEFAULT 0 CHECK (used_disk >= 0)
+            )
+            """,
+            # Очередь массового развертывания: задание и по одной задаче на каждую ВМ
+            """
+            CREATE TABLE IF NOT EXISTS deploy_jobs (
+                job_id SERIAL PRIMARY KEY,
+                base_name VARCHAR(50) NOT NULL,
+                vcpu INTEGER NOT NULL,
+                vram INTEGER NOT NULL,
+                vhdd INTEGER NOT NULL,
+                total INTEGER NOT NULL CHECK (total > 0),
+                priority INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                created INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS deploy_tasks (
+                job_id INTEGER NOT NULL REFERENCES deploy_jobs(job_id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                vm_name VARCHAR(50) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP,
+                worker VARCHAR(100),
+                error TEXT,
+                PRIMARY KEY (job_id, seq)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_deploy_tasks_active 
+            ON deploy_tasks(job_id, seq) WHERE status IN ('pending', 'running')
+            """,
+            # Правила размещения и счетчики ВМ их групп по гипервизорам (ведутся триггером)
+            """
+            CREATE TABLE IF NOT EXISTS placement_rules (
+                rule_id SERIAL PRIMARY KEY,
+                kind VARCHAR(20) NOT NULL CHECK (kind IN ('spread', 'max_per_host', 'pin')),
+                vm_prefix VARCHAR(50) NOT NULL,
+                max_per_host INTEGER CHECK (max_per_host > 0),
+                hosts TEXT[],
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS placement_counts (
+                rule_id INTEGER NOT NULL REFERENCES placement_rules(rule_id) ON DELETE CASCADE,
+                hv_name VARCHAR(50) NOT NULL REFERENCES hypervisors(hv_name) ON DELETE CASCADE,
+                vm_count INTEGER NOT NULL DEFAULT 0 CHECK (vm_count >= 0),
+                PRIMARY KEY (rule_id, hv_name)
+            )
+            """,
+            """
+            CREATE OR REPLACE FUNCTION placement_count_vm() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    UPDATE placement_counts c SET vm_count = c.vm_count - 1
+                    FROM placement_rules r
+                    WHERE c.rule_id = r.rule_id AND c.hv_name = OLD.hv_name
+                      AND OLD.vm_name LIKE r.vm_prefix || '%';
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+                    SELECT r.rule_id, NEW.hv_name, 1 FROM placement_rules r
+                    WHERE NEW.vm_name LIKE r.vm_prefix || '%'
+                    ON CONFLICT (rule_id, hv_name) DO UPDATE SET vm_count = placement_counts.vm_count + 1;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            # Реестр имен ВМ секционированной таблицы: первичный ключ секционированной таблицы
+            # включает ключ секционирования, уникальность имени по всем секциям обеспечивает реестр
+            """
+            CREATE TABLE IF NOT EXISTS vm_names (
+                vm_name VARCHAR(50) PRIMARY KEY
+            )
+            """,
+            """
+            CREATE OR REPLACE FUNCTION vm_names_sync() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    DELETE FROM vm_names WHERE vm_name = OLD.vm_name;
+                ELSE
+                    INSERT INTO vm_names (vm_name) VALUES (NEW.vm_name);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            # Резервы емкости: места удерживают ресурсы гипервизоров и дискового пула до создания ВМ
+            """
+            CREATE TABLE IF NOT EXISTS capacity_reservations (
+                reservation_id BIGSERIAL PRIMARY KEY,
+                owner VARCHAR(64) NOT NULL DEFAULT '',
+                vcpu INTEGER NOT NULL CHECK (vcpu > 0),
+                vram INTEGER NOT NULL CHECK (vram > 0),
+                vhdd INTEGER NOT NULL CHECK (vhdd > 0),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_reservations_expires ON capacity_reservations(expires_at)",
+            """
+            CREATE TABLE IF NOT EXISTS reservation_slots (
+                reservation_id BIGINT NOT NULL REFERENCES capacity_reservations(reservation_id) ON DELETE CASCADE,
+                hv_name VARCHAR(50) NOT NULL REFERENCES hypervisors(hv_name),
+                slots INTEGER NOT NULL CHECK (slots >= 0),
+                PRIMARY KEY (reservation_id, hv_name)
+            )
+            """,
+            # Контрольные точки развертываний, выполняемых в процессе приложения
+            """
+            CREATE TABLE IF NOT EXISTS deploy_checkpoints (
+                run_id VARCHAR(64) PRIMARY KEY,
+                status VARCHAR(20) NOT NULL,
+                state JSONB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # История загрузки: сырые отсчеты секционированы по дням,
+            # агрегаты по минутам и часам хранятся дольше
+            """
+            CREATE TABLE IF NOT EXISTS utilization_history (
+                ts TIMESTAMP NOT NULL,
+                hv_name VARCHAR(50) NOT NULL,
+                cpu_usage REAL NOT NULL,
+                ram_usage REAL NOT NULL,
+                num_vms INTEGER NOT NULL
+            ) PARTITION BY RANGE (ts)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_history_hv_ts ON utilization_history(hv_name, ts)",
+            """
+            CREATE TABLE IF NOT EXISTS utilization_history_1m (
+                bucket TIMESTAMP NOT NULL,
+                hv_name VARCHAR(50) NOT NULL,
+                cpu_avg REAL NOT NULL,
+                cpu_max REAL NOT NULL,
+                ram_avg REAL NOT NULL,
+                ram_max REAL NOT NULL,
+                num_vms_max INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                PRIMARY KEY (hv_name, bucket)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS utilization_history_1h (
+                bucket TIMESTAMP NOT NULL,
+                hv_name VARCHAR(50) NOT NULL,
+                cpu_avg REAL NOT NULL,
+                cpu_max REAL NOT NULL,
+                ram_avg REAL NOT NULL,
+                ram_max REAL NOT NULL,
+                num_vms_max INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                PRIMARY KEY (hv_name, bucket)
+            )
+            """,
+            # Версия данных для кэша отчетов: увеличивается один раз на оператор записи
+            # (триггеры FOR EACH STATEMENT) и становится видна вместе с фиксацией транзакции
+            """
+            CREATE TABLE IF NOT EXISTS data_version (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL DEFAULT 0
+            )
+            """,
+            "INSERT INTO data_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING",
+            """
+            CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE data_version SET version = version + 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            # Журнал операций с изменениями счетчиков: записи добавляются триггерами FOR EACH STATEMENT
+            # одним INSERT ... SELECT на оператор (массовая загрузка - одна вставка в журнал)
+            """
+            CREATE TABLE IF NOT EXISTS operation_journal (
+                op_id BIGSERIAL PRIMARY KEY,
+                ts TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                op VARCHAR(20) NOT NULL,
+                vm_name VARCHAR(50),
+                hv_name VARCHAR(50) NOT NULL,
+                d_cpu INTEGER NOT NULL DEFAULT 0,
+                d_ram INTEGER NOT NULL DEFAULT 0,
+                d_vms INTEGER NOT NULL DEFAULT 0,
+                d_disk INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS journal_snapshots (
+                snapshot_id BIGSERIAL PRIMARY KEY,
+                op_id BIGINT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                used_disk BIGINT NOT NULL,
+                hypervisors JSONB NOT NULL
+            )
+            """,
+            """
+            CREATE OR REPLACE FUNCTION journal_vm_insert() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                SELECT 'vm_create', vm_name, hv_name, -vcpu, -vram, 1, vhdd FROM new_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE FUNCTION journal_vm_delete() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                SELECT 'vm_delete', vm_name, hv_name, vcpu, vram, -1, -vhdd FROM old_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE FUNCTION journal_vm_update() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                SELECT op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk
+                FROM old_rows o JOIN new_rows n USING (vm_name)
+                CROSS JOIN LATERAL (VALUES
+                    ('vm_move_out', o.hv_name, o.vcpu, o.vram, -1, -o.vhdd),
+                    ('vm_move_in', n.hv_name, -n.vcpu, -n.vram, 1, n.vhdd)
+                ) AS d(op, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                WHERE (o.hv_name, o.vcpu, o.vram, o.vhdd) IS DISTINCT FROM (n.hv_name, n.vcpu, n.vram, n.vhdd);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE FUNCTION journal_hv_insert() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_vms)
+                SELECT 'hv_add', hv_name, free_cpu, free_ram, num_vms FROM new_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE FUNCTION journal_hv_delete() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_vms)
+                SELECT 'hv_delete', hv_name, -free_cpu, -free_ram, -num_vms FROM old_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS trg_journal_hv_insert ON hypervisors",
+            """
+            CREATE TRIGGER trg_journal_hv_insert AFTER INSERT ON hypervisors
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION journal_hv_insert()
+            """,
+            "DROP TRIGGER IF EXISTS trg_journal_hv_delete ON hypervisors",
+            """
+            CREATE TRIGGER trg_journal_hv_delete AFTER DELETE ON hypervisors
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION journal_hv_delete()
             """
         ]
         
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            for query in queries:
+            # Таблица ВМ создается после гипервизоров, ее триггеры - после функций
+            cur.execute(queries[0])
+            layout = self._vm_layout(cur)
+            if layout is None:
+                layout = self.partitioning or 'heap'
+                for query in self._vm_table_ddl(layout, self._vm_months_ahead()):
+                    cur.execute(query)
+            for query in queries[1:]:
+                cur.execute(query)
+            for query in self._vm_trigger_ddl(layout):
+                cur.execute(query)
+            for table in self.VERSIONED_TABLES:
+                cur.execute(f"DROP TRIGGER IF EXISTS trg_data_version ON {table}")
+                cur.execute(f"""
+                    CREATE TRIGGER trg_data_version
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                    FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+                """)
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info("Таблицы успешно созданы или уже существуют")
+        except Exception as e:
+            logger.error(f"Ошибка при создании таблиц: {e}")
+    
+    @staticmethod
+    def _vm_layout(cur) -> Optional[str]:
+        """Текущая схема таблицы ВМ: None - таблицы нет, heap (без секций), hash или range"""
+        cur.execute("""
+            SELECT p.partstrat FROM pg_class c
+            LEFT JOIN pg_partitioned_table p ON p.partrelid = c.oid
+            WHERE c.oid = to_regclass('virtual_machines')
+        """)
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return {'h': 'hash', 'r': 'range'}.get(row[0], 'heap')
+    
+    def _vm_months_ahead(self, start: Optional[date] = None) -> List[date]:
+        """Первые числа месяцев от start (по умолчанию - текущего) до VM_PARTITION_MONTHS_AHEAD вперед"""
+        month = (start or date.today()).replace(day=1)
+        last = date.today().replace(day=1)
+        for _ in range(self.VM_PARTITION_MONTHS_AHEAD):
+            last = self._next_month(last)
+        months = []
+        while month <= last:
+            months.append(month)
+            month = self._next_month(month)
+        return months
+    
+    @staticmethod
+    def _next_month(month: date) -> date:
+        return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+    
+    def _vm_table_ddl(self, layout: str, months: List[date], table: str = "virtual_machines") -> List[str]:
+        """Создание таблицы ВМ: без секций, hash по hv_name или range по месяцам creation_date.
+        Первичный ключ секционированной таблицы включает ключ секционирования"""
+        key = {'heap': "PRIMARY KEY (vm_name)", 'hash': "PRIMARY KEY (hv_name, vm_name)",
+               'range': "PRIMARY KEY (vm_name, creation_date)"}[layout]
+        partition_by = {'heap': "", 'hash': " PARTITION BY HASH (hv_name)",
+                        'range': " PARTITION BY RANGE (creation_date)"}[layout]
+        queries = [f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                vm_name VARCHAR(50) NOT NULL,
+                vcpu INTEGER NOT NULL CHECK (vcpu BETWEEN 2 AND 24 AND vcpu % 2 = 0),
+                vram INTEGER NOT NULL CHECK (vram BETWEEN 4 AND 128),
+                vhdd INTEGER NOT NULL CHECK (vhdd BETWEEN 40 AND 4096),
+                hv_name VARCHAR(50) NOT NULL,
+                creation_date TIMESTAMP {'NOT NULL ' if layout == 'range' else ''}DEFAULT CURRENT_TIMESTAMP,
+                {key},
+                FOREIGN KEY (hv_name) REFERENCES hypervisors(hv_name) ON DELETE CASCADE
+            ){partition_by}
+        """]
+        if layout == 'hash':
+            queries += [f"""
+                CREATE TABLE IF NOT EXISTS {table}_h{i:02d} PARTITION OF {table}
+                FOR VALUES WITH (MODULUS {self.hash_partitions}, REMAINDER {i})
+            """ for i in range(self.hash_partitions)]
+        elif layout == 'range':
+            # Строки вне созданных месяцев попадают в секцию по умолчанию
+            queries.append(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+            queries += [self._vm_month_ddl(month, table) for month in months]
+        if layout != 'hash':
+            queries.append(f"CREATE INDEX IF NOT EXISTS idx_vm_hv_name ON {table}(hv_name)")
+        if layout != 'heap':
+            # Поиск ВМ по имени - по индексу каждой секции
+            queries.append(f"CREATE INDEX IF NOT EXISTS idx_vm_name ON {table}(vm_name)")
+        return queries
+    
+    @staticmethod
+    def _vm_month_ddl(month: date, table: str = "virtual_machines") -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table}_{month:%Y%m} PARTITION OF {table}
+            FOR VALUES FROM ('{month}') TO ('{Database._next_month(month)}')
+        """
+    
+    @staticmethod
+    def _vm_trigger_ddl(layout: str) -> List[str]:
+        """Строчные триггеры таблицы ВМ: счетчики правил размещения и реестр имен (для секций)"""
+        queries = [
+            "DROP TRIGGER IF EXISTS trg_placement_counts ON virtual_machines",
+            """
+            CREATE TRIGGER trg_placement_counts
+            AFTER INSERT OR DELETE OR UPDATE OF hv_name ON virtual_machines
+            FOR EACH ROW EXECUTE FUNCTION placement_count_vm()
+            """,
+            "DROP TRIGGER IF EXISTS trg_vm_names ON virtual_machines"
+        ]
+        if layout != 'heap':
+            # Перенос ВМ в секцию другого гипервизора выполняется как удаление и вставка
+            queries.append("""
+            CREATE TRIGGER trg_vm_names
+            AFTER INSERT OR DELETE ON virtual_machines
+            FOR EACH ROW EXECUTE FUNCTION vm_names_sync()
+            """)
+        # Журнал операций: таблицы переходов допускают одно событие на триггер
+        for event, table in (('INSERT', "NEW TABLE AS new_rows"), ('DELETE', "OLD TABLE AS old_rows"),
+                             ('UPDATE', "OLD TABLE AS old_rows NEW TABLE AS new_rows")):
+            queries += [
+                f"DROP TRIGGER IF EXISTS trg_journal_vm_{event.lower()} ON virtual_machines",
+                f"""
+                CREATE TRIGGER trg_journal_vm_{event.lower()} AFTER {event} ON virtual_machines
+                REFERENCING {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION journal_vm_{event.lower()}()
+                """
+            ]
+        return queries
+    
+    def _ensure_vm_partitions(self, months: List[date]):
+        """Создание месячных секций ВМ (range) до вставки строк этих месяцев"""
+        months = [month for month in months if month not in self._vm_partitions]
+        if self.partitioning != 'range' or not months:
+            return
+        conn = self._get_connection()
+        try:
+            cur = conn.cursor()
+            for month in months:
+                cur.execute(self._vm_month_ddl(month))
+            conn.commit()
+            self._vm_partitions.update(months)
+        except psycopg2.Error as e:
+            # Например, строки месяца уже лежат в секции по умолчанию - они остаются там
+            logger.error(f"Не удалось создать секции ВМ: {e}")
+        finally:
+            conn.close()
+    
+    def _migrate_partitioning(self):
+        """Перевод таблицы ВМ без секций в секционированную (partitioning) одной транзакцией.
+        Строки копируются без повторного срабатывания триггеров: счетчики правил уже учитывают эти ВМ"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            layout = self._vm_layout(cur)
+            if layout != 'heap' or self.partitioning is None:
+                if layout != 'heap' and self.partitioning not in (None, layout):
+                    logger.error(f"Таблица ВМ уже секционирована ({layout}), "
+                                 f"перевод в {self.partitioning} не выполняется")
+                self.partitioning = None if layout == 'heap' else layout
+                if self.partitioning == 'range':
+                    self._vm_partitions.update(self._vm_months_ahead())
+                cur.close()
+                conn.close()
+                return
+            
+            logger.info(f"Перевод таблицы ВМ в секционированную ({self.partitioning})")
+            cur.execute("LOCK TABLE virtual_machines IN ACCESS EXCLUSIVE MODE")
+            cur.execute("SELECT MIN(creation_date) FROM virtual_machines")
+            oldest = cur.fetchone()[0]
+            months = self._vm_months_ahead(oldest.date() if oldest else None)
+            
+            cur.execute("ALTER TABLE virtual_machines RENAME TO virtual_machines_unpartitioned")
+            cur.execute("ALTER TABLE virtual_machines_unpartitioned "
+                        "RENAME CONSTRAINT virtual_machines_pkey TO virtual_machines_unpartitioned_pkey")
+            cur.execute("DROP INDEX IF EXISTS idx_vm_hv_name")
+            for query in self._vm_table_ddl(self.partitioning, months):
                 cur.execute(query)
+            cur.execute("""
+                INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date)
+                SELECT vm_name, vcpu, vram, vhdd, hv_name, COALESCE(creation_date, CURRENT_TIMESTAMP)
+                FROM virtual_machines_unpartitioned
+            """)
+            cur.execute("INSERT INTO vm_names (vm_name) SELECT vm_name FROM virtual_machines")
+            for query in self._vm_trigger_ddl(self.partitioning):
+                cur.execute(query)
+            cur.execute("DROP TABLE virtual_machines_unpartitioned")
+            cur.execute("""
+                CREATE TRIGGER trg_data_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON virtual_machines
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+            """)
+            cur.execute("UPDATE data_version SET version = version + 1")
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            self._vm_partitions.update(months)
+            logger.info(f"Таблица ВМ секционирована ({self.partitioning}), месячных секций: "
+                        f"{len(months) if self.partitioning == 'range' else 0}")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при секционировании таблицы ВМ: {e}")
+    
+    def _initialize_cluster(self, config: Optional[Dict[str, str]] = None):
+        """Инициализация конфигурации кластера (config - начальные значения для новой базы)"""
+        configs = dict(self.DEFAULT_CONFIG)
+        configs.update(config or {})
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            for key, value in configs.items():
+                cur.execute("""
+                    INSERT INTO cluster_config (config_key, config_value) 
+                    VALUES (%s, %s)
+                    ON CONFLICT (config_key) DO NOTHING
+                """, (key, value))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info("Конфигурация кластера инициализирована")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации кластера: {e}")
+    
+    def _migrate_capacity_units(self):
+        """Перевод free_cpu/free_ram в виртуальные единицы (с учетом переподписки).
+        До миграции свободные ресурсы хранились как физические ядра/ГБ. Ограничение check_min_resources
+        (резерв 10%, создавалось sql_scripts.sql) удаляется: резерв в виртуальных единицах зависит от
+        переподписки и не проверяется ни одним хранилищем, это порог предупреждений (models.MIN_FREE_SHARE)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            cur.execute("SELECT config_value FROM cluster_config WHERE config_key = 'capacity_units'")
+            if cur.fetchone():
+                cur.close()
+                conn.close()
+                return
+            
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            
+            cur.execute("LOCK TABLE hypervisors IN EXCLUSIVE MODE")
+            cur.execute("""
+                ALTER TABLE hypervisors 
+                DROP CONSTRAINT IF EXISTS hypervisors_free_cpu_check,
+                DROP CONSTRAINT IF EXISTS hypervisors_free_ram_check,
+                DROP CONSTRAINT IF EXISTS check_min_resources
+            """)
+            cur.execute("""
+                ALTER TABLE hypervisors 
+                ADD CONSTRAINT hypervisors_free_cpu_check CHECK (free_cpu >= 0),
+                ADD CONSTRAINT hypervisors_free_ram_check CHECK (free_ram >= 0)
+            """)
+            
+            # Пересчет свободной емкости по фактически размещенным ВМ
+            cur.execute("""
+                UPDATE hypervisors h
+                SET free_cpu = FLOOR(h.cpu * %s::numeric) - COALESCE(v.vcpu, 0),
+                    free_ram = FLOOR(h.ram * %s::numeric) - COALESCE(v.vram, 0),
+                    num_vms = COALESCE(v.cnt, 0)
+                FROM hypervisors hv
+                LEFT JOIN (
+                    SELECT hv_name, SUM(vcpu) AS vcpu, SUM(vram) AS vram, COUNT(*) AS cnt
+                    FROM virtual_machines
+                    GROUP BY hv_name
+                ) v ON v.hv_name = hv.hv_name
+                WHERE h.hv_name = hv.hv_name
+            """, (str(overcommit_cpu), str(overcommit_ram)))
+            
+            cur.execute("""
+                INSERT INTO cluster_config (config_key, config_value) 
+                VALUES ('capacity_units', 'virtual')
+            """)
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            self._config_cache = None
+            logger.info("Свободные ресурсы гипервизоров пересчитаны с учетом переподписки")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете ресурсов с учетом переподписки: {e}")
+    
+    def _initialize_storage_pool(self):
+        """Создание счетчика дискового пула по конфигурации и существующим ВМ.
+        Емкость пула при каждом запуске берется из disk_pool (значение могли изменить в cluster_config)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            cur.execute("""
+                INSERT INTO storage_pool (pool_name, capacity, used_disk)
+                SELECT %s,
+                       (SELECT config_value::bigint FROM cluster_config WHERE config_key = 'disk_pool'),
+                       (SELECT COALESCE(SUM(vhdd), 0) FROM virtual_machines)
+                ON CONFLICT (pool_name) DO UPDATE SET capacity = EXCLUDED.capacity
+            """, (self.STORAGE_POOL,))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации дискового пула: {e}")
+    
+    def _initialize_journal(self):
+        """Первый снимок журнала - состояние счетчиков на момент появления журнала"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("LOCK TABLE journal_snapshots IN EXCLUSIVE MODE")
+            cur.execute("SELECT 1 FROM journal_snapshots LIMIT 1")
+            if cur.fetchone() is None:
+                self._snapshot(cur)
+            conn.commit()
+            cur.close()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации журнала операций: {e}")
+    
+    # Методы для работы с виртуальными машинами
+    def try_create_vm(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ с причиной отказа.
+        Нарушения ограничений (дубль имени, неверные ресурсы) - отказ,
+        ошибки соединения и взаимные блокировки пробрасываются для повтора"""
+        rules = self._matching_rules(vm_data['vm_name'])
+        if self.partitioning == 'range':
+            # Секция текущего месяца (создается один раз, дальше проверка по множеству)
+            self._ensure_vm_partitions(self._vm_months_ahead())
+        conn = self._get_connection()
+        try:
+            cur = conn.cursor()
+            
+            # Находим подходящий гипервизор
+            if rules:
+                hv_name, message = self._place_with_rules(cur, vm_data, rules)
+                if hv_name is None:
+                    return False, message
+            else:
+                self.statements.execute(cur, "vm_place", (vm_data['vcpu'], vm_data['vram']))
+                
+                result = cur.fetchone()
+                if not result:
+                    return False, self.NO_CAPACITY_MESSAGE
+                
+                hv_name = result[0]
+            
+            # Резервируем место в дисковом пуле (строка пула блокируется до конца транзакции)
+            self.statements.execute(cur, "disk_reserve", (vm_data['vhdd'], self.STORAGE_POOL, vm_data['vhdd']))
+            
+            if not cur.fetchone():
+                return False, self.DISK_FULL_MESSAGE
+            
+            # Создаем ВМ
+            self.statements.execute(cur, "vm_insert", (vm_data['vm_name'], vm_data['vcpu'], vm_data['vram'],
+                                                       vm_data['vhdd'], hv_name))
+            
+            # Обновляем ресурсы гипервизора
+            self.statements.execute(cur, "hv_consume", (vm_data['vcpu'], vm_data['vram'], hv_name))
+            
+            conn.commit()
+            cur.close()
+            return True, hv_name
+            
+        except psycopg2.IntegrityError as e:
+            return False, str(e).strip()
+        finally:
+            # Незавершенная транзакция откатывается при возврате соединения в пул
+            conn.close()
+    
+    def _place_with_rules(self, cur, vm_data: Dict[str, Any],
+                          rules: List[Dict[str, Any]]) -> Tuple[Optional[str], str]:
+        """Выбор гипервизора по счетчикам групп правил.
+        Строки правил блокируются - размещения ВМ одной группы выполняются по очереди,
+        гипервизоры блокируются в порядке имен (без взаимных блокировок)"""
+        rule_ids = [rule['rule_id'] for rule in rules]
+        cur.execute("SELECT rule_id FROM placement_rules WHERE rule_id = ANY(%s) ORDER BY rule_id FOR UPDATE",
+                    (rule_ids,))
+        cur.execute("""
+            SELECT hv_name, free_cpu, free_ram, num_vms FROM hypervisors
+            WHERE free_cpu >= %s AND free_ram >= %s
+            ORDER BY hv_name
+            FOR UPDATE
+        """, (vm_data['vcpu'], vm_data['vram']))
+        hypervisors = [dict(zip(('hv_name', 'free_cpu', 'free_ram', 'num_vms'), row)) for row in cur.fetchall()]
+        cur.execute("SELECT rule_id, hv_name, vm_count FROM placement_counts WHERE rule_id = ANY(%s)", (rule_ids,))
+        counts = {(rule_id, hv_name): vm_count for rule_id, hv_name, vm_count in cur.fetchall()}
+        return self._choose_with_rules(hypervisors, counts, vm_data, rules)
+    
+    def get_all_vms(self) -> List[Dict[str, Any]]:
+        """Получение всех виртуальных машин"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                SELECT vm_name, vcpu, vram, vhdd, hv_name, creation_date 
+                FROM virtual_machines 
+                ORDER BY vm_name
+            """)
+            vms = cur.fetchall()
+            cur.close()
+            conn.close()
+            return vms
+        except Exception as e:
+            logger.error(f"Ошибка при получении ВМ: {e}")
+            return []
+    
+    def delete_vm(self, vm_name: str) -> bool:
+        """Удаление виртуальной машины"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            # Удаляем ВМ и получаем ее ресурсы одним запросом
+            self.statements.execute(cur, "vm_delete", (vm_name,))
+            result = cur.fetchone()
+            
+            if not result:
+                cur.close()
+                conn.close()
+                return False
+            
+            hv_name, vcpu, vram, vhdd = result
+            
+            # Освобождаем ресурсы на гипервизоре и в дисковом пуле
+            self.statements.execute(cur, "hv_release", (vcpu, vram, hv_name))
+            self.statements.execute(cur, "disk_release", (vhdd, self.STORAGE_POOL))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"ВМ {vm_name} успешно удалена")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка при удалении ВМ: {e}")
+            return False
+    
+    def delete_vms_bulk(self, vm_names: List[str]) -> int:
+        """Массовое удаление ВМ одним запросом с освобождением ресурсов
+        на гипервизорах (одно обновление на гипервизор)"""
+        if not vm_names:
+            return 0
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            deleted_count = self._delete_vms_where(cur, "vm_name = ANY(%s)", (list(vm_names),))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Массово удалено ВМ: {deleted_count} из {len(vm_names)}")
+            return deleted_count
+            
+        except Exception as e:
+            logger.error(f"Ошибка при массовом удалении ВМ: {e}")
+            return 0
+    
+    def _delete_vms_where(self, cur, condition: str, params: Tuple) -> int:
+        """Удаление ВМ по условию с освобождением ресурсов на гипервизорах (одно обновление
+        на гипервизор) и в дисковом пуле. По условию на ключ секционирования затрагиваются
+        только подходящие секции"""
+        cur.execute(f"""
+                WITH deleted AS (
+                    DELETE FROM virtual_machines 
+                    WHERE {condition}
+                    RETURNING hv_name, vcpu, vram, vhdd
+                ), released AS (
+                    SELECT hv_name, SUM(vcpu) AS vcpu, SUM(vram) AS vram, COUNT(*) AS cnt
+                    FROM deleted
+                    GROUP BY hv_name
+                ), storage AS (
+                    UPDATE storage_pool 
+                    SET used_disk = used_disk - (SELECT COALESCE(SUM(vhdd), 0) FROM deleted)
+                    WHERE pool_name = %s
+                )
+                UPDATE hypervisors h
+                SET free_cpu = h.free_cpu + r.vcpu,
+                    free_ram = h.free_ram + r.vram,
+                    num_vms = h.num_vms - r.cnt
+                FROM released r
+                WHERE h.hv_name = r.hv_name
+                RETURNING r.cnt
+            """, params + (self.STORAGE_POOL,))
+        return sum(row[0] for row in cur.fetchall())
+    
+    def delete_vms_on_hypervisor(self, hv_name: str) -> int:
+        """Удаление всех ВМ гипервизора (при секционировании hash - одна секция)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            deleted_count = self._delete_vms_where(cur, "hv_name = %s", (hv_name,))
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Удалено ВМ гипервизора {hv_name}: {deleted_count}")
+            return deleted_count
+        except Exception as e:
+            logger.error(f"Ошибка при удалении ВМ гипервизора: {e}")
+            return 0
+    
+    def delete_vms_created_before(self, cutoff: datetime) -> int:
+        """Удаление ВМ, созданных раньше cutoff. При секционировании range месяцы целиком до cutoff
+        удаляются вместе с секцией (ресурсы, счетчики правил и реестр имен освобождаются по агрегатам
+        секции), остаток - удалением строк одной пограничной секции"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            deleted_count = 0
+            if self.partitioning == 'range':
+                for partition in self._vm_partitions_before(cur, cutoff):
+                    deleted_count += self._drop_vm_partition(cur, partition)
+            deleted_count += self._delete_vms_where(cur, "creation_date < %s", (cutoff,))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Удалено ВМ, созданных до {cutoff:%Y-%m-%d %H:%M}: {deleted_count}")
+            return deleted_count
+            
+        except Exception as e:
+            logger.error(f"Ошибка при удалении ВМ по дате создания: {e}")
+            return 0
+    
+    @staticmethod
+    def _vm_partitions_before(cur, cutoff: datetime) -> List[str]:
+        """Месячные секции ВМ, целиком лежащие до cutoff"""
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'virtual_machines'::regclass
+            ORDER BY c.relname
+        """)
+        partitions = []
+        for (partition,) in cur.fetchall():
+            suffix = partition.rsplit('_', 1)[1]
+            if not suffix.isdigit():
+                continue
+            month = datetime.strptime(suffix, "%Y%m").date()
+            if datetime.combine(Database._next_month(month), datetime.min.time()) <= cutoff:
+                partitions.append(partition)
+        return partitions
+    
+    def _drop_vm_partition(self, cur, partition: str) -> int:
+        """Удаление месячной секции ВМ целиком с освобождением ресурсов по ее агрегатам"""
+        cur.execute(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"""
+            WITH released AS (
+                SELECT hv_name, SUM(vcpu) AS vcpu, SUM(vram) AS vram, COUNT(*) AS cnt
+                FROM {partition}
+                GROUP BY hv_name
+            ), storage AS (
+                UPDATE storage_pool 
+                SET used_disk = used_disk - (SELECT COALESCE(SUM(vhdd), 0) FROM {partition})
+                WHERE pool_name = %s
+            ), rule_counts AS (
+                UPDATE placement_counts c
+                SET vm_count = c.vm_count - d.cnt
+                FROM (
+                    SELECT r.rule_id, v.hv_name, COUNT(*) AS cnt
+                    FROM {partition} v
+                    JOIN placement_rules r ON v.vm_name LIKE r.vm_prefix || '%%'
+                    GROUP BY r.rule_id, v.hv_name
+                ) d
+                WHERE c.rule_id = d.rule_id AND c.hv_name = d.hv_name
+            ), names AS (
+                DELETE FROM vm_names n USING {partition} v WHERE n.vm_name = v.vm_name
+            ), journal AS (
+                INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                SELECT 'vm_delete', vm_name, hv_name, vcpu, vram, -1, -vhdd FROM {partition}
+            )
+            UPDATE hypervisors h
+            SET free_cpu = h.free_cpu + r.vcpu,
+                free_ram = h.free_ram + r.vram,
+                num_vms = h.num_vms - r.cnt
+            FROM released r
+            WHERE h.hv_name = r.hv_name
+            RETURNING r.cnt
+        """, (self.STORAGE_POOL,))
+        deleted_count = sum(row[0] for row in cur.fetchall())
+        cur.execute(f"DROP TABLE {partition}")
+        # Удаление секции не вызывает триггеров версии данных
+        cur.execute("UPDATE data_version SET version = version + 1")
+        month = datetime.strptime(partition.rsplit('_', 1)[1], "%Y%m").date()
+        self._vm_partitions.discard(month)
+        return deleted_count
+    
+    def create_vms_bulk(self, vms: List[Dict[str, Any]]) -> int:
+        """Загрузка ВМ с заданным размещением одной транзакцией
+        (пакетная вставка, одно обновление на гипервизор)"""
+        if not vms:
+            return 0
+        now = datetime.now()
+        if self.partitioning == 'range':
+            self._ensure_vm_partitions(sorted({(vm.get('creation_date') or now).date().replace(day=1)
+                                               for vm in vms}))
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            execute_values(cur, """
+                INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date) VALUES %s
+            """, [(vm['vm_name'], vm['vcpu'], vm['vram'], vm['vhdd'], vm['hv_name'],
+                   vm.get('creation_date') or now) for vm in vms], page_size=1000)
+            execute_values(cur, """
+                UPDATE hypervisors h
+                SET free_cpu = h.free_cpu - v.vcpu,
+                    free_ram = h.free_ram - v.vram,
+                    num_vms = h.num_vms + v.cnt
+                FROM (VALUES %s) AS v(hv_name, vcpu, vram, cnt)
+                WHERE h.hv_name = v.hv_name
+            """, [(hv_name, vcpu, vram, cnt) for hv_name, (vcpu, vram, cnt) in self._consumed(vms).items()],
+                page_size=1000)
+            disk = sum(vm['vhdd'] for vm in vms)
+            self.statements.execute(cur, "disk_reserve", (disk, self.STORAGE_POOL, disk))
+            if cur.fetchone() is None:
+                conn.rollback()
+                conn.close()
+                logger.error(f"Ошибка при массовой загрузке ВМ: {self.DISK_FULL_MESSAGE}")
+                return 0
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Загружено ВМ: {len(vms)}")
+            return len(vms)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при массовой загрузке ВМ: {e}")
+            return 0
+    
+    def _move_vms(self, cur, moves: List[Tuple[str, str, str, int, int]]):
+        """Перенос ВМ между гипервизорами в текущей транзакции.
+        moves - список (vm_name, исходный hv, целевой hv, vcpu, vram)"""
+        if not moves:
+            return
+        
+        execute_values(cur, """
+            UPDATE virtual_machines v 
+            SET hv_name = m.target
+            FROM (VALUES %s) AS m(vm_name, target)
+            WHERE v.vm_name = m.vm_name
+        """, [(vm_name, target) for vm_name, _, target, _, _ in moves])
+        
+        # Суммарное изменение ресурсов по каждому гипервизору
+        deltas: Dict[str, List[int]] = {}
+        for _, source, target, vcpu, vram in moves:
+            src = deltas.setdefault(source, [0, 0, 0])
+            src[0] += vcpu
+            src[1] += vram
+            src[2] -= 1
+            dst = deltas.setdefault(target, [0, 0, 0])
+            dst[0] -= vcpu
+            dst[1] -= vram
+            dst[2] += 1
+        
+        execute_values(cur, """
+            UPDATE hypervisors h
+            SET free_cpu = h.free_cpu + d.cpu,
+                free_ram = h.free_ram + d.ram,
+                num_vms = h.num_vms + d.cnt
+            FROM (VALUES %s) AS d(hv_name, cpu, ram, cnt)
+            WHERE h.hv_name = d.hv_name
+        """, [(hv_name, cpu, ram, cnt) for hv_name, (cpu, ram, cnt) in deltas.items()])
+    
+    def migrate_vms(self, migrations: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        """Перенос ВМ на указанные гипервизоры в одной транзакции.
+        migrations - список (vm_name, целевой гипервизор)"""
+        if not migrations:
+            return True, ""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            targets = dict(migrations)
+            cur.execute("""
+                SELECT vm_name, hv_name, vcpu, vram 
+                FROM virtual_machines 
+                WHERE vm_name = ANY(%s)
+                FOR UPDATE
+            """, (list(targets),))
+            vms = cur.fetchall()
+            
+            if len(vms) != len(targets):
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return False, "Часть ВМ для переноса не найдена"
+            
+            moves = [(vm_name, hv_name, targets[vm_name], vcpu, vram)
+                     for vm_name, hv_name, vcpu, vram in vms
+                     if hv_name != targets[vm_name]]
+            
+            # Блокируем затронутые гипервизоры в одном порядке, чтобы избежать взаимных блокировок
+            involved = sorted({m[1] for m in moves} | {m[2] for m in moves})
+            cur.execute("SELECT hv_name FROM hypervisors WHERE hv_name = ANY(%s) ORDER BY hv_name FOR UPDATE",
+                        (involved,))
+            
+            self._move_vms(cur, moves)
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Перенесено ВМ: {len(moves)}")
+            return True, ""
+            
+        except Exception as e:
+            logger.error(f"Ошибка при переносе ВМ: {e}")
+            return False, str(e)
+    
+    def drain_hypervisor(self, hv_name: str, exclude: Optional[List[str]] = None) -> Tuple[bool, str]:
+        """Перенос всех ВМ гипервизора на другие гипервизоры в одной транзакции.
+        exclude - гипервизоры, которые нельзя использовать как целевые"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cur.execute("""
+                SELECT hv_name, free_cpu, free_ram, num_vms 
+                FROM hypervisors 
+                ORDER BY hv_name 
+                FOR UPDATE
+            """)
+            hypervisors = cur.fetchall()
+            
+            # Крупные ВМ размещаем первыми - так меньше шансов не найти для них место
+            cur.execute("""
+                SELECT vm_name, vcpu, vram 
+                FROM virtual_machines 
+                WHERE hv_name = %s 
+                ORDER BY vcpu DESC, vram DESC
+                FOR UPDATE
+            """, (hv_name,))
+            vms = cur.fetchall()
+            
+            moves, message = self._plan_drain(hypervisors, vms, hv_name, exclude,
+                                              self._placement_index(hypervisors))
+            if moves is None:
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return False, message
+            
+            self._move_vms(cur, moves)
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Гипервизор {hv_name} освобожден, перенесено ВМ: {len(moves)}")
+            return True, ""
+            
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении гипервизора: {e}")
+            return False, str(e)
+    
+    # Очередь заданий массового развертывания
+    def submit_deploy_job(self, base_vm_data: Dict[str, Any], count: int, priority: int = 0,
+                          max_attempts: int = 3) -> Optional[int]:
+        """Постановка задания на создание count ВМ в очередь, возвращает номер задания.
+        Имена ВМ распределяются сразу, чтобы одновременные задания не конфликтовали"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            # Распределение имен сериализуется между операторами
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (self.DEPLOY_NAMES_LOCK,))
+            cur.execute("""
+                SELECT vm_name FROM virtual_machines
+                UNION ALL
+                SELECT vm_name FROM deploy_tasks WHERE status IN ('pending', 'running')
+            """)
+            names = NameGenerator.generate_vm_names(base_vm_data['vm_name'],
+                                                    [row[0] for row in cur.fetchall()], count)
+            
+            cur.execute("""
+                INSERT INTO deploy_jobs (base_name, vcpu, vram, vhdd, total, priority, max_attempts)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING job_id
+            """, (base_vm_data['vm_name'], base_vm_data['vcpu'], base_vm_data['vram'],
+                  base_vm_data['vhdd'], count, priority, max_attempts))
+            job_id = cur.fetchone()[0]
+            
+            execute_values(cur, "INSERT INTO deploy_tasks (job_id, seq, vm_name) VALUES %s",
+                           [(job_id, seq, name) for seq, name in enumerate(names, 1)], page_size=1000)
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Задание развертывания {job_id} поставлено в очередь: {count} ВМ")
+            return job_id
+            
+        except Exception as e:
+            logger.error(f"Ошибка при постановке задания развертывания: {e}")
+            return None
+    
+    def claim_deploy_tasks(self, worker: str, limit: int = 10,
+                           lease: timedelta = timedelta(minutes=5)) -> List[Dict[str, Any]]:
+        """Захват задач исполнителем (FOR UPDATE SKIP LOCKED - исполнители не ждут друг друга).
+        Задачи упавшего исполнителя возвращаются в работу по истечении lease, но не больше max_attempts
+        захватов: после этого задача завершается (done, если ВМ успела создаться, иначе failed).
+        already_created - ВМ задачи уже создана, name_taken - имя занято ВМ, созданной не этой задачей.
+        Резервы исполнителей живут не дольше аренды: места резервов упавших исполнителей освобождаются здесь же"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            released = self._release_where(conn.cursor(), "expires_at <= CURRENT_TIMESTAMP", ())
+            if released:
+                logger.info(f"Освобождено мест истекших резервов: {released}")
+            
+            cur.execute(f"""
+                UPDATE deploy_tasks t
+                SET status = CASE WHEN EXISTS ({self.DEPLOY_TASK_VM}) THEN 'done' ELSE 'failed' END,
+                    error = CASE WHEN EXISTS ({self.DEPLOY_TASK_VM}) THEN NULL ELSE %(message)s END
+                FROM deploy_jobs j
+                WHERE j.job_id = t.job_id AND t.status = 'running'
+                  AND t.claimed_at < now() - %(lease)s AND t.attempts >= j.max_attempts
+                RETURNING t.job_id, t.status
+            """, {'lease': lease, 'message': self.DEPLOY_LEASE_EXPIRED_MESSAGE})
+            expired = cur.fetchall()
+            if expired:
+                logger.warning(f"Завершено задач развертывания с истекшими захватами: {len(expired)}")
+                self._add_deploy_progress(cur, [(row['job_id'], row['status']) for row in expired])
+            
+            cur.execute(f"""
+                WITH claimed AS (
+                    SELECT t.job_id, t.seq
+                    FROM deploy_tasks t
+                    JOIN deploy_jobs j ON j.job_id = t.job_id
+                    WHERE j.status IN ('queued', 'running')
+                      AND ((t.status = 'pending' AND t.next_attempt_at <= now())
+                           OR (t.status = 'running' AND t.claimed_at < now() - %(lease)s
+                               AND t.attempts < j.max_attempts))
+                    ORDER BY j.priority DESC, t.job_id, t.seq
+                    LIMIT %(limit)s
+                    FOR UPDATE OF t SKIP LOCKED
+                )
+                UPDATE deploy_tasks t
+                SET status = 'running', attempts = t.attempts + 1, claimed_at = now(), worker = %(worker)s
+                FROM claimed c, deploy_jobs j
+                WHERE t.job_id = c.job_id AND t.seq = c.seq AND j.job_id = t.job_id
+                RETURNING t.job_id, t.seq, t.vm_name, t.attempts, j.vcpu, j.vram, j.vhdd, j.max_attempts,
+                          EXISTS ({self.DEPLOY_TASK_VM}) AS already_created,
+                          EXISTS (SELECT 1 FROM virtual_machines v WHERE v.vm_name = t.vm_name) AS name_taken
+            """, {'lease': lease, 'limit': limit, 'worker': worker})
+            tasks = cur.fetchall()
+            
+            if tasks:
+                cur.execute("""
+                    UPDATE deploy_jobs SET status = 'running', started_at = now()
+                    WHERE job_id = ANY(%s) AND status = 'queued'
+                """, (list({task['job_id'] for task in tasks}),))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            return tasks
+            
+        except Exception as e:
+            logger.error(f"Ошибка при захвате задач развертывания: {e}")
+            return []
+    
+    @staticmethod
+    def _add_deploy_progress(cur, finished: List[Tuple[int, str]]):
+        """Счетчики заданий по завершенным задачам (job_id, статус done/failed) - один раз на пакет"""
+        progress: Dict[int, List[int]] = {}
+        for job_id, status in finished:
+            counters = progress.setdefault(job_id, [0, 0])
+            if status == 'done':
+                counters[0] += 1
+            elif status == 'failed':
+                counters[1] += 1
+        if not progress:
+            return
+        
+        execute_values(cur, """
+            UPDATE deploy_jobs j
+            SET created = j.created + d.created,
+                failed = j.failed + d.failed,
+                status = CASE WHEN j.status = 'running' 
+                               AND j.created + d.created + j.failed + d.failed >= j.total
+                              THEN 'done' ELSE j.status END,
+                finished_at = CASE WHEN j.created + d.created + j.failed + d.failed >= j.total
+                                   THEN now() ELSE j.finished_at END
+            FROM (VALUES %s) AS d(job_id, created, failed)
+            WHERE j.job_id = d.job_id
+        """, [(job_id, created, failed) for job_id, (created, failed) in progress.items()])
+    
+    def finish_deploy_tasks(self, results: List[Tuple[int, int, str, Optional[str], float]],
+                            worker: Optional[str] = None):
+        """Фиксация результатов задач и счетчиков заданий одной транзакцией.
+        results - (job_id, seq, статус done/failed/retry, ошибка, задержка повтора в секундах).
+        Фиксируются только задачи, которые еще выполняет worker: результат задачи, захваченной
+        повторно другим исполнителем или отмененной, не учитывается в счетчиках"""
+        if not results:
+            return
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            updated = execute_values(cur, """
+                UPDATE deploy_tasks t
+                SET status = CASE WHEN r.status = 'retry' THEN 'pending' ELSE r.status END,
+                    error = r.error,
+                    next_attempt_at = now() + r.delay * INTERVAL '1 second'
+                FROM (VALUES %s) AS r(job_id, seq, status, error, delay, worker)
+                WHERE t.job_id = r.job_id AND t.seq = r.seq AND t.status = 'running'
+                  AND (r.worker IS NULL OR t.worker = r.worker)
+                RETURNING t.job_id, t.status
+            """, [tuple(result) + (worker,) for result in results], fetch=True)
+            
+            # Счетчики - по фактически обновленным задачам
+            self._add_deploy_progress(cur, updated)
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            if len(updated) < len(results):
+                logger.warning(f"Результаты {len(results) - len(updated)} задач развертывания не учтены: "
+                               f"задачи захвачены другим исполнителем или отменены")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении результатов развертывания: {e}")
+    
+    def get_deploy_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние задания развертывания с прогрессом"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                SELECT job_id, base_name, vcpu, vram, vhdd, total, priority, status,
+                       created, failed, submitted_at, started_at, finished_at
+                FROM deploy_jobs
+                ORDER BY job_id DESC
+                LIMIT %s
+            """, (limit,))
+            jobs = cur.fetchall()
+            cur.close()
+            conn.close()
+            return jobs
+        except Exception as e:
+            logger.error(f"Ошибка при получении заданий развертывания: {e}")
+            return []
+    
+    def cancel_deploy_job(self, job_id: int) -> bool:
+        """Отмена задания: оставшиеся задачи не выполняются, созданные ВМ сохраняются"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            cur.execute("""
+                UPDATE deploy_jobs SET status = 'cancelled', finished_at = now()
+                WHERE job_id = %s AND status IN ('queued', 'running')
+            """, (job_id,))
+            cancelled = cur.rowcount > 0
+            cur.execute("""
+                UPDATE deploy_tasks SET status = 'cancelled' 
+                WHERE job_id = %s AND status = 'pending'
+            """, (job_id,))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            if cancelled:
+                logger.info(f"Задание развертывания {job_id} отменено")
+            return cancelled
+            
+        except Exception as e:
+            logger.error(f"Ошибка при отмене задания развертывания: {e}")
+            return False
+    
+    def save_deploy_checkpoint(self, run_id: str, state: Dict[str, Any]) -> bool:
+        """Сохранение состояния развертывания (перезапись предыдущей точки)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO deploy_checkpoints (run_id, status, state, updated_at)
+                VALUES (%s, %s, %s, now())
+                ON CONFLICT (run_id) DO UPDATE
+                SET status = EXCLUDED.status, state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+            """, (run_id, state['status'], Json(state)))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении контрольной точки развертывания: {e}")
+            return False
+    
+    def get_deploy_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Последняя контрольная точка развертывания"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT state FROM deploy_checkpoints WHERE run_id = %s", (run_id,))
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении контрольной точки развертывания: {e}")
+            return None
+    
+    def get_deploy_checkpoints(self) -> List[Dict[str, Any]]:
+        """Контрольные точки всех развертываний, новые первыми"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT state FROM deploy_checkpoints ORDER BY updated_at DESC")
+            states = [row[0] for row in cur.fetchall()]
+            cur.close()
+            conn.close()
+            return states
+        except Exception as e:
+            logger.error(f"Ошибка при получении контрольных точек развертывания: {e}")
+            return []
+    
+    # Правила размещения
+    def add_placement_rule(self, rule: Dict[str, Any]) -> Tuple[bool, str]:
+        """Добавление правила с расчетом счетчиков по уже размещенным ВМ"""
+        is_valid, message = Validator.validate_placement_rule(rule)
+        if not is_valid:
+            return False, message
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            # Создание ВМ ждет фиксации правила - счетчики не пропустят новые ВМ
+            cur.execute("LOCK TABLE virtual_machines IN SHARE MODE")
+            cur.execute("""
+                INSERT INTO placement_rules (kind, vm_prefix, max_per_host, hosts)
+                VALUES (%s, %s, %s, %s)
+                RETURNING rule_id
+            """, (rule['kind'], rule['vm_prefix'], rule.get('max_per_host'), rule.get('hosts') or None))
+            rule_id = cur.fetchone()[0]
+            cur.execute("""
+                INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+                SELECT %s, hv_name, COUNT(*) FROM virtual_machines
+                WHERE vm_name LIKE %s || '%%'
+                GROUP BY hv_name
+            """, (rule_id, rule['vm_prefix']))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            self._rules_cache = None
+            logger.info(f"Добавлено правило размещения {rule_id}: {rule['kind']} {rule['vm_prefix']}")
+            return True, str(rule_id)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении правила размещения: {e}")
+            return False, str(e)
+    
+    def get_placement_rules(self) -> List[Dict[str, Any]]:
+        """Правила размещения (кэшируются, как конфигурация кластера)"""
+        if self._rules_cache is not None:
+            return list(self._rules_cache)
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SELECT rule_id, kind, vm_prefix, max_per_host, hosts FROM placement_rules ORDER BY rule_id")
+            self._rules_cache = [dict(row) for row in cur.fetchall()]
+            cur.close()
+            conn.close()
+            return list(self._rules_cache)
+        except Exception as e:
+            logger.error(f"Ошибка при получении правил размещения: {e}")
+            return []
+    
+    def delete_placement_rule(self, rule_id: int) -> bool:
+        """Удаление правила размещения"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("DELETE FROM placement_rules WHERE rule_id = %s", (rule_id,))
+            deleted = cur.rowcount > 0
             conn.commit()
             cur.close()
             conn.close()
-            logger.info("Таблицы успешно созданы или уже существуют")
+            self._rules_cache = None
+            return deleted
         except Exception as e:
-            logger.error(f"Ошибка при создании таблиц: {e}")
+            logger.error(f"Ошибка при удалении правила размещения: {e}")
+            return False
     
-    def _initialize_cluster(self):
-        """Инициализация конфигурации кластера"""
+    def get_placement_counts(self) -> Dict[Tuple[int, str], int]:
+        """Счетчики ВМ групп правил по гипервизорам"""
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            
-            configs = [
-                ("cluster_name", "Moscow_Cluster"),
-                ("disk_pool", "1000000"),
-                ("overcommit_cpu", "3.0"),
-                ("overcommit_ram", "1.0"),
-                ("max_hypervisors", "24")
-            ]
-            
-            for key, value in configs:
-                cur.execute("""
-                    INSERT INTO cluster_config (config_key, config_value) 
-                    VALUES (%s, %s)
-                    ON CONFLICT (config_key) DO NOTHING
-                """, (key, value))
-            
-            conn.commit()
+            cur.execute("SELECT rule_id, hv_name, vm_count FROM placement_counts")
+            counts = {(rule_id, hv_name): vm_count for rule_id, hv_name, vm_count in cur.fetchall()}
             cur.close()
             conn.close()
-            logger.info("Конфигурация кластера инициализирована")
-            
+            return counts
         except Exception as e:
-            logger.error(f"Ошибка при инициализации кластера: {e}")
-    
-    # Методы для работы с виртуальными машинами
-    def create_vm(self, vm_data: Dict[str, Any]) -> bool:
-        """Создание виртуальной машины"""
+            logger.error(f"Ошибка при получении счетчиков правил размещения: {e}")
+            return {}
+
+    # Резервы емкости
+    def reserve_capacity(self, vm_data: Dict[str, Any], count: int, ttl: Optional[float] = None,
+                         owner: str = "") -> Tuple[Optional[int], str]:
+        """Резерв мест одним оператором: план по гипервизорам строится по текущим счетчикам,
+        затем удержание ресурсов всех гипервизоров плана и дискового пула, запись резерва и журнала.
+        Если ресурсы гипервизора заняты параллельно - откат и новый план (до трех попыток)"""
+        for _ in range(3):
+            plan, message = self._plan_reservation(self.get_all_hypervisors(), vm_data, count)
+            if plan is None:
+                return None, message
+            conn = self._get_connection()
+            try:
+                cur = conn.cursor()
+                names = sorted(plan)
+                # Гипервизоры блокируются в порядке имен (без взаимных блокировок)
+                cur.execute("SELECT hv_name FROM hypervisors WHERE hv_name = ANY(%s) ORDER BY hv_name FOR UPDATE",
+                            (names,))
+                cur.execute("""
+                    WITH plan AS (
+                        SELECT * FROM unnest(%(names)s::varchar[], %(slots)s::integer[]) AS p(hv_name, slots)
+                    ), held AS (
+                        UPDATE hypervisors h
+                        SET free_cpu = h.free_cpu - p.slots * %(vcpu)s, free_ram = h.free_ram - p.slots * %(vram)s
+                        FROM plan p
+                        WHERE h.hv_name = p.hv_name
+                          AND h.free_cpu >= p.slots * %(vcpu)s AND h.free_ram >= p.slots * %(vram)s
+                        RETURNING h.hv_name, p.slots
+                    ), disk AS (
+                        UPDATE storage_pool SET used_disk = used_disk + %(disk)s
+                        WHERE pool_name = %(pool)s AND used_disk + %(disk)s <= capacity
+                        RETURNING pool_name
+                    ), reservation AS (
+                        INSERT INTO capacity_reservations (owner, vcpu, vram, vhdd, expires_at)
+                        VALUES (%(owner)s, %(vcpu)s, %(vram)s, %(vhdd)s,
+                                CURRENT_TIMESTAMP + %(ttl)s * interval '1 second')
+                        RETURNING reservation_id
+                    ), slots AS (
+                        INSERT INTO reservation_slots (reservation_id, hv_name, slots)
+                        SELECT r.reservation_id, held.hv_name, held.slots FROM reservation r, held
+                    ), journal AS (
+                        INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk)
+                        SELECT 'reserve', hv_name, -slots * %(vcpu)s, -slots * %(vram)s, slots * %(vhdd)s FROM held
+                    )
+                    SELECT (SELECT reservation_id FROM reservation), (SELECT COUNT(*) FROM held),
+                           (SELECT COUNT(*) FROM disk)
+                """, {'names': names, 'slots': [plan[name] for name in names], 'vcpu': vm_data['vcpu'],
+                      'vram': vm_data['vram'], 'vhdd': vm_data['vhdd'], 'disk': count * vm_data['vhdd'],
+                      'pool': self.STORAGE_POOL, 'owner': owner, 'ttl': ttl or self.RESERVATION_TTL})
+                reservation_id, held, disk = cur.fetchone()
+                if not disk:
+                    return None, self.DISK_FULL_MESSAGE
+                if held == len(plan):
+                    conn.commit()
+                    cur.close()
+                    logger.info(f"Резерв {reservation_id}: {count} мест на {len(plan)} гипервизорах")
+                    return reservation_id, ""
+            except psycopg2.IntegrityError as e:
+                return None, str(e).strip()
+            finally:
+                # Незавершенная транзакция (часть гипервизоров плана уже занята) откатывается
+                conn.close()
+        return None, self.NO_CAPACITY_MESSAGE
+
+    def try_create_reserved_vm(self, reservation_id: int, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ в месте резерва. Строка резерва блокируется в режиме SHARE: ВМ одного резерва
+        создаются параллельно (места разных гипервизоров блокируются независимо), освобождение
+        резерва ждет завершения начатых созданий. Ошибки базы (не нарушения ограничений) - отказ
+        с причиной, начинающейся с DB_ERROR_MESSAGE: создание можно повторить"""
+        conn = None
         try:
+            if self.partitioning == 'range':
+                self._ensure_vm_partitions(self._vm_months_ahead())
             conn = self._get_connection()
             cur = conn.cursor()
-            
-            # Находим подходящий гипервизор
             cur.execute("""
-                SELECT hv_name, free_cpu, free_ram 
-                FROM hypervisors 
-                WHERE free_cpu >= %s AND free_ram >= %s
-                ORDER BY num_vms ASC, free_cpu DESC
-                LIMIT 1
-            """, (vm_data['vcpu'], vm_data['vram']))
-            
-            result = cur.fetchone()
-            if not result:
-                logger.error("Нет доступных гипервизоров с достаточными ресурсами")
-                cur.close()
-                conn.close()
-                return False
-            
-            hv_name = result[0]
-            
-            # Создаем ВМ
+                SELECT vcpu, vram, vhdd FROM capacity_reservations
+                WHERE reservation_id = %s AND expires_at > CURRENT_TIMESTAMP
+                FOR SHARE
+            """, (reservation_id,))
+            reservation = cur.fetchone()
+            slot = None
+            if reservation is not None:
+                # Сначала место, не занятое параллельным созданием; если заняты все - ожидание
+                for lock in ("FOR UPDATE SKIP LOCKED", "FOR UPDATE"):
+                    cur.execute(f"""
+                        SELECT hv_name FROM reservation_slots WHERE reservation_id = %s AND slots > 0
+                        ORDER BY slots DESC, hv_name LIMIT 1 {lock}
+                    """, (reservation_id,))
+                    slot = cur.fetchone()
+                    if slot is not None:
+                        break
+            if reservation is None or slot is None:
+                return False, self.RESERVATION_MISSING_MESSAGE
+            if tuple(reservation) != (vm_data['vcpu'], vm_data['vram'], vm_data['vhdd']):
+                return False, "Размер ВМ не совпадает с размером мест резерва"
+            hv_name = slot[0]
+
             cur.execute("""
-                INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (vm_data['vm_name'], vm_data['vcpu'], vm_data['vram'], 
-                  vm_data['vhdd'], hv_name))
-            
-            # Обновляем ресурсы гипервизора
+                WITH slot AS (
+                    UPDATE reservation_slots SET slots = slots - 1 WHERE reservation_id = %s AND hv_name = %s
+                )
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk) VALUES ('release', %s, %s, %s, %s)
+            """, (reservation_id, hv_name, hv_name, vm_data['vcpu'], vm_data['vram'], -vm_data['vhdd']))
+            self.statements.execute(cur, "vm_insert", (vm_data['vm_name'], vm_data['vcpu'], vm_data['vram'],
+                                                       vm_data['vhdd'], hv_name))
+            # Место резерва переходит к ВМ: свободные ресурсы и дисковый пул не меняются
+            cur.execute("UPDATE hypervisors SET num_vms = num_vms + 1 WHERE hv_name = %s", (hv_name,))
+
+            conn.commit()
+            cur.close()
+            return True, hv_name
+
+        except psycopg2.IntegrityError as e:
+            return False, str(e).strip()
+        except Exception as e:
+            logger.error(f"Ошибка при создании ВМ {vm_data['vm_name']} в резерве {reservation_id}: {e}")
+            return False, f"{self.DB_ERROR_MESSAGE}: {str(e).strip()}"
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def renew_reservation(self, reservation_id: int, ttl: Optional[float] = None) -> bool:
+        """Продление действующего резерва"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
             cur.execute("""
-                UPDATE hypervisors 
-                SET free_cpu = free_cpu - %s, 
-                    free_ram = free_ram - %s,
-                    num_vms = num_vms + 1
-                WHERE hv_name = %s
-            """, (vm_data['vcpu'], vm_data['vram'], hv_name))
-            
+                UPDATE capacity_reservations SET expires_at = CURRENT_TIMESTAMP + %s * interval '1 second'
+                WHERE reservation_id = %s AND expires_at > CURRENT_TIMESTAMP
+            """, (ttl or self.RESERVATION_TTL, reservation_id))
+            renewed = cur.rowcount > 0
             conn.commit()
             cur.close()
             conn.close()
-            logger.info(f"ВМ {vm_data['vm_name']} успешно создана на гипервизоре {hv_name}")
-            return True
-            
+            return renewed
         except Exception as e:
-            logger.error(f"Ошибка при создании ВМ: {e}")
+            logger.error(f"Ошибка при продлении резерва: {e}")
             return False
-    
-    def get_all_vms(self) -> List[Dict[str, Any]]:
-        """Получение всех виртуальных машин"""
+
+    def _release_where(self, cur, condition: str, params: Tuple) -> int:
+        """Возврат мест резервов по условию гипервизорам и дисковому пулу с удалением резервов.
+        Резервы сначала блокируются (ждут создания ВМ в их местах), возврат выполняется
+        следующим оператором - по уже уменьшенным количествам мест"""
+        cur.execute(f"""
+            SELECT reservation_id FROM capacity_reservations WHERE {condition}
+            ORDER BY reservation_id FOR UPDATE
+        """, params)
+        ids = [row[0] for row in cur.fetchall()]
+        if not ids:
+            return 0
+        cur.execute("""
+            WITH released AS (
+                DELETE FROM capacity_reservations WHERE reservation_id = ANY(%s)
+                RETURNING reservation_id, vcpu, vram, vhdd
+            ), freed AS (
+                SELECT s.hv_name, SUM(s.slots) AS slots, SUM(s.slots * r.vcpu) AS vcpu,
+                       SUM(s.slots * r.vram) AS vram, SUM(s.slots * r.vhdd) AS vhdd
+                FROM reservation_slots s JOIN released r USING (reservation_id)
+                WHERE s.slots > 0
+                GROUP BY s.hv_name
+            ), journal AS (
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk)
+                SELECT 'release', hv_name, vcpu, vram, -vhdd FROM freed
+            ), storage AS (
+                UPDATE storage_pool SET used_disk = used_disk - (SELECT COALESCE(SUM(vhdd), 0) FROM freed)
+                WHERE pool_name = %s
+            )
+            UPDATE hypervisors h
+            SET free_cpu = h.free_cpu + f.vcpu, free_ram = h.free_ram + f.vram
+            FROM freed f
+            WHERE h.hv_name = f.hv_name
+            RETURNING f.slots
+        """, (ids, self.STORAGE_POOL))
+        return sum(row[0] for row in cur.fetchall())
+
+    def release_reservation(self, reservation_id: int) -> int:
+        """Освобождение неиспользованных мест резерва"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            released = self._release_where(cur, "reservation_id = %s", (reservation_id,))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return released
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении резерва: {e}")
+            return 0
+
+    def release_expired_reservations(self) -> int:
+        """Освобождение мест истекших резервов"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            released = self._release_where(cur, "expires_at <= CURRENT_TIMESTAMP", ())
+            conn.commit()
+            cur.close()
+            conn.close()
+            if released:
+                logger.info(f"Освобождено мест истекших резервов: {released}")
+            return released
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении истекших резервов: {e}")
+            return 0
+
+    def get_reservations(self) -> List[Dict[str, Any]]:
+        """Резервы с оставшимися местами по гипервизорам"""
         try:
             conn = self._get_connection()
             cur = conn.cursor(cursor_factory=RealDictCursor)
             cur.execute("""
-                SELECT vm_name, vcpu, vram, vhdd, hv_name, creation_date 
-                FROM virtual_machines 
-                ORDER BY vm_name
+                SELECT r.reservation_id, r.owner, r.vcpu, r.vram, r.vhdd, r.expires_at,
+                       COALESCE(jsonb_object_agg(s.hv_name, s.slots) FILTER (WHERE s.slots > 0), '{}'::jsonb) AS slots
+                FROM capacity_reservations r LEFT JOIN reservation_slots s USING (reservation_id)
+                GROUP BY r.reservation_id
+                ORDER BY r.reservation_id
             """)
-            vms = cur.fetchall()
+            reservations = [dict(row) for row in cur.fetchall()]
             cur.close()
             conn.close()
-            return vms
+            return reservations
         except Exception as e:
-            logger.error(f"Ошибка при получении ВМ: {e}")
+            logger.error(f"Ошибка при получении резервов: {e}")
             return []
-    
-    def delete_vm(self, vm_name: str) -> bool:
-        """Удаление виртуальной машины"""
+
+    # Журнал операций
+    def get_journal(self, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Записи журнала с op_id больше after"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SELECT * FROM operation_journal WHERE op_id > %s ORDER BY op_id LIMIT %s", (after, limit))
+            entries = [dict(row) for row in cur.fetchall()]
+            cur.close()
+            conn.close()
+            return entries
+        except Exception as e:
+            logger.error(f"Ошибка при чтении журнала операций: {e}")
+            return []
+
+    def _snapshot(self, cur) -> int:
+        """Снимок счетчиков одним оператором. Вызывающий держит блокировку SHARE на журнале:
+        транзакции, уже записавшие в журнал, зафиксированы, новые ждут - записи с меньшим op_id
+        не появятся после снимка"""
+        cur.execute("""
+            INSERT INTO journal_snapshots (op_id, used_disk, hypervisors)
+            SELECT (SELECT COALESCE(MAX(op_id), 0) FROM operation_journal),
+                   (SELECT used_disk FROM storage_pool WHERE pool_name = %s),
+                   (SELECT COALESCE(jsonb_object_agg(hv_name, jsonb_build_array(free_cpu, free_ram, num_vms)),
+                                    '{}'::jsonb)
+                    FROM hypervisors)
+            RETURNING op_id
+        """, (self.STORAGE_POOL,))
+        return cur.fetchone()[0]
+
+    def create_journal_snapshot(self) -> Optional[int]:
+        """Снимок счетчиков на текущей позиции журнала (запись в журнал ждет на время снимка)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("LOCK TABLE operation_journal IN SHARE MODE")
+            op_id = self._snapshot(cur)
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.info(f"Снимок журнала операций на позиции {op_id}")
+            return op_id
+        except Exception as e:
+            logger.error(f"Ошибка при создании снимка журнала: {e}")
+            return None
+
+    def compact_journal(self, keep_snapshots: int = 2) -> int:
+        """Удаление старых снимков и записей журнала до самого раннего из оставшихся снимков"""
         try:
             conn = self._get_connection()
             cur = conn.cursor()
-            
-            # Получаем данные о ВМ
-            cur.execute("SELECT hv_name, vcpu, vram FROM virtual_machines WHERE vm_name = %s", (vm_name,))
-            result = cur.fetchone()
-            
-            if not result:
-                cur.close()
-                conn.close()
-                return False
-            
-            hv_name, vcpu, vram = result
-            
-            # Удаляем ВМ
-            cur.execute("DELETE FROM virtual_machines WHERE vm_name = %s", (vm_name,))
-            
-            # Освобождаем ресурсы на гипервизоре
             cur.execute("""
-                UPDATE hypervisors 
-                SET free_cpu = free_cpu + %s, 
-                    free_ram = free_ram + %s,
-                    num_vms = num_vms - 1
-                WHERE hv_name = %s
-            """, (vcpu, vram, hv_name))
-            
+                SELECT snapshot_id, op_id FROM journal_snapshots ORDER BY snapshot_id DESC LIMIT 1 OFFSET %s
+            """, (max(keep_snapshots, 1) - 1,))
+            oldest = cur.fetchone()
+            deleted_count = 0
+            if oldest is not None:
+                cur.execute("DELETE FROM journal_snapshots WHERE snapshot_id < %s", (oldest[0],))
+                cur.execute("DELETE FROM operation_journal WHERE op_id <= %s", (oldest[1],))
+                deleted_count = cur.rowcount
             conn.commit()
             cur.close()
             conn.close()
-            logger.info(f"ВМ {vm_name} успешно удалена")
-            return True
-            
+            logger.info(f"Журнал операций сжат, удалено записей: {deleted_count}")
+            return deleted_count
         except Exception as e:
-            logger.error(f"Ошибка при удалении ВМ: {e}")
-            return False
-    
+            logger.error(f"Ошибка при сжатии журнала: {e}")
+            return 0
+
+    def _read_journal(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]]:
+        """Снимок, записи после него и счетчики в одной транзакции REPEATABLE READ"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cur.execute("""
+                SELECT op_id, used_disk, hypervisors FROM journal_snapshots ORDER BY snapshot_id DESC LIMIT 1
+            """)
+            snapshot = cur.fetchone()
+            if snapshot is None:
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return None
+            cur.execute("SELECT * FROM operation_journal WHERE op_id > %s ORDER BY op_id", (snapshot['op_id'],))
+            tail = [dict(row) for row in cur.fetchall()]
+            cur.execute("SELECT hv_name, free_cpu, free_ram, num_vms FROM hypervisors")
+            hypervisors = cur.fetchall()
+            cur.execute("SELECT used_disk FROM storage_pool WHERE pool_name = %s", (self.STORAGE_POOL,))
+            current = self._counters(hypervisors, cur.fetchone()['used_disk'])
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return dict(snapshot), tail, current
+        except Exception as e:
+            logger.error(f"Ошибка при чтении журнала операций: {e}")
+            return None
+
+    def _write_counters(self, state: Dict[str, Any]):
+        conn = self._get_connection()
+        try:
+            cur = conn.cursor()
+            execute_values(cur, """
+                UPDATE hypervisors h
+                SET free_cpu = v.free_cpu, free_ram = v.free_ram, num_vms = v.num_vms
+                FROM (VALUES %s) AS v(hv_name, free_cpu, free_ram, num_vms)
+                WHERE h.hv_name = v.hv_name
+            """, [(name, *counters) for name, counters in state['hypervisors'].items()])
+            cur.execute("UPDATE storage_pool SET used_disk = %s WHERE pool_name = %s",
+                        (state['used_disk'], self.STORAGE_POOL))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
     # Методы для работы с гипервизорами
     def add_hypervisor(self, hv_data: Dict[str, Any]) -> bool:
         """Добавление гипервизора"""
@@ -217,43 +2088,36 @@ class Database:
             cur.execute("SELECT COUNT(*) FROM hypervisors")
             hv_count = cur.fetchone()[0]
             
-            cur.execute("SELECT config_value FROM cluster_config WHERE config_key = 'max_hypervisors'")
-            max_hv = cur.fetchone()
-            max_hypervisors = int(max_hv[0]) if max_hv else 24
-            
-            if hv_count >= max_hypervisors:
-                logger.error(f"Достигнуто максимальное количество гипервизоров: {max_hypervisors}")
-                cur.close()
-                conn.close()
-                return False
-            
-            # Проверяем минимальные требования к гипервизору (ДОБАВЛЕНО)
-            if hv_data['cpu'] < 24:  # Минимум 24 ядра CPU
-                logger.error(f"CPU гипервизора должно быть не менее 24 ядер")
-                cur.close()
-                conn.close()
-                return False
-            
-            if hv_data['ram'] < 256:  # Минимум 256 ГБ RAM
-                logger.error(f"RAM гипервизора должно быть не менее 256 ГБ")
-                cur.close()
-                conn.close()
-                return False
-            
             # Проверяем, существует ли уже гипервизор с таким именем
             cur.execute("SELECT 1 FROM hypervisors WHERE hv_name = %s", (hv_data['hv_name'],))
-            if cur.fetchone():
-                logger.error(f"Гипервизор с именем {hv_data['hv_name']} уже существует")
+            exists = cur.fetchone() is not None
+            
+            # Лимит количества, минимальные требования и уникальность имени
+            error = self._check_new_hypervisor(hv_data, hv_count, exists)
+            if error:
+                logger.error(error)
                 cur.close()
                 conn.close()
                 return False
             
+            # Свободная емкость хранится в виртуальных единицах с учетом переподписки.
+            # Коэффициенты читаются в той же транзакции под FOR SHARE: параллельный
+            # set_overcommit дождется вставки и сдвинет емкость нового гипервизора
+            cur.execute("""
+                SELECT config_key, config_value FROM cluster_config
+                WHERE config_key IN ('overcommit_cpu', 'overcommit_ram')
+                FOR SHARE
+            """)
+            ratios = dict(cur.fetchall())
+            overcommit_cpu = float(ratios.get('overcommit_cpu', 3.0))
+            overcommit_ram = float(ratios.get('overcommit_ram', 1.0))
             cur.execute("""
                 INSERT INTO hypervisors 
                 (hv_name, cpu, ram, free_cpu, free_ram, num_vms)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (hv_data['hv_name'], hv_data['cpu'], hv_data['ram'],
-                hv_data['cpu'], hv_data['ram'], 0))
+                ResourceCalculator.calculate_capacity(hv_data['cpu'], overcommit_cpu),
+                ResourceCalculator.calculate_capacity(hv_data['ram'], overcommit_ram), 0))
             
             conn.commit()
             cur.close()
@@ -270,11 +2134,14 @@ class Database:
         try:
             conn = self._get_connection()
             cur = conn.cursor(cursor_factory=RealDictCursor)
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
             cur.execute("""
-                SELECT hv_name, cpu, ram, free_cpu, free_ram, num_vms, created_at 
+                SELECT hv_name, cpu, ram, free_cpu, free_ram, num_vms, created_at,
+                       FLOOR(cpu * %s::numeric)::int AS cpu_capacity,
+                       FLOOR(ram * %s::numeric)::int AS ram_capacity
                 FROM hypervisors 
                 ORDER BY hv_name
-            """)
+            """, (str(overcommit_cpu), str(overcommit_ram)))
             hvs = cur.fetchall()
             cur.close()
             conn.close()
@@ -282,6 +2149,54 @@ class Database:
         except Exception as e:
             logger.error(f"Ошибка при получении гипервизоров: {e}")
             return []
+
+    def get_data_version(self) -> Optional[int]:
+        """Счетчик таблицы data_version (ведется триггерами на VERSIONED_TABLES)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT version FROM data_version")
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении версии данных: {e}")
+            return None
+    
+    def export_csv(self, kind: str) -> Optional[bytes]:
+        """Выгрузка через COPY (SELECT ...) TO STDOUT: строки идут потоком CSV с сервера,
+        без построчных объектов psycopg2 (RealDictRow)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            if kind == 'hypervisors':
+                overcommit_cpu, overcommit_ram = self.get_overcommit()
+                query = cur.mogrify("""
+                    SELECT hv_name, cpu, ram, free_cpu, free_ram, num_vms, created_at,
+                           FLOOR(cpu * %s::numeric)::int AS cpu_capacity,
+                           FLOOR(ram * %s::numeric)::int AS ram_capacity
+                    FROM hypervisors
+                    ORDER BY hv_name
+                """, (str(overcommit_cpu), str(overcommit_ram))).decode()
+            else:
+                query = """
+                    SELECT vm_name, vcpu, vram, vhdd, hv_name, creation_date,
+                           CASE WHEN strpos(vm_name, 'app') > 0 THEN 'Сервер приложений'
+                                WHEN strpos(vm_name, 'db') > 0 THEN 'Сервер БД'
+                                WHEN strpos(vm_name, 'ts') > 0 THEN 'Терминальный сервер'
+                                ELSE 'Неизвестный' END AS vm_type
+                    FROM virtual_machines
+                    ORDER BY vm_name
+                """
+            buffer = io.BytesIO()
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')", buffer)
+            cur.close()
+            conn.close()
+            return buffer.getvalue()
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке {kind}: {e}")
+            return None
     
     def delete_hypervisor(self, hv_name: str) -> Tuple[bool, str]:
         """Удаление гипервизора"""
@@ -298,6 +2213,17 @@ class Database:
                 conn.close()
                 return False, f"На гипервизоре {hv_name} запущено {vm_count} ВМ"
             
+            # Места резервов удерживают ресурсы гипервизора
+            cur.execute("SELECT COALESCE(SUM(slots), 0) FROM reservation_slots WHERE hv_name = %s", (hv_name,))
+            slots = cur.fetchone()[0]
+            
+            if slots > 0:
+                cur.close()
+                conn.close()
+                return False, f"На гипервизоре {hv_name} зарезервировано мест: {slots}"
+            
+            cur.execute("DELETE FROM reservation_slots WHERE hv_name = %s", (hv_name,))
+            
             # Удаляем гипервизор
             cur.execute("DELETE FROM hypervisors WHERE hv_name = %s", (hv_name,))
             
@@ -312,10 +2238,19 @@ class Database:
             return False, str(e)
     
     def get_cluster_config(self) -> Dict[str, str]:
-        """Получение конфигурации кластера"""
+        """Получение конфигурации кластера. Кэш действителен, пока не изменилась версия
+        данных: переподписку может сменить другой процесс (API-сервер, воркер, GUI)"""
         try:
             conn = self._get_connection()
             cur = conn.cursor()
+            cur.execute("SELECT version FROM data_version")
+            row = cur.fetchone()
+            version = row[0] if row else None
+            if self._config_cache is not None and version is not None and self._config_cache[0] == version:
+                cur.close()
+                conn.close()
+                return dict(self._config_cache[1])
+            
             cur.execute("SELECT config_key, config_value FROM cluster_config")
             rows = cur.fetchall()
             cur.close()
@@ -324,12 +2259,61 @@ class Database:
             config = {}
             for key, value in rows:
                 config[key] = value
-            return config
+            self._config_cache = (version, config)
+            return dict(config)
             
         except Exception as e:
             logger.error(f"Ошибка при получении конфигурации кластера: {e}")
             return {}
     
+    def set_overcommit(self, overcommit_cpu: float, overcommit_ram: float) -> Tuple[bool, str]:
+        """Изменение коэффициентов переподписки со сдвигом свободной емкости гипервизоров"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            cur.execute("""
+                SELECT config_key, config_value FROM cluster_config 
+                WHERE config_key IN ('overcommit_cpu', 'overcommit_ram')
+                FOR UPDATE
+            """)
+            old = dict(cur.fetchall())
+            old_cpu = old.get('overcommit_cpu', '3.0')
+            old_ram = old.get('overcommit_ram', '1.0')
+            
+            # Емкость меняется на разницу, занятые ресурсы остаются прежними
+            cur.execute("""
+                WITH shifted AS (
+                    UPDATE hypervisors
+                    SET free_cpu = free_cpu + FLOOR(cpu * %s::numeric) - FLOOR(cpu * %s::numeric),
+                        free_ram = free_ram + FLOOR(ram * %s::numeric) - FLOOR(ram * %s::numeric)
+                    RETURNING hv_name, cpu, ram
+                )
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram)
+                SELECT 'hv_resize', hv_name, FLOOR(cpu * %s::numeric) - FLOOR(cpu * %s::numeric),
+                       FLOOR(ram * %s::numeric) - FLOOR(ram * %s::numeric)
+                FROM shifted
+            """, (str(overcommit_cpu), old_cpu, str(overcommit_ram), old_ram) * 2)
+            
+            for key, value in (('overcommit_cpu', overcommit_cpu), ('overcommit_ram', overcommit_ram)):
+                cur.execute("""
+                    INSERT INTO cluster_config (config_key, config_value, updated_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (config_key) 
+                    DO UPDATE SET config_value = EXCLUDED.config_value, updated_at = EXCLUDED.updated_at
+                """, (key, str(value)))
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            self._config_cache = None
+            logger.info(f"Переподписка изменена: CPU {overcommit_cpu}, RAM {overcommit_ram}")
+            return True, ""
+            
+        except Exception as e:
+            logger.error(f"Ошибка при изменении переподписки: {e}")
+            return False, str(e)
+    
     def get_cluster_statistics(self) -> Dict[str, Any]:
         """Получение статистики кластера"""
         try:
@@ -337,51 +2321,230 @@ class Database:
             cur = conn.cursor()
             
             # Общая статистика
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            self.statements.execute(cur, "cluster_totals", (str(overcommit_cpu), str(overcommit_ram)))
+            
+            stats_result = cur.fetchone()
+            
+            # Дисковый пул - счетчик, без суммирования по таблице ВМ
+            self.statements.execute(cur, "storage_usage", (self.STORAGE_POOL,))
+            
+            storage = cur.fetchone()
+            
+            cur.close()
+            conn.close()
+            
+            return self._build_statistics(stats_result, storage, overcommit_cpu, overcommit_ram)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики кластера: {e}")
+            return {}
+    
+    def get_daily_growth(self) -> Dict[str, List[Tuple]]:
+        """Агрегаты создания ВМ и гипервизоров по дням (для прогнозирования)"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            cur.execute("""
+                SELECT creation_date::date AS day, COUNT(*), SUM(vcpu), SUM(vram), SUM(vhdd)
+                FROM virtual_machines
+                WHERE creation_date IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
+            """)
+            vms = cur.fetchall()
+            
             cur.execute("""
-                SELECT 
-                    COUNT(*) as total_hypervisors,
-                    SUM(cpu) as total_cpu,
-                    SUM(ram) as total_ram,
-                    SUM(free_cpu) as free_cpu,
-                    SUM(free_ram) as free_ram,
-                    SUM(num_vms) as total_vms
+                SELECT created_at::date AS day, COUNT(*)
                 FROM hypervisors
+                WHERE created_at IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
             """)
+            hypervisors = cur.fetchall()
             
-            stats_result = cur.fetchone()
+            cur.close()
+            conn.close()
+            return {'vms': vms, 'hypervisors': hypervisors}
+            
+        except Exception as e:
+            logger.error(f"Ошибка при получении динамики роста: {e}")
+            return {'vms': [], 'hypervisors': []}
+    
+    # Методы для истории загрузки
+    def _ensure_history_partition(self, cur, day: date):
+        """Создание дневной секции истории загрузки (если еще не создана)"""
+        if day in self._history_partitions:
+            return
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS utilization_history_{day:%Y%m%d}
+            PARTITION OF utilization_history
+            FOR VALUES FROM (%s) TO (%s)
+        """, (day, day + timedelta(days=1)))
+        self._history_partitions.add(day)
+    
+    def record_utilization_sample(self, ts: Optional[datetime] = None) -> int:
+        """Запись отсчета загрузки всех гипервизоров и кластера одной вставкой"""
+        ts = ts or datetime.now()
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            
+            self._ensure_history_partition(cur, ts.date())
             
-            # Статистика по ВМ
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
             cur.execute("""
-                SELECT 
-                    COUNT(*) as vm_count,
-                    SUM(vcpu) as total_vcpu,
-                    SUM(vram) as total_vram,
-                    SUM(vhdd) as total_vhdd
-                FROM virtual_machines
+                WITH capacity AS (
+                    SELECT hv_name, free_cpu, free_ram, num_vms,
+                           GREATEST(FLOOR(cpu * %(oc_cpu)s::numeric), 1) AS cpu_capacity,
+                           GREATEST(FLOOR(ram * %(oc_ram)s::numeric), 1) AS ram_capacity
+                    FROM hypervisors
+                )
+                INSERT INTO utilization_history (ts, hv_name, cpu_usage, ram_usage, num_vms)
+                SELECT %(ts)s, hv_name,
+                       (cpu_capacity - free_cpu) * 100.0 / cpu_capacity,
+                       (ram_capacity - free_ram) * 100.0 / ram_capacity,
+                       num_vms
+                FROM capacity
+                UNION ALL
+                SELECT %(ts)s, %(cluster)s,
+                       SUM(cpu_capacity - free_cpu) * 100.0 / SUM(cpu_capacity),
+                       SUM(ram_capacity - free_ram) * 100.0 / SUM(ram_capacity),
+                       SUM(num_vms)
+                FROM capacity
+                HAVING COUNT(*) > 0
+            """, {'ts': ts, 'cluster': self.HISTORY_CLUSTER_KEY,
+                  'oc_cpu': str(overcommit_cpu), 'oc_ram': str(overcommit_ram)})
+            rows = cur.rowcount
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            return rows
+            
+        except Exception as e:
+            # Секция могла быть удалена при свертке - создадим заново при следующем отсчете
+            self._history_partitions.discard(ts.date())
+            logger.error(f"Ошибка при записи истории загрузки: {e}")
+            return 0
+    
+    def rollup_utilization_history(self, raw_retention: timedelta = timedelta(days=2),
+                                   minute_retention: timedelta = timedelta(days=30),
+                                   hour_retention: timedelta = timedelta(days=730)) -> bool:
+        """Свертка истории: сырые отсчеты -> минутные агрегаты -> часовые агрегаты.
+        Сырые данные сворачиваются целыми дневными секциями, после чего секция удаляется"""
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor()
+            now = datetime.now()
+            
+            # Дневные секции, полностью вышедшие за срок хранения сырых данных
+            cur.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = 'utilization_history'
+                ORDER BY c.relname
             """)
+            cutoff_day = (now - raw_retention).date()
+            for (partition,) in cur.fetchall():
+                day = datetime.strptime(partition.rsplit('_', 1)[1], "%Y%m%d").date()
+                if day >= cutoff_day:
+                    continue
+                
+                cur.execute(f"""
+                    INSERT INTO utilization_history_1m 
+                        (bucket, hv_name, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples)
+                    SELECT date_trunc('minute', ts), hv_name, 
+                           AVG(cpu_usage), MAX(cpu_usage), AVG(ram_usage), MAX(ram_usage), 
+                           MAX(num_vms), COUNT(*)
+                    FROM {partition}
+                    GROUP BY 1, 2
+                    ON CONFLICT (hv_name, bucket) DO NOTHING
+                """)
+                cur.execute(f"DROP TABLE {partition}")
+                self._history_partitions.discard(day)
+            
+            # Минутные агрегаты старше срока хранения переносятся в часовые
+            cur.execute("""
+                WITH moved AS (
+                    DELETE FROM utilization_history_1m 
+                    WHERE bucket < %s
+                    RETURNING *
+                )
+                INSERT INTO utilization_history_1h AS h
+                    (bucket, hv_name, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples)
+                SELECT date_trunc('hour', bucket), hv_name,
+                       SUM(cpu_avg * samples) / SUM(samples), MAX(cpu_max),
+                       SUM(ram_avg * samples) / SUM(samples), MAX(ram_max),
+                       MAX(num_vms_max), SUM(samples)
+                FROM moved
+                GROUP BY 1, 2
+                ON CONFLICT (hv_name, bucket) DO UPDATE SET
+                    cpu_avg = (h.cpu_avg * h.samples + EXCLUDED.cpu_avg * EXCLUDED.samples) 
+                              / (h.samples + EXCLUDED.samples),
+                    cpu_max = GREATEST(h.cpu_max, EXCLUDED.cpu_max),
+                    ram_avg = (h.ram_avg * h.samples + EXCLUDED.ram_avg * EXCLUDED.samples) 
+                              / (h.samples + EXCLUDED.samples),
+                    ram_max = GREATEST(h.ram_max, EXCLUDED.ram_max),
+                    num_vms_max = GREATEST(h.num_vms_max, EXCLUDED.num_vms_max),
+                    samples = h.samples + EXCLUDED.samples
+            """, (now - minute_retention,))
             
-            vm_stats = cur.fetchone()
+            cur.execute("DELETE FROM utilization_history_1h WHERE bucket < %s", (now - hour_retention,))
             
+            conn.commit()
             cur.close()
             conn.close()
+            logger.info("Свертка истории загрузки выполнена")
+            return True
             
-            stats = {}
-            if stats_result:
-                stats['total_hypervisors'] = stats_result[0] or 0
-                stats['total_cpu'] = stats_result[1] or 0
-                stats['total_ram'] = stats_result[2] or 0
-                stats['free_cpu'] = stats_result[3] or 0
-                stats['free_ram'] = stats_result[4] or 0
-                stats['total_vms'] = stats_result[5] or 0
+        except Exception as e:
+            logger.error(f"Ошибка при свертке истории загрузки: {e}")
+            return False
+    
+    def get_utilization_history(self, hv_name: Optional[str] = None, start: Optional[datetime] = None,
+                                end: Optional[datetime] = None, max_points: int = 500) -> List[Dict[str, Any]]:
+        """Прореженный ряд загрузки за период (не более max_points строк).
+        hv_name=None - загрузка кластера в целом"""
+        end = end or datetime.now()
+        start = start or end - timedelta(days=1)
+        bucket_seconds = max((end - start).total_seconds() / max(max_points, 1), 1.0)
+        try:
+            conn = self._get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            if vm_stats:
-                stats['vm_count'] = vm_stats[0] or 0
-                stats['total_vcpu'] = vm_stats[1] or 0
-                stats['total_vram'] = vm_stats[2] or 0
-                stats['total_vhdd'] = vm_stats[3] or 0
+            cur.execute("""
+                SELECT to_timestamp(FLOOR(EXTRACT(EPOCH FROM t) / %(w)s) * %(w)s) AT TIME ZONE 'UTC' AS ts,
+                       SUM(cpu * n) / SUM(n) AS cpu_usage, MAX(cpu_max) AS cpu_max,
+                       SUM(ram * n) / SUM(n) AS ram_usage, MAX(ram_max) AS ram_max,
+                       MAX(vms) AS num_vms
+                FROM (
+                    SELECT ts AS t, cpu_usage AS cpu, cpu_usage AS cpu_max, 
+                           ram_usage AS ram, ram_usage AS ram_max, num_vms AS vms, 1 AS n
+                    FROM utilization_history
+                    WHERE hv_name = %(hv)s AND ts BETWEEN %(start)s AND %(end)s
+                    UNION ALL
+                    SELECT bucket, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples
+                    FROM utilization_history_1m
+                    WHERE hv_name = %(hv)s AND bucket BETWEEN %(start)s AND %(end)s
+                    UNION ALL
+                    SELECT bucket, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples
+                    FROM utilization_history_1h
+                    WHERE hv_name = %(hv)s AND bucket BETWEEN %(start)s AND %(end)s
+                ) samples
+                GROUP BY 1
+                ORDER BY 1
+            """, {'w': bucket_seconds, 'hv': hv_name or self.HISTORY_CLUSTER_KEY, 
+                  'start': start, 'end': end})
+            rows = cur.fetchall()
             
-            return stats
+            cur.close()
+            conn.close()
+            return rows
             
         except Exception as e:
-            logger.error(f"Ошибка при получении статистики кластера: {e}")
-            return {}
\ No newline at end of file
+            logger.error(f"Ошибка при получении истории загрузки: {e}")
+            return []
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import time
+import socket
+import logging
+import multiprocessing
+from datetime import timedelta
+from typing import List, Dict, Tuple, Any, Optional
+
+from async_operations import DEPLOY_VMS, DEPLOY_BATCH_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DeployWorker:
+    """Исполнитель заданий развертывания: забирает задачи из очереди deploy_tasks и создает ВМ"""
+
+    def __init__(self, db, worker_id: Optional[str] = None, batch_size: int = 10,
+                 retry_backoff: float = 2.0, idle_interval: float = 1.0,
+                 lease: timedelta = timedelta(minutes=5)):
+        self.db = db
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.retry_backoff = retry_backoff
+        self.idle_interval = idle_interval
+        # Аренда захваченных задач и срок резерва их мест
+        self.lease = lease
+
+    def process_batch(self) -> int:
+        """Обработка одного пакета задач, возвращает количество обработанных"""
+        started = time.perf_counter()
+        tasks = self.db.claim_deploy_tasks(self.worker_id, self.batch_size, self.lease)
+        if not tasks:
+            return 0
+        results = []
+        jobs: Dict[int, List[Dict[str, Any]]] = {}
+        for task in tasks:
+            # Задача упавшего исполнителя: ВМ могла быть создана до фиксации результата
+            if task['already_created']:
+                results.append((task['job_id'], task['seq'], 'done', None, 0))
+            elif task['name_taken']:
+                results.append((task['job_id'], task['seq'], 'failed',
+                                f"Имя {task['vm_name']} занято ВМ, созданной не этим заданием", 0))
+            else:
+                jobs.setdefault(task['job_id'], []).append(task)
+        for job_id, job_tasks in jobs.items():
+            results.extend(self._deploy_job_tasks(job_id, job_tasks))
+
+        self.db.finish_deploy_tasks(results, self.worker_id)
+        for result in ('done', 'failed', 'retry'):
+            count = sum(1 for item in results if item[2] == result)
+            if count:
+                DEPLOY_VMS.inc("queue", "created" if result == 'done' else result, amount=count)
+        DEPLOY_BATCH_SECONDS.observe(time.perf_counter() - started, "queue")
+        return len(tasks)
+
+    def _deploy_job_tasks(self, job_id: int, tasks: List[Dict[str, Any]]) -> List[Tuple]:
+        """Создание ВМ задач одного задания в местах резерва.
+        Места под все ВМ пакета резервируются до создания первой: пакет не обрывается на середине
+        из-за нехватки емкости. Резерв живет не дольше аренды задач (при захвате задач упавшего
+        исполнителя его места уже освобождены) и освобождается после пакета"""
+        size = {'vcpu': tasks[0]['vcpu'], 'vram': tasks[0]['vram'], 'vhdd': tasks[0]['vhdd']}
+        try:
+            reservation_id, message = self.db.reserve_capacity(
+                dict(size, vm_name=tasks[0]['vm_name']), len(tasks), self.lease.total_seconds(),
+                f"deploy:{job_id}:{self.worker_id}")
+        except Exception as e:
+            return [self._retry(task, str(e)) for task in tasks]
+        if reservation_id is None:
+            # Отказ по ресурсам или правилам размещения не повторяется
+            return [(task['job_id'], task['seq'], 'failed', message, 0) for task in tasks]
+
+        results = []
+        try:
+            for task in tasks:
+                try:
+                    created, message = self.db.try_create_reserved_vm(reservation_id,
+                                                                      dict(size, vm_name=task['vm_name']))
+                except Exception as e:
+                    created, message = False, f"{self.db.DB_ERROR_MESSAGE}: {e}"
+                if created:
+                    results.append((task['job_id'], task['seq'], 'done', None, 0))
+                elif message == self.db.RESERVATION_MISSING_MESSAGE or message.startswith(self.db.DB_ERROR_MESSAGE):
+                    # Временная ошибка или истекший резерв: повтор (новый резерв в следующем пакете)
+                    results.append(self._retry(task, message))
+                else:
+                    results.append((task['job_id'], task['seq'], 'failed', message, 0))
+        finally:
+            self.db.release_reservation(reservation_id)
+        return results
+
+    def _retry(self, task: Dict[str, Any], error: str) -> Tuple:
+        """Повтор задачи с экспоненциальной задержкой, после max_attempts - отказ"""
+        if task['attempts'] < task['max_attempts']:
+            delay = self.retry_backoff * 2 ** (task['attempts'] - 1)
+            return task['job_id'], task['seq'], 'retry', error, delay
+        return task['job_id'], task['seq'], 'failed', error, 0
+
+    def run(self, stop_event=None):
+        """Цикл обработки очереди до установки stop_event"""
+        logger.info(f"Исполнитель {self.worker_id} запущен")
+        while stop_event is None or not stop_event.is_set():
+            if self.process_batch() == 0:
+                # Очередь пуста - ждем новых заданий
+                if stop_event is None:
+                    break
+                stop_event.wait(self.idle_interval)
+        logger.info(f"Исполнитель {self.worker_id} остановлен")
+
+
+def _worker_process(connection_params: Dict[str, Any], batch_size: int, stop_event,
+                    metrics_port: Optional[int] = None):
+    """Точка входа процесса-исполнителя (собственные соединения с БД)"""
+    from database import Database
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if 'slow_log_path' in connection_params:
+        # Свой файл журнала у каждого процесса: ротация не пересекается, сводка читает все файлы
+        connection_params = dict(connection_params,
+                                 slow_log_path=f"{connection_params['slow_log_path']}.{os.getpid()}")
+    if metrics_port:
+        from metrics import start_http_server
+        try:
+            start_http_server(metrics_port)
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик на порту {metrics_port}: {e}")
+    db = Database(**connection_params)
+    try:
+        DeployWorker(db, batch_size=batch_size).run(stop_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+def run_worker_pool(processes: int = 4, batch_size: int = 10, metrics_port: Optional[int] = None,
+                    **connection_params):
+    """Запуск пула процессов-исполнителей до остановки (Ctrl+C).
+    metrics_port - первый порт метрик, исполнитель i публикует метрики на metrics_port + i"""
+    stop_event = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_worker_process,
+                                       args=(connection_params, batch_size, stop_event,
+                                             metrics_port + i if metrics_port else None))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Запущено исполнителей развертывания: {processes}")
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+        logger.info("Исполнители развертывания остановлены")
@@ -1,31 +1,45 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, simpledialog
 import pandas as pd
 from datetime import datetime
 import asyncio
 import threading
+import time
 import logging
 
 from database import Database
 from models import VirtualMachine, Hypervisor, Cluster
-from utils import Validator, NameGenerator, ResourceCalculator, Formatter
+from utils import Validator, NameGenerator, ResourceCalculator, Formatter, PlacementIndex
 from async_operations import AsyncOperations
+from reservations import ReservationSweeper
 from analysis import DataAnalyzer
+from rebalancer import ClusterRebalancer
+from simulation import CapacitySimulator
+from dashboard import LiveDashboard, GUI_REFRESH_SECONDS
+from metrics import REGISTRY
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class DataCenterGUI:
-    def __init__(self, root):
+    def __init__(self, root, db=None):
         self.root = root
         self.root.title("Учет инфраструктуры кластера Москва")
         self.root.geometry("1200x700")
         
         # Инициализация компонентов
-        self.db = Database()
+        # По умолчанию PostgreSQL, можно передать любое хранилище из storage.py
+        self.db = db if db is not None else Database()
         self.analyzer = DataAnalyzer(self.db)
         self.async_ops = AsyncOperations(self.db)
+        self.active_deployment = None
+        # Резервы прерванных развертываний освобождаются по истечении TTL
+        self.reservation_sweeper = ReservationSweeper(self.db)
+        self.reservation_sweeper.start()
+        self.rebalancer = ClusterRebalancer(self.db)
         self.cluster = Cluster()
         
         # Создание вкладок
@@ -36,12 +50,14 @@ class DataCenterGUI:
         self.create_vm_tab()
         self.create_hypervisor_tab()
         self.create_analysis_tab()
+        self.create_monitoring_tab()
         
         # Обновление данных при запуске
         self.refresh_vm_data()
         self.refresh_hv_data()
         self.update_cluster_info()
     
+    @GUI_REFRESH_SECONDS.timed("cluster_info")
     def update_cluster_info(self):
         """Обновление информации о кластере в заголовке"""
         try:
@@ -105,6 +121,8 @@ class DataCenterGUI:
                   command=self.show_vm_limits).grid(row=1, column=6, padx=5, pady=2)
         ttk.Button(control_frame, text="Сгенерировать имя",
               command=self.generate_vm_name).grid(row=1, column=7, padx=5, pady=2)   
+        ttk.Button(control_frame, text="Задания",
+                  command=self.show_deploy_jobs).grid(row=1, column=8, padx=5, pady=2)
         
         # Информационная панель
         info_frame = ttk.Frame(vm_frame)
@@ -194,6 +212,10 @@ class DataCenterGUI:
                   command=self.check_resources).grid(row=1, column=5, padx=5, pady=2)
         ttk.Button(control_frame, text="Сгенерировать имя", 
                   command=self.generate_hv_name).grid(row=1, column=6, padx=5, pady=2)
+        ttk.Button(control_frame, text="Вывести из эксплуатации", 
+                  command=self.decommission_hypervisors).grid(row=1, column=7, padx=5, pady=2)
+        ttk.Button(control_frame, text="Правила размещения", 
+                  command=self.open_placement_rules_dialog).grid(row=1, column=8, padx=5, pady=2)
         
         # Информационная панель о кластере
         info_frame = ttk.Frame(hv_frame)
@@ -206,7 +228,7 @@ class DataCenterGUI:
         tree_frame = ttk.Frame(hv_frame)
         tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        columns = ("Имя", "CPU", "RAM", "Свободно CPU", "Свободно RAM", 
+        columns = ("Имя", "CPU", "RAM", "Свободно vCPU", "Свободно RAM", 
                   "ВМ", "Исп. CPU%", "Исп. RAM%", "Статус CPU", "Статус RAM")
         self.hv_tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=20)
         
@@ -240,22 +262,20 @@ class DataCenterGUI:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось сгенерировать имя: {str(e)}")
     
+    @GUI_REFRESH_SECONDS.timed("cluster_status")
     def update_cluster_status(self):
         """Обновление статуса кластера"""
         try:
             stats = self.db.get_cluster_statistics()
             
             if stats.get('total_cpu', 0) > 0:
-                cpu_usage = ResourceCalculator.calculate_cpu_usage(
-                    stats['total_cpu'], stats.get('free_cpu', 0)
-                )
-                ram_usage = ResourceCalculator.calculate_ram_usage(
-                    stats['total_ram'], stats.get('free_ram', 0)
-                )
+                cpu_usage = stats['cpu_usage_percent']
+                ram_usage = stats['ram_usage_percent']
                 
                 info_text = f"Кластер: {stats.get('total_hypervisors', 0)} гипервизоров, "
                 info_text += f"{stats.get('total_vms', 0)} ВМ | "
-                info_text += f"Использование CPU: {cpu_usage:.1f}%, RAM: {ram_usage:.1f}%"
+                info_text += f"Использование CPU: {cpu_usage:.1f}%, RAM: {ram_usage:.1f}%, "
+                info_text += f"Диск: {stats.get('disk_usage_percent', 0):.1f}%"
                 
                 self.cluster_info_label.config(text=info_text)
             
@@ -273,8 +293,8 @@ class DataCenterGUI:
             hvs = self.db.get_all_hypervisors()
             for hv in hvs:
                 if hv['hv_name'] == hv_name:
-                    cpu_usage = ResourceCalculator.calculate_cpu_usage(hv['cpu'], hv['free_cpu'])
-                    ram_usage = ResourceCalculator.calculate_ram_usage(hv['ram'], hv['free_ram'])
+                    cpu_usage = ResourceCalculator.calculate_cpu_usage(hv['cpu_capacity'], hv['free_cpu'])
+                    ram_usage = ResourceCalculator.calculate_ram_usage(hv['ram_capacity'], hv['free_ram'])
                     
                     info_text = f"Выбран гипервизор: {hv_name} | "
                     info_text += f"Использование CPU: {cpu_usage:.1f}%, RAM: {ram_usage:.1f}% | "
@@ -292,31 +312,31 @@ class DataCenterGUI:
                 messagebox.showinfo("Ресурсы", "В кластере нет гипервизоров")
                 return
             
-            cpu_usage = ResourceCalculator.calculate_cpu_usage(
-                stats['total_cpu'], stats.get('free_cpu', 0)
-            )
-            ram_usage = ResourceCalculator.calculate_ram_usage(
-                stats['total_ram'], stats.get('free_ram', 0)
-            )
+            cpu_usage = stats['cpu_usage_percent']
+            ram_usage = stats['ram_usage_percent']
             
-            # Проверяем минимальные свободные ресурсы
+            # Проверяем минимальные свободные ресурсы (от емкости с учетом переподписки)
             is_ok, message = ResourceCalculator.check_minimum_resources(
-                stats['total_cpu'], stats.get('free_cpu', 0),
-                stats['total_ram'], stats.get('free_ram', 0)
+                stats['vcpu_capacity'], stats.get('free_cpu', 0),
+                stats['vram_capacity'], stats.get('free_ram', 0)
             )
+            overcommit_cpu, overcommit_ram = self.db.get_overcommit()
             
             resources_text = "=== РЕСУРСЫ КЛАСТЕРА ===\n\n"
             resources_text += f"Гипервизоров: {stats.get('total_hypervisors', 0)}\n"
             resources_text += f"Виртуальных машин: {stats.get('total_vms', 0)}\n\n"
             resources_text += f"Общие ресурсы:\n"
-            resources_text += f"• CPU: {stats['total_cpu']} ядер\n"
-            resources_text += f"• RAM: {stats['total_ram']} ГБ\n\n"
+            resources_text += f"• CPU: {stats['total_cpu']} ядер ({stats['vcpu_capacity']} vCPU, 1:{overcommit_cpu:g})\n"
+            resources_text += f"• RAM: {stats['total_ram']} ГБ ({stats['vram_capacity']} ГБ vRAM, 1:{overcommit_ram:g})\n"
+            resources_text += f"• Дисковый пул: {stats.get('disk_pool', 0)} ГБ\n\n"
             resources_text += f"Свободные ресурсы:\n"
-            resources_text += f"• CPU: {stats.get('free_cpu', 0)} ядер\n"
-            resources_text += f"• RAM: {stats.get('free_ram', 0)} ГБ\n\n"
+            resources_text += f"• CPU: {stats.get('free_cpu', 0)} vCPU\n"
+            resources_text += f"• RAM: {stats.get('free_ram', 0)} ГБ\n"
+            resources_text += f"• Диск: {stats.get('free_disk', 0)} ГБ\n\n"
             resources_text += f"Использование:\n"
             resources_text += f"• CPU: {cpu_usage:.1f}%\n"
-            resources_text += f"• RAM: {ram_usage:.1f}%\n\n"
+            resources_text += f"• RAM: {ram_usage:.1f}%\n"
+            resources_text += f"• Диск: {stats.get('disk_usage_percent', 0):.1f}%\n\n"
             resources_text += f"Статус: {message}"
             
             messagebox.showinfo("Ресурсы кластера", resources_text)
@@ -343,11 +363,28 @@ class DataCenterGUI:
                   command=self.refresh_analysis).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="Отчет по кластеру", 
                   command=self.cluster_report).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Перебалансировка", 
+                  command=self.rebalance_cluster).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Что если...", 
+                  command=self.open_simulation_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Тренд загрузки", 
+                  command=self.show_utilization_trend).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Производительность", 
+                  command=self.show_performance).pack(side=tk.LEFT, padx=5)
         
         # Область для вывода информации
         self.analysis_text = scrolledtext.ScrolledText(analysis_frame, width=100, height=30)
         self.analysis_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
     
+    def create_monitoring_tab(self):
+        """Создание вкладки с живой панелью мониторинга"""
+        monitoring_frame = ttk.Frame(self.notebook)
+        self.notebook.add(monitoring_frame, text="Мониторинг")
+        
+        self.dashboard = LiveDashboard(monitoring_frame, self.root, self.db, interval_ms=1000)
+        self.dashboard.widget.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.dashboard.start()
+    
     def refresh_analysis(self):
         """Обновление данных в анализе"""
         self.show_statistics()
@@ -451,46 +488,134 @@ class DataCenterGUI:
                 'vhdd': vhdd
             }
             
-            # Запуск в отдельном потоке
-            def run_async():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    results = loop.run_until_complete(
-                        self.async_ops.mass_deploy_vms(vm_data, count)
-                    )
-                    
-                    success_count = sum(1 for r in results if r is True)
-                    
-                    self.root.after(0, lambda: messagebox.showinfo(
-                        "Завершено", 
-                        f"Создано {success_count} из {count} ВМ"
-                    ))
-                    
-                    self.root.after(0, self.refresh_vm_data)
-                    self.root.after(0, self.refresh_hv_data)
-                    self.root.after(0, self.update_cluster_info)
-                    self.root.after(0, self.update_cluster_status)
-                    
-                except Exception as e:
-                    self.root.after(0, lambda: messagebox.showerror(
-                        "Ошибка", f"Произошла ошибка: {str(e)}"
-                    ))
-                finally:
-                    loop.close()
+            # Задание в очереди выполняется процессами-исполнителями и переживает закрытие окна
+            if self.db.SUPPORTS_DEPLOY_QUEUE:
+                job_id = self.db.submit_deploy_job(vm_data, count)
+                if job_id is None:
+                    messagebox.showerror("Ошибка", "Не удалось поставить задание в очередь")
+                    return
+                messagebox.showinfo("Запущено", 
+                                   f"Задание {job_id} на создание {count} ВМ поставлено в очередь.\n"
+                                   f"Исполнители: python main.py worker")
+                return
             
-            thread = threading.Thread(target=run_async)
-            thread.daemon = True
-            thread.start()
+            # Развертывание пакетами в процессе приложения с контрольными точками
+            state = self.async_ops.start_deployment(vm_data, count)
+            if state is None:
+                messagebox.showerror("Ошибка", "Не удалось сохранить контрольную точку развертывания")
+                return
+            self.run_deployment_thread(state['run_id'])
             
-            messagebox.showinfo("Запущено", f"Начато массовое создание {count} ВМ")
+            messagebox.showinfo("Запущено", f"Начато массовое создание {count} ВМ "
+                                           f"(развертывание {state['run_id']})")
             
         except ValueError as e:
             messagebox.showerror("Ошибка", "Проверьте правильность введенных значений")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Произошла ошибка: {str(e)}")
     
+    def run_deployment_thread(self, run_id: str, resume: bool = False):
+        """Выполнение или продолжение развертывания в отдельном потоке"""
+        def on_progress(state):
+            self.root.after(0, lambda: self.vm_info_label.config(
+                text=f"Развертывание {run_id}: создано {state['created']} из {state['count']}"))
+        
+        def run_async():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            
+            try:
+                operation = self.async_ops.resume_deployment if resume else self.async_ops.run_deployment
+                state = loop.run_until_complete(operation(run_id, on_progress))
+                if state is None:
+                    raise RuntimeError(f"развертывание {run_id} не найдено")
+                
+                result_text = f"Создано {state['created']} из {state['count']} ВМ"
+                if state['failed']:
+                    result_text += f", отказов {len(state['failed'])}"
+                if state['status'] == 'cancelled':
+                    result_text += "\nРазвертывание отменено, его можно продолжить"
+                elif state['status'] == 'stopped':
+                    result_text += f"\nРазвертывание остановлено: {state['message']}"
+                
+                self.root.after(0, lambda: messagebox.showinfo("Завершено", result_text))
+                
+                self.root.after(0, self.refresh_vm_data)
+                self.root.after(0, self.refresh_hv_data)
+                self.root.after(0, self.update_cluster_info)
+                self.root.after(0, self.update_cluster_status)
+                
+            except Exception as e:
+                # e удаляется по выходу из except, в обработчик Tk передается текст
+                msg = str(e)
+                self.root.after(0, lambda m=msg: messagebox.showerror(
+                    "Ошибка", f"Произошла ошибка: {m}"
+                ))
+            finally:
+                loop.close()
+        
+        self.active_deployment = run_id
+        thread = threading.Thread(target=run_async)
+        thread.daemon = True
+        thread.start()
+    
+    def show_deploy_jobs(self):
+        """Прогресс заданий массового развертывания"""
+        if not self.db.SUPPORTS_DEPLOY_QUEUE:
+            self.show_deployments()
+            return
+        try:
+            jobs = self.db.get_deploy_jobs(limit=20)
+            if not jobs:
+                messagebox.showinfo("Задания", "Заданий развертывания нет")
+                return
+            
+            jobs_text = "=== ЗАДАНИЯ РАЗВЕРТЫВАНИЯ ===\n\n"
+            for job in jobs:
+                jobs_text += f"№{job['job_id']} {job['base_name']} ({job['vcpu']} vCPU/{job['vram']} ГБ): "
+                jobs_text += f"{job['status']}, создано {job['created']} из {job['total']}"
+                if job['failed']:
+                    jobs_text += f", ошибок {job['failed']}"
+                jobs_text += "\n"
+            
+            messagebox.showinfo("Задания", jobs_text)
+            self.refresh_vm_data()
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось получить задания: {str(e)}")
+    
+    def show_deployments(self):
+        """Развертывания в процессе приложения: отмена текущего или продолжение прерванного"""
+        try:
+            deployments = self.async_ops.get_deployments()[:20]
+            if not deployments:
+                messagebox.showinfo("Развертывания", "Развертываний нет")
+                return
+            
+            text = "=== РАЗВЕРТЫВАНИЯ ===\n\n"
+            for state in deployments:
+                text += f"{state['run_id']} {state['vm']['vm_name']} ({state['vm']['vcpu']} vCPU/"
+                text += f"{state['vm']['vram']} ГБ): {state['status']}, создано {state['created']} из {state['count']}"
+                if state['failed']:
+                    text += f", отказов {len(state['failed'])}"
+                text += "\n"
+            
+            active = self.active_deployment
+            if active and self.async_ops.is_deployment_active(active):
+                if messagebox.askyesno("Развертывания", text + f"\nОтменить развертывание {active}?"):
+                    self.async_ops.cancel_deployment(active)
+                return
+            
+            resumable = next((state for state in deployments if state['status'] != 'done'), None)
+            if resumable is None:
+                messagebox.showinfo("Развертывания", text)
+                return
+            if messagebox.askyesno("Развертывания", text + f"\nПродолжить развертывание {resumable['run_id']}?"):
+                self.run_deployment_thread(resumable['run_id'], resume=True)
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось получить развертывания: {str(e)}")
+    
     def delete_vm(self):
         """Удаление виртуальной машины"""
         selection = self.vm_tree.selection()
@@ -498,6 +623,10 @@ class DataCenterGUI:
             messagebox.showwarning("Предупреждение", "Выберите ВМ для удаления")
             return
         
+        if len(selection) > 1:
+            self.delete_selected_vms(selection)
+            return
+        
         item = self.vm_tree.item(selection[0])
         vm_name = item['values'][0]
         vm_type = Formatter.format_vm_type(vm_name)
@@ -517,6 +646,26 @@ class DataCenterGUI:
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось удалить ВМ: {str(e)}")
     
+    def delete_selected_vms(self, selection):
+        """Массовое удаление выбранных ВМ"""
+        vm_names = [self.vm_tree.item(item)['values'][0] for item in selection]
+        
+        if messagebox.askyesno("Подтверждение", f"Удалить выбранные ВМ ({len(vm_names)} шт.)?"):
+            try:
+                deleted_count = self.db.delete_vms_bulk(vm_names)
+                if deleted_count:
+                    messagebox.showinfo("Успех", f"Удалено {deleted_count} из {len(vm_names)} ВМ")
+                    self.refresh_vm_data()
+                    self.refresh_hv_data()
+                    self.update_cluster_info()
+                    self.update_cluster_status()
+                else:
+                    messagebox.showerror("Ошибка", "Не удалось удалить выбранные ВМ")
+                    
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось удалить ВМ: {str(e)}")
+    
+    @GUI_REFRESH_SECONDS.timed("vm_table")
     def refresh_vm_data(self):
         """Обновление данных о ВМ"""
         for item in self.vm_tree.get_children():
@@ -659,6 +808,43 @@ class DataCenterGUI:
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось удалить гипервизор: {str(e)}")
     
+    def decommission_hypervisors(self):
+        """Перенос ВМ с выбранных гипервизоров на остальные и удаление гипервизоров"""
+        selection = self.hv_tree.selection()
+        if not selection:
+            messagebox.showwarning("Предупреждение", "Выберите гипервизоры для вывода из эксплуатации")
+            return
+        
+        hv_names = [self.hv_tree.item(item)['values'][0] for item in selection]
+        
+        if not messagebox.askyesno("Подтверждение", 
+                                   f"Перенести ВМ и удалить гипервизоры: {', '.join(hv_names)}?"):
+            return
+        
+        try:
+            errors = []
+            for hv_name in hv_names:
+                # Выводимые гипервизоры не могут быть целевыми для переноса
+                success, message = self.db.drain_hypervisor(hv_name, exclude=hv_names)
+                if success:
+                    success, message = self.db.delete_hypervisor(hv_name)
+                if not success:
+                    errors.append(f"{hv_name}: {message}")
+            
+            self.refresh_hv_data()
+            self.refresh_vm_data()
+            self.update_cluster_info()
+            self.update_cluster_status()
+            
+            if errors:
+                messagebox.showerror("Ошибка", "\n".join(errors))
+            else:
+                messagebox.showinfo("Успех", f"Выведено из эксплуатации гипервизоров: {len(hv_names)}")
+                
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось вывести гипервизоры: {str(e)}")
+    
+    @GUI_REFRESH_SECONDS.timed("hv_table")
     def refresh_hv_data(self):
         """Обновление данных о гипервизорах"""
         for item in self.hv_tree.get_children():
@@ -666,8 +852,8 @@ class DataCenterGUI:
         
         hvs = self.db.get_all_hypervisors()
         for hv in hvs:
-            cpu_usage = ResourceCalculator.calculate_cpu_usage(hv['cpu'], hv['free_cpu'])
-            ram_usage = ResourceCalculator.calculate_ram_usage(hv['ram'], hv['free_ram'])
+            cpu_usage = ResourceCalculator.calculate_cpu_usage(hv['cpu_capacity'], hv['free_cpu'])
+            ram_usage = ResourceCalculator.calculate_ram_usage(hv['ram_capacity'], hv['free_ram'])
             
             # Определяем статус
             cpu_status = 'Высокая' if cpu_usage > 80 else 'Средняя' if cpu_usage > 50 else 'Низкая'
@@ -688,12 +874,39 @@ class DataCenterGUI:
     
     # Методы для анализа
     def generate_plots(self):
-        """Генерация графиков"""
-        try:
-            self.analyzer.generate_visualizations("cluster_analysis.png")
-            messagebox.showinfo("Успех", "Графики сгенерированы и сохранены в cluster_analysis.png")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сгенерировать графики: {str(e)}")
+        """Генерация графиков (рендеринг в фоновом потоке, без блокировки интерфейса).
+        Файл сохраняется в фоне, интерактивное окно открывается в потоке Tk"""
+        def render():
+            try:
+                with GUI_REFRESH_SECONDS.time("charts"):
+                    path = self.analyzer.generate_visualizations("cluster_analysis.png", show=False)
+                    figure = Figure(figsize=(16, 12))
+                    drawn = path is not None and self.analyzer.draw_visualizations(figure)
+                if path:
+                    self.root.after(0, lambda: self.show_plots(figure if drawn else None, path))
+                else:
+                    self.root.after(0, lambda: messagebox.showwarning(
+                        "Предупреждение", "Нет данных для визуализации"))
+            except Exception as e:
+                message = str(e)
+                self.root.after(0, lambda m=message: messagebox.showerror(
+                    "Ошибка", f"Не удалось сгенерировать графики: {m}"))
+        
+        thread = threading.Thread(target=render)
+        thread.daemon = True
+        thread.start()
+    
+    def show_plots(self, figure, path: str):
+        """Окно с графиками (масштабирование и сдвиг - панель matplotlib), вызывается в потоке Tk"""
+        if figure is not None:
+            window = tk.Toplevel(self.root)
+            window.title("Анализ использования ресурсов кластера")
+            
+            canvas = FigureCanvasTkAgg(figure, master=window)
+            NavigationToolbar2Tk(canvas, window).update()
+            canvas.draw()
+            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        messagebox.showinfo("Успех", f"Графики сгенерированы и сохранены в {path}")
     
     def export_to_excel(self):
         """Экспорт данных в Excel"""
@@ -747,6 +960,25 @@ class DataCenterGUI:
                     else:
                         report_text += f"  {key.replace('_', ' ').title()}: {value}\n"
             
+            # Прогноз исчерпания ресурсов
+            forecast = report.get('forecast', {})
+            if forecast:
+                report_text += "\nПРОГНОЗ ИСЧЕРПАНИЯ РЕСУРСОВ:\n"
+                for key, result in forecast.items():
+                    if result['date'] is None:
+                        report_text += f"  {key.upper()}: рост не наблюдается\n"
+                    else:
+                        report_text += f"  {key.upper()}: {result['date']} "
+                        report_text += f"({result['date_min']} - {result['date_max']}, "
+                        report_text += f"модель: {result['model']})\n"
+            
+            # Нарушения правил размещения
+            violations = report.get('placement_violations', [])
+            if violations:
+                report_text += "\nНАРУШЕНИЯ ПРАВИЛ РАЗМЕЩЕНИЯ:\n"
+                for violation in violations:
+                    report_text += f"  - {violation}\n"
+            
             # Рекомендации
             recommendations = report.get('recommendations', [])
             if recommendations:
@@ -760,6 +992,197 @@ class DataCenterGUI:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось сгенерировать отчет: {str(e)}")
     
+    def rebalance_cluster(self):
+        """Построение плана перебалансировки и его применение после подтверждения"""
+        try:
+            objective = 'largest_vm'
+            if not messagebox.askyesno("Перебалансировка", 
+                                       "Освободить место под ВМ 24 vCPU / 128 ГБ?\n"
+                                       "(Нет - выровнять загрузку CPU/RAM)"):
+                objective = 'balance'
+            
+            plan = self.rebalancer.plan(objective=objective)
+            report_text = ClusterRebalancer.format_report(plan)
+            
+            self.analysis_text.delete(1.0, tk.END)
+            self.analysis_text.insert(1.0, report_text)
+            
+            if not plan or not plan['moves']:
+                return
+            
+            if messagebox.askyesno("Подтверждение", f"Выполнить {len(plan['moves'])} переносов ВМ?"):
+                success, message = self.rebalancer.apply(plan)
+                if success:
+                    messagebox.showinfo("Успех", "План перебалансировки применен")
+                    self.refresh_vm_data()
+                    self.refresh_hv_data()
+                    self.update_cluster_status()
+                else:
+                    messagebox.showerror("Ошибка", f"Не удалось применить план: {message}")
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось выполнить перебалансировку: {str(e)}")
+    
+    def open_placement_rules_dialog(self):
+        """Окно правил размещения ВМ (распределение групп, ограничение на гипервизор, привязка)"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Правила размещения")
+        
+        rules_list = tk.Listbox(dialog, width=70, height=8)
+        rules_list.grid(row=0, column=0, columnspan=4, padx=5, pady=5)
+        
+        def refresh():
+            rules_list.delete(0, tk.END)
+            for rule in self.db.get_placement_rules():
+                text = f"{rule['rule_id']}: {rule['kind']} {rule['vm_prefix']}"
+                if rule['kind'] == 'max_per_host':
+                    text += f" (не более {rule['max_per_host']} на гипервизор)"
+                elif rule['kind'] == 'pin':
+                    text += f" ({', '.join(rule['hosts'])})"
+                rules_list.insert(tk.END, text)
+        
+        ttk.Label(dialog, text="Тип:").grid(row=1, column=0, padx=5, pady=2, sticky=tk.W)
+        kind_combo = ttk.Combobox(dialog, values=PlacementIndex.RULE_KINDS, state="readonly", width=15)
+        kind_combo.grid(row=1, column=1, padx=5, pady=2)
+        kind_combo.set('spread')
+        
+        fields = [("Группа ВМ (начало имени):", "vm77db"), ("ВМ на гипервизор (max_per_host):", "1"),
+                  ("Гипервизоры через запятую (pin):", "")]
+        entries = []
+        for row, (label, default) in enumerate(fields, 2):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, padx=5, pady=2, sticky=tk.W)
+            entry = ttk.Entry(dialog, width=30)
+            entry.grid(row=row, column=1, columnspan=3, padx=5, pady=2, sticky=tk.W)
+            entry.insert(0, default)
+            entries.append(entry)
+        
+        def add():
+            try:
+                prefix, max_text, hosts_text = [entry.get().strip() for entry in entries]
+                rule = {'kind': kind_combo.get(), 'vm_prefix': prefix,
+                        'max_per_host': int(max_text) if max_text else None,
+                        'hosts': [name.strip() for name in hosts_text.split(',') if name.strip()]}
+                added, message = self.db.add_placement_rule(rule)
+                if not added:
+                    messagebox.showerror("Ошибка", message, parent=dialog)
+                refresh()
+            except ValueError:
+                messagebox.showerror("Ошибка", "Проверьте правильность введенных числовых значений", parent=dialog)
+        
+        def delete():
+            selection = rules_list.curselection()
+            if not selection:
+                return
+            rule_id = int(rules_list.get(selection[0]).split(':')[0])
+            self.db.delete_placement_rule(rule_id)
+            refresh()
+        
+        def show_violations():
+            violations = self.db.get_placement_violations()
+            messagebox.showinfo("Нарушения правил", "\n".join(violations) or "Нарушений нет", parent=dialog)
+        
+        ttk.Button(dialog, text="Добавить", command=add).grid(row=5, column=0, pady=5)
+        ttk.Button(dialog, text="Удалить", command=delete).grid(row=5, column=1, pady=5)
+        ttk.Button(dialog, text="Нарушения", command=show_violations).grid(row=5, column=2, pady=5)
+        refresh()
+    
+    def open_simulation_dialog(self):
+        """Окно симуляции емкости кластера (живая БД не изменяется)"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Симуляция емкости")
+        
+        fields = [("vCPU ВМ:", "4"), ("vRAM ВМ (ГБ):", "8"), ("Добавить гипервизоров:", "0"),
+                  ("CPU гипервизора:", "64"), ("RAM гипервизора (ГБ):", "512")]
+        entries = []
+        for row, (label, default) in enumerate(fields):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, padx=5, pady=2, sticky=tk.W)
+            entry = ttk.Entry(dialog, width=10)
+            entry.grid(row=row, column=1, padx=5, pady=2)
+            entry.insert(0, default)
+            entries.append(entry)
+        
+        def run():
+            try:
+                vcpu, vram, add_hv, hv_cpu, hv_ram = [int(entry.get().strip()) for entry in entries]
+                simulator = CapacitySimulator.from_database(self.db)
+                result = simulator.what_if(vcpu, vram, add_hv, hv_cpu, hv_ram)
+                
+                self.analysis_text.delete(1.0, tk.END)
+                self.analysis_text.insert(1.0, CapacitySimulator.format_report(result))
+                dialog.destroy()
+                
+            except ValueError:
+                messagebox.showerror("Ошибка", "Проверьте правильность введенных числовых значений", parent=dialog)
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось выполнить симуляцию: {str(e)}", parent=dialog)
+        
+        ttk.Button(dialog, text="Рассчитать", command=run).grid(row=len(fields), column=0, 
+                                                                columnspan=2, pady=5)
+    
+    def show_utilization_trend(self):
+        """Окно с трендом загрузки кластера за выбранный период"""
+        period = simpledialog.askinteger("Тренд загрузки", "Период (дней):", 
+                                         initialvalue=7, minvalue=1, maxvalue=3650)
+        if not period:
+            return
+        
+        try:
+            trend = self.analyzer.get_utilization_trend(days=period)
+            if trend.empty:
+                messagebox.showinfo("Тренд загрузки", 
+                                    "Нет истории загрузки. Запустите запись: python main.py sample")
+                return
+            
+            window = tk.Toplevel(self.root)
+            window.title(f"Тренд загрузки за {period} дн.")
+            
+            figure = Figure(figsize=(10, 5))
+            self.analyzer.draw_utilization_trend(figure, trend, f"Загрузка кластера за {period} дн.")
+            canvas = FigureCanvasTkAgg(figure, master=window)
+            canvas.draw()
+            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось построить тренд: {str(e)}")
+    
+    def show_performance(self):
+        """Сводка задержек горячих путей процесса (запросы, размещение, отрисовка)"""
+        groups = [
+            ("БАЗА ДАННЫХ", "datacenter_db_"),
+            ("РАЗМЕЩЕНИЕ ВМ", "datacenter_placement_"),
+            ("РАЗВЕРТЫВАНИЕ", "datacenter_deploy_"),
+            ("ИНТЕРФЕЙС", "datacenter_gui_"),
+            ("КЭШ ОТЧЕТОВ", "datacenter_report_"),
+        ]
+        snapshot = REGISTRY.snapshot()
+        uptime = max(time.time() - REGISTRY.started_at, 1e-9)
+        
+        text = "=== ПРОИЗВОДИТЕЛЬНОСТЬ ===\n"
+        text += f"Время работы процесса: {uptime:.0f} с (полные гистограммы: /metrics)\n\n"
+        for title, prefix in groups:
+            rows = [row for row in snapshot if row['name'].startswith(prefix)]
+            if not rows:
+                continue
+            text += f"{title}:\n"
+            for row in rows:
+                labels = ", ".join(str(value) for value in row['labels'].values())
+                name = row['name'][len(prefix):] + (f" [{labels}]" if labels else "")
+                if row['type'] == 'counter':
+                    text += f"  {name}: {row['value']:.0f} ({row['value'] / uptime:.1f}/с)\n"
+                elif name.startswith("rows"):
+                    text += (f"  {name}: {row['count']} запросов, в среднем {row['avg']:.1f} строк, "
+                             f"p95 {row['p95']:.0f}, макс. {row['max']:.0f}\n")
+                else:
+                    text += (f"  {name}: {row['count']} раз, ср. {row['avg'] * 1000:.2f} мс, "
+                             f"p50 {row['p50'] * 1000:.2f} мс, p95 {row['p95'] * 1000:.2f} мс, "
+                             f"макс. {row['max'] * 1000:.2f} мс\n")
+            text += "\n"
+        if not snapshot:
+            text += "Измерений пока нет\n"
+        
+        self.analysis_text.delete(1.0, tk.END)
+        self.analysis_text.insert(1.0, text)
+    
     def show_statistics(self):
         """Показать статистику"""
         try:
@@ -774,15 +1197,19 @@ class DataCenterGUI:
                 
                 total_cpu = hv_df['cpu'].sum()
                 total_ram = hv_df['ram'].sum()
+                vcpu_capacity = hv_df['cpu_capacity'].sum()
+                vram_capacity = hv_df['ram_capacity'].sum()
                 free_cpu = hv_df['free_cpu'].sum()
                 free_ram = hv_df['free_ram'].sum()
                 total_vms = hv_df['num_vms'].sum()
                 
-                cpu_usage = ResourceCalculator.calculate_cpu_usage(total_cpu, free_cpu)
-                ram_usage = ResourceCalculator.calculate_ram_usage(total_ram, free_ram)
+                cpu_usage = ResourceCalculator.calculate_cpu_usage(vcpu_capacity, free_cpu)
+                ram_usage = ResourceCalculator.calculate_ram_usage(vram_capacity, free_ram)
                 
-                stats_text += f"Общие ресурсы: CPU {total_cpu} ядер, RAM {total_ram} ГБ\n"
-                stats_text += f"Свободные ресурсы: CPU {free_cpu} ядер, RAM {free_ram} ГБ\n"
+                stats_text += f"Общие ресурсы: CPU {total_cpu} ядер ({vcpu_capacity} vCPU), RAM {total_ram} ГБ\n"
+                stats_text += f"Свободные ресурсы: CPU {free_cpu} vCPU, RAM {free_ram} ГБ\n"
+                stats_text += f"Занято физических ресурсов: CPU {hv_df['used_physical_cpu'].sum():.1f} ядер, "
+                stats_text += f"RAM {hv_df['used_physical_ram'].sum():.1f} ГБ\n"
                 stats_text += f"Использование: CPU {cpu_usage:.1f}%, RAM {ram_usage:.1f}%\n"
                 stats_text += f"Всего ВМ на гипервизорах: {total_vms}\n\n"
                 
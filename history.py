@@ -0,0 +1,64 @@
+import threading
+import time
+import logging
+from datetime import timedelta
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UtilizationSampler:
+    """Периодическая запись истории загрузки гипервизоров и кластера.
+    Раз в snapshot_interval - снимок счетчиков журнала операций и сжатие журнала
+    (остаются keep_snapshots последних снимков и записи после самого раннего из них)"""
+
+    def __init__(self, db, interval: float = 60.0, rollup_interval: float = 3600.0,
+                 raw_retention: timedelta = timedelta(days=2),
+                 minute_retention: timedelta = timedelta(days=30),
+                 hour_retention: timedelta = timedelta(days=730),
+                 snapshot_interval: float = 3600.0, keep_snapshots: int = 2):
+        self.db = db
+        self.interval = interval
+        self.rollup_interval = rollup_interval
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = keep_snapshots
+        self.retention = (raw_retention, minute_retention, hour_retention)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run(self):
+        """Цикл записи отсчетов (блокирующий)"""
+        next_rollup = next_snapshot = time.monotonic()
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            self.db.record_utilization_sample()
+
+            if started >= next_rollup:
+                self.db.rollup_utilization_history(*self.retention)
+                next_rollup = started + self.rollup_interval
+
+            if started >= next_snapshot:
+                if self.db.create_journal_snapshot() is not None:
+                    self.db.compact_journal(self.keep_snapshots)
+                next_snapshot = started + self.snapshot_interval
+
+            # Следующий отсчет по расписанию, без накопления задержки
+            self._stop_event.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def start(self):
+        """Запуск записи в фоновом потоке"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Запись истории загрузки запущена (интервал {self.interval} c)")
+
+    def stop(self):
+        """Остановка записи"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        logger.info("Запись истории загрузки остановлена")
@@ -1,6 +1,6 @@
 import tkinter as tk
+import argparse
 import logging
-from gui import DataCenterGUI
 
 # Настройка логирования
 logging.basicConfig(
@@ -8,11 +8,332 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+def open_storage(args):
+    """Хранилище, выбранное в командной строке"""
+    from storage import open_database
+    
+    # Сочетания --api-url с локальным хранилищем отклоняются при разборе аргументов
+    if args.api_url:
+        return open_database("http", url=args.api_url)
+    if args.backend == "sqlite":
+        return open_database("sqlite", path=args.db_path)
+    if args.backend == "postgresql":
+        params = slow_log_params(args)
+        if args.partitioning:
+            params['partitioning'] = args.partitioning
+        return open_database("postgresql", **params)
+    return open_database(args.backend)
+
+def slow_log_params(args):
+    """Параметры журнала медленных запросов PostgreSQL (пусто - журнал выключен)"""
+    if args.slow_ms is None:
+        return {}
+    return {'slow_query_ms': args.slow_ms, 'slow_log_path': args.slow_log}
+
+def run_simulation(args):
+    """Симуляция емкости кластера по снимку БД (данные в БД не изменяются)"""
+    from simulation import CapacitySimulator
+    
+    simulator = CapacitySimulator.from_database(open_storage(args), keep_reserve=not args.no_reserve)
+    result = simulator.what_if(args.vcpu, args.vram, args.add_hv, args.hv_cpu, args.hv_ram)
+    print(CapacitySimulator.format_report(result))
+
+def run_sampler(args):
+    """Запись истории загрузки кластера до остановки (Ctrl+C)"""
+    from history import UtilizationSampler
+    from reservations import ReservationSweeper
+    
+    db = open_storage(args)
+    sampler = UtilizationSampler(db, interval=args.interval, snapshot_interval=args.snapshot_interval)
+    # Процесс записи истории работает постоянно - в нем же освобождаются истекшие резервы
+    ReservationSweeper(db, interval=args.reservation_sweep).start()
+    try:
+        sampler.run()
+    except KeyboardInterrupt:
+        logging.info("Запись истории загрузки остановлена")
+
+def run_api_server(args):
+    """HTTP API для нескольких клиентов над одним хранилищем (до остановки Ctrl+C)"""
+    from api_server import run_server
+    from reservations import ReservationSweeper
+    
+    db = open_storage(args)
+    # Развертывания без очереди выполняются в процессе сервиса - здесь же очистка их резервов
+    ReservationSweeper(db).start()
+    run_server(db, args.host, args.port, args.workers, args.max_age)
+
+def run_workers(args):
+    """Пул процессов-исполнителей очереди развертывания (PostgreSQL)"""
+    from deploy_worker import run_worker_pool
+    
+    # Порт метрик основного процесса занят, исполнители публикуют метрики на следующих портах
+    run_worker_pool(args.processes, args.batch, args.metrics_port + 1 if args.metrics_port else None,
+                    **slow_log_params(args))
+
+def submit_deploy(args):
+    """Постановка задания массового развертывания в очередь"""
+    db = open_storage(args)
+    vm_data = {'vm_name': args.name, 'vcpu': args.vcpu, 'vram': args.vram, 'vhdd': args.vhdd}
+    if args.resume or not db.SUPPORTS_DEPLOY_QUEUE:
+        run_deploy(db, vm_data, args)
+        return
+    if args.count is None:
+        print("Укажите количество ВМ (--count)")
+        return
+    
+    job_id = db.submit_deploy_job(vm_data, args.count, priority=args.priority)
+    if job_id is not None:
+        print(f"Задание {job_id} поставлено в очередь: {args.count} ВМ")
+
+def run_deploy(db, vm_data, args):
+    """Развертывание пакетами в этом процессе с контрольными точками.
+    Прерывание (Ctrl+C) оставляет точку, с которой развертывание продолжается (--resume)"""
+    import asyncio
+    from async_operations import AsyncOperations
+    
+    ops = AsyncOperations(db)
+    if args.resume:
+        run_id = args.resume
+    else:
+        if args.count is None:
+            print("Укажите количество ВМ (--count)")
+            return
+        state = ops.start_deployment(vm_data, args.count, args.chunk)
+        if state is None:
+            return
+        run_id = state['run_id']
+    
+    def on_progress(state):
+        print(f"{run_id}: создано {state['created']}/{state['count']}, отказов {len(state['failed'])}")
+    
+    try:
+        state = asyncio.run(ops.resume_deployment(run_id, on_progress))
+    except KeyboardInterrupt:
+        print(f"Развертывание прервано, продолжение: deploy --resume {run_id}")
+        return
+    if state is not None:
+        print(f"Развертывание {run_id}: {state['status']} {state['message']}".rstrip())
+
+def show_jobs(args):
+    """Прогресс заданий развертывания"""
+    db = open_storage(args)
+    if not db.SUPPORTS_DEPLOY_QUEUE:
+        for state in db.get_deploy_checkpoints():
+            print(f"{state['run_id']:>12} {state['vm']['vm_name']:<12} {state['status']:<10} "
+                  f"создано {state['created']}/{state['count']}, отказов {len(state['failed'])}")
+        return
+    
+    for job in db.get_deploy_jobs():
+        print(f"{job['job_id']:>6} {job['base_name']:<12} {job['status']:<10} "
+              f"создано {job['created']}/{job['total']}, ошибок {job['failed']}, приоритет {job['priority']}")
+
+def show_slow_log(args):
+    """Сводка журнала медленных запросов по отпечаткам"""
+    from slow_log import SlowQueryLog
+    
+    summary = SlowQueryLog.summarize(args.slow_log, top=args.top)
+    if not summary:
+        print(f"Журнал {args.slow_log} пуст (включите запись: --slow-ms 100)")
+        return
+    for group in summary:
+        print(f"[{group['fingerprint']}] {group['count']} раз, всего {group['total_ms']:.0f} мс, "
+              f"ср. {group['avg_ms']:.1f} мс, макс. {group['max_ms']:.1f} мс; {', '.join(group['methods'])}")
+        print(f"  {group['sql'][:300]}")
+        for site, count in sorted(group['call_sites'].items(), key=lambda item: -item[1])[:3]:
+            print(f"  {count} x {site}")
+        plan = group['plan']
+        if args.plans and plan:
+            print("  План:" if plan.get('analyzed') else "  План (без выполнения):")
+            for line in (plan.get('plan') or plan.get('error', '')).splitlines():
+                print(f"    {line}")
+        print()
+
+def show_journal(args):
+    """Журнал операций: последние записи, снимок и сжатие, сверка и восстановление счетчиков"""
+    db = open_storage(args)
+    if args.snapshot:
+        op_id = db.create_journal_snapshot()
+        print(f"Снимок на позиции {op_id}" if op_id is not None else "Снимок не создан")
+    if args.compact:
+        print(f"Удалено записей журнала: {db.compact_journal(args.keep)}")
+    if args.tail:
+        state = db.replay_journal()
+        after = max((state or {}).get('op_id', 0) - args.tail, 0)
+        for entry in db.get_journal(after, args.tail):
+            print(f"{entry['op_id']:>10} {entry['ts']:%Y-%m-%d %H:%M:%S} {entry['op']:<12} "
+                  f"{entry['hv_name']:<12} {entry['vm_name'] or '':<14} "
+                  f"CPU {entry['d_cpu']:+d} RAM {entry['d_ram']:+d} ВМ {entry['d_vms']:+d} диск {entry['d_disk']:+d}")
+    if args.restore:
+        restored, message = db.restore_counters()
+        print("Счетчики восстановлены по журналу" if restored else f"Счетчики не восстановлены: {message}")
+        return
+    problems = db.verify_counters()
+    for problem in problems:
+        print(problem)
+    state = db.replay_journal()
+    if state is not None:
+        print(f"Позиция журнала {state['op_id']}, записей после снимка: {state['replayed']}, "
+              f"расхождений счетчиков: {len(problems)}")
+
+def show_clusters(args):
+    """Сводка по всем кластерам и поиск места для ВМ (запросы к кластерам выполняются одновременно)"""
+    from clusters import ClusterSet
+    
+    clusters = ClusterSet.from_config(args.clusters)
+    try:
+        print(ClusterSet.format_report(clusters.get_global_statistics()))
+        if args.vcpu is None:
+            return
+        vm_data = {'vm_name': args.create, 'vcpu': args.vcpu, 'vram': args.vram, 'vhdd': args.vhdd}
+        if args.create:
+            created, message = clusters.create_vm_anywhere(vm_data)
+            print(f"\nВМ {args.create} {'создана: ' if created else 'не создана: '}{message}")
+            return
+        print(f"\nМесто для ВМ {args.vcpu} vCPU / {args.vram} ГБ / {args.vhdd} ГБ:")
+        candidates = clusters.find_capacity(args.vcpu, args.vram, args.vhdd)
+        if not candidates:
+            print("  нет ни в одном кластере")
+        for candidate in candidates:
+            print(f"  {candidate['cluster']}: подходит гипервизоров {candidate['fits']}, "
+                  f"первый по порядку размещения {candidate['hypervisor']}, "
+                  f"свободно CPU {candidate['free_cpu_share'] * 100:.0f}%")
+    finally:
+        clusters.close()
+
+# Команды, которые работают с хранилищем напрямую (журнал, история, исполнители очереди, сам сервис)
+LOCAL_STORAGE_COMMANDS = ("serve", "sample", "worker", "journal")
+
+def parse_args(argv=None):
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Учет инфраструктуры кластера ЦОД Москва")
+    parser.add_argument("--backend", choices=("postgresql", "sqlite", "memory"), default="postgresql",
+                        help="Хранилище данных")
+    parser.add_argument("--db-path", default="datacenter.db", help="Файл базы SQLite")
+    parser.add_argument("--metrics-port", type=int, default=9177,
+                        help="Порт метрик Prometheus на 127.0.0.1 (0 - не публиковать)")
+    parser.add_argument("--slow-ms", type=float,
+                        help="Записывать запросы PostgreSQL длительнее порога (мс) с планом EXPLAIN")
+    parser.add_argument("--slow-log", default="slow_queries.log", help="Файл журнала медленных запросов")
+    parser.add_argument("--partitioning", choices=("hash", "range"),
+                        help="Секционирование таблицы ВМ PostgreSQL: hash по гипервизору, range по месяцу создания")
+    parser.add_argument("--clusters", default="clusters.json", help="Описание кластеров (площадок) для команды clusters")
+    parser.add_argument("--api-url", help="Работать через HTTP API (python main.py serve), например http://127.0.0.1:8077")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    simulate = subparsers.add_parser("simulate", help="Симуляция емкости кластера (что если)")
+    simulate.add_argument("--vcpu", type=int, default=4, help="vCPU одной ВМ")
+    simulate.add_argument("--vram", type=int, default=8, help="vRAM одной ВМ (ГБ)")
+    simulate.add_argument("--add-hv", type=int, default=0, help="Количество добавляемых гипервизоров")
+    simulate.add_argument("--hv-cpu", type=int, default=64, help="CPU добавляемого гипервизора")
+    simulate.add_argument("--hv-ram", type=int, default=512, help="RAM добавляемого гипервизора (ГБ)")
+    simulate.add_argument("--no-reserve", action="store_true", help="Не учитывать резерв 10%%")
+    
+    sample = subparsers.add_parser("sample", help="Запись истории загрузки кластера")
+    sample.add_argument("--interval", type=float, default=60.0, help="Интервал между отсчетами (с)")
+    sample.add_argument("--snapshot-interval", type=float, default=3600.0,
+                        help="Интервал между снимками журнала операций (с)")
+    sample.add_argument("--reservation-sweep", type=float, default=30.0,
+                        help="Интервал очистки истекших резервов емкости (с)")
+    
+    serve = subparsers.add_parser("serve", help="HTTP API с общим кэшем состояния кластера для нескольких клиентов")
+    serve.add_argument("--host", default="127.0.0.1", help="Адрес сервиса")
+    serve.add_argument("--port", type=int, default=8077, help="Порт сервиса")
+    serve.add_argument("--workers", type=int, default=8,
+                       help="Одновременных запросов к хранилищу (не больше пула соединений PostgreSQL)")
+    serve.add_argument("--max-age", type=float, default=1.0,
+                       help="Как часто сервис проверяет версию данных (с)")
+    
+    worker = subparsers.add_parser("worker", help="Исполнители очереди массового развертывания")
+    worker.add_argument("--processes", type=int, default=4, help="Количество процессов")
+    worker.add_argument("--batch", type=int, default=10, help="Задач за один захват")
+    
+    deploy = subparsers.add_parser("deploy", help="Массовое развертывание (очередь PostgreSQL или пакетами в процессе)")
+    deploy.add_argument("--name", default="vm77app01", help="Базовое имя ВМ")
+    deploy.add_argument("--vcpu", type=int, default=2, help="vCPU одной ВМ")
+    deploy.add_argument("--vram", type=int, default=4, help="vRAM одной ВМ (ГБ)")
+    deploy.add_argument("--vhdd", type=int, default=40, help="vHDD одной ВМ (ГБ)")
+    deploy.add_argument("--count", type=int, help="Количество ВМ")
+    deploy.add_argument("--priority", type=int, default=0, help="Приоритет (больше - раньше)")
+    deploy.add_argument("--chunk", type=int, help="Размер пакета развертывания в процессе")
+    deploy.add_argument("--resume", metavar="RUN_ID", help="Продолжить развертывание с контрольной точки")
+    
+    subparsers.add_parser("jobs", help="Прогресс заданий развертывания")
+    
+    slow_log = subparsers.add_parser("slow-log", help="Сводка журнала медленных запросов")
+    slow_log.add_argument("--top", type=int, default=20, help="Количество запросов в сводке")
+    slow_log.add_argument("--plans", action="store_true", help="Показать планы EXPLAIN")
+    
+    journal = subparsers.add_parser("journal", help="Журнал операций: сверка и восстановление счетчиков")
+    journal.add_argument("--tail", type=int, default=0, help="Показать последние записи журнала")
+    journal.add_argument("--snapshot", action="store_true", help="Создать снимок счетчиков")
+    journal.add_argument("--compact", action="store_true", help="Удалить старые снимки и записи журнала")
+    journal.add_argument("--keep", type=int, default=2, help="Сколько последних снимков оставить при сжатии")
+    journal.add_argument("--restore", action="store_true",
+                         help="Записать счетчики, восстановленные по снимку и журналу")
+    
+    clusters = subparsers.add_parser("clusters", help="Сводка по всем кластерам, поиск места для ВМ")
+    clusters.add_argument("--vcpu", type=int, help="Найти место для ВМ с таким количеством vCPU")
+    clusters.add_argument("--vram", type=int, default=4, help="vRAM ВМ (ГБ)")
+    clusters.add_argument("--vhdd", type=int, default=40, help="vHDD ВМ (ГБ)")
+    clusters.add_argument("--create", metavar="VM_NAME", help="Создать ВМ в кластере с наибольшим запасом")
+    
+    args = parser.parse_args(argv)
+    if args.api_url:
+        if args.backend != "postgresql":
+            parser.error(f"--api-url нельзя совмещать с --backend {args.backend}: хранилище выбирает сервис")
+        if args.command in LOCAL_STORAGE_COMMANDS:
+            parser.error(f"команда {args.command} работает с хранилищем напрямую, --api-url не поддерживается")
+        if args.command == "deploy" and args.resume:
+            parser.error("развертывание через сервис продолжает сервис, --resume не поддерживается с --api-url")
+    return args
+
 def main():
     """Основная функция приложения"""
+    args = parse_args()
+    
+    # Разовые команды завершаются сразу - метрики публикуют только долгоживущие процессы
+    if args.metrics_port and args.command in (None, "sample", "worker", "serve"):
+        from metrics import start_http_server
+        try:
+            start_http_server(args.metrics_port)
+        except OSError as e:
+            logging.error(f"Не удалось запустить сервер метрик на порту {args.metrics_port}: {e}")
+    
+    if args.command == "simulate":
+        run_simulation(args)
+        return
+    if args.command == "sample":
+        run_sampler(args)
+        return
+    if args.command == "worker":
+        run_workers(args)
+        return
+    if args.command == "serve":
+        run_api_server(args)
+        return
+    if args.command == "deploy":
+        submit_deploy(args)
+        return
+    if args.command == "jobs":
+        show_jobs(args)
+        return
+    if args.command == "slow-log":
+        show_slow_log(args)
+        return
+    if args.command == "journal":
+        show_journal(args)
+        return
+    if args.command == "clusters":
+        show_clusters(args)
+        return
+    
+    from gui import DataCenterGUI
+    
     try:
         root = tk.Tk()
-        app = DataCenterGUI(root)
+        db = open_storage(args) if args.backend != "postgresql" or args.slow_ms is not None \
+            or args.partitioning or args.api_url else None
+        app = DataCenterGUI(root, db)
         root.mainloop()
     except Exception as e:
         logging.error(f"Ошибка при запуске приложения: {e}")
@@ -0,0 +1,221 @@
+import bisect
+import functools
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Tuple, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Границы корзин: длительности в секундах и количество строк
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма с метками. Наблюдение - поиск корзины и инкремент под блокировкой,
+    накопительные суммы корзин считаются только при выгрузке"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = TIME_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Значения меток -> [количество по корзинам (+Inf последней), сумма, количество, максимум]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        """Учет одного наблюдения"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            if value > series[3]:
+                series[3] = value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Замер длительности блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def timed(self, *labels: str):
+        """Декоратор: замер длительности каждого вызова функции"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return wrapper
+        return decorator
+
+    def _quantile(self, counts: List[int], total: int, maximum: float, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины (как histogram_quantile)"""
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return maximum
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(self.buckets[i], maximum)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return maximum
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Сводка по каждому набору меток"""
+        with self._lock:
+            series = {labels: (list(counts), total, count, maximum)
+                      for labels, (counts, total, count, maximum) in self._series.items()}
+        return [{
+            'name': self.name, 'type': 'histogram', 'labels': dict(zip(self.labels, labels)),
+            'count': count, 'sum': total, 'avg': total / count if count else 0.0, 'max': maximum,
+            'p50': self._quantile(counts, count, maximum, 0.5),
+            'p95': self._quantile(counts, count, maximum, 0.95)
+        } for labels, (counts, total, count, maximum) in sorted(series.items())]
+
+    def render(self) -> List[str]:
+        """Строки текстового формата Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count, _) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        """Увеличение счетчика"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            values = dict(self._values)
+        return [{'name': self.name, 'type': 'counter', 'labels': dict(zip(self.labels, labels)), 'value': value}
+                for labels, value in sorted(values.items())]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = TIME_BUCKETS) -> Histogram:
+        """Гистограмма (повторная регистрация возвращает существующую)"""
+        return self._register(Histogram, name, help_text, labels, buckets)
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        """Счетчик (повторная регистрация возвращает существующий)"""
+        return self._register(Counter, name, help_text, labels)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Сводка всех метрик (для представления "Производительность")"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [row for metric in metrics for row in metric.snapshot()]
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Реестр по умолчанию: метрики регистрируются модулями при импорте
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Выдача метрик на /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int = 9177, host: str = "127.0.0.1",
+                      registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """Запуск HTTP-сервера метрик в фоновом потоке (только локальный адрес по умолчанию)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry or REGISTRY
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
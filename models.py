@@ -2,6 +2,11 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
+# Рекомендуемый минимальный свободный резерв гипервизора - доля емкости в виртуальных единицах.
+# Хранилища его не проверяют (емкость зависит от переподписки, которую можно изменить):
+# это порог предупреждений и запас при планировании емкости (simulation.CapacitySimulator)
+MIN_FREE_SHARE = 0.1
+
 @dataclass
 class Hypervisor:
     hv_name: str
@@ -11,10 +16,11 @@ class Hypervisor:
     free_ram: int
     num_vms: int = 0
     
-    def has_minimum_resources(self) -> bool:
-        """Проверка минимальных свободных ресурсов (10%)"""
-        min_cpu = self.cpu * 0.1
-        min_ram = self.ram * 0.1
+    def has_minimum_resources(self, overcommit_cpu: float = 1.0, overcommit_ram: float = 1.0) -> bool:
+        """Проверка рекомендуемого свободного резерва (MIN_FREE_SHARE емкости).
+        free_cpu/free_ram задаются в виртуальных единицах с учетом переподписки"""
+        min_cpu = self.cpu * overcommit_cpu * MIN_FREE_SHARE
+        min_ram = self.ram * overcommit_ram * MIN_FREE_SHARE
         return self.free_cpu >= min_cpu and self.free_ram >= min_ram
 
 @dataclass
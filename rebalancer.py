@@ -0,0 +1,304 @@
+import time
+import logging
+from typing import List, Dict, Tuple, Any, Optional
+
+import numpy as np
+
+from utils import PlacementIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ClusterRebalancer:
+    """Планировщик перебалансировки (дефрагментации) кластера"""
+
+    OBJECTIVES = ('largest_vm', 'balance')
+
+    def __init__(self, db):
+        self.db = db
+
+    def _load_state(self) -> Dict[str, Any]:
+        """Загрузка текущего состояния кластера в массивы NumPy
+        (и индекса правил размещения - None, если правил нет)"""
+        hypervisors = self.db.get_all_hypervisors()
+        vms = self.db.get_all_vms()
+        rules = self.db.get_placement_rules()
+
+        hv_names = [hv['hv_name'] for hv in hypervisors]
+        hv_index = {name: idx for idx, name in enumerate(hv_names)}
+
+        # cpu/ram - емкость в виртуальных единицах с учетом переподписки
+        return {
+            'hv_names': np.array(hv_names, dtype=object),
+            'cpu': np.array([hv['cpu_capacity'] for hv in hypervisors], dtype=np.int64),
+            'ram': np.array([hv['ram_capacity'] for hv in hypervisors], dtype=np.int64),
+            'free_cpu': np.array([hv['free_cpu'] for hv in hypervisors], dtype=np.int64),
+            'free_ram': np.array([hv['free_ram'] for hv in hypervisors], dtype=np.int64),
+            'vm_names': np.array([vm['vm_name'] for vm in vms], dtype=object),
+            'vm_host': np.array([hv_index[vm['hv_name']] for vm in vms], dtype=np.int64),
+            'vcpu': np.array([vm['vcpu'] for vm in vms], dtype=np.int64),
+            'vram': np.array([vm['vram'] for vm in vms], dtype=np.int64),
+            'index': PlacementIndex(hv_names, rules, self.db.get_placement_counts()) if rules else None
+        }
+
+    @staticmethod
+    def _allowed_hosts(state: Dict[str, Any], index: Optional[PlacementIndex], vm: int, host: int) -> np.ndarray:
+        """Гипервизоры, на которые ВМ можно перенести с host по правилам размещения"""
+        if index is None or not index.matching_rules(state['vm_names'][vm]):
+            allowed = np.ones(len(state['hv_names']), dtype=bool)
+            allowed[host] = False
+            return allowed
+        mask = index.move_mask(state['vm_names'][vm], state['hv_names'][host])
+        return np.array([mask >> i & 1 for i in range(len(state['hv_names']))], dtype=bool)
+
+    @staticmethod
+    def _metrics(state: Dict[str, Any], free_cpu: np.ndarray, free_ram: np.ndarray,
+                 target_vcpu: int, target_vram: int) -> Dict[str, Any]:
+        """Показатели фрагментации и равномерности загрузки"""
+        if len(free_cpu) == 0:
+            return {'fits_target': False, 'max_free_cpu': 0, 'max_free_ram': 0,
+                    'cpu_usage_std': 0.0, 'ram_usage_std': 0.0}
+
+        cpu_usage = (state['cpu'] - free_cpu) / state['cpu'] * 100
+        ram_usage = (state['ram'] - free_ram) / state['ram'] * 100
+        return {
+            'fits_target': bool(np.any((free_cpu >= target_vcpu) & (free_ram >= target_vram))),
+            'max_free_cpu': int(free_cpu.max()),
+            'max_free_ram': int(free_ram.max()),
+            'cpu_usage_std': float(cpu_usage.std()),
+            'ram_usage_std': float(ram_usage.std())
+        }
+
+    @staticmethod
+    def _best_fit_host(free_cpu: np.ndarray, free_ram: np.ndarray, vcpu: int, vram: int,
+                       allowed: np.ndarray) -> int:
+        """Гипервизор из allowed с наименьшим остатком после размещения ВМ (или -1)"""
+        feasible = (free_cpu >= vcpu) & (free_ram >= vram) & allowed
+        if not feasible.any():
+            return -1
+        leftover = np.where(feasible, (free_cpu - vcpu) / np.maximum(free_cpu, 1) +
+                            (free_ram - vram) / np.maximum(free_ram, 1), np.inf)
+        return int(leftover.argmin())
+
+    def _plan_largest_vm(self, state: Dict[str, Any], target_vcpu: int, target_vram: int,
+                         max_moves: int, deadline: float) -> List[Tuple[int, int]]:
+        """Минимальный набор переносов, освобождающий место под ВМ заданного размера"""
+        free_cpu, free_ram = state['free_cpu'], state['free_ram']
+        index = state['index']
+        if np.any((free_cpu >= target_vcpu) & (free_ram >= target_vram)):
+            return []
+
+        deficit_cpu = np.maximum(target_vcpu - free_cpu, 0)
+        deficit_ram = np.maximum(target_vram - free_ram, 0)
+
+        # Кандидаты в порядке возрастания относительного дефицита
+        order = np.argsort(deficit_cpu / np.maximum(state['cpu'], 1) +
+                           deficit_ram / np.maximum(state['ram'], 1))
+        best: List[Tuple[int, int]] = []
+
+        for host in order:
+            if time.monotonic() > deadline:
+                break
+            # Хост не сможет вместить целевую ВМ, даже если его полностью освободить
+            if state['cpu'][host] < target_vcpu or state['ram'][host] < target_vram:
+                continue
+
+            vm_idx = np.flatnonzero(state['vm_host'] == host)
+            need_cpu, need_ram = deficit_cpu[host], deficit_ram[host]
+
+            # Сначала переносим ВМ, которые сильнее всего закрывают дефицит
+            coverage = (np.minimum(state['vcpu'][vm_idx] / max(need_cpu, 1), 1.0) * (need_cpu > 0) +
+                        np.minimum(state['vram'][vm_idx] / max(need_ram, 1), 1.0) * (need_ram > 0))
+            vm_idx = vm_idx[np.argsort(-coverage, kind='stable')]
+
+            trial_cpu, trial_ram = free_cpu.copy(), free_ram.copy()
+            moves: List[Tuple[int, int]] = []
+            for vm in vm_idx:
+                if trial_cpu[host] >= target_vcpu and trial_ram[host] >= target_vram:
+                    break
+                if best and len(moves) >= len(best) - 1 or len(moves) >= max_moves:
+                    moves = []
+                    break
+
+                vcpu, vram = state['vcpu'][vm], state['vram'][vm]
+                target = self._best_fit_host(trial_cpu, trial_ram, vcpu, vram,
+                                             self._allowed_hosts(state, index, vm, host))
+                if target < 0:
+                    continue
+
+                trial_cpu[target] -= vcpu
+                trial_ram[target] -= vram
+                trial_cpu[host] += vcpu
+                trial_ram[host] += vram
+                moves.append((int(vm), target))
+                if index is not None:
+                    index.add_vm(state['vm_names'][vm], state['hv_names'][host], -1)
+                    index.add_vm(state['vm_names'][vm], state['hv_names'][target])
+
+            # Счетчики правил возвращаются к исходному размещению перед следующим кандидатом
+            if index is not None:
+                for vm, target in moves:
+                    index.add_vm(state['vm_names'][vm], state['hv_names'][target], -1)
+                    index.add_vm(state['vm_names'][vm], state['hv_names'][host])
+
+            if moves and trial_cpu[host] >= target_vcpu and trial_ram[host] >= target_vram:
+                best = moves
+                if len(best) == 1:
+                    break
+
+        return best
+
+    def _plan_balance(self, state: Dict[str, Any], max_moves: int,
+                      deadline: float) -> List[Tuple[int, int]]:
+        """Жадное выравнивание загрузки CPU/RAM (минимизация суммы квадратов загрузки).
+        Матрица изменения суммы для пар (ВМ, целевой гипервизор) строится один раз: перенос
+        меняет загрузку двух гипервизоров, поэтому пересчитываются их столбцы и строки ВМ,
+        размещенных на них (и строки ВМ тех же групп правил размещения)"""
+        free_cpu, free_ram = state['free_cpu'].copy(), state['free_ram'].copy()
+        vm_host = state['vm_host'].copy()
+        cpu, ram = state['cpu'].astype(float), state['ram'].astype(float)
+        vcpu, vram = state['vcpu'], state['vram']
+        index = state['index']
+        n_vms, n_hosts = len(vm_host), len(cpu)
+        moved = np.zeros(n_vms, dtype=bool)
+        moves: List[Tuple[int, int]] = []
+        if n_vms == 0 or n_hosts < 2:
+            return moves
+
+        all_vms, all_hosts = np.arange(n_vms), np.arange(n_hosts)
+        allowed = np.ones((n_vms, n_hosts), dtype=bool)
+        allowed[all_vms, vm_host] = False
+        ruled: Dict[int, set] = {}
+        if index is not None:
+            for vm in all_vms:
+                rule_ids = index.matching_rules(state['vm_names'][vm])
+                if rule_ids:
+                    ruled[int(vm)] = set(rule_ids)
+                    allowed[vm] = self._allowed_hosts(state, index, vm, vm_host[vm])
+
+        delta = np.empty((n_vms, n_hosts))
+
+        def update(vms: np.ndarray, hosts: np.ndarray):
+            used_cpu, used_ram = cpu - free_cpu, ram - free_ram
+            src = vm_host[vms]
+            src_gain = (((used_cpu[src] - vcpu[vms]) / cpu[src]) ** 2 - (used_cpu[src] / cpu[src]) ** 2 +
+                        ((used_ram[src] - vram[vms]) / ram[src]) ** 2 - (used_ram[src] / ram[src]) ** 2)
+            h_cpu, h_ram = cpu[hosts], ram[hosts]
+            dst_cost = (((used_cpu[hosts][None, :] + vcpu[vms][:, None]) / h_cpu) ** 2 -
+                        (used_cpu[hosts] / h_cpu) ** 2 +
+                        ((used_ram[hosts][None, :] + vram[vms][:, None]) / h_ram) ** 2 -
+                        (used_ram[hosts] / h_ram) ** 2)
+            feasible = ((free_cpu[hosts][None, :] >= vcpu[vms][:, None]) &
+                        (free_ram[hosts][None, :] >= vram[vms][:, None]) &
+                        allowed[np.ix_(vms, hosts)] & ~moved[vms][:, None])
+            delta[np.ix_(vms, hosts)] = np.where(feasible, src_gain[:, None] + dst_cost, np.inf)
+
+        update(all_vms, all_hosts)
+        while len(moves) < max_moves and time.monotonic() < deadline:
+            vm, target = np.unravel_index(int(delta.argmin()), delta.shape)
+            if not np.isfinite(delta[vm, target]) or delta[vm, target] > -1e-6:
+                break
+
+            source = vm_host[vm]
+            free_cpu[source] += vcpu[vm]
+            free_ram[source] += vram[vm]
+            free_cpu[target] -= vcpu[vm]
+            free_ram[target] -= vram[vm]
+            vm_host[vm] = target
+            moved[vm] = True
+            moves.append((int(vm), int(target)))
+
+            # Правила размещения меняются только для ВМ групп перенесенной ВМ
+            changed = []
+            if int(vm) in ruled:
+                index.add_vm(state['vm_names'][vm], state['hv_names'][source], -1)
+                index.add_vm(state['vm_names'][vm], state['hv_names'][target])
+                for other, rule_ids in ruled.items():
+                    if not moved[other] and rule_ids & ruled[int(vm)]:
+                        allowed[other] = self._allowed_hosts(state, index, other, vm_host[other])
+                        changed.append(other)
+
+            touched = np.array([source, target])
+            rows = np.union1d(np.flatnonzero(np.isin(vm_host, touched)), np.array(changed, dtype=np.int64))
+            update(rows, all_hosts)
+            update(all_vms, touched)
+
+        return moves
+
+    def plan(self, objective: str = 'largest_vm', target_vcpu: int = 24, target_vram: int = 128,
+             max_moves: int = 50, time_budget: float = 2.0) -> Dict[str, Any]:
+        """Построение плана переносов ВМ (без изменения данных)"""
+        try:
+            if objective not in self.OBJECTIVES:
+                raise ValueError(f"Неизвестная цель перебалансировки: {objective}")
+
+            started = time.monotonic()
+            deadline = started + time_budget
+            state = self._load_state()
+
+            if objective == 'largest_vm':
+                raw_moves = self._plan_largest_vm(state, target_vcpu, target_vram, max_moves, deadline)
+            else:
+                raw_moves = self._plan_balance(state, max_moves, deadline)
+
+            free_cpu, free_ram = state['free_cpu'].copy(), state['free_ram'].copy()
+            moves = []
+            for vm, target in raw_moves:
+                source = state['vm_host'][vm]
+                free_cpu[source] += state['vcpu'][vm]
+                free_ram[source] += state['vram'][vm]
+                free_cpu[target] -= state['vcpu'][vm]
+                free_ram[target] -= state['vram'][vm]
+                moves.append((state['vm_names'][vm], state['hv_names'][source], state['hv_names'][target]))
+
+            return {
+                'objective': objective,
+                'target': (target_vcpu, target_vram),
+                'moves': moves,
+                'before': self._metrics(state, state['free_cpu'], state['free_ram'], target_vcpu, target_vram),
+                'after': self._metrics(state, free_cpu, free_ram, target_vcpu, target_vram),
+                'elapsed': time.monotonic() - started,
+                'timed_out': time.monotonic() > deadline
+            }
+
+        except Exception as e:
+            logger.error(f"Ошибка при планировании перебалансировки: {e}")
+            return {}
+
+    def apply(self, plan: Dict[str, Any]) -> Tuple[bool, str]:
+        """Применение плана переносов в одной транзакции"""
+        moves = plan.get('moves', [])
+        if not moves:
+            return True, ""
+        return self.db.migrate_vms([(vm_name, target) for vm_name, _, target in moves])
+
+    @staticmethod
+    def format_report(plan: Dict[str, Any]) -> str:
+        """Текстовый отчет о плане перебалансировки (dry-run)"""
+        if not plan:
+            return "Не удалось построить план перебалансировки"
+
+        target_vcpu, target_vram = plan['target']
+        report = "=== ПЛАН ПЕРЕБАЛАНСИРОВКИ ===\n\n"
+        if plan['objective'] == 'largest_vm':
+            report += f"Цель: освободить место под ВМ {target_vcpu} vCPU / {target_vram} ГБ\n"
+        else:
+            report += "Цель: выравнивание загрузки CPU/RAM\n"
+        report += f"Время расчета: {plan['elapsed']:.2f} c"
+        report += " (прервано по лимиту времени)\n\n" if plan['timed_out'] else "\n\n"
+
+        for title, key in (("До", 'before'), ("После", 'after')):
+            metrics = plan[key]
+            report += f"{title}:\n"
+            report += f"  Целевая ВМ помещается: {'да' if metrics['fits_target'] else 'нет'}\n"
+            report += f"  Макс. свободно на одном гипервизоре: CPU {metrics['max_free_cpu']}, "
+            report += f"RAM {metrics['max_free_ram']} ГБ\n"
+            report += f"  Разброс загрузки (СКО): CPU {metrics['cpu_usage_std']:.1f}%, "
+            report += f"RAM {metrics['ram_usage_std']:.1f}%\n"
+
+        report += f"\nПереносов: {len(plan['moves'])}\n"
+        for vm_name, source, target in plan['moves']:
+            report += f"  {vm_name}: {source} -> {target}\n"
+
+        return report
@@ -0,0 +1,41 @@
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ReservationSweeper:
+    """Периодическое освобождение мест истекших резервов емкости.
+    Резерв развертывания, прерванного вместе с процессом, не продлевается и через TTL
+    возвращает ресурсы гипервизорам и дисковому пулу"""
+
+    def __init__(self, db, interval: float = 30.0):
+        self.db = db
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run(self):
+        """Цикл очистки (блокирующий)"""
+        while not self._stop_event.is_set():
+            self.db.release_expired_reservations()
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """Запуск очистки в фоновом потоке"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Очистка истекших резервов запущена (интервал {self.interval} c)")
+
+    def stop(self):
+        """Остановка очистки"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        logger.info("Очистка истекших резервов остановлена")
@@ -0,0 +1,210 @@
+import logging
+from typing import List, Dict, Tuple, Any, Optional
+from models import Cluster, MIN_FREE_SHARE
+from utils import NameGenerator, ResourceCalculator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CapacitySimulator:
+    """Симулятор размещения ВМ по снимку кластера в памяти (живая БД не изменяется)"""
+
+    # Запас емкости при планировании (хранилища резерв не проверяют, см. models.MIN_FREE_SHARE)
+    RESERVE = MIN_FREE_SHARE
+
+    def __init__(self, hypervisors: List[Dict[str, Any]], cluster: Optional[Cluster] = None,
+                 keep_reserve: bool = True):
+        self.cluster = cluster or Cluster()
+        self.keep_reserve = keep_reserve
+
+        # Состояние хранится в параллельных списках - так цикл размещения быстрее
+        self.hv_names: List[str] = []
+        self.cpu: List[int] = []
+        self.ram: List[int] = []
+        self.free_cpu: List[int] = []
+        self.free_ram: List[int] = []
+        self.min_cpu: List[float] = []
+        self.min_ram: List[float] = []
+        self.num_vms: List[int] = []
+
+        # Созданные в симуляции ВМ: имя -> (индекс гипервизора, vcpu, vram)
+        self.vms: Dict[str, Tuple[int, int, int]] = {}
+        self._vm_counter = 0
+
+        for hv in hypervisors:
+            # В снимке free_cpu/free_ram хранятся в виртуальных единицах с учетом переподписки
+            capacity_cpu = ResourceCalculator.calculate_capacity(hv['cpu'], self.cluster.overcommit_cpu)
+            capacity_ram = ResourceCalculator.calculate_capacity(hv['ram'], self.cluster.overcommit_ram)
+            self._add_host(hv['hv_name'], hv['cpu'], hv['ram'],
+                           capacity_cpu - hv['free_cpu'], capacity_ram - hv['free_ram'], hv['num_vms'])
+
+    @classmethod
+    def from_database(cls, db, keep_reserve: bool = True) -> 'CapacitySimulator':
+        """Создание симулятора по снимку текущего состояния кластера"""
+        config = db.get_cluster_config()
+        cluster = Cluster(
+            name=config.get('cluster_name', Cluster.name),
+            disk_pool=int(config.get('disk_pool', Cluster.disk_pool)),
+            overcommit_cpu=float(config.get('overcommit_cpu', Cluster.overcommit_cpu)),
+            overcommit_ram=float(config.get('overcommit_ram', Cluster.overcommit_ram)),
+            max_hypervisors=int(config.get('max_hypervisors', Cluster.max_hypervisors))
+        )
+        return cls(db.get_all_hypervisors(), cluster, keep_reserve)
+
+    def _add_host(self, hv_name: str, cpu: int, ram: int, used_cpu: int, used_ram: int, num_vms: int):
+        """Добавление гипервизора в состояние симуляции с учетом переподписки"""
+        capacity_cpu = ResourceCalculator.calculate_capacity(cpu, self.cluster.overcommit_cpu)
+        capacity_ram = ResourceCalculator.calculate_capacity(ram, self.cluster.overcommit_ram)
+
+        self.hv_names.append(hv_name)
+        self.cpu.append(capacity_cpu)
+        self.ram.append(capacity_ram)
+        self.free_cpu.append(capacity_cpu - used_cpu)
+        self.free_ram.append(capacity_ram - used_ram)
+        self.min_cpu.append(capacity_cpu * self.RESERVE if self.keep_reserve else 0)
+        self.min_ram.append(capacity_ram * self.RESERVE if self.keep_reserve else 0)
+        self.num_vms.append(num_vms)
+
+    def copy(self) -> 'CapacitySimulator':
+        """Независимая копия состояния для сценариев "что если" """
+        clone = CapacitySimulator([], self.cluster, self.keep_reserve)
+        for attr in ('hv_names', 'cpu', 'ram', 'free_cpu', 'free_ram', 'min_cpu', 'min_ram', 'num_vms'):
+            setattr(clone, attr, list(getattr(self, attr)))
+        clone.vms = dict(self.vms)
+        clone._vm_counter = self._vm_counter
+        return clone
+
+    def add_hypervisors(self, count: int, cpu: int, ram: int, ignore_limit: bool = False) -> int:
+        """Добавление гипотетических гипервизоров, возвращает количество добавленных"""
+        added = 0
+        for _ in range(count):
+            if not ignore_limit and len(self.hv_names) >= self.cluster.max_hypervisors:
+                logger.warning(f"Достигнуто максимальное количество гипервизоров: {self.cluster.max_hypervisors}")
+                break
+            self._add_host(NameGenerator.get_next_hv_name(self.hv_names), cpu, ram, 0, 0, 0)
+            added += 1
+        return added
+
+    def place(self, vcpu: int, vram: int) -> int:
+        """Размещение одной ВМ по правилам create_vm, возвращает индекс гипервизора или -1"""
+        free_cpu, free_ram = self.free_cpu, self.free_ram
+        min_cpu, min_ram, num_vms = self.min_cpu, self.min_ram, self.num_vms
+
+        best = -1
+        best_vms = 0
+        best_cpu = 0
+        for idx in range(len(free_cpu)):
+            left_cpu = free_cpu[idx] - vcpu
+            if left_cpu < min_cpu[idx] or free_ram[idx] - vram < min_ram[idx]:
+                continue
+            # Меньше всего ВМ, затем больше всего свободных CPU
+            if best < 0 or num_vms[idx] < best_vms or (num_vms[idx] == best_vms and free_cpu[idx] > best_cpu):
+                best, best_vms, best_cpu = idx, num_vms[idx], free_cpu[idx]
+
+        if best >= 0:
+            free_cpu[best] -= vcpu
+            free_ram[best] -= vram
+            num_vms[best] += 1
+        return best
+
+    def deploy(self, vcpu: int, vram: int, count: int = 1, stop_on_failure: bool = True) -> int:
+        """Развертывание count одинаковых ВМ, возвращает количество размещенных"""
+        placed = 0
+        for _ in range(count):
+            host = self.place(vcpu, vram)
+            if host < 0:
+                if stop_on_failure:
+                    break
+                continue
+            self._vm_counter += 1
+            self.vms[f"sim{self._vm_counter}"] = (host, vcpu, vram)
+            placed += 1
+        return placed
+
+    def delete(self, vm_names: List[str]) -> int:
+        """Удаление ВМ, созданных в симуляции, возвращает количество удаленных"""
+        deleted = 0
+        for vm_name in vm_names:
+            vm = self.vms.pop(vm_name, None)
+            if vm is None:
+                continue
+            host, vcpu, vram = vm
+            self.free_cpu[host] += vcpu
+            self.free_ram[host] += vram
+            self.num_vms[host] -= 1
+            deleted += 1
+        return deleted
+
+    def delete_latest(self, count: int) -> int:
+        """Удаление последних созданных в симуляции ВМ"""
+        return self.delete(list(self.vms)[-count:] if count > 0 else [])
+
+    def how_many_fit(self, vcpu: int, vram: int, limit: int = 1000000) -> int:
+        """Сколько еще ВМ заданного размера поместится в кластер"""
+        return self.copy().deploy(vcpu, vram, limit)
+
+    def replay(self, events: List[Tuple]) -> List[int]:
+        """Воспроизведение потока событий:
+        ('deploy', vcpu, vram, count), ('delete', count), ('add_hv', count, cpu, ram).
+        Возвращает результат каждого события"""
+        results = []
+        for event in events:
+            action = event[0]
+            if action == 'deploy':
+                results.append(self.deploy(event[1], event[2], event[3], stop_on_failure=False))
+            elif action == 'delete':
+                results.append(self.delete_latest(event[1]))
+            elif action == 'add_hv':
+                results.append(self.add_hypervisors(event[1], event[2], event[3]))
+            else:
+                raise ValueError(f"Неизвестное событие симуляции: {action}")
+        return results
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка по состоянию симуляции"""
+        total_cpu = sum(self.cpu)
+        total_ram = sum(self.ram)
+        return {
+            'total_hypervisors': len(self.hv_names),
+            'total_vms': sum(self.num_vms),
+            'vcpu_capacity': total_cpu,
+            'vram_capacity': total_ram,
+            'free_vcpu': sum(self.free_cpu),
+            'free_vram': sum(self.free_ram),
+            'cpu_usage_percent': (total_cpu - sum(self.free_cpu)) / total_cpu * 100 if total_cpu else 0.0,
+            'ram_usage_percent': (total_ram - sum(self.free_ram)) / total_ram * 100 if total_ram else 0.0
+        }
+
+    def what_if(self, vcpu: int, vram: int, add_hv_count: int = 0,
+                hv_cpu: int = 64, hv_ram: int = 512) -> Dict[str, Any]:
+        """Сценарий: сколько ВМ поместится сейчас и после добавления гипервизоров"""
+        result = {
+            'vm_size': (vcpu, vram),
+            'fit_now': self.how_many_fit(vcpu, vram),
+            'summary_now': self.summary()
+        }
+        if add_hv_count > 0:
+            scenario = self.copy()
+            result['added_hypervisors'] = scenario.add_hypervisors(add_hv_count, hv_cpu, hv_ram)
+            result['fit_after'] = scenario.how_many_fit(vcpu, vram)
+            result['summary_after'] = scenario.summary()
+        return result
+
+    @staticmethod
+    def format_report(result: Dict[str, Any]) -> str:
+        """Текстовый отчет по сценарию "что если" """
+        vcpu, vram = result['vm_size']
+        report = "=== СИМУЛЯЦИЯ ЕМКОСТИ ===\n\n"
+        report += f"Размер ВМ: {vcpu} vCPU / {vram} ГБ\n"
+        report += f"Поместится сейчас: {result['fit_now']} ВМ\n"
+
+        summary = result['summary_now']
+        report += f"Загрузка сейчас: CPU {summary['cpu_usage_percent']:.1f}%, "
+        report += f"RAM {summary['ram_usage_percent']:.1f}%\n"
+
+        if 'fit_after' in result:
+            report += f"\nПосле добавления {result['added_hypervisors']} гипервизоров:\n"
+            report += f"Поместится: {result['fit_after']} ВМ\n"
+
+        return report
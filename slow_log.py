@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import glob
+import json
+import queue
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import List, Dict, Any, Tuple, Optional, Callable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Нормализация запроса для отпечатка: параметры, литералы, списки значений
+_PLACEHOLDERS = re.compile(r"%s|%\(\w+\)s|\$\d+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*|ARRAY\[[^\]]*\]")
+_SPACES = re.compile(r"\s+")
+# Запросы, для которых строится план (служебные PREPARE/LOCK/CREATE только записываются)
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+# Кадры, не являющиеся местом вызова: сам журнал, psycopg2.extras, обертки execute
+_SKIP_FILES = {"slow_log.py", "extras.py"}
+
+
+def fingerprint(sql: str) -> Tuple[str, str]:
+    """Отпечаток запроса: (хэш, нормализованный текст) - запросы, отличающиеся только значениями, совпадают"""
+    normalized = _LITERALS.sub("?", _PLACEHOLDERS.sub("?", sql))
+    normalized = _SPACES.sub(" ", _VALUE_LISTS.sub("(...)", normalized)).strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16], normalized
+
+
+def params_shape(params) -> Any:
+    """Форма параметров без значений: типы и длины списков"""
+    def shape(value):
+        if isinstance(value, (list, tuple, set)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+
+def _call_site(depth: int = 3) -> str:
+    """Цепочка вызова запроса: метод хранилища и вызвавший его код"""
+    frame = sys._getframe(2)
+    sites = []
+    while frame is not None and len(sites) < depth:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        if filename not in _SKIP_FILES and code.co_name != "execute":
+            sites.append(f"{filename}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return " <- ".join(sites)
+
+
+class SlowQueryLog:
+    """Журнал медленных запросов (JSON-строки в ротируемом файле).
+    Для первого появления каждого отпечатка план строится в фоновом потоке"""
+
+    def __init__(self, path: str = "slow_queries.log", threshold_ms: float = 100.0,
+                 explain: Optional[Callable[[str, Any], Tuple[str, bool]]] = None,
+                 resolve: Optional[Callable[[str], str]] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backups: int = 5, max_sql: int = 4000):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.resolve = resolve
+        self.max_sql = max_sql
+        self._seen = set()
+        self._lock = threading.Lock()
+
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                      encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        # Отдельный логгер вне иерархии: записи не попадают в общий журнал приложения
+        self._log = logging.Logger(f"slow_queries:{path}", logging.INFO)
+        self._log.addHandler(handler)
+        self._handler = handler
+
+        # Очередь планов ограничена: при всплеске медленных запросов лишние планы пропускаются
+        self._queue: "queue.Queue" = queue.Queue(maxsize=100)
+        self._worker = None
+        if explain is not None:
+            self._worker = threading.Thread(target=self._explain_loop, name="slow-query-explain")
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _write(self, entry: Dict[str, Any]):
+        entry = dict(entry, ts=datetime.now().isoformat(timespec="milliseconds"))
+        self._log.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def record(self, sql, params, duration: float, method: str = "", rows: int = -1) -> bool:
+        """Запись запроса длительностью не меньше порога, возвращает True если запрос записан"""
+        if duration < self.threshold or threading.current_thread() is self._worker:
+            return False
+        try:
+            if isinstance(sql, bytes):
+                sql = sql.decode("utf-8", "replace")
+            sql = self.resolve(sql) if self.resolve else str(sql)
+            key, normalized = fingerprint(sql)
+
+            with self._lock:
+                first = key not in self._seen
+                self._seen.add(key)
+            self._write({
+                'type': 'query', 'fingerprint': key, 'duration_ms': round(duration * 1000, 3),
+                'method': method, 'call_site': _call_site(), 'rows': rows,
+                'params': params_shape(params), 'sql': normalized[:self.max_sql]
+            })
+
+            if first and self._worker is not None and sql.lstrip().upper().startswith(_EXPLAINABLE):
+                try:
+                    self._queue.put_nowait((key, sql, params))
+                except queue.Full:
+                    # План будет построен при следующем появлении запроса
+                    with self._lock:
+                        self._seen.discard(key)
+            return True
+        except Exception as e:
+            # Журнал не должен ломать выполнение запроса
+            logger.error(f"Ошибка записи медленного запроса: {e}")
+            return False
+
+    def _explain_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            key, sql, params = item
+            entry = {'type': 'explain', 'fingerprint': key}
+            try:
+                plan, analyzed = self.explain(sql, params)
+                entry.update(analyzed=analyzed, plan=plan)
+            except Exception as e:
+                entry['error'] = str(e)
+            self._write(entry)
+
+    def close(self, timeout: float = 5.0):
+        """Остановка фонового потока (построенные планы дописываются) и закрытие файла"""
+        if self._worker is not None and self._worker.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+                self._worker.join(timeout)
+            except queue.Full:
+                pass
+        self._handler.close()
+
+    @staticmethod
+    def read(path: str = "slow_queries.log") -> List[Dict[str, Any]]:
+        """Все записи журнала, включая ротированные файлы и журналы исполнителей (path*)"""
+        entries = []
+        for filename in sorted(glob.glob(glob.escape(path) + "*")):
+            with open(filename, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        entries.sort(key=lambda entry: entry.get('ts', ''))
+        return entries
+
+    @classmethod
+    def summarize(cls, path: str = "slow_queries.log", top: int = 20) -> List[Dict[str, Any]]:
+        """Сводка по отпечаткам, упорядоченная по суммарному времени"""
+        groups: Dict[str, Dict[str, Any]] = {}
+        plans: Dict[str, Dict[str, Any]] = {}
+        for entry in cls.read(path):
+            key = entry.get('fingerprint')
+            if entry.get('type') == 'explain':
+                plans[key] = entry
+                continue
+            group = groups.setdefault(key, {
+                'fingerprint': key, 'sql': entry.get('sql', ''), 'count': 0, 'total_ms': 0.0,
+                'max_ms': 0.0, 'methods': set(), 'call_sites': {}, 'last_seen': ''
+            })
+            duration = entry.get('duration_ms', 0.0)
+            group['count'] += 1
+            group['total_ms'] += duration
+            group['max_ms'] = max(group['max_ms'], duration)
+            group['methods'].add(entry.get('method', ''))
+            site = entry.get('call_site', '')
+            group['call_sites'][site] = group['call_sites'].get(site, 0) + 1
+            group['last_seen'] = entry.get('ts', '')
+
+        summary = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:top]
+        for group in summary:
+            group['avg_ms'] = group['total_ms'] / group['count']
+            group['methods'] = sorted(group['methods'])
+            group['plan'] = plans.get(group['fingerprint'])
+        return summary
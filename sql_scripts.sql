@@ -14,11 +14,13 @@ CREATE TABLE hypervisors (
     hv_name VARCHAR(50) PRIMARY KEY,
     cpu INTEGER NOT NULL CHECK (cpu > 0),
     ram INTEGER NOT NULL CHECK (ram > 0),
-    free_cpu INTEGER NOT NULL CHECK (free_cpu >= 0 AND free_cpu <= cpu),
-    free_ram INTEGER NOT NULL CHECK (free_ram >= 0 AND free_ram <= ram),
+    -- Свободные ресурсы хранятся в виртуальных единицах (vCPU/vRAM) с учетом переподписки.
+    -- Резерв 10% (прежнее ограничение check_min_resources) базой не проверяется: емкость зависит
+    -- от переподписки в cluster_config; порог используется для предупреждений и в симуляции
+    free_cpu INTEGER NOT NULL CHECK (free_cpu >= 0),
+    free_ram INTEGER NOT NULL CHECK (free_ram >= 0),
     num_vms INTEGER DEFAULT 0 CHECK (num_vms >= 0),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    CONSTRAINT check_min_resources CHECK (free_cpu >= cpu * 0.1 AND free_ram >= ram * 0.1)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Создание таблицы виртуальных машин
@@ -39,15 +41,108 @@ CREATE TABLE cluster_config (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Счетчик занятого места в дисковом пуле (обновляется вместе с ВМ)
+CREATE TABLE storage_pool (
+    pool_name VARCHAR(50) PRIMARY KEY,
+    capacity BIGINT NOT NULL CHECK (capacity > 0),
+    used_disk BIGINT NOT NULL DEFAULT 0 CHECK (used_disk >= 0)
+);
+
+-- Очередь массового развертывания: задание и по одной задаче на каждую ВМ
+CREATE TABLE deploy_jobs (
+    job_id SERIAL PRIMARY KEY,
+    base_name VARCHAR(50) NOT NULL,
+    vcpu INTEGER NOT NULL,
+    vram INTEGER NOT NULL,
+    vhdd INTEGER NOT NULL,
+    total INTEGER NOT NULL CHECK (total > 0),
+    priority INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    created INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE deploy_tasks (
+    job_id INTEGER NOT NULL REFERENCES deploy_jobs(job_id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    vm_name VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP,
+    worker VARCHAR(100),
+    error TEXT,
+    PRIMARY KEY (job_id, seq)
+);
+
+CREATE INDEX idx_deploy_tasks_active ON deploy_tasks(job_id, seq) WHERE status IN ('pending', 'running');
+
+-- Правила размещения ВМ (группа ВМ - начало имени) и счетчики ВМ групп по гипервизорам
+CREATE TABLE placement_rules (
+    rule_id SERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL CHECK (kind IN ('spread', 'max_per_host', 'pin')),
+    vm_prefix VARCHAR(50) NOT NULL,
+    max_per_host INTEGER CHECK (max_per_host > 0),
+    hosts TEXT[],
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE placement_counts (
+    rule_id INTEGER NOT NULL REFERENCES placement_rules(rule_id) ON DELETE CASCADE,
+    hv_name VARCHAR(50) NOT NULL REFERENCES hypervisors(hv_name) ON DELETE CASCADE,
+    vm_count INTEGER NOT NULL DEFAULT 0 CHECK (vm_count >= 0),
+    PRIMARY KEY (rule_id, hv_name)
+);
+
+-- Счетчики обновляются при любом изменении размещения ВМ
+CREATE OR REPLACE FUNCTION placement_count_vm() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE placement_counts c SET vm_count = c.vm_count - 1
+        FROM placement_rules r
+        WHERE c.rule_id = r.rule_id AND c.hv_name = OLD.hv_name
+          AND OLD.vm_name LIKE r.vm_prefix || '%';
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+        SELECT r.rule_id, NEW.hv_name, 1 FROM placement_rules r
+        WHERE NEW.vm_name LIKE r.vm_prefix || '%'
+        ON CONFLICT (rule_id, hv_name) DO UPDATE SET vm_count = placement_counts.vm_count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_placement_counts
+AFTER INSERT OR DELETE OR UPDATE OF hv_name ON virtual_machines
+FOR EACH ROW EXECUTE FUNCTION placement_count_vm();
+
+-- Контрольные точки развертываний, выполняемых в процессе приложения
+CREATE TABLE deploy_checkpoints (
+    run_id VARCHAR(64) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL,
+    state JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Инициализация конфигурации кластера
 INSERT INTO cluster_config (config_key, config_value) VALUES
     ('cluster_name', 'Moscow_Cluster'),
     ('disk_pool', '1000000'),
     ('overcommit_cpu', '3.0'),
     ('overcommit_ram', '1.0'),
-    ('max_hypervisors', '24')
+    ('max_hypervisors', '24'),
+    ('capacity_units', 'virtual')
 ON CONFLICT (config_key) DO NOTHING;
 
+INSERT INTO storage_pool (pool_name, capacity, used_disk) VALUES
+    ('main', 1000000, 0)
+ON CONFLICT (pool_name) DO NOTHING;
+
 -- Индексы для улучшения производительности
 CREATE INDEX idx_vm_hv_name ON virtual_machines(hv_name);
 CREATE INDEX idx_vm_creation_date ON virtual_machines(creation_date);
\ No newline at end of file
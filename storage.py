@@ -0,0 +1,2212 @@
+import io
+import csv
+import sqlite3
+import threading
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, date
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils import PlacementPolicy, PlacementIndex, ResourceCalculator, Validator, Formatter
+from metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Выбор гипервизора в Python: policy=rules - по правилам размещения, default - PlacementPolicy
+PLACEMENT_SECONDS = REGISTRY.histogram("datacenter_placement_seconds", "Выбор гипервизора для ВМ", ("policy",))
+
+# Хранение даты/времени в SQLite как текст ISO (без устаревших адаптеров по умолчанию)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class StorageBackend:
+    """Интерфейс хранилища учета кластера.
+    Реализации: PostgreSQL (database.Database), SQLite и хранилище в памяти"""
+
+    # Ключ строк истории загрузки, относящихся ко всему кластеру
+    HISTORY_CLUSTER_KEY = "__cluster__"
+    # Имя строки счетчика дискового пула в storage_pool
+    STORAGE_POOL = "main"
+
+    DEFAULT_CONFIG = [
+        ("cluster_name", "Moscow_Cluster"),
+        ("disk_pool", "1000000"),
+        ("overcommit_cpu", "3.0"),
+        ("overcommit_ram", "1.0"),
+        ("max_hypervisors", "24")
+    ]
+
+    # Причины отказа в создании ВМ, не зависящие от состояния соединения (повтор не поможет)
+    NO_CAPACITY_MESSAGE = "Нет доступных гипервизоров с достаточными ресурсами"
+    DISK_FULL_MESSAGE = "Недостаточно места в дисковом пуле"
+    PLACEMENT_RULES_MESSAGE = "Правила размещения не позволяют разместить ВМ ни на одном гипервизоре"
+    RESERVATION_MISSING_MESSAGE = "Резерв не найден, истек или исчерпан"
+    # Начало причины отказа при ошибке базы (соединение, сериализация, тайм-аут) - создание можно повторить
+    DB_ERROR_MESSAGE = "Ошибка базы данных"
+
+    # Срок резерва емкости по умолчанию (с): продлевается владельцем, истекшие освобождаются
+    RESERVATION_TTL = 300.0
+
+    # Очередь заданий развертывания с отдельными процессами-исполнителями
+    SUPPORTS_DEPLOY_QUEUE = False
+
+    # Таблицы, запись в которые меняет версию данных (get_data_version)
+    VERSIONED_TABLES = ('hypervisors', 'virtual_machines', 'cluster_config', 'placement_rules')
+
+    # Операции журнала: каждая запись несет изменения счетчиков гипервизора hv_name
+    # (d_cpu, d_ram - свободные ресурсы, d_vms - количество ВМ) и занятого места пула (d_disk)
+    JOURNAL_OPS = ('vm_create', 'vm_delete', 'vm_move_out', 'vm_move_in', 'hv_add', 'hv_delete', 'hv_resize',
+                   'reserve', 'release')
+
+    # Колонки выгрузки для анализа (export_csv) в порядке следования в CSV
+    EXPORT_COLUMNS = {
+        'hypervisors': ('hv_name', 'cpu', 'ram', 'free_cpu', 'free_ram', 'num_vms', 'created_at',
+                        'cpu_capacity', 'ram_capacity'),
+        'vms': ('vm_name', 'vcpu', 'vram', 'vhdd', 'hv_name', 'creation_date', 'vm_type')
+    }
+
+    def close(self):
+        """Освобождение соединений хранилища"""
+        pass
+
+    # Методы для работы с виртуальными машинами
+    def try_create_vm(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ: (True, гипервизор) или (False, причина отказа).
+        Временные ошибки хранилища пробрасываются исключением"""
+        raise NotImplementedError
+
+    def create_vm(self, vm_data: Dict[str, Any]) -> bool:
+        """Создание виртуальной машины"""
+        try:
+            created, message = self.try_create_vm(vm_data)
+        except Exception as e:
+            logger.error(f"Ошибка при создании ВМ: {e}")
+            return False
+
+        if created:
+            logger.info(f"ВМ {vm_data['vm_name']} успешно создана на гипервизоре {message}")
+        else:
+            logger.error(f"ВМ {vm_data['vm_name']} не создана: {message}")
+        return created
+
+    def get_all_vms(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_vm(self, vm_name: str) -> bool:
+        raise NotImplementedError
+
+    def delete_vms_bulk(self, vm_names: List[str]) -> int:
+        raise NotImplementedError
+
+    def delete_vms_on_hypervisor(self, hv_name: str) -> int:
+        """Удаление всех ВМ гипервизора. Возвращает количество удаленных ВМ"""
+        return self.delete_vms_bulk([vm['vm_name'] for vm in self.get_all_vms() if vm['hv_name'] == hv_name])
+
+    def delete_vms_created_before(self, cutoff: datetime) -> int:
+        """Удаление ВМ, созданных раньше cutoff (очистка за период). Возвращает количество удаленных ВМ"""
+        return self.delete_vms_bulk([vm['vm_name'] for vm in self.get_all_vms()
+                                     if vm.get('creation_date') and vm['creation_date'] < cutoff])
+
+    def create_vms_bulk(self, vms: List[Dict[str, Any]]) -> int:
+        """Загрузка ВМ с заданным размещением (hv_name, необязательно creation_date) одной транзакцией.
+        Гипервизор не выбирается и правила размещения не проверяются; при нарушении ограничений
+        или нехватке ресурсов не создается ни одна ВМ. Возвращает количество созданных ВМ"""
+        raise NotImplementedError
+
+    def migrate_vms(self, migrations: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    def drain_hypervisor(self, hv_name: str, exclude: Optional[List[str]] = None) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    # Методы для работы с гипервизорами
+    def add_hypervisor(self, hv_data: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def get_all_hypervisors(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_hypervisor(self, hv_name: str) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    def get_data_version(self) -> Optional[Any]:
+        """Токен версии данных для кэша отчетов: меняется при каждой записи в VERSIONED_TABLES.
+        None - версия неизвестна, отчеты не кэшируются"""
+        return None
+
+    # Выгрузка для анализа
+    def export_csv(self, kind: str) -> Optional[bytes]:
+        """Гипервизоры (kind='hypervisors') или ВМ ('vms') в CSV с заголовком, колонки EXPORT_COLUMNS.
+        Тип ВМ вычисляется при выгрузке. None - ошибка чтения"""
+        if kind == 'hypervisors':
+            rows = ([hv[column] for column in self.EXPORT_COLUMNS[kind]] for hv in self.get_all_hypervisors())
+        else:
+            rows = ([vm['vm_name'], vm['vcpu'], vm['vram'], vm['vhdd'], vm['hv_name'], vm['creation_date'],
+                     Formatter.format_vm_type(vm['vm_name'])] for vm in self.get_all_vms())
+        return self._write_csv(kind, rows)
+
+    @classmethod
+    def _write_csv(cls, kind: str, rows) -> bytes:
+        """CSV выгрузки: заголовок EXPORT_COLUMNS[kind], пустое поле - NULL"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(cls.EXPORT_COLUMNS[kind])
+        writer.writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    # Конфигурация и статистика
+    def get_cluster_config(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def set_overcommit(self, overcommit_cpu: float, overcommit_ram: float) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    def get_cluster_statistics(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def get_daily_growth(self) -> Dict[str, List[Tuple]]:
+        raise NotImplementedError
+
+    # История загрузки
+    def record_utilization_sample(self, ts: Optional[datetime] = None) -> int:
+        raise NotImplementedError
+
+    def rollup_utilization_history(self, raw_retention: timedelta = timedelta(days=2),
+                                   minute_retention: timedelta = timedelta(days=30),
+                                   hour_retention: timedelta = timedelta(days=730)) -> bool:
+        raise NotImplementedError
+
+    def get_utilization_history(self, hv_name: Optional[str] = None, start: Optional[datetime] = None,
+                                end: Optional[datetime] = None, max_points: int = 500) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # Контрольные точки массовых развертываний
+    def save_deploy_checkpoint(self, run_id: str, state: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def get_deploy_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_deploy_checkpoints(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # Правила размещения (группа ВМ - начало имени, см. utils.PlacementIndex)
+    def add_placement_rule(self, rule: Dict[str, Any]) -> Tuple[bool, str]:
+        """Добавление правила: (True, номер правила) или (False, причина)"""
+        raise NotImplementedError
+
+    def get_placement_rules(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_placement_rule(self, rule_id: int) -> bool:
+        raise NotImplementedError
+
+    def get_placement_counts(self) -> Dict[Tuple[int, str], int]:
+        """Количество ВМ группы каждого правила по гипервизорам: (rule_id, hv_name) -> ВМ"""
+        raise NotImplementedError
+
+    # Резервы емкости: места под ВМ одного размера удерживаются на гипервизорах и в дисковом пуле
+    # (свободные ресурсы уменьшаются сразу), ВМ создаются в зарезервированных местах
+    def reserve_capacity(self, vm_data: Dict[str, Any], count: int, ttl: Optional[float] = None,
+                         owner: str = "") -> Tuple[Optional[int], str]:
+        """Резерв count мест под ВМ размера vm_data (vcpu, vram, vhdd; по vm_name учитываются правила
+        размещения) на ttl секунд: все места или ни одного. Возвращает (номер резерва, '') или (None, причина)"""
+        raise NotImplementedError
+
+    def try_create_reserved_vm(self, reservation_id: int, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ в месте резерва (размер ВМ - размер резерва): (True, гипервизор) или (False, причина).
+        Ресурсы уже удержаны, поэтому отказ из-за нехватки емкости невозможен"""
+        raise NotImplementedError
+
+    def renew_reservation(self, reservation_id: int, ttl: Optional[float] = None) -> bool:
+        """Продление действующего резерва на ttl секунд от текущего момента"""
+        raise NotImplementedError
+
+    def release_reservation(self, reservation_id: int) -> int:
+        """Освобождение неиспользованных мест резерва. Возвращает количество освобожденных мест"""
+        raise NotImplementedError
+
+    def release_expired_reservations(self) -> int:
+        """Освобождение мест истекших резервов (фоновая очистка). Возвращает количество мест"""
+        raise NotImplementedError
+
+    def get_reservations(self) -> List[Dict[str, Any]]:
+        """Действующие и еще не очищенные резервы: {'reservation_id', 'owner', 'vcpu', 'vram', 'vhdd',
+        'expires_at', 'slots': {hv_name: свободных мест}}"""
+        raise NotImplementedError
+
+    # Журнал операций (только добавление записей) и снимки счетчиков
+    def get_journal(self, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Записи журнала с op_id больше after по возрастанию op_id"""
+        raise NotImplementedError
+
+    def create_journal_snapshot(self) -> Optional[int]:
+        """Снимок счетчиков гипервизоров и дискового пула, согласованный с позицией журнала.
+        Возвращает позицию снимка (op_id последней учтенной записи) или None при ошибке"""
+        raise NotImplementedError
+
+    def compact_journal(self, keep_snapshots: int = 2) -> int:
+        """Удаление снимков, кроме keep_snapshots последних, и записей журнала до самого раннего
+        из оставшихся снимков. Возвращает количество удаленных записей"""
+        raise NotImplementedError
+
+    def _read_journal(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]]:
+        """Последний снимок, записи журнала после него и текущие счетчики, прочитанные согласованно"""
+        raise NotImplementedError
+
+    def _write_counters(self, state: Dict[str, Any]):
+        """Запись счетчиков гипервизоров и дискового пула из восстановленного состояния"""
+        raise NotImplementedError
+
+    # Общая логика всех хранилищ
+    def get_placement_violations(self) -> List[str]:
+        """Нарушения правил размещения (правило добавлено позже ВМ, ручной перенос и т.п.)"""
+        index = self._placement_index(self.get_all_hypervisors())
+        return index.violations() if index else []
+
+    def check_invariants(self) -> List[str]:
+        """Сверка счетчиков с фактическими ВМ (вызывать без параллельных изменений):
+        свободные ресурсы и количество ВМ каждого гипервизора, занятое место дискового пула,
+        счетчики групп правил размещения. Возвращает описания расхождений"""
+        problems = []
+        vms = self.get_all_vms()
+        consumed = self._consumed(vms)
+        # Места резервов удерживают ресурсы гипервизоров и дискового пула
+        reserved_disk = 0
+        for reservation in self.get_reservations():
+            for hv_name, slots in reservation['slots'].items():
+                totals = consumed.setdefault(hv_name, [0, 0, 0])
+                totals[0] += slots * reservation['vcpu']
+                totals[1] += slots * reservation['vram']
+                reserved_disk += slots * reservation['vhdd']
+        for hv in self.get_all_hypervisors():
+            vcpu, vram, count = consumed.pop(hv['hv_name'], (0, 0, 0))
+            for field, expected in (('free_cpu', hv['cpu_capacity'] - vcpu),
+                                    ('free_ram', hv['ram_capacity'] - vram), ('num_vms', count)):
+                if hv[field] != expected:
+                    problems.append(f"{hv['hv_name']}: {field} = {hv[field]}, по ВМ должно быть {expected}")
+        for hv_name, (_, _, count) in consumed.items():
+            problems.append(f"{count} ВМ или резерв на несуществующем гипервизоре {hv_name}")
+
+        stats = self.get_cluster_statistics()
+        vhdd = sum(vm['vhdd'] for vm in vms) + reserved_disk
+        if 'total_vhdd' in stats and stats['total_vhdd'] != vhdd:
+            problems.append(f"Дисковый пул: занято {stats['total_vhdd']}, по ВМ должно быть {vhdd}")
+
+        expected_counts: Dict[Tuple[int, str], int] = {}
+        for rule in self.get_placement_rules():
+            for vm in vms:
+                if vm['vm_name'].startswith(rule['vm_prefix']):
+                    key = (rule['rule_id'], vm['hv_name'])
+                    expected_counts[key] = expected_counts.get(key, 0) + 1
+        actual_counts = {key: count for key, count in self.get_placement_counts().items() if count}
+        for key in sorted(set(expected_counts) | set(actual_counts)):
+            if expected_counts.get(key, 0) != actual_counts.get(key, 0):
+                problems.append(f"Правило {key[0]} на {key[1]}: счетчик {actual_counts.get(key, 0)}, "
+                                f"по ВМ должно быть {expected_counts.get(key, 0)}")
+        return problems
+
+    @staticmethod
+    def _counters(hypervisors: List[Dict[str, Any]], used_disk: int) -> Dict[str, Any]:
+        """Счетчики в формате снимка журнала: {'hypervisors': {hv_name: [free_cpu, free_ram, num_vms]}, 'used_disk'}"""
+        return {'hypervisors': {hv['hv_name']: [hv['free_cpu'], hv['free_ram'], hv['num_vms']] for hv in hypervisors},
+                'used_disk': used_disk}
+
+    @staticmethod
+    def _replay(snapshot: Dict[str, Any], tail: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Счетчики после применения записей журнала к снимку"""
+        hypervisors = {name: list(counters) for name, counters in snapshot['hypervisors'].items()}
+        used_disk = snapshot['used_disk']
+        for entry in tail:
+            if entry['op'] == 'hv_add':
+                hypervisors[entry['hv_name']] = [0, 0, 0]
+            counters = hypervisors.get(entry['hv_name'])
+            # Записи удаленных гипервизоров (каскадное удаление ВМ) на счетчики не влияют
+            if counters is not None:
+                counters[0] += entry['d_cpu']
+                counters[1] += entry['d_ram']
+                counters[2] += entry['d_vms']
+            if entry['op'] == 'hv_delete':
+                hypervisors.pop(entry['hv_name'], None)
+            used_disk += entry['d_disk']
+        return {'op_id': tail[-1]['op_id'] if tail else snapshot['op_id'], 'replayed': len(tail),
+                'hypervisors': hypervisors, 'used_disk': used_disk}
+
+    def replay_journal(self) -> Optional[Dict[str, Any]]:
+        """Восстановление счетчиков по последнему снимку и записям журнала после него:
+        {'op_id', 'replayed' (применено записей), 'hypervisors': {hv_name: [free_cpu, free_ram, num_vms]},
+        'used_disk'}. Время зависит от числа записей после снимка, а не от количества ВМ"""
+        journal = self._read_journal()
+        if journal is None:
+            return None
+        snapshot, tail, _ = journal
+        return self._replay(snapshot, tail)
+
+    def verify_counters(self) -> List[str]:
+        """Сверка текущих счетчиков с восстановленными по журналу (без просмотра всех ВМ,
+        полная сверка - check_invariants). Возвращает описания расхождений"""
+        journal = self._read_journal()
+        if journal is None:
+            return ["Не удалось прочитать журнал операций"]
+        snapshot, tail, current = journal
+        state = self._replay(snapshot, tail)
+        problems = []
+        for name in sorted(set(state['hypervisors']) | set(current['hypervisors'])):
+            expected, actual = state['hypervisors'].get(name), current['hypervisors'].get(name)
+            if expected is None or actual is None:
+                problems.append(f"{name}: гипервизор {'отсутствует в журнале' if expected is None else 'удален'}")
+                continue
+            for field, value, journal_value in zip(('free_cpu', 'free_ram', 'num_vms'), actual, expected):
+                if value != journal_value:
+                    problems.append(f"{name}: {field} = {value}, по журналу должно быть {journal_value}")
+        if current['used_disk'] != state['used_disk']:
+            problems.append(f"Дисковый пул: занято {current['used_disk']}, по журналу должно быть {state['used_disk']}")
+        return problems
+
+    def restore_counters(self) -> Tuple[bool, str]:
+        """Запись счетчиков, восстановленных по журналу (вызывать без параллельных изменений)"""
+        state = self.replay_journal()
+        if state is None:
+            return False, "Не удалось прочитать журнал операций"
+        try:
+            self._write_counters(state)
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении счетчиков по журналу: {e}")
+            return False, str(e)
+        logger.info(f"Счетчики восстановлены по журналу (позиция {state['op_id']}, "
+                    f"применено записей: {state['replayed']})")
+        return True, ""
+
+    def _placement_index(self, hypervisors: List[Dict[str, Any]]) -> Optional[PlacementIndex]:
+        """Индекс всех правил размещения по гипервизорам (None, если правил нет)"""
+        rules = self.get_placement_rules()
+        if not rules:
+            return None
+        return PlacementIndex([hv['hv_name'] for hv in hypervisors], rules, self.get_placement_counts())
+
+    def _matching_rules(self, vm_name: str) -> List[Dict[str, Any]]:
+        """Правила, группа которых включает ВМ"""
+        return [rule for rule in self.get_placement_rules() if vm_name.startswith(rule['vm_prefix'])]
+
+    def _choose_with_rules(self, hypervisors: List[Dict[str, Any]], counts: Dict[Tuple[int, str], int],
+                           vm_data: Dict[str, Any], rules: List[Dict[str, Any]]) -> Tuple[Optional[str], str]:
+        """Выбор гипервизора для ВМ группы правил: (имя, '') или (None, причина отказа)"""
+        with PLACEMENT_SECONDS.time("rules"):
+            index = PlacementIndex([hv['hv_name'] for hv in hypervisors], rules, counts)
+            hv, blocked = index.choose(hypervisors, vm_data['vcpu'], vm_data['vram'], vm_data['vm_name'])
+        if hv is None:
+            return None, self.PLACEMENT_RULES_MESSAGE if blocked else self.NO_CAPACITY_MESSAGE
+        return hv['hv_name'], ""
+
+    def get_overcommit(self) -> Tuple[float, float]:
+        """Коэффициенты переподписки CPU и RAM из кэшированной конфигурации"""
+        config = self.get_cluster_config()
+        return (float(config.get('overcommit_cpu', 3.0)),
+                float(config.get('overcommit_ram', 1.0)))
+
+    def _check_new_hypervisor(self, hv_data: Dict[str, Any], hv_count: int, exists: bool) -> str:
+        """Проверка ограничений при добавлении гипервизора, возвращает текст ошибки или пустую строку"""
+        max_hypervisors = int(self.get_cluster_config().get('max_hypervisors', 24))
+        if hv_count >= max_hypervisors:
+            return f"Достигнуто максимальное количество гипервизоров: {max_hypervisors}"
+        if hv_data['cpu'] < 24:  # Минимум 24 ядра CPU
+            return "CPU гипервизора должно быть не менее 24 ядер"
+        if hv_data['ram'] < 256:  # Минимум 256 ГБ RAM
+            return "RAM гипервизора должно быть не менее 256 ГБ"
+        if exists:
+            return f"Гипервизор с именем {hv_data['hv_name']} уже существует"
+        return ""
+
+    @staticmethod
+    def _consumed(vms: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+        """Ресурсы, занимаемые ВМ на каждом гипервизоре: hv_name -> [vcpu, vram, количество ВМ]"""
+        consumed: Dict[str, List[int]] = {}
+        for vm in vms:
+            totals = consumed.setdefault(vm['hv_name'], [0, 0, 0])
+            totals[0] += vm['vcpu']
+            totals[1] += vm['vram']
+            totals[2] += 1
+        return consumed
+
+    @staticmethod
+    def _plan_drain(hypervisors: List[Dict[str, Any]], vms: List[Dict[str, Any]], hv_name: str,
+                    exclude: Optional[List[str]] = None,
+                    index: Optional[PlacementIndex] = None) -> Tuple[Optional[List[Tuple]], str]:
+        """План переноса ВМ с гипервизора (first fit decreasing по правилам размещения).
+        vms должны быть отсортированы по убыванию размера, index - правила affinity/anti-affinity.
+        Возвращает список (vm_name, исходный hv, целевой hv, vcpu, vram) или None и текст ошибки"""
+        if not any(hv['hv_name'] == hv_name for hv in hypervisors):
+            return None, f"Гипервизор {hv_name} не найден"
+
+        excluded = set(exclude or []) | {hv_name}
+        targets = [dict(hv) for hv in hypervisors if hv['hv_name'] not in excluded]
+
+        moves = []
+        for vm in vms:
+            if index is None:
+                target = PlacementPolicy.choose_hypervisor(targets, vm['vcpu'], vm['vram'])
+            else:
+                target, blocked = index.choose(targets, vm['vcpu'], vm['vram'], vm['vm_name'])
+                if blocked:
+                    return None, f"Правила размещения не позволяют перенести ВМ {vm['vm_name']}"
+            if target is None:
+                return None, f"Недостаточно ресурсов для переноса ВМ {vm['vm_name']}"
+            if index is not None:
+                index.add_vm(vm['vm_name'], hv_name, -1)
+                index.add_vm(vm['vm_name'], target['hv_name'])
+
+            target['free_cpu'] -= vm['vcpu']
+            target['free_ram'] -= vm['vram']
+            target['num_vms'] += 1
+            moves.append((vm['vm_name'], hv_name, target['hv_name'], vm['vcpu'], vm['vram']))
+        return moves, ""
+
+    def _plan_reservation(self, hypervisors: List[Dict[str, Any]], vm_data: Dict[str, Any],
+                          count: int) -> Tuple[Optional[Dict[str, int]], str]:
+        """Распределение мест резерва по гипервизорам (по одному месту, как при создании ВМ).
+        Возвращает ({hv_name: мест}, '') или (None, причина)"""
+        is_valid, message = Validator.validate_vm_resources(vm_data['vcpu'], vm_data['vram'], vm_data['vhdd'])
+        if not is_valid:
+            return None, message
+        if count <= 0:
+            return None, "Количество мест резерва должно быть больше 0"
+        vm_name = vm_data.get('vm_name')
+        index = self._placement_index(hypervisors) if vm_name and self._matching_rules(vm_name) else None
+        targets = [dict(hv) for hv in hypervisors]
+        plan: Dict[str, int] = {}
+        for _ in range(count):
+            if index is None:
+                target = PlacementPolicy.choose_hypervisor(targets, vm_data['vcpu'], vm_data['vram'])
+            else:
+                target, blocked = index.choose(targets, vm_data['vcpu'], vm_data['vram'], vm_name)
+                if blocked:
+                    return None, self.PLACEMENT_RULES_MESSAGE
+            if target is None:
+                return None, self.NO_CAPACITY_MESSAGE
+            if index is not None:
+                index.add_vm(vm_name, target['hv_name'])
+            target['free_cpu'] -= vm_data['vcpu']
+            target['free_ram'] -= vm_data['vram']
+            target['num_vms'] += 1
+            plan[target['hv_name']] = plan.get(target['hv_name'], 0) + 1
+        return plan, ""
+
+    @staticmethod
+    def _build_statistics(totals: Tuple, storage: Optional[Tuple],
+                          overcommit_cpu: float, overcommit_ram: float) -> Dict[str, Any]:
+        """Статистика кластера по счетчикам.
+        totals - (гипервизоров, CPU, RAM, свободно vCPU, свободно vRAM, ВМ, емкость vCPU, емкость vRAM),
+        storage - (емкость дискового пула, занято)"""
+        stats = {}
+        if totals:
+            stats['total_hypervisors'] = totals[0] or 0
+            stats['total_cpu'] = totals[1] or 0
+            stats['total_ram'] = totals[2] or 0
+            stats['free_cpu'] = totals[3] or 0
+            stats['free_ram'] = totals[4] or 0
+            stats['total_vms'] = totals[5] or 0
+            # Емкость и свободные ресурсы в виртуальных единицах (с учетом переподписки)
+            stats['vcpu_capacity'] = int(totals[6] or 0)
+            stats['vram_capacity'] = int(totals[7] or 0)
+            stats['cpu_usage_percent'] = ResourceCalculator.calculate_cpu_usage(
+                stats['vcpu_capacity'], stats['free_cpu'])
+            stats['ram_usage_percent'] = ResourceCalculator.calculate_ram_usage(
+                stats['vram_capacity'], stats['free_ram'])
+
+            # Ресурсы ВМ по счетчикам гипервизоров: занято = емкость - свободно
+            stats['vm_count'] = stats['total_vms']
+            stats['total_vcpu'] = stats['vcpu_capacity'] - stats['free_cpu']
+            stats['total_vram'] = stats['vram_capacity'] - stats['free_ram']
+            # Эквивалент в физических ресурсах
+            stats['used_physical_cpu'] = round(ResourceCalculator.calculate_required_physical_cpu(
+                stats['total_vcpu'], overcommit_cpu), 1)
+            stats['used_physical_ram'] = round(stats['total_vram'] / overcommit_ram, 1)
+
+        if storage:
+            stats['disk_pool'] = storage[0]
+            stats['total_vhdd'] = storage[1]
+            stats['free_disk'] = storage[0] - storage[1]
+            stats['disk_usage_percent'] = storage[1] / storage[0] * 100
+
+        return stats
+
+
+class SQLiteDatabase(StorageBackend):
+    """Встроенное хранилище SQLite (режим WAL) для однопользовательской установки.
+    path=':memory:' - база в памяти процесса, config - начальная конфигурация новой базы"""
+
+    def __init__(self, path: str = "datacenter.db", config: Optional[Dict[str, str]] = None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._config_cache = None
+        self._rules_cache = None
+        self._commits = 0
+
+        # Одно соединение на процесс: операции сериализуются блокировкой
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+        self._create_tables()
+        self._initialize_cluster(config)
+
+    def close(self):
+        """Закрытие соединения с базой"""
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция с блокировкой записи на все время выполнения"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+                self._commits += 1
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_data_version(self) -> Optional[Any]:
+        """Свои фиксации считаются в процессе (с запасом - любые транзакции записи),
+        фиксации других соединений с файлом видны по PRAGMA data_version"""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0], self._commits
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        """Чтение строк в виде словарей"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def _create_tables(self):
+        """Создание таблиц (ограничения как в PostgreSQL)"""
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS hypervisors (
+                    hv_name VARCHAR(50) PRIMARY KEY,
+                    cpu INTEGER NOT NULL CHECK (cpu > 0),
+                    ram INTEGER NOT NULL CHECK (ram > 0),
+                    free_cpu INTEGER NOT NULL CHECK (free_cpu >= 0),
+                    free_ram INTEGER NOT NULL CHECK (free_ram >= 0),
+                    num_vms INTEGER DEFAULT 0 CHECK (num_vms >= 0),
+                    created_at TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS virtual_machines (
+                    vm_name VARCHAR(50) PRIMARY KEY,
+                    vcpu INTEGER NOT NULL CHECK (vcpu BETWEEN 2 AND 24 AND vcpu % 2 = 0),
+                    vram INTEGER NOT NULL CHECK (vram BETWEEN 4 AND 128),
+                    vhdd INTEGER NOT NULL CHECK (vhdd BETWEEN 40 AND 4096),
+                    hv_name VARCHAR(50) NOT NULL,
+                    creation_date TIMESTAMP,
+                    FOREIGN KEY (hv_name) REFERENCES hypervisors(hv_name) ON DELETE CASCADE
+                );
+                CREATE TABLE IF NOT EXISTS cluster_config (
+                    config_key VARCHAR(50) PRIMARY KEY,
+                    config_value VARCHAR(200),
+                    updated_at TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS storage_pool (
+                    pool_name VARCHAR(50) PRIMARY KEY,
+                    capacity INTEGER NOT NULL CHECK (capacity > 0),
+                    used_disk INTEGER NOT NULL DEFAULT 0 CHECK (used_disk >= 0)
+                );
+                CREATE INDEX IF NOT EXISTS idx_vm_hv_name ON virtual_machines(hv_name);
+                CREATE TABLE IF NOT EXISTS placement_rules (
+                    rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind VARCHAR(20) NOT NULL CHECK (kind IN ('spread', 'max_per_host', 'pin')),
+                    vm_prefix VARCHAR(50) NOT NULL,
+                    max_per_host INTEGER CHECK (max_per_host > 0),
+                    hosts TEXT,
+                    created_at TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS placement_counts (
+                    rule_id INTEGER NOT NULL REFERENCES placement_rules(rule_id) ON DELETE CASCADE,
+                    hv_name VARCHAR(50) NOT NULL REFERENCES hypervisors(hv_name) ON DELETE CASCADE,
+                    vm_count INTEGER NOT NULL DEFAULT 0 CHECK (vm_count >= 0),
+                    PRIMARY KEY (rule_id, hv_name)
+                );
+                -- Счетчики ВМ групп правил обновляются при любом изменении размещения ВМ
+                CREATE TRIGGER IF NOT EXISTS trg_placement_vm_insert AFTER INSERT ON virtual_machines
+                BEGIN
+                    INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+                    SELECT rule_id, NEW.hv_name, 1 FROM placement_rules WHERE NEW.vm_name LIKE vm_prefix || '%'
+                    ON CONFLICT (rule_id, hv_name) DO UPDATE SET vm_count = vm_count + 1;
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_placement_vm_delete AFTER DELETE ON virtual_machines
+                BEGIN
+                    UPDATE placement_counts SET vm_count = vm_count - 1
+                    WHERE hv_name = OLD.hv_name
+                      AND rule_id IN (SELECT rule_id FROM placement_rules WHERE OLD.vm_name LIKE vm_prefix || '%');
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_placement_vm_move AFTER UPDATE OF hv_name ON virtual_machines
+                BEGIN
+                    UPDATE placement_counts SET vm_count = vm_count - 1
+                    WHERE hv_name = OLD.hv_name
+                      AND rule_id IN (SELECT rule_id FROM placement_rules WHERE OLD.vm_name LIKE vm_prefix || '%');
+                    INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+                    SELECT rule_id, NEW.hv_name, 1 FROM placement_rules WHERE NEW.vm_name LIKE vm_prefix || '%'
+                    ON CONFLICT (rule_id, hv_name) DO UPDATE SET vm_count = vm_count + 1;
+                END;
+                -- Журнал операций: записи добавляются триггерами в транзакции операции
+                CREATE TABLE IF NOT EXISTS operation_journal (
+                    op_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+                    op VARCHAR(20) NOT NULL,
+                    vm_name VARCHAR(50),
+                    hv_name VARCHAR(50) NOT NULL,
+                    d_cpu INTEGER NOT NULL DEFAULT 0,
+                    d_ram INTEGER NOT NULL DEFAULT 0,
+                    d_vms INTEGER NOT NULL DEFAULT 0,
+                    d_disk INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS journal_snapshots (
+                    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op_id INTEGER NOT NULL,
+                    created_at TIMESTAMP,
+                    used_disk INTEGER NOT NULL,
+                    hypervisors TEXT NOT NULL
+                );
+                CREATE TRIGGER IF NOT EXISTS trg_journal_vm_insert AFTER INSERT ON virtual_machines
+                BEGIN
+                    INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                    VALUES ('vm_create', NEW.vm_name, NEW.hv_name, -NEW.vcpu, -NEW.vram, 1, NEW.vhdd);
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_journal_vm_delete AFTER DELETE ON virtual_machines
+                BEGIN
+                    INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                    VALUES ('vm_delete', OLD.vm_name, OLD.hv_name, OLD.vcpu, OLD.vram, -1, -OLD.vhdd);
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_journal_vm_move AFTER UPDATE OF hv_name, vcpu, vram, vhdd
+                ON virtual_machines
+                BEGIN
+                    INSERT INTO operation_journal (op, vm_name, hv_name, d_cpu, d_ram, d_vms, d_disk)
+                    VALUES ('vm_move_out', OLD.vm_name, OLD.hv_name, OLD.vcpu, OLD.vram, -1, -OLD.vhdd),
+                           ('vm_move_in', NEW.vm_name, NEW.hv_name, -NEW.vcpu, -NEW.vram, 1, NEW.vhdd);
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_journal_hv_insert AFTER INSERT ON hypervisors
+                BEGIN
+                    INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_vms)
+                    VALUES ('hv_add', NEW.hv_name, NEW.free_cpu, NEW.free_ram, NEW.num_vms);
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_journal_hv_delete AFTER DELETE ON hypervisors
+                BEGIN
+                    INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_vms)
+                    VALUES ('hv_delete', OLD.hv_name, -OLD.free_cpu, -OLD.free_ram, -OLD.num_vms);
+                END;
+                -- Резервы емкости: места удерживают ресурсы гипервизоров и дискового пула до создания ВМ
+                CREATE TABLE IF NOT EXISTS capacity_reservations (
+                    reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner VARCHAR(64) NOT NULL DEFAULT '',
+                    vcpu INTEGER NOT NULL CHECK (vcpu > 0),
+                    vram INTEGER NOT NULL CHECK (vram > 0),
+                    vhdd INTEGER NOT NULL CHECK (vhdd > 0),
+                    created_at TIMESTAMP,
+                    expires_at TIMESTAMP NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS reservation_slots (
+                    reservation_id INTEGER NOT NULL REFERENCES capacity_reservations(reservation_id) ON DELETE CASCADE,
+                    hv_name VARCHAR(50) NOT NULL REFERENCES hypervisors(hv_name),
+                    slots INTEGER NOT NULL CHECK (slots >= 0),
+                    PRIMARY KEY (reservation_id, hv_name)
+                );
+                CREATE TABLE IF NOT EXISTS deploy_checkpoints (
+                    run_id VARCHAR(64) PRIMARY KEY,
+                    status VARCHAR(20) NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS utilization_history (
+                    ts TIMESTAMP NOT NULL,
+                    hv_name VARCHAR(50) NOT NULL,
+                    cpu_usage REAL NOT NULL,
+                    ram_usage REAL NOT NULL,
+                    num_vms INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_hv_ts ON utilization_history(hv_name, ts);
+                CREATE TABLE IF NOT EXISTS utilization_history_1m (
+                    bucket TIMESTAMP NOT NULL,
+                    hv_name VARCHAR(50) NOT NULL,
+                    cpu_avg REAL NOT NULL,
+                    cpu_max REAL NOT NULL,
+                    ram_avg REAL NOT NULL,
+                    ram_max REAL NOT NULL,
+                    num_vms_max INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (hv_name, bucket)
+                );
+                CREATE TABLE IF NOT EXISTS utilization_history_1h (
+                    bucket TIMESTAMP NOT NULL,
+                    hv_name VARCHAR(50) NOT NULL,
+                    cpu_avg REAL NOT NULL,
+                    cpu_max REAL NOT NULL,
+                    ram_avg REAL NOT NULL,
+                    ram_max REAL NOT NULL,
+                    num_vms_max INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (hv_name, bucket)
+                );
+            """)
+
+    def _initialize_cluster(self, config: Optional[Dict[str, str]] = None):
+        """Инициализация конфигурации кластера и счетчика дискового пула
+        (емкость пула при каждом открытии берется из disk_pool)"""
+        configs = dict(self.DEFAULT_CONFIG)
+        configs.update(config or {})
+        with self._transaction() as conn:
+            conn.executemany("""
+                INSERT INTO cluster_config (config_key, config_value, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (config_key) DO NOTHING
+            """, [(key, value, datetime.now()) for key, value in configs.items()])
+            conn.execute("""
+                INSERT INTO storage_pool (pool_name, capacity, used_disk)
+                SELECT ?,
+                       (SELECT CAST(config_value AS INTEGER) FROM cluster_config WHERE config_key = 'disk_pool'),
+                       (SELECT COALESCE(SUM(vhdd), 0) FROM virtual_machines)
+                ON CONFLICT (pool_name) DO UPDATE SET capacity = excluded.capacity
+            """, (self.STORAGE_POOL,))
+            # Первый снимок - состояние на момент появления журнала
+            if conn.execute("SELECT 1 FROM journal_snapshots LIMIT 1").fetchone() is None:
+                self._snapshot(conn)
+
+    # Методы для работы с виртуальными машинами
+    def try_create_vm(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ с причиной отказа (ошибки ограничений - отказ, блокировка базы - исключение)"""
+        try:
+            rules = self._matching_rules(vm_data['vm_name'])
+            with self._transaction() as conn:
+                if rules:
+                    hv_name, message = self._place_with_rules(conn, vm_data, rules)
+                    if hv_name is None:
+                        return False, message
+                else:
+                    result = conn.execute("""
+                        SELECT hv_name FROM hypervisors
+                        WHERE free_cpu >= ? AND free_ram >= ?
+                        ORDER BY num_vms ASC, free_cpu DESC
+                        LIMIT 1
+                    """, (vm_data['vcpu'], vm_data['vram'])).fetchone()
+                    if not result:
+                        return False, self.NO_CAPACITY_MESSAGE
+                    hv_name = result[0]
+
+                reserved = conn.execute("""
+                    UPDATE storage_pool SET used_disk = used_disk + ?
+                    WHERE pool_name = ? AND used_disk + ? <= capacity
+                """, (vm_data['vhdd'], self.STORAGE_POOL, vm_data['vhdd'])).rowcount
+                if not reserved:
+                    return False, self.DISK_FULL_MESSAGE
+
+                conn.execute("""
+                    INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (vm_data['vm_name'], vm_data['vcpu'], vm_data['vram'],
+                      vm_data['vhdd'], hv_name, datetime.now()))
+                conn.execute("""
+                    UPDATE hypervisors
+                    SET free_cpu = free_cpu - ?, free_ram = free_ram - ?, num_vms = num_vms + 1
+                    WHERE hv_name = ?
+                """, (vm_data['vcpu'], vm_data['vram'], hv_name))
+
+            return True, hv_name
+
+        except sqlite3.IntegrityError as e:
+            return False, str(e)
+
+    def _place_with_rules(self, conn, vm_data: Dict[str, Any],
+                          rules: List[Dict[str, Any]]) -> Tuple[Optional[str], str]:
+        """Выбор гипервизора по счетчикам групп правил (внутри транзакции создания ВМ)"""
+        hypervisors = [dict(row) for row in conn.execute("""
+            SELECT hv_name, free_cpu, free_ram, num_vms FROM hypervisors
+            WHERE free_cpu >= ? AND free_ram >= ?
+            ORDER BY hv_name
+        """, (vm_data['vcpu'], vm_data['vram']))]
+        rule_ids = [rule['rule_id'] for rule in rules]
+        counts = {(row['rule_id'], row['hv_name']): row['vm_count'] for row in conn.execute(
+            f"SELECT rule_id, hv_name, vm_count FROM placement_counts WHERE rule_id IN ({','.join('?' * len(rule_ids))})",
+            rule_ids)}
+        return self._choose_with_rules(hypervisors, counts, vm_data, rules)
+
+    def get_all_vms(self) -> List[Dict[str, Any]]:
+        """Получение всех виртуальных машин"""
+        try:
+            return self._query("""
+                SELECT vm_name, vcpu, vram, vhdd, hv_name, creation_date
+                FROM virtual_machines
+                ORDER BY vm_name
+            """)
+        except Exception as e:
+            logger.error(f"Ошибка при получении ВМ: {e}")
+            return []
+
+    def delete_vm(self, vm_name: str) -> bool:
+        """Удаление виртуальной машины"""
+        return self.delete_vms_bulk([vm_name]) == 1
+
+    def delete_vms_bulk(self, vm_names: List[str]) -> int:
+        """Массовое удаление ВМ с освобождением ресурсов (одно обновление на гипервизор)"""
+        if not vm_names:
+            return 0
+        try:
+            deleted_count = 0
+            with self._transaction() as conn:
+                # Ограничение SQLite на количество параметров в запросе
+                names = list(vm_names)
+                for offset in range(0, len(names), 500):
+                    chunk = names[offset:offset + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    released = conn.execute(f"""
+                        SELECT hv_name, SUM(vcpu), SUM(vram), SUM(vhdd), COUNT(*)
+                        FROM virtual_machines
+                        WHERE vm_name IN ({placeholders})
+                        GROUP BY hv_name
+                    """, chunk).fetchall()
+                    conn.execute(f"DELETE FROM virtual_machines WHERE vm_name IN ({placeholders})", chunk)
+                    conn.executemany("""
+                        UPDATE hypervisors
+                        SET free_cpu = free_cpu + ?, free_ram = free_ram + ?, num_vms = num_vms - ?
+                        WHERE hv_name = ?
+                    """, [(vcpu, vram, cnt, hv_name) for hv_name, vcpu, vram, _, cnt in released])
+                    conn.execute("UPDATE storage_pool SET used_disk = used_disk - ? WHERE pool_name = ?",
+                                 (sum(row[3] for row in released), self.STORAGE_POOL))
+                    deleted_count += sum(row[4] for row in released)
+
+            logger.info(f"Удалено ВМ: {deleted_count} из {len(vm_names)}")
+            return deleted_count
+
+        except Exception as e:
+            logger.error(f"Ошибка при массовом удалении ВМ: {e}")
+            return 0
+
+    def create_vms_bulk(self, vms: List[Dict[str, Any]]) -> int:
+        """Загрузка ВМ с заданным размещением одной транзакцией"""
+        if not vms:
+            return 0
+        try:
+            now = datetime.now()
+            with self._transaction() as conn:
+                conn.executemany("""
+                    INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, [(vm['vm_name'], vm['vcpu'], vm['vram'], vm['vhdd'], vm['hv_name'],
+                       vm.get('creation_date') or now) for vm in vms])
+                conn.executemany("""
+                    UPDATE hypervisors
+                    SET free_cpu = free_cpu - ?, free_ram = free_ram - ?, num_vms = num_vms + ?
+                    WHERE hv_name = ?
+                """, [(vcpu, vram, cnt, hv_name) for hv_name, (vcpu, vram, cnt) in self._consumed(vms).items()])
+                disk = sum(vm['vhdd'] for vm in vms)
+                reserved = conn.execute("""
+                    UPDATE storage_pool SET used_disk = used_disk + ?
+                    WHERE pool_name = ? AND used_disk + ? <= capacity
+                """, (disk, self.STORAGE_POOL, disk)).rowcount
+                if not reserved:
+                    raise ValueError(self.DISK_FULL_MESSAGE)
+
+            logger.info(f"Загружено ВМ: {len(vms)}")
+            return len(vms)
+
+        except Exception as e:
+            logger.error(f"Ошибка при массовой загрузке ВМ: {e}")
+            return 0
+
+    def _move_vms(self, conn, moves: List[Tuple[str, str, str, int, int]]):
+        """Перенос ВМ между гипервизорами в текущей транзакции"""
+        conn.executemany("UPDATE virtual_machines SET hv_name = ? WHERE vm_name = ?",
+                         [(target, vm_name) for vm_name, _, target, _, _ in moves])
+        deltas: Dict[str, List[int]] = {}
+        for _, source, target, vcpu, vram in moves:
+            src = deltas.setdefault(source, [0, 0, 0])
+            dst = deltas.setdefault(target, [0, 0, 0])
+            src[0] += vcpu
+            src[1] += vram
+            src[2] -= 1
+            dst[0] -= vcpu
+            dst[1] -= vram
+            dst[2] += 1
+        conn.executemany("""
+            UPDATE hypervisors
+            SET free_cpu = free_cpu + ?, free_ram = free_ram + ?, num_vms = num_vms + ?
+            WHERE hv_name = ?
+        """, [(cpu, ram, cnt, hv_name) for hv_name, (cpu, ram, cnt) in deltas.items()])
+
+    def migrate_vms(self, migrations: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        """Перенос ВМ на указанные гипервизоры в одной транзакции"""
+        if not migrations:
+            return True, ""
+        try:
+            targets = dict(migrations)
+            with self._transaction() as conn:
+                vms = [conn.execute("SELECT vm_name, hv_name, vcpu, vram FROM virtual_machines WHERE vm_name = ?",
+                                    (vm_name,)).fetchone() for vm_name in targets]
+                if not all(vms):
+                    raise LookupError("Часть ВМ для переноса не найдена")
+
+                moves = [(vm_name, hv_name, targets[vm_name], vcpu, vram)
+                         for vm_name, hv_name, vcpu, vram in vms
+                         if hv_name != targets[vm_name]]
+                self._move_vms(conn, moves)
+
+            logger.info(f"Перенесено ВМ: {len(moves)}")
+            return True, ""
+
+        except Exception as e:
+            logger.error(f"Ошибка при переносе ВМ: {e}")
+            return False, str(e)
+
+    def drain_hypervisor(self, hv_name: str, exclude: Optional[List[str]] = None) -> Tuple[bool, str]:
+        """Перенос всех ВМ гипервизора на другие гипервизоры в одной транзакции"""
+        try:
+            with self._transaction() as conn:
+                hypervisors = [dict(row) for row in conn.execute(
+                    "SELECT hv_name, free_cpu, free_ram, num_vms FROM hypervisors ORDER BY hv_name")]
+                vms = [dict(row) for row in conn.execute("""
+                    SELECT vm_name, vcpu, vram FROM virtual_machines
+                    WHERE hv_name = ? ORDER BY vcpu DESC, vram DESC
+                """, (hv_name,))]
+
+                moves, message = self._plan_drain(hypervisors, vms, hv_name, exclude,
+                                                  self._placement_index(hypervisors))
+                if moves is None:
+                    return False, message
+                self._move_vms(conn, moves)
+
+            logger.info(f"Гипервизор {hv_name} освобожден, перенесено ВМ: {len(moves)}")
+            return True, ""
+
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении гипервизора: {e}")
+            return False, str(e)
+
+    # Методы для работы с гипервизорами
+    def add_hypervisor(self, hv_data: Dict[str, Any]) -> bool:
+        """Добавление гипервизора"""
+        try:
+            with self._transaction() as conn:
+                # Коэффициенты читаются под блокировкой записи, а не из кэша процесса
+                ratios = dict(conn.execute("""
+                    SELECT config_key, config_value FROM cluster_config
+                    WHERE config_key IN ('overcommit_cpu', 'overcommit_ram')
+                """).fetchall())
+                overcommit_cpu = float(ratios.get('overcommit_cpu', 3.0))
+                overcommit_ram = float(ratios.get('overcommit_ram', 1.0))
+                hv_count = conn.execute("SELECT COUNT(*) FROM hypervisors").fetchone()[0]
+                exists = conn.execute("SELECT 1 FROM hypervisors WHERE hv_name = ?",
+                                      (hv_data['hv_name'],)).fetchone() is not None
+                error = self._check_new_hypervisor(hv_data, hv_count, exists)
+                if error:
+                    logger.error(error)
+                    return False
+
+                conn.execute("""
+                    INSERT INTO hypervisors (hv_name, cpu, ram, free_cpu, free_ram, num_vms, created_at)
+                    VALUES (?, ?, ?, ?, ?, 0, ?)
+                """, (hv_data['hv_name'], hv_data['cpu'], hv_data['ram'],
+                      ResourceCalculator.calculate_capacity(hv_data['cpu'], overcommit_cpu),
+                      ResourceCalculator.calculate_capacity(hv_data['ram'], overcommit_ram), datetime.now()))
+
+            logger.info(f"Гипервизор {hv_data['hv_name']} успешно добавлен")
+            return True
+
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении гипервизора: {e}")
+            return False
+
+    def get_all_hypervisors(self) -> List[Dict[str, Any]]:
+        """Получение всех гипервизоров (с емкостью в виртуальных единицах)"""
+        try:
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            hvs = self._query("""
+                SELECT hv_name, cpu, ram, free_cpu, free_ram, num_vms, created_at
+                FROM hypervisors
+                ORDER BY hv_name
+            """)
+            for hv in hvs:
+                hv['cpu_capacity'] = ResourceCalculator.calculate_capacity(hv['cpu'], overcommit_cpu)
+                hv['ram_capacity'] = ResourceCalculator.calculate_capacity(hv['ram'], overcommit_ram)
+            return hvs
+        except Exception as e:
+            logger.error(f"Ошибка при получении гипервизоров: {e}")
+            return []
+
+    def export_csv(self, kind: str) -> Optional[bytes]:
+        """Выгрузка ВМ кортежами курсора, без промежуточных словарей"""
+        if kind == 'hypervisors':
+            return super().export_csv(kind)
+        try:
+            with self._lock:
+                return self._write_csv(kind, self._conn.execute("""
+                    SELECT vm_name, vcpu, vram, vhdd, hv_name, creation_date,
+                           CASE WHEN instr(vm_name, 'app') > 0 THEN 'Сервер приложений'
+                                WHEN instr(vm_name, 'db') > 0 THEN 'Сервер БД'
+                                WHEN instr(vm_name, 'ts') > 0 THEN 'Терминальный сервер'
+                                ELSE 'Неизвестный' END
+                    FROM virtual_machines
+                    ORDER BY vm_name
+                """))
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке ВМ: {e}")
+            return None
+
+    def delete_hypervisor(self, hv_name: str) -> Tuple[bool, str]:
+        """Удаление гипервизора"""
+        try:
+            with self._transaction() as conn:
+                vm_count = conn.execute("SELECT COUNT(*) FROM virtual_machines WHERE hv_name = ?",
+                                        (hv_name,)).fetchone()[0]
+                if vm_count > 0:
+                    return False, f"На гипервизоре {hv_name} запущено {vm_count} ВМ"
+                slots = conn.execute("SELECT COALESCE(SUM(slots), 0) FROM reservation_slots WHERE hv_name = ?",
+                                     (hv_name,)).fetchone()[0]
+                if slots > 0:
+                    return False, f"На гипервизоре {hv_name} зарезервировано мест: {slots}"
+                conn.execute("DELETE FROM reservation_slots WHERE hv_name = ?", (hv_name,))
+                conn.execute("DELETE FROM hypervisors WHERE hv_name = ?", (hv_name,))
+
+            logger.info(f"Гипервизор {hv_name} успешно удален")
+            return True, ""
+
+        except Exception as e:
+            logger.error(f"Ошибка при удалении гипервизора: {e}")
+            return False, str(e)
+
+    # Конфигурация и статистика
+    def get_cluster_config(self) -> Dict[str, str]:
+        """Получение конфигурации кластера (кэш сверяется с версией данных:
+        файл базы может изменить другой процесс)"""
+        try:
+            version = self.get_data_version()
+            if self._config_cache is not None and self._config_cache[0] == version:
+                return dict(self._config_cache[1])
+            rows = self._query("SELECT config_key, config_value FROM cluster_config")
+            self._config_cache = (version, {row['config_key']: row['config_value'] for row in rows})
+            return dict(self._config_cache[1])
+        except Exception as e:
+            logger.error(f"Ошибка при получении конфигурации кластера: {e}")
+            return {}
+
+    def set_overcommit(self, overcommit_cpu: float, overcommit_ram: float) -> Tuple[bool, str]:
+        """Изменение коэффициентов переподписки со сдвигом свободной емкости гипервизоров"""
+        try:
+            old_cpu, old_ram = self.get_overcommit()
+            with self._transaction() as conn:
+                rows = conn.execute("SELECT hv_name, cpu, ram FROM hypervisors").fetchall()
+                shifts = [(ResourceCalculator.calculate_capacity(cpu, overcommit_cpu) -
+                           ResourceCalculator.calculate_capacity(cpu, old_cpu),
+                           ResourceCalculator.calculate_capacity(ram, overcommit_ram) -
+                           ResourceCalculator.calculate_capacity(ram, old_ram), hv_name)
+                          for hv_name, cpu, ram in rows]
+                conn.executemany("""
+                    UPDATE hypervisors SET free_cpu = free_cpu + ?, free_ram = free_ram + ? WHERE hv_name = ?
+                """, shifts)
+                conn.executemany("""
+                    INSERT INTO operation_journal (op, d_cpu, d_ram, hv_name) VALUES ('hv_resize', ?, ?, ?)
+                """, shifts)
+                conn.executemany("""
+                    INSERT INTO cluster_config (config_key, config_value, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (config_key)
+                    DO UPDATE SET config_value = excluded.config_value, updated_at = excluded.updated_at
+                """, [('overcommit_cpu', str(overcommit_cpu), datetime.now()),
+                      ('overcommit_ram', str(overcommit_ram), datetime.now())])
+
+            self._config_cache = None
+            logger.info(f"Переподписка изменена: CPU {overcommit_cpu}, RAM {overcommit_ram}")
+            return True, ""
+
+        except Exception as e:
+            self._config_cache = None
+            logger.error(f"Ошибка при изменении переподписки: {e}")
+            return False, str(e)
+
+    def get_cluster_statistics(self) -> Dict[str, Any]:
+        """Получение статистики кластера по счетчикам"""
+        try:
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            hvs = self.get_all_hypervisors()
+            storage = self._query("SELECT capacity, used_disk FROM storage_pool WHERE pool_name = ?",
+                                  (self.STORAGE_POOL,))
+            totals = (len(hvs), sum(hv['cpu'] for hv in hvs), sum(hv['ram'] for hv in hvs),
+                      sum(hv['free_cpu'] for hv in hvs), sum(hv['free_ram'] for hv in hvs),
+                      sum(hv['num_vms'] for hv in hvs),
+                      sum(hv['cpu_capacity'] for hv in hvs), sum(hv['ram_capacity'] for hv in hvs))
+            return self._build_statistics(
+                totals, (storage[0]['capacity'], storage[0]['used_disk']) if storage else None,
+                overcommit_cpu, overcommit_ram)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики кластера: {e}")
+            return {}
+
+    def get_daily_growth(self) -> Dict[str, List[Tuple]]:
+        """Агрегаты создания ВМ и гипервизоров по дням (для прогнозирования)"""
+        try:
+            vms = self._query("""
+                SELECT date(creation_date) AS day, COUNT(*) AS cnt, SUM(vcpu) AS vcpu,
+                       SUM(vram) AS vram, SUM(vhdd) AS vhdd
+                FROM virtual_machines
+                WHERE creation_date IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
+            """)
+            hypervisors = self._query("""
+                SELECT date(created_at) AS day, COUNT(*) AS cnt
+                FROM hypervisors
+                WHERE created_at IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
+            """)
+            return {
+                'vms': [(date.fromisoformat(row['day']), row['cnt'], row['vcpu'], row['vram'], row['vhdd'])
+                        for row in vms],
+                'hypervisors': [(date.fromisoformat(row['day']), row['cnt']) for row in hypervisors]
+            }
+        except Exception as e:
+            logger.error(f"Ошибка при получении динамики роста: {e}")
+            return {'vms': [], 'hypervisors': []}
+
+    # Правила размещения
+    def add_placement_rule(self, rule: Dict[str, Any]) -> Tuple[bool, str]:
+        """Добавление правила с расчетом счетчиков по уже размещенным ВМ"""
+        is_valid, message = Validator.validate_placement_rule(rule)
+        if not is_valid:
+            return False, message
+        try:
+            with self._transaction() as conn:
+                rule_id = conn.execute("""
+                    INSERT INTO placement_rules (kind, vm_prefix, max_per_host, hosts, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (rule['kind'], rule['vm_prefix'], rule.get('max_per_host'),
+                      json.dumps(rule['hosts']) if rule.get('hosts') else None, datetime.now())).lastrowid
+                conn.execute("""
+                    INSERT INTO placement_counts (rule_id, hv_name, vm_count)
+                    SELECT ?, hv_name, COUNT(*) FROM virtual_machines
+                    WHERE vm_name LIKE ? || '%'
+                    GROUP BY hv_name
+                """, (rule_id, rule['vm_prefix']))
+            self._rules_cache = None
+            logger.info(f"Добавлено правило размещения {rule_id}: {rule['kind']} {rule['vm_prefix']}")
+            return True, str(rule_id)
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении правила размещения: {e}")
+            return False, str(e)
+
+    def get_placement_rules(self) -> List[Dict[str, Any]]:
+        """Правила размещения (кэшируются)"""
+        if self._rules_cache is not None:
+            return list(self._rules_cache)
+        try:
+            rows = self._query("SELECT rule_id, kind, vm_prefix, max_per_host, hosts FROM placement_rules ORDER BY rule_id")
+            for row in rows:
+                row['hosts'] = json.loads(row['hosts']) if row['hosts'] else None
+            self._rules_cache = rows
+            return list(rows)
+        except Exception as e:
+            logger.error(f"Ошибка при получении правил размещения: {e}")
+            return []
+
+    def delete_placement_rule(self, rule_id: int) -> bool:
+        """Удаление правила размещения"""
+        try:
+            with self._transaction() as conn:
+                deleted = conn.execute("DELETE FROM placement_rules WHERE rule_id = ?", (rule_id,)).rowcount
+            self._rules_cache = None
+            return deleted > 0
+        except Exception as e:
+            logger.error(f"Ошибка при удалении правила размещения: {e}")
+            return False
+
+    def get_placement_counts(self) -> Dict[Tuple[int, str], int]:
+        """Счетчики ВМ групп правил по гипервизорам"""
+        rows = self._query("SELECT rule_id, hv_name, vm_count FROM placement_counts")
+        return {(row['rule_id'], row['hv_name']): row['vm_count'] for row in rows}
+
+    # Резервы емкости
+    def reserve_capacity(self, vm_data: Dict[str, Any], count: int, ttl: Optional[float] = None,
+                         owner: str = "") -> Tuple[Optional[int], str]:
+        """Резерв мест в одной транзакции: план по гипервизорам, удержание ресурсов и диска"""
+        try:
+            with self._transaction() as conn:
+                hypervisors = self.get_all_hypervisors()
+                plan, message = self._plan_reservation(hypervisors, vm_data, count)
+                if plan is None:
+                    return None, message
+                reserved = conn.execute("""
+                    UPDATE storage_pool SET used_disk = used_disk + ?
+                    WHERE pool_name = ? AND used_disk + ? <= capacity
+                """, (count * vm_data['vhdd'], self.STORAGE_POOL, count * vm_data['vhdd'])).rowcount
+                if not reserved:
+                    return None, self.DISK_FULL_MESSAGE
+
+                now = datetime.now()
+                reservation_id = conn.execute("""
+                    INSERT INTO capacity_reservations (owner, vcpu, vram, vhdd, created_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (owner, vm_data['vcpu'], vm_data['vram'], vm_data['vhdd'], now,
+                      now + timedelta(seconds=ttl or self.RESERVATION_TTL))).lastrowid
+                conn.executemany("""
+                    UPDATE hypervisors SET free_cpu = free_cpu - ?, free_ram = free_ram - ? WHERE hv_name = ?
+                """, [(slots * vm_data['vcpu'], slots * vm_data['vram'], hv_name) for hv_name, slots in plan.items()])
+                conn.executemany("""
+                    INSERT INTO reservation_slots (reservation_id, hv_name, slots) VALUES (?, ?, ?)
+                """, [(reservation_id, hv_name, slots) for hv_name, slots in plan.items()])
+                conn.executemany("""
+                    INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk) VALUES ('reserve', ?, ?, ?, ?)
+                """, [(hv_name, -slots * vm_data['vcpu'], -slots * vm_data['vram'], slots * vm_data['vhdd'])
+                      for hv_name, slots in plan.items()])
+
+            logger.info(f"Резерв {reservation_id}: {count} мест на {len(plan)} гипервизорах")
+            return reservation_id, ""
+
+        except sqlite3.IntegrityError as e:
+            return None, str(e)
+
+    def try_create_reserved_vm(self, reservation_id: int, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ в месте резерва (гипервизор с наибольшим числом свободных мест резерва)"""
+        try:
+            with self._transaction() as conn:
+                reservation = conn.execute("""
+                    SELECT vcpu, vram, vhdd FROM capacity_reservations
+                    WHERE reservation_id = ? AND expires_at > ?
+                """, (reservation_id, datetime.now())).fetchone()
+                slot = conn.execute("""
+                    SELECT hv_name FROM reservation_slots WHERE reservation_id = ? AND slots > 0
+                    ORDER BY slots DESC, hv_name LIMIT 1
+                """, (reservation_id,)).fetchone()
+                if reservation is None or slot is None:
+                    return False, self.RESERVATION_MISSING_MESSAGE
+                if tuple(reservation) != (vm_data['vcpu'], vm_data['vram'], vm_data['vhdd']):
+                    return False, "Размер ВМ не совпадает с размером мест резерва"
+                hv_name = slot[0]
+
+                conn.execute("""
+                    UPDATE reservation_slots SET slots = slots - 1 WHERE reservation_id = ? AND hv_name = ?
+                """, (reservation_id, hv_name))
+                conn.execute("""
+                    INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk) VALUES ('release', ?, ?, ?, ?)
+                """, (hv_name, vm_data['vcpu'], vm_data['vram'], -vm_data['vhdd']))
+                conn.execute("""
+                    INSERT INTO virtual_machines (vm_name, vcpu, vram, vhdd, hv_name, creation_date)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (vm_data['vm_name'], vm_data['vcpu'], vm_data['vram'],
+                      vm_data['vhdd'], hv_name, datetime.now()))
+                # Место резерва переходит к ВМ: свободные ресурсы и дисковый пул не меняются
+                conn.execute("UPDATE hypervisors SET num_vms = num_vms + 1 WHERE hv_name = ?", (hv_name,))
+
+            return True, hv_name
+
+        except sqlite3.IntegrityError as e:
+            return False, str(e)
+
+    def renew_reservation(self, reservation_id: int, ttl: Optional[float] = None) -> bool:
+        """Продление действующего резерва"""
+        try:
+            with self._transaction() as conn:
+                now = datetime.now()
+                return conn.execute("""
+                    UPDATE capacity_reservations SET expires_at = ? WHERE reservation_id = ? AND expires_at > ?
+                """, (now + timedelta(seconds=ttl or self.RESERVATION_TTL), reservation_id, now)).rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при продлении резерва: {e}")
+            return False
+
+    def _release_where(self, condition: str, params: Tuple) -> int:
+        """Возврат мест резервов по условию на capacity_reservations и удаление резервов"""
+        with self._transaction() as conn:
+            ids = [row[0] for row in conn.execute(
+                f"SELECT reservation_id FROM capacity_reservations WHERE {condition}", params)]
+            if not ids:
+                return 0
+            marks = ','.join('?' * len(ids))
+            rows = conn.execute(f"""
+                SELECT s.hv_name, SUM(s.slots), SUM(s.slots * r.vcpu), SUM(s.slots * r.vram), SUM(s.slots * r.vhdd)
+                FROM reservation_slots s JOIN capacity_reservations r USING (reservation_id)
+                WHERE s.reservation_id IN ({marks}) AND s.slots > 0
+                GROUP BY s.hv_name
+            """, ids).fetchall()
+            conn.executemany("""
+                UPDATE hypervisors SET free_cpu = free_cpu + ?, free_ram = free_ram + ? WHERE hv_name = ?
+            """, [(vcpu, vram, hv_name) for hv_name, _, vcpu, vram, _ in rows])
+            conn.executemany("""
+                INSERT INTO operation_journal (op, hv_name, d_cpu, d_ram, d_disk) VALUES ('release', ?, ?, ?, ?)
+            """, [(hv_name, vcpu, vram, -vhdd) for hv_name, _, vcpu, vram, vhdd in rows])
+            conn.execute("UPDATE storage_pool SET used_disk = used_disk - ? WHERE pool_name = ?",
+                         (sum(row[4] for row in rows), self.STORAGE_POOL))
+            conn.execute(f"DELETE FROM capacity_reservations WHERE reservation_id IN ({marks})", ids)
+            return sum(row[1] for row in rows)
+
+    def release_reservation(self, reservation_id: int) -> int:
+        """Освобождение неиспользованных мест резерва"""
+        try:
+            return self._release_where("reservation_id = ?", (reservation_id,))
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении резерва: {e}")
+            return 0
+
+    def release_expired_reservations(self) -> int:
+        """Освобождение мест истекших резервов"""
+        try:
+            return self._release_where("expires_at <= ?", (datetime.now(),))
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении истекших резервов: {e}")
+            return 0
+
+    def get_reservations(self) -> List[Dict[str, Any]]:
+        """Резервы с оставшимися местами по гипервизорам"""
+        with self._lock:
+            reservations = self._query("""
+                SELECT reservation_id, owner, vcpu, vram, vhdd, expires_at FROM capacity_reservations
+                ORDER BY reservation_id
+            """)
+            slots = self._query("SELECT reservation_id, hv_name, slots FROM reservation_slots WHERE slots > 0")
+        for reservation in reservations:
+            reservation['slots'] = {row['hv_name']: row['slots'] for row in slots
+                                    if row['reservation_id'] == reservation['reservation_id']}
+        return reservations
+
+    # Журнал операций
+    def get_journal(self, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Записи журнала с op_id больше after"""
+        return self._query("SELECT * FROM operation_journal WHERE op_id > ? ORDER BY op_id LIMIT ?", (after, limit))
+
+    @staticmethod
+    def _snapshot(conn) -> int:
+        """Запись снимка текущих счетчиков в транзакции записи (журнал в это время не меняется)"""
+        op_id = conn.execute("SELECT COALESCE(MAX(op_id), 0) FROM operation_journal").fetchone()[0]
+        used_disk = conn.execute("SELECT used_disk FROM storage_pool WHERE pool_name = ?",
+                                 (StorageBackend.STORAGE_POOL,)).fetchone()[0]
+        rows = conn.execute("SELECT hv_name, free_cpu, free_ram, num_vms FROM hypervisors").fetchall()
+        conn.execute("""
+            INSERT INTO journal_snapshots (op_id, created_at, used_disk, hypervisors) VALUES (?, ?, ?, ?)
+        """, (op_id, datetime.now(), used_disk, json.dumps({row[0]: list(row[1:]) for row in rows})))
+        return op_id
+
+    def create_journal_snapshot(self) -> Optional[int]:
+        """Снимок счетчиков на текущей позиции журнала"""
+        try:
+            with self._transaction() as conn:
+                return self._snapshot(conn)
+        except Exception as e:
+            logger.error(f"Ошибка при создании снимка журнала: {e}")
+            return None
+
+    def compact_journal(self, keep_snapshots: int = 2) -> int:
+        """Удаление старых снимков и записей журнала до самого раннего из оставшихся снимков"""
+        try:
+            with self._transaction() as conn:
+                oldest = conn.execute("""
+                    SELECT snapshot_id, op_id FROM journal_snapshots ORDER BY snapshot_id DESC LIMIT 1 OFFSET ?
+                """, (max(keep_snapshots, 1) - 1,)).fetchone()
+                if oldest is None:
+                    return 0
+                conn.execute("DELETE FROM journal_snapshots WHERE snapshot_id < ?", (oldest[0],))
+                return conn.execute("DELETE FROM operation_journal WHERE op_id <= ?", (oldest[1],)).rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при сжатии журнала: {e}")
+            return 0
+
+    def _read_journal(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]]:
+        """Снимок, записи после него и счетчики читаются под блокировкой соединения"""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT op_id, used_disk, hypervisors FROM journal_snapshots ORDER BY snapshot_id DESC LIMIT 1
+            """).fetchone()
+            if row is None:
+                return None
+            snapshot = {'op_id': row[0], 'used_disk': row[1], 'hypervisors': json.loads(row[2])}
+            tail = self._query("SELECT * FROM operation_journal WHERE op_id > ? ORDER BY op_id", (row[0],))
+            used_disk = self._conn.execute("SELECT used_disk FROM storage_pool WHERE pool_name = ?",
+                                           (self.STORAGE_POOL,)).fetchone()[0]
+            return snapshot, tail, self._counters(self._query("SELECT * FROM hypervisors"), used_disk)
+
+    def _write_counters(self, state: Dict[str, Any]):
+        with self._transaction() as conn:
+            conn.executemany("UPDATE hypervisors SET free_cpu = ?, free_ram = ?, num_vms = ? WHERE hv_name = ?",
+                             [(*counters, name) for name, counters in state['hypervisors'].items()])
+            conn.execute("UPDATE storage_pool SET used_disk = ? WHERE pool_name = ?",
+                         (state['used_disk'], self.STORAGE_POOL))
+
+    # Контрольные точки массовых развертываний
+    def save_deploy_checkpoint(self, run_id: str, state: Dict[str, Any]) -> bool:
+        """Сохранение состояния развертывания (перезапись предыдущей точки)"""
+        try:
+            with self._transaction() as conn:
+                conn.execute("""
+                    INSERT INTO deploy_checkpoints (run_id, status, state, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (run_id) DO UPDATE
+                    SET status = excluded.status, state = excluded.state, updated_at = excluded.updated_at
+                """, (run_id, state['status'], json.dumps(state, ensure_ascii=False), datetime.now()))
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении контрольной точки развертывания: {e}")
+            return False
+
+    def get_deploy_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Последняя контрольная точка развертывания"""
+        try:
+            rows = self._query("SELECT state FROM deploy_checkpoints WHERE run_id = ?", (run_id,))
+            return json.loads(rows[0]['state']) if rows else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении контрольной точки развертывания: {e}")
+            return None
+
+    def get_deploy_checkpoints(self) -> List[Dict[str, Any]]:
+        """Контрольные точки всех развертываний, новые первыми"""
+        try:
+            rows = self._query("SELECT state FROM deploy_checkpoints ORDER BY updated_at DESC")
+            return [json.loads(row['state']) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении контрольных точек развертывания: {e}")
+            return []
+
+    # История загрузки
+    def record_utilization_sample(self, ts: Optional[datetime] = None) -> int:
+        """Запись отсчета загрузки всех гипервизоров и кластера"""
+        ts = ts or datetime.now()
+        try:
+            rows = _utilization_rows(self.get_all_hypervisors(), ts, self.HISTORY_CLUSTER_KEY)
+            with self._transaction() as conn:
+                conn.executemany("""
+                    INSERT INTO utilization_history (ts, hv_name, cpu_usage, ram_usage, num_vms)
+                    VALUES (?, ?, ?, ?, ?)
+                """, rows)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Ошибка при записи истории загрузки: {e}")
+            return 0
+
+    def rollup_utilization_history(self, raw_retention: timedelta = timedelta(days=2),
+                                   minute_retention: timedelta = timedelta(days=30),
+                                   hour_retention: timedelta = timedelta(days=730)) -> bool:
+        """Свертка истории: сырые отсчеты -> минутные агрегаты -> часовые агрегаты"""
+        now = datetime.now()
+        try:
+            with self._transaction() as conn:
+                raw_cutoff = datetime.combine((now - raw_retention).date(), datetime.min.time())
+                conn.execute("""
+                    INSERT INTO utilization_history_1m
+                        (bucket, hv_name, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples)
+                    SELECT strftime('%Y-%m-%d %H:%M:00', ts), hv_name,
+                           AVG(cpu_usage), MAX(cpu_usage), AVG(ram_usage), MAX(ram_usage),
+                           MAX(num_vms), COUNT(*)
+                    FROM utilization_history
+                    WHERE ts < ?
+                    GROUP BY 1, 2
+                    ON CONFLICT (hv_name, bucket) DO NOTHING
+                """, (raw_cutoff,))
+                conn.execute("DELETE FROM utilization_history WHERE ts < ?", (raw_cutoff,))
+
+                minute_cutoff = now - minute_retention
+                conn.execute("""
+                    INSERT INTO utilization_history_1h AS h
+                        (bucket, hv_name, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples)
+                    SELECT strftime('%Y-%m-%d %H:00:00', bucket), hv_name,
+                           SUM(cpu_avg * samples) / SUM(samples), MAX(cpu_max),
+                           SUM(ram_avg * samples) / SUM(samples), MAX(ram_max),
+                           MAX(num_vms_max), SUM(samples)
+                    FROM utilization_history_1m
+                    WHERE bucket < ?
+                    GROUP BY 1, 2
+                    ON CONFLICT (hv_name, bucket) DO UPDATE SET
+                        cpu_avg = (h.cpu_avg * h.samples + excluded.cpu_avg * excluded.samples)
+                                  / (h.samples + excluded.samples),
+                        cpu_max = MAX(h.cpu_max, excluded.cpu_max),
+                        ram_avg = (h.ram_avg * h.samples + excluded.ram_avg * excluded.samples)
+                                  / (h.samples + excluded.samples),
+                        ram_max = MAX(h.ram_max, excluded.ram_max),
+                        num_vms_max = MAX(h.num_vms_max, excluded.num_vms_max),
+                        samples = h.samples + excluded.samples
+                """, (minute_cutoff,))
+                conn.execute("DELETE FROM utilization_history_1m WHERE bucket < ?", (minute_cutoff,))
+                conn.execute("DELETE FROM utilization_history_1h WHERE bucket < ?", (now - hour_retention,))
+
+            logger.info("Свертка истории загрузки выполнена")
+            return True
+
+        except Exception as e:
+            logger.error(f"Ошибка при свертке истории загрузки: {e}")
+            return False
+
+    def get_utilization_history(self, hv_name: Optional[str] = None, start: Optional[datetime] = None,
+                                end: Optional[datetime] = None, max_points: int = 500) -> List[Dict[str, Any]]:
+        """Прореженный ряд загрузки за период (не более max_points строк)"""
+        end = end or datetime.now()
+        start = start or end - timedelta(days=1)
+        bucket_seconds = max(int((end - start).total_seconds() / max(max_points, 1)), 1)
+        try:
+            rows = self._query("""
+                SELECT datetime(CAST(strftime('%s', t) AS INTEGER) / :w * :w, 'unixepoch') AS ts,
+                       SUM(cpu * n) / SUM(n) AS cpu_usage, MAX(cpu_max) AS cpu_max,
+                       SUM(ram * n) / SUM(n) AS ram_usage, MAX(ram_max) AS ram_max,
+                       MAX(vms) AS num_vms
+                FROM (
+                    SELECT ts AS t, cpu_usage AS cpu, cpu_usage AS cpu_max,
+                           ram_usage AS ram, ram_usage AS ram_max, num_vms AS vms, 1 AS n
+                    FROM utilization_history
+                    WHERE hv_name = :hv AND ts BETWEEN :start AND :end
+                    UNION ALL
+                    SELECT bucket, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples
+                    FROM utilization_history_1m
+                    WHERE hv_name = :hv AND bucket BETWEEN :start AND :end
+                    UNION ALL
+                    SELECT bucket, cpu_avg, cpu_max, ram_avg, ram_max, num_vms_max, samples
+                    FROM utilization_history_1h
+                    WHERE hv_name = :hv AND bucket BETWEEN :start AND :end
+                )
+                GROUP BY 1
+                ORDER BY 1
+            """, {'w': bucket_seconds, 'hv': hv_name or self.HISTORY_CLUSTER_KEY, 'start': start, 'end': end})
+            for row in rows:
+                row['ts'] = datetime.fromisoformat(row['ts'])
+            return rows
+        except Exception as e:
+            logger.error(f"Ошибка при получении истории загрузки: {e}")
+            return []
+
+
+class MemoryDatabase(StorageBackend):
+    """Хранилище в памяти процесса с теми же ограничениями и правилами размещения.
+    Данные не сохраняются - для тестов, демонстраций и симуляций"""
+
+    def __init__(self, config: Optional[Dict[str, str]] = None):
+        self._lock = threading.RLock()
+        self.config: Dict[str, str] = dict(self.DEFAULT_CONFIG)
+        self.config.update(config or {})
+        self.hypervisors: Dict[str, Dict[str, Any]] = {}
+        self.vms: Dict[str, Dict[str, Any]] = {}
+        self.disk_pool = int(self.config['disk_pool'])
+        self.used_disk = 0
+        # История: сырые отсчеты и агрегаты (hv_name, bucket) -> показатели
+        self.history: List[Tuple] = []
+        self.history_1m: Dict[Tuple[str, datetime], Dict[str, float]] = {}
+        self.history_1h: Dict[Tuple[str, datetime], Dict[str, float]] = {}
+        # Контрольные точки развертываний хранятся сериализованными (снимок, а не ссылка)
+        self.deploy_checkpoints: Dict[str, str] = {}
+        # Правила размещения и счетчики ВМ их групп: (rule_id, hv_name) -> ВМ
+        self.placement_rules: Dict[int, Dict[str, Any]] = {}
+        self.placement_counts: Dict[Tuple[int, str], int] = {}
+        # Версия данных: увеличивается каждой записью в гипервизоры, ВМ, конфигурацию и правила
+        self.data_version = 0
+        # Журнал операций и снимки счетчиков (первый - пустой кластер)
+        self.journal: List[Dict[str, Any]] = []
+        self.journal_snapshots: List[Dict[str, Any]] = [dict(op_id=0, **self._counters([], 0))]
+        self._journal_id = 0
+        # Резервы емкости: номер -> резерв (места по гипервизорам в 'slots')
+        self.reservations: Dict[int, Dict[str, Any]] = {}
+        self._reservation_id = 0
+
+    # Методы для работы с виртуальными машинами
+    def try_create_vm(self, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ с причиной отказа"""
+        with self._lock:
+            is_valid, message = Validator.validate_vm_resources(vm_data['vcpu'], vm_data['vram'], vm_data['vhdd'])
+            if not is_valid:
+                return False, message
+            if vm_data['vm_name'] in self.vms:
+                return False, f"ВМ {vm_data['vm_name']} уже существует"
+
+            rules = self._matching_rules(vm_data['vm_name'])
+            if rules:
+                hv_name, message = self._choose_with_rules(list(self.hypervisors.values()), self.placement_counts,
+                                                           vm_data, rules)
+                if hv_name is None:
+                    return False, message
+                hv = self.hypervisors[hv_name]
+            else:
+                with PLACEMENT_SECONDS.time("default"):
+                    hv = PlacementPolicy.choose_hypervisor(list(self.hypervisors.values()),
+                                                           vm_data['vcpu'], vm_data['vram'])
+                if hv is None:
+                    return False, self.NO_CAPACITY_MESSAGE
+            if self.used_disk + vm_data['vhdd'] > self.disk_pool:
+                return False, self.DISK_FULL_MESSAGE
+
+            self.vms[vm_data['vm_name']] = {
+                'vm_name': vm_data['vm_name'], 'vcpu': vm_data['vcpu'], 'vram': vm_data['vram'],
+                'vhdd': vm_data['vhdd'], 'hv_name': hv['hv_name'], 'creation_date': datetime.now()
+            }
+            hv['free_cpu'] -= vm_data['vcpu']
+            hv['free_ram'] -= vm_data['vram']
+            hv['num_vms'] += 1
+            self.used_disk += vm_data['vhdd']
+            self._count_vm(vm_data['vm_name'], hv['hv_name'], 1)
+            self._journal('vm_create', hv['hv_name'], vm_data['vm_name'],
+                          -vm_data['vcpu'], -vm_data['vram'], 1, vm_data['vhdd'])
+            self.data_version += 1
+            return True, hv['hv_name']
+
+    def _count_vm(self, vm_name: str, hv_name: str, delta: int):
+        """Обновление счетчиков групп правил при размещении/удалении ВМ"""
+        for rule in self._matching_rules(vm_name):
+            key = (rule['rule_id'], hv_name)
+            self.placement_counts[key] = self.placement_counts.get(key, 0) + delta
+
+    def _journal(self, op: str, hv_name: str, vm_name: Optional[str] = None,
+                 d_cpu: int = 0, d_ram: int = 0, d_vms: int = 0, d_disk: int = 0):
+        """Запись операции в журнал (вызывается под блокировкой вместе с изменением счетчиков)"""
+        self._journal_id += 1
+        self.journal.append({'op_id': self._journal_id, 'ts': datetime.now(), 'op': op, 'vm_name': vm_name,
+                             'hv_name': hv_name, 'd_cpu': d_cpu, 'd_ram': d_ram, 'd_vms': d_vms, 'd_disk': d_disk})
+
+    def get_all_vms(self) -> List[Dict[str, Any]]:
+        """Получение всех виртуальных машин"""
+        with self._lock:
+            return [dict(self.vms[name]) for name in sorted(self.vms)]
+
+    def delete_vm(self, vm_name: str) -> bool:
+        """Удаление виртуальной машины"""
+        return self.delete_vms_bulk([vm_name]) == 1
+
+    def delete_vms_bulk(self, vm_names: List[str]) -> int:
+        """Массовое удаление ВМ с освобождением ресурсов"""
+        with self._lock:
+            deleted_count = 0
+            for vm_name in set(vm_names):
+                vm = self.vms.pop(vm_name, None)
+                if vm is None:
+                    continue
+                hv = self.hypervisors[vm['hv_name']]
+                hv['free_cpu'] += vm['vcpu']
+                hv['free_ram'] += vm['vram']
+                hv['num_vms'] -= 1
+                self.used_disk -= vm['vhdd']
+                self._count_vm(vm_name, vm['hv_name'], -1)
+                self._journal('vm_delete', vm['hv_name'], vm_name, vm['vcpu'], vm['vram'], -1, -vm['vhdd'])
+                deleted_count += 1
+            if deleted_count:
+                self.data_version += 1
+            if vm_names:
+                logger.info(f"Удалено ВМ: {deleted_count} из {len(vm_names)}")
+            return deleted_count
+
+    def create_vms_bulk(self, vms: List[Dict[str, Any]]) -> int:
+        """Загрузка ВМ с заданным размещением (все ограничения проверяются до изменений)"""
+        with self._lock:
+            names = set()
+            for vm in vms:
+                is_valid, message = Validator.validate_vm_resources(vm['vcpu'], vm['vram'], vm['vhdd'])
+                if not is_valid or vm['vm_name'] in self.vms or vm['vm_name'] in names \
+                        or vm['hv_name'] not in self.hypervisors:
+                    logger.error(f"Ошибка при массовой загрузке ВМ {vm['vm_name']}: "
+                                 f"{message or 'дубль имени или неизвестный гипервизор'}")
+                    return 0
+                names.add(vm['vm_name'])
+            consumed = self._consumed(vms)
+            for hv_name, (vcpu, vram, _) in consumed.items():
+                hv = self.hypervisors[hv_name]
+                if hv['free_cpu'] < vcpu or hv['free_ram'] < vram:
+                    logger.error(f"Ошибка при массовой загрузке ВМ: недостаточно ресурсов на {hv_name}")
+                    return 0
+            disk = sum(vm['vhdd'] for vm in vms)
+            if self.used_disk + disk > self.disk_pool:
+                logger.error(f"Ошибка при массовой загрузке ВМ: {self.DISK_FULL_MESSAGE}")
+                return 0
+
+            now = datetime.now()
+            for vm in vms:
+                self.vms[vm['vm_name']] = {
+                    'vm_name': vm['vm_name'], 'vcpu': vm['vcpu'], 'vram': vm['vram'], 'vhdd': vm['vhdd'],
+                    'hv_name': vm['hv_name'], 'creation_date': vm.get('creation_date') or now
+                }
+                self._count_vm(vm['vm_name'], vm['hv_name'], 1)
+                self._journal('vm_create', vm['hv_name'], vm['vm_name'], -vm['vcpu'], -vm['vram'], 1, vm['vhdd'])
+            for hv_name, (vcpu, vram, cnt) in consumed.items():
+                hv = self.hypervisors[hv_name]
+                hv['free_cpu'] -= vcpu
+                hv['free_ram'] -= vram
+                hv['num_vms'] += cnt
+            self.used_disk += disk
+            self.data_version += 1
+            if vms:
+                logger.info(f"Загружено ВМ: {len(vms)}")
+            return len(vms)
+
+    def _move_vms(self, moves: List[Tuple[str, str, str, int, int]]) -> Optional[str]:
+        """Перенос ВМ с проверкой ресурсов: либо все переносы, либо ни одного"""
+        free = {name: [hv['free_cpu'], hv['free_ram'], hv['num_vms']] for name, hv in self.hypervisors.items()}
+        for _, source, target, vcpu, vram in moves:
+            if target not in free:
+                return f"Гипервизор {target} не найден"
+            free[source][0] += vcpu
+            free[source][1] += vram
+            free[source][2] -= 1
+            free[target][0] -= vcpu
+            free[target][1] -= vram
+            free[target][2] += 1
+        if any(cpu < 0 or ram < 0 for cpu, ram, _ in free.values()):
+            return "Недостаточно ресурсов на целевых гипервизорах"
+
+        for name, (cpu, ram, cnt) in free.items():
+            hv = self.hypervisors[name]
+            hv['free_cpu'], hv['free_ram'], hv['num_vms'] = cpu, ram, cnt
+        for vm_name, source, target, vcpu, vram in moves:
+            self.vms[vm_name]['hv_name'] = target
+            self._count_vm(vm_name, source, -1)
+            self._count_vm(vm_name, target, 1)
+            vhdd = self.vms[vm_name]['vhdd']
+            self._journal('vm_move_out', source, vm_name, vcpu, vram, -1, -vhdd)
+            self._journal('vm_move_in', target, vm_name, -vcpu, -vram, 1, vhdd)
+        self.data_version += 1
+        return None
+
+    def migrate_vms(self, migrations: List[Tuple[str, str]]) -> Tuple[bool, str]:
+        """Перенос ВМ на указанные гипервизоры (все или ни одного)"""
+        with self._lock:
+            targets = dict(migrations)
+            if any(vm_name not in self.vms for vm_name in targets):
+                return False, "Часть ВМ для переноса не найдена"
+            moves = [(vm_name, self.vms[vm_name]['hv_name'], target,
+                      self.vms[vm_name]['vcpu'], self.vms[vm_name]['vram'])
+                     for vm_name, target in targets.items() if self.vms[vm_name]['hv_name'] != target]
+            error = self._move_vms(moves)
+            if error:
+                logger.error(f"Ошибка при переносе ВМ: {error}")
+                return False, error
+            logger.info(f"Перенесено ВМ: {len(moves)}")
+            return True, ""
+
+    def drain_hypervisor(self, hv_name: str, exclude: Optional[List[str]] = None) -> Tuple[bool, str]:
+        """Перенос всех ВМ гипервизора на другие гипервизоры"""
+        with self._lock:
+            vms = sorted((vm for vm in self.vms.values() if vm['hv_name'] == hv_name),
+                         key=lambda vm: (-vm['vcpu'], -vm['vram']))
+            hypervisors = self.get_all_hypervisors()
+            moves, message = self._plan_drain(hypervisors, vms, hv_name, exclude, self._placement_index(hypervisors))
+            if moves is None:
+                return False, message
+            self._move_vms(moves)
+            logger.info(f"Гипервизор {hv_name} освобожден, перенесено ВМ: {len(moves)}")
+            return True, ""
+
+    # Методы для работы с гипервизорами
+    def add_hypervisor(self, hv_data: Dict[str, Any]) -> bool:
+        """Добавление гипервизора"""
+        with self._lock:
+            error = self._check_new_hypervisor(hv_data, len(self.hypervisors), hv_data['hv_name'] in self.hypervisors)
+            if error:
+                logger.error(error)
+                return False
+
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            self.hypervisors[hv_data['hv_name']] = {
+                'hv_name': hv_data['hv_name'], 'cpu': hv_data['cpu'], 'ram': hv_data['ram'],
+                'free_cpu': ResourceCalculator.calculate_capacity(hv_data['cpu'], overcommit_cpu),
+                'free_ram': ResourceCalculator.calculate_capacity(hv_data['ram'], overcommit_ram),
+                'num_vms': 0, 'created_at': datetime.now()
+            }
+            hv = self.hypervisors[hv_data['hv_name']]
+            self._journal('hv_add', hv['hv_name'], None, hv['free_cpu'], hv['free_ram'])
+            self.data_version += 1
+            logger.info(f"Гипервизор {hv_data['hv_name']} успешно добавлен")
+            return True
+
+    def get_all_hypervisors(self) -> List[Dict[str, Any]]:
+        """Получение всех гипервизоров (с емкостью в виртуальных единицах)"""
+        with self._lock:
+            overcommit_cpu, overcommit_ram = self.get_overcommit()
+            hvs = []
+            for name in sorted(self.hypervisors):
+                hv = dict(self.hypervisors[name])
+                hv['cpu_capacity'] = ResourceCalculator.calculate_capacity(hv['cpu'], overcommit_cpu)
+                hv['ram_capacity'] = ResourceCalculator.calculate_capacity(hv['ram'], overcommit_ram)
+                hvs.append(hv)
+            return hvs
+
+    def delete_hypervisor(self, hv_name: str) -> Tuple[bool, str]:
+        """Удаление гипервизора"""
+        with self._lock:
+            vm_count = self.hypervisors[hv_name]['num_vms'] if hv_name in self.hypervisors else 0
+            if vm_count > 0:
+                return False, f"На гипервизоре {hv_name} запущено {vm_count} ВМ"
+            slots = sum(reservation['slots'].get(hv_name, 0) for reservation in self.reservations.values())
+            if slots > 0:
+                return False, f"На гипервизоре {hv_name} зарезервировано мест: {slots}"
+            hv = self.hypervisors.pop(hv_name, None)
+            if hv is not None:
+                self._journal('hv_delete', hv_name, None, -hv['free_cpu'], -hv['free_ram'], -hv['num_vms'])
+                self.data_version += 1
+            logger.info(f"Гипервизор {hv_name} успешно удален")
+            return True, ""
+
+    # Конфигурация и статистика
+    def get_cluster_config(self) -> Dict[str, str]:
+        """Получение конфигурации кластера"""
+        return dict(self.config)
+
+    def get_data_version(self) -> Optional[Any]:
+        """Счетчик записей хранилища"""
+        return self.data_version
+
+    def set_overcommit(self, overcommit_cpu: float, overcommit_ram: float) -> Tuple[bool, str]:
+        """Изменение коэффициентов переподписки со сдвигом свободной емкости гипервизоров"""
+        with self._lock:
+            old_cpu, old_ram = self.get_overcommit()
+            shifted = {}
+            for name, hv in self.hypervisors.items():
+                free_cpu = hv['free_cpu'] + (ResourceCalculator.calculate_capacity(hv['cpu'], overcommit_cpu) -
+                                             ResourceCalculator.calculate_capacity(hv['cpu'], old_cpu))
+                free_ram = hv['free_ram'] + (ResourceCalculator.calculate_capacity(hv['ram'], overcommit_ram) -
+                                             ResourceCalculator.calculate_capacity(hv['ram'], old_ram))
+                if free_cpu < 0 or free_ram < 0:
+                    return False, f"Занятые ресурсы гипервизора {name} превышают новую емкость"
+                shifted[name] = (free_cpu, free_ram)
+
+            for name, (free_cpu, free_ram) in shifted.items():
+                hv = self.hypervisors[name]
+                self._journal('hv_resize', name, None, free_cpu - hv['free_cpu'], free_ram - hv['free_ram'])
+                hv['free_cpu'], hv['free_ram'] = free_cpu, free_ram
+            self.config['overcommit_cpu'] = str(overcommit_cpu)
+            self.config['overcommit_ram'] = str(overcommit_ram)
+            self.data_version += 1
+            logger.info(f"Переподписка изменена: CPU {overcommit_cpu}, RAM {overcommit_ram}")
+            return True, ""
+
+    def get_cluster_statistics(self) -> Dict[str, Any]:
+        """Получение статистики кластера по счетчикам"""
+        overcommit_cpu, overcommit_ram = self.get_overcommit()
+        hvs = self.get_all_hypervisors()
+        totals = (len(hvs), sum(hv['cpu'] for hv in hvs), sum(hv['ram'] for hv in hvs),
+                  sum(hv['free_cpu'] for hv in hvs), sum(hv['free_ram'] for hv in hvs),
+                  sum(hv['num_vms'] for hv in hvs),
+                  sum(hv['cpu_capacity'] for hv in hvs), sum(hv['ram_capacity'] for hv in hvs))
+        return self._build_statistics(totals, (self.disk_pool, self.used_disk), overcommit_cpu, overcommit_ram)
+
+    def get_daily_growth(self) -> Dict[str, List[Tuple]]:
+        """Агрегаты создания ВМ и гипервизоров по дням (для прогнозирования)"""
+        with self._lock:
+            vms: Dict[date, List[int]] = {}
+            for vm in self.vms.values():
+                day = vms.setdefault(vm['creation_date'].date(), [0, 0, 0, 0])
+                day[0] += 1
+                day[1] += vm['vcpu']
+                day[2] += vm['vram']
+                day[3] += vm['vhdd']
+            hypervisors: Dict[date, int] = {}
+            for hv in self.hypervisors.values():
+                day = hv['created_at'].date()
+                hypervisors[day] = hypervisors.get(day, 0) + 1
+            return {
+                'vms': [(day, *values) for day, values in sorted(vms.items())],
+                'hypervisors': sorted(hypervisors.items())
+            }
+
+    # Правила размещения
+    def add_placement_rule(self, rule: Dict[str, Any]) -> Tuple[bool, str]:
+        """Добавление правила с расчетом счетчиков по уже размещенным ВМ"""
+        is_valid, message = Validator.validate_placement_rule(rule)
+        if not is_valid:
+            return False, message
+        with self._lock:
+            rule_id = max(self.placement_rules, default=0) + 1
+            self.placement_rules[rule_id] = {
+                'rule_id': rule_id, 'kind': rule['kind'], 'vm_prefix': rule['vm_prefix'],
+                'max_per_host': rule.get('max_per_host'), 'hosts': list(rule['hosts']) if rule.get('hosts') else None
+            }
+            for vm in self.vms.values():
+                if vm['vm_name'].startswith(rule['vm_prefix']):
+                    key = (rule_id, vm['hv_name'])
+                    self.placement_counts[key] = self.placement_counts.get(key, 0) + 1
+            self.data_version += 1
+            logger.info(f"Добавлено правило размещения {rule_id}: {rule['kind']} {rule['vm_prefix']}")
+            return True, str(rule_id)
+
+    def get_placement_rules(self) -> List[Dict[str, Any]]:
+        """Правила размещения"""
+        with self._lock:
+            return [dict(rule) for rule in self.placement_rules.values()]
+
+    def delete_placement_rule(self, rule_id: int) -> bool:
+        """Удаление правила размещения"""
+        with self._lock:
+            if self.placement_rules.pop(rule_id, None) is None:
+                return False
+            self.placement_counts = {key: count for key, count in self.placement_counts.items() if key[0] != rule_id}
+            self.data_version += 1
+            return True
+
+    def get_placement_counts(self) -> Dict[Tuple[int, str], int]:
+        """Счетчики ВМ групп правил по гипервизорам"""
+        with self._lock:
+            return dict(self.placement_counts)
+
+    # Резервы емкости
+    def reserve_capacity(self, vm_data: Dict[str, Any], count: int, ttl: Optional[float] = None,
+                         owner: str = "") -> Tuple[Optional[int], str]:
+        """Резерв мест: все или ни одного"""
+        with self._lock:
+            plan, message = self._plan_reservation(self.get_all_hypervisors(), vm_data, count)
+            if plan is None:
+                return None, message
+            if self.used_disk + count * vm_data['vhdd'] > self.disk_pool:
+                return None, self.DISK_FULL_MESSAGE
+
+            self._reservation_id += 1
+            self.reservations[self._reservation_id] = {
+                'reservation_id': self._reservation_id, 'owner': owner, 'vcpu': vm_data['vcpu'],
+                'vram': vm_data['vram'], 'vhdd': vm_data['vhdd'], 'slots': plan,
+                'expires_at': datetime.now() + timedelta(seconds=ttl or self.RESERVATION_TTL)
+            }
+            for hv_name, slots in plan.items():
+                hv = self.hypervisors[hv_name]
+                hv['free_cpu'] -= slots * vm_data['vcpu']
+                hv['free_ram'] -= slots * vm_data['vram']
+                self._journal('reserve', hv_name, None, -slots * vm_data['vcpu'], -slots * vm_data['vram'],
+                              0, slots * vm_data['vhdd'])
+            self.used_disk += count * vm_data['vhdd']
+            self.data_version += 1
+            logger.info(f"Резерв {self._reservation_id}: {count} мест на {len(plan)} гипервизорах")
+            return self._reservation_id, ""
+
+    def try_create_reserved_vm(self, reservation_id: int, vm_data: Dict[str, Any]) -> Tuple[bool, str]:
+        """Создание ВМ в месте резерва (гипервизор с наибольшим числом свободных мест резерва)"""
+        with self._lock:
+            reservation = self.reservations.get(reservation_id)
+            if reservation is None or reservation['expires_at'] <= datetime.now() or not reservation['slots']:
+                return False, self.RESERVATION_MISSING_MESSAGE
+            if any(vm_data[key] != reservation[key] for key in ('vcpu', 'vram', 'vhdd')):
+                return False, "Размер ВМ не совпадает с размером мест резерва"
+            if vm_data['vm_name'] in self.vms:
+                return False, f"ВМ {vm_data['vm_name']} уже существует"
+
+            hv_name = min(reservation['slots'], key=lambda name: (-reservation['slots'][name], name))
+            reservation['slots'][hv_name] -= 1
+            if not reservation['slots'][hv_name]:
+                del reservation['slots'][hv_name]
+            self.vms[vm_data['vm_name']] = {
+                'vm_name': vm_data['vm_name'], 'vcpu': vm_data['vcpu'], 'vram': vm_data['vram'],
+                'vhdd': vm_data['vhdd'], 'hv_name': hv_name, 'creation_date': datetime.now()
+            }
+            # Место резерва переходит к ВМ: свободные ресурсы и дисковый пул не меняются
+            self.hypervisors[hv_name]['num_vms'] += 1
+            self._count_vm(vm_data['vm_name'], hv_name, 1)
+            self._journal('release', hv_name, None, vm_data['vcpu'], vm_data['vram'], 0, -vm_data['vhdd'])
+            self._journal('vm_create', hv_name, vm_data['vm_name'],
+                          -vm_data['vcpu'], -vm_data['vram'], 1, vm_data['vhdd'])
+            self.data_version += 1
+            return True, hv_name
+
+    def renew_reservation(self, reservation_id: int, ttl: Optional[float] = None) -> bool:
+        """Продление действующего резерва"""
+        with self._lock:
+            reservation = self.reservations.get(reservation_id)
+            if reservation is None or reservation['expires_at'] <= datetime.now():
+                return False
+            reservation['expires_at'] = datetime.now() + timedelta(seconds=ttl or self.RESERVATION_TTL)
+            return True
+
+    def _release(self, reservation_ids: List[int]) -> int:
+        """Возврат мест резервов гипервизорам и дисковому пулу"""
+        released = 0
+        for reservation_id in reservation_ids:
+            reservation = self.reservations.pop(reservation_id)
+            for hv_name, slots in reservation['slots'].items():
+                hv = self.hypervisors[hv_name]
+                hv['free_cpu'] += slots * reservation['vcpu']
+                hv['free_ram'] += slots * reservation['vram']
+                self.used_disk -= slots * reservation['vhdd']
+                self._journal('release', hv_name, None, slots * reservation['vcpu'], slots * reservation['vram'],
+                              0, -slots * reservation['vhdd'])
+                released += slots
+        if reservation_ids:
+            self.data_version += 1
+        return released
+
+    def release_reservation(self, reservation_id: int) -> int:
+        """Освобождение неиспользованных мест резерва"""
+        with self._lock:
+            return self._release([reservation_id] if reservation_id in self.reservations else [])
+
+    def release_expired_reservations(self) -> int:
+        """Освобождение мест истекших резервов"""
+        with self._lock:
+            now = datetime.now()
+            return self._release([reservation_id for reservation_id, reservation in self.reservations.items()
+                                  if reservation['expires_at'] <= now])
+
+    def get_reservations(self) -> List[Dict[str, Any]]:
+        """Резервы с оставшимися местами по гипервизорам"""
+        with self._lock:
+            return [dict(reservation, slots=dict(reservation['slots']))
+                    for _, reservation in sorted(self.reservations.items())]
+
+    # Журнал операций
+    def get_journal(self, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Записи журнала с op_id больше after"""
+        with self._lock:
+            return [dict(entry) for entry in self.journal if entry['op_id'] > after][:limit]
+
+    def create_journal_snapshot(self) -> Optional[int]:
+        """Снимок счетчиков на текущей позиции журнала"""
+        with self._lock:
+            snapshot = dict(op_id=self._journal_id, created_at=datetime.now(),
+                            **self._counters(list(self.hypervisors.values()), self.used_disk))
+            self.journal_snapshots.append(snapshot)
+            return snapshot['op_id']
+
+    def compact_journal(self, keep_snapshots: int = 2) -> int:
+        """Удаление старых снимков и записей журнала до самого раннего из оставшихся снимков"""
+        with self._lock:
+            self.journal_snapshots = self.journal_snapshots[-max(keep_snapshots, 1):]
+            oldest = self.journal_snapshots[0]['op_id']
+            count = len(self.journal)
+            self.journal = [entry for entry in self.journal if entry['op_id'] > oldest]
+            return count - len(self.journal)
+
+    def _read_journal(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]]:
+        with self._lock:
+            snapshot = self.journal_snapshots[-1]
+            tail = [entry for entry in self.journal if entry['op_id'] > snapshot['op_id']]
+            return snapshot, tail, self._counters(list(self.hypervisors.values()), self.used_disk)
+
+    def _write_counters(self, state: Dict[str, Any]):
+        with self._lock:
+            for name, (free_cpu, free_ram, num_vms) in state['hypervisors'].items():
+                if name in self.hypervisors:
+                    self.hypervisors[name].update(free_cpu=free_cpu, free_ram=free_ram, num_vms=num_vms)
+            self.used_disk = state['used_disk']
+            self.data_version += 1
+
+    # Контрольные точки массовых развертываний
+    def save_deploy_checkpoint(self, run_id: str, state: Dict[str, Any]) -> bool:
+        """Сохранение состояния развертывания"""
+        with self._lock:
+            # Перезапись переносит точку в конец: порядок словаря - порядок обновления
+            self.deploy_checkpoints.pop(run_id, None)
+            self.deploy_checkpoints[run_id] = json.dumps(state, ensure_ascii=False)
+            return True
+
+    def get_deploy_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Последняя контрольная точка развертывания"""
+        with self._lock:
+            state = self.deploy_checkpoints.get(run_id)
+            return json.loads(state) if state is not None else None
+
+    def get_deploy_checkpoints(self) -> List[Dict[str, Any]]:
+        """Контрольные точки всех развертываний, новые первыми"""
+        with self._lock:
+            return [json.loads(state) for state in reversed(list(self.deploy_checkpoints.values()))]
+
+    # История загрузки
+    def record_utilization_sample(self, ts: Optional[datetime] = None) -> int:
+        """Запись отсчета загрузки всех гипервизоров и кластера"""
+        rows = _utilization_rows(self.get_all_hypervisors(), ts or datetime.now(), self.HISTORY_CLUSTER_KEY)
+        with self._lock:
+            self.history.extend(rows)
+        return len(rows)
+
+    @staticmethod
+    def _merge_bucket(target: Dict[Tuple[str, datetime], Dict[str, float]], key: Tuple[str, datetime],
+                      cpu_avg: float, cpu_max: float, ram_avg: float, ram_max: float,
+                      num_vms_max: int, samples: int):
+        """Добавление показателей в агрегат (средние взвешиваются по числу отсчетов)"""
+        bucket = target.get(key)
+        if bucket is None:
+            target[key] = {'cpu_avg': cpu_avg, 'cpu_max': cpu_max, 'ram_avg': ram_avg, 'ram_max': ram_max,
+                           'num_vms_max': num_vms_max, 'samples': samples}
+            return
+        total = bucket['samples'] + samples
+        bucket['cpu_avg'] = (bucket['cpu_avg'] * bucket['samples'] + cpu_avg * samples) / total
+        bucket['ram_avg'] = (bucket['ram_avg'] * bucket['samples'] + ram_avg * samples) / total
+        bucket['cpu_max'] = max(bucket['cpu_max'], cpu_max)
+        bucket['ram_max'] = max(bucket['ram_max'], ram_max)
+        bucket['num_vms_max'] = max(bucket['num_vms_max'], num_vms_max)
+        bucket['samples'] = total
+
+    def rollup_utilization_history(self, raw_retention: timedelta = timedelta(days=2),
+                                   minute_retention: timedelta = timedelta(days=30),
+                                   hour_retention: timedelta = timedelta(days=730)) -> bool:
+        """Свертка истории: сырые отсчеты -> минутные агрегаты -> часовые агрегаты"""
+        now = datetime.now()
+        with self._lock:
+            raw_cutoff = datetime.combine((now - raw_retention).date(), datetime.min.time())
+            kept = []
+            for ts, hv_name, cpu, ram, num_vms in self.history:
+                if ts >= raw_cutoff:
+                    kept.append((ts, hv_name, cpu, ram, num_vms))
+                    continue
+                self._merge_bucket(self.history_1m, (hv_name, ts.replace(second=0, microsecond=0)),
+                                   cpu, cpu, ram, ram, num_vms, 1)
+            self.history = kept
+
+            minute_cutoff = now - minute_retention
+            for key in [key for key in self.history_1m if key[1] < minute_cutoff]:
+                bucket = self.history_1m.pop(key)
+                self._merge_bucket(self.history_1h, (key[0], key[1].replace(minute=0)), **bucket)
+
+            for key in [key for key in self.history_1h if key[1] < now - hour_retention]:
+                del self.history_1h[key]
+
+        logger.info("Свертка истории загрузки выполнена")
+        return True
+
+    def get_utilization_history(self, hv_name: Optional[str] = None, start: Optional[datetime] = None,
+                                end: Optional[datetime] = None, max_points: int = 500) -> List[Dict[str, Any]]:
+        """Прореженный ряд загрузки за период (не более max_points строк)"""
+        end = end or datetime.now()
+        start = start or end - timedelta(days=1)
+        bucket_seconds = max(int((end - start).total_seconds() / max(max_points, 1)), 1)
+        hv_name = hv_name or self.HISTORY_CLUSTER_KEY
+
+        with self._lock:
+            samples = [(ts, cpu, cpu, ram, ram, num_vms, 1)
+                       for ts, name, cpu, ram, num_vms in self.history
+                       if name == hv_name and start <= ts <= end]
+            for tier in (self.history_1m, self.history_1h):
+                samples.extend((bucket, b['cpu_avg'], b['cpu_max'], b['ram_avg'], b['ram_max'],
+                                b['num_vms_max'], b['samples'])
+                               for (name, bucket), b in tier.items()
+                               if name == hv_name and start <= bucket <= end)
+
+        buckets: Dict[datetime, Dict[str, float]] = {}
+        for ts, cpu, cpu_max, ram, ram_max, num_vms, n in samples:
+            epoch = int((ts - datetime(1970, 1, 1)).total_seconds()) // bucket_seconds * bucket_seconds
+            key = datetime(1970, 1, 1) + timedelta(seconds=epoch)
+            self._merge_bucket(buckets, key, cpu, cpu_max, ram, ram_max, num_vms, n)
+
+        return [{'ts': key, 'cpu_usage': b['cpu_avg'], 'cpu_max': b['cpu_max'],
+                 'ram_usage': b['ram_avg'], 'ram_max': b['ram_max'], 'num_vms': b['num_vms_max']}
+                for key, b in sorted(buckets.items())]
+
+
+def _utilization_rows(hypervisors: List[Dict[str, Any]], ts: datetime, cluster_key: str) -> List[Tuple]:
+    """Строки отсчета загрузки: по каждому гипервизору и итог по кластеру"""
+    rows = []
+    totals = [0, 0, 0, 0, 0]
+    for hv in hypervisors:
+        cpu_capacity = max(hv['cpu_capacity'], 1)
+        ram_capacity = max(hv['ram_capacity'], 1)
+        rows.append((ts, hv['hv_name'], (cpu_capacity - hv['free_cpu']) * 100.0 / cpu_capacity,
+                     (ram_capacity - hv['free_ram']) * 100.0 / ram_capacity, hv['num_vms']))
+        totals[0] += cpu_capacity - hv['free_cpu']
+        totals[1] += cpu_capacity
+        totals[2] += ram_capacity - hv['free_ram']
+        totals[3] += ram_capacity
+        totals[4] += hv['num_vms']
+    if hypervisors:
+        rows.append((ts, cluster_key, totals[0] * 100.0 / totals[1], totals[2] * 100.0 / totals[3], totals[4]))
+    return rows
+
+
+BACKENDS = ('postgresql', 'sqlite', 'memory')
+
+
+def open_database(backend: str = 'postgresql', **params) -> StorageBackend:
+    """Создание хранилища по имени: postgresql (параметры подключения), sqlite (path), memory
+    или http (url сервиса api_server)"""
+    if backend == 'postgresql':
+        from database import Database
+        return Database(**params)
+    if backend == 'sqlite':
+        return SQLiteDatabase(**params)
+    if backend == 'memory':
+        return MemoryDatabase(**params)
+    if backend == 'http':
+        from api_client import RemoteStorage
+        return RemoteStorage(**params)
+    raise ValueError(f"Неизвестное хранилище: {backend}")
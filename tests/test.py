@@ -1,6 +1,11 @@
 import unittest
+import asyncio
 import sys
 import os
+import tempfile
+import json
+import threading
+import time
 from datetime import datetime
 
 # Добавляем родительскую директорию в путь для импорта
@@ -8,13 +13,31 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
     from models import VirtualMachine, Hypervisor, Cluster
-    from utils import Validator, ResourceCalculator
+    from utils import Validator, ResourceCalculator, PlacementPolicy, PlacementIndex, NameGenerator
+    from simulation import CapacitySimulator
+    from storage import SQLiteDatabase, MemoryDatabase
+    from async_operations import AsyncOperations
+    from metrics import MetricsRegistry
+    from slow_log import SlowQueryLog, fingerprint
+    from benchmarks.synthetic import generate_cluster
+    from clusters import ClusterSet
+    from api_server import ApiServer
+    from api_client import RemoteStorage
+    from connection_pool import BlockingConnectionPool
+    from deploy_worker import DeployWorker
     IMPORT_SUCCESS = True
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
     print("Убедитесь, что файлы проекта находятся в родительской директории")
     IMPORT_SUCCESS = False
 
+# Планировщик перебалансировки считает на NumPy
+try:
+    from rebalancer import ClusterRebalancer
+    REBALANCER_IMPORTED = True
+except ImportError:
+    REBALANCER_IMPORTED = False
+
 @unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
 class TestModels(unittest.TestCase):
     def test_vm_creation(self):
@@ -38,11 +61,746 @@ class TestValidator(unittest.TestCase):
         self.assertTrue(Validator.validate_vm_resources(2, 4, 40)[0])
         self.assertFalse(Validator.validate_vm_resources(1, 4, 40)[0])
 
+    def test_generate_vm_names(self):
+        names = NameGenerator.generate_vm_names("vm77db05", ["vm77db06", "vm77db08"], 4)
+        self.assertEqual(names, ["vm77db05", "vm77db07", "vm77db09", "vm77db10"])
+
 @unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
 class TestCalculator(unittest.TestCase):
     def test_cpu_usage(self):
         self.assertEqual(ResourceCalculator.calculate_cpu_usage(100, 30), 70.0)
         self.assertEqual(ResourceCalculator.calculate_cpu_usage(0, 0), 0.0)
+    
+    def test_capacity_with_overcommit(self):
+        self.assertEqual(ResourceCalculator.calculate_capacity(48, 3.0), 144)
+        self.assertEqual(ResourceCalculator.calculate_capacity(10, 1.1), 11)
+        self.assertEqual(ResourceCalculator.calculate_capacity(3, 1.1), 3)
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestPlacement(unittest.TestCase):
+    def test_choose_hypervisor(self):
+        hvs = [
+            {'hv_name': 's77hv01', 'free_cpu': 10, 'free_ram': 100, 'num_vms': 1},
+            {'hv_name': 's77hv02', 'free_cpu': 20, 'free_ram': 100, 'num_vms': 1},
+            {'hv_name': 's77hv03', 'free_cpu': 2, 'free_ram': 100, 'num_vms': 0}
+        ]
+        self.assertEqual(PlacementPolicy.choose_hypervisor(hvs, 4, 8)['hv_name'], 's77hv02')
+        self.assertEqual(PlacementPolicy.choose_hypervisor(hvs, 2, 8)['hv_name'], 's77hv03')
+        self.assertIsNone(PlacementPolicy.choose_hypervisor(hvs, 24, 8))
+    
+    def test_placement_index_rules(self):
+        hvs = [{'hv_name': f's77hv0{i}', 'free_cpu': 20, 'free_ram': 100, 'num_vms': 0} for i in range(1, 4)]
+        rules = [{'rule_id': 1, 'kind': 'spread', 'vm_prefix': 'vm77db', 'max_per_host': None, 'hosts': None},
+                 {'rule_id': 2, 'kind': 'max_per_host', 'vm_prefix': 'vm77db', 'max_per_host': 1, 'hosts': None},
+                 {'rule_id': 3, 'kind': 'pin', 'vm_prefix': 'vm77ts', 'max_per_host': None, 'hosts': ['s77hv03']}]
+        index = PlacementIndex([hv['hv_name'] for hv in hvs], rules, {(1, 's77hv01'): 1, (2, 's77hv01'): 1})
+        
+        # Пакетное размещение: счетчики и маски обновляются без перестроения индекса
+        placed = []
+        for name in ('vm77db02', 'vm77db03'):
+            hv, blocked = index.choose(hvs, 2, 4, name)
+            index.add_vm(name, hv['hv_name'])
+            placed.append(hv['hv_name'])
+        self.assertEqual(sorted(placed), ['s77hv02', 's77hv03'])
+        self.assertEqual(index.choose(hvs, 2, 4, 'vm77db04'), (None, True))
+        self.assertEqual(index.choose(hvs, 2, 4, 'vm77ts01')[0]['hv_name'], 's77hv03')
+        self.assertEqual(index.violations(), [])
+        
+        # Вторая ВМ группы на s77hv01: нарушено max_per_host, разница 2/1/1 для spread допустима
+        index.add_vm('vm77db04', 's77hv01')
+        violations = index.violations()
+        self.assertEqual(len(violations), 1)
+        self.assertIn('s77hv01 (2)', violations[0])
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestSimulator(unittest.TestCase):
+    def test_how_many_fit(self):
+        hvs = [{'hv_name': 's77hv01', 'cpu': 100, 'ram': 1000, 'free_cpu': 100, 'free_ram': 1000, 'num_vms': 0}]
+        simulator = CapacitySimulator(hvs, Cluster(overcommit_cpu=1.0), keep_reserve=True)
+        # 90 vCPU до резерва 10% -> 22 ВМ по 4 vCPU
+        self.assertEqual(simulator.how_many_fit(4, 8), 22)
+        self.assertEqual(simulator.summary()['total_vms'], 0)
+    
+    def test_what_if_add_hypervisors(self):
+        simulator = CapacitySimulator([], Cluster(overcommit_cpu=1.0), keep_reserve=False)
+        result = simulator.what_if(4, 8, add_hv_count=2, hv_cpu=64, hv_ram=512)
+        self.assertEqual(result['fit_now'], 0)
+        self.assertEqual(result['fit_after'], 32)
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestStorageBackends(unittest.TestCase):
+    def _backends(self, **config):
+        return [SQLiteDatabase(":memory:", config=config), MemoryDatabase(config=config)]
+    
+    def test_placement_and_counters(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                self.assertTrue(db.create_vm({'vm_name': 'vm77app01', 'vcpu': 4, 'vram': 8, 'vhdd': 100}))
+                self.assertTrue(db.create_vm({'vm_name': 'vm77app02', 'vcpu': 4, 'vram': 8, 'vhdd': 100}))
+                # Каждая ВМ на гипервизоре с наименьшим количеством ВМ
+                self.assertEqual({vm['hv_name'] for vm in db.get_all_vms()}, {'s77hv01', 's77hv02'})
+                self.assertFalse(db.create_vm({'vm_name': 'vm77app03', 'vcpu': 3, 'vram': 8, 'vhdd': 100}))
+                
+                stats = db.get_cluster_statistics()
+                self.assertEqual(stats['vcpu_capacity'], 144)
+                self.assertEqual(stats['total_vcpu'], 8)
+                self.assertEqual(stats['total_vhdd'], 200)
+                
+                self.assertEqual(db.delete_vms_bulk(['vm77app01', 'vm77app02']), 2)
+                self.assertEqual(db.get_cluster_statistics()['free_cpu'], 144)
+    
+    def test_disk_pool_overflow(self):
+        for db in self._backends(disk_pool='150'):
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                self.assertTrue(db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 100}))
+                self.assertFalse(db.create_vm({'vm_name': 'vm77app02', 'vcpu': 2, 'vram': 4, 'vhdd': 100}))
+                self.assertEqual(db.get_cluster_statistics()['total_vms'], 1)
+    
+    def test_drain_hypervisor(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                for i in range(1, 5):
+                    db.create_vm({'vm_name': f'vm77app0{i}', 'vcpu': 8, 'vram': 16, 'vhdd': 40})
+                self.assertEqual(db.drain_hypervisor('s77hv01'), (True, ""))
+                self.assertEqual(db.delete_hypervisor('s77hv01'), (True, ""))
+                self.assertEqual(db.get_all_hypervisors()[0]['num_vms'], 4)
+    
+    def test_placement_rules(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                for i in range(1, 4):
+                    db.add_hypervisor({'hv_name': f's77hv0{i}', 'cpu': 24, 'ram': 256})
+                db.create_vm({'vm_name': 'vm77db01', 'vcpu': 2, 'vram': 4, 'vhdd': 40})
+                db.migrate_vms([('vm77db01', 's77hv01')])
+                self.assertFalse(db.add_placement_rule({'kind': 'pin', 'vm_prefix': 'vm77ts'})[0])
+                self.assertTrue(db.add_placement_rule({'kind': 'max_per_host', 'vm_prefix': 'vm77db',
+                                                       'max_per_host': 1})[0])
+                
+                # Каждая ВМ группы на своем гипервизоре, четвертой места по правилу нет
+                for name in ('vm77db02', 'vm77db03'):
+                    self.assertTrue(db.create_vm({'vm_name': name, 'vcpu': 2, 'vram': 4, 'vhdd': 40}))
+                self.assertEqual(len({vm['hv_name'] for vm in db.get_all_vms()}), 3)
+                self.assertEqual(db.try_create_vm({'vm_name': 'vm77db04', 'vcpu': 2, 'vram': 4, 'vhdd': 40}),
+                                 (False, db.PLACEMENT_RULES_MESSAGE))
+                self.assertTrue(db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40}))
+                
+                # Счетчики ведутся при переносе и удалении, нарушения видны в отчете
+                self.assertEqual(db.get_placement_violations(), [])
+                db.migrate_vms([('vm77db02', 's77hv01')])
+                self.assertEqual(len(db.get_placement_violations()), 1)
+                db.delete_vm('vm77db02')
+                self.assertEqual(db.get_placement_violations(), [])
+                self.assertEqual(sum(db.get_placement_counts().values()), 2)
+    
+    def test_bulk_load_synthetic_cluster(self):
+        cluster = generate_cluster(300, seed=5)
+        # Генератор воспроизводим: тот же seed - тот же кластер
+        self.assertEqual(cluster, generate_cluster(300, seed=5))
+        for db in self._backends(**cluster['config']):
+            with self.subTest(backend=type(db).__name__):
+                for hv in cluster['hypervisors']:
+                    self.assertTrue(db.add_hypervisor(hv))
+                self.assertEqual(db.create_vms_bulk(cluster['vms']), 300)
+                
+                stats = db.get_cluster_statistics()
+                self.assertEqual(stats['total_vms'], 300)
+                self.assertEqual(stats['vcpu_capacity'] - stats['free_cpu'], sum(vm['vcpu'] for vm in cluster['vms']))
+                self.assertEqual(min(vm['creation_date'] for vm in db.get_all_vms()),
+                                 min(vm['creation_date'] for vm in cluster['vms']))
+                # Дубль имени: не загружается ни одна ВМ пакета
+                extra = dict(cluster['vms'][0], vm_name='vm77app999')
+                self.assertEqual(db.create_vms_bulk([extra, cluster['vms'][1]]), 0)
+                self.assertEqual(db.get_cluster_statistics()['total_vms'], 300)
+    
+    def test_check_invariants(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_placement_rule({'kind': 'spread', 'vm_prefix': 'vm77db'})
+                db.create_vm({'vm_name': 'vm77db01', 'vcpu': 4, 'vram': 8, 'vhdd': 40})
+                db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40})
+                db.delete_vm('vm77app01')
+                self.assertEqual(db.check_invariants(), [])
+        
+        # Счетчик, разошедшийся с ВМ (например, после сбоя), обнаруживается
+        db.hypervisors['s77hv01']['free_cpu'] += 4
+        self.assertEqual(db.check_invariants(), ["s77hv01: free_cpu = 72, по ВМ должно быть 68"])
+    
+    def test_data_version(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                versions = [db.get_data_version()]
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                versions.append(db.get_data_version())
+                db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40})
+                versions.append(db.get_data_version())
+                # Чтение и отказ в создании версию не меняют
+                db.get_cluster_statistics()
+                db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40})
+                self.assertEqual(db.get_data_version(), versions[-1])
+                db.set_overcommit(4.0, 1.0)
+                versions.append(db.get_data_version())
+                db.delete_vm('vm77app01')
+                versions.append(db.get_data_version())
+                self.assertEqual(len(set(versions)), len(versions))
+    
+    def test_export_csv(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.create_vms_bulk([{'vm_name': 'vm77db01', 'vcpu': 4, 'vram': 8, 'vhdd': 40, 'hv_name': 's77hv01',
+                                     'creation_date': datetime(2026, 1, 2, 3, 4, 5)}])
+                hv_rows = db.export_csv('hypervisors').decode().splitlines()
+                self.assertEqual(hv_rows[0], ",".join(db.EXPORT_COLUMNS['hypervisors']))
+                self.assertTrue(hv_rows[1].startswith("s77hv01,24,256,68,248,1,"))
+                self.assertTrue(hv_rows[1].endswith(",72,256"))
+                # Тип ВМ вычисляется при выгрузке
+                self.assertEqual(db.export_csv('vms').decode().splitlines(), [
+                    "vm_name,vcpu,vram,vhdd,hv_name,creation_date,vm_type",
+                    "vm77db01,4,8,40,s77hv01,2026-01-02 03:04:05,Сервер БД"
+                ])
+    
+    def test_delete_by_host_and_period(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                db.create_vms_bulk([{'vm_name': f'vm77app0{i}', 'vcpu': 2, 'vram': 4, 'vhdd': 40,
+                                     'hv_name': f's77hv0{i % 2 + 1}', 'creation_date': datetime(2025, i, 15)}
+                                    for i in range(1, 7)])
+                self.assertEqual(db.delete_vms_on_hypervisor('s77hv01'), 3)
+                self.assertEqual({vm['hv_name'] for vm in db.get_all_vms()}, {'s77hv02'})
+                # Остались vm77app01, 03, 05: раньше апреля созданы 01 и 03
+                self.assertEqual(db.delete_vms_created_before(datetime(2025, 4, 1)), 2)
+                self.assertEqual([vm['vm_name'] for vm in db.get_all_vms()], ['vm77app05'])
+                stats = db.get_cluster_statistics()
+                self.assertEqual((stats['total_vms'], stats['total_vcpu'], stats['total_vhdd']), (1, 2, 40))
+    
+    def test_journal_replay(self):
+        for db in self._backends():
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                db.create_vms_bulk([{'vm_name': f'vm77app0{i}', 'vcpu': 4, 'vram': 8, 'vhdd': 40,
+                                     'hv_name': 's77hv01'} for i in range(1, 4)])
+                db.migrate_vms([('vm77app01', 's77hv02')])
+                first = db.create_journal_snapshot()
+                db.create_vm({'vm_name': 'vm77db01', 'vcpu': 8, 'vram': 16, 'vhdd': 100})
+                db.delete_vm('vm77app02')
+                db.set_overcommit(4.0, 1.0)
+                db.add_hypervisor({'hv_name': 's77hv03', 'cpu': 24, 'ram': 256})
+                db.delete_hypervisor('s77hv03')
+                
+                # Снимок и 6 записей после него воспроизводят текущие счетчики
+                state = db.replay_journal()
+                self.assertEqual(state['replayed'], 6)
+                self.assertEqual(db.verify_counters(), [])
+                self.assertEqual([entry['op'] for entry in db.get_journal(first)],
+                                 ['vm_create', 'vm_delete', 'hv_resize', 'hv_resize', 'hv_add', 'hv_delete'])
+                
+                # Сбитый счетчик обнаруживается и восстанавливается без просмотра ВМ
+                if isinstance(db, MemoryDatabase):
+                    db.hypervisors['s77hv01']['free_cpu'] = 0
+                else:
+                    db._conn.execute("UPDATE hypervisors SET free_cpu = 0 WHERE hv_name = 's77hv01'")
+                self.assertEqual(len(db.verify_counters()), 1)
+                self.assertEqual(db.restore_counters(), (True, ""))
+                self.assertEqual(db.check_invariants(), [])
+                
+                # Сжатие оставляет последний снимок и записи после него
+                db.create_journal_snapshot()
+                db.delete_vm('vm77app03')
+                self.assertGreater(db.compact_journal(keep_snapshots=1), 0)
+                self.assertEqual([entry['op'] for entry in db.get_journal()], ['vm_delete'])
+                self.assertEqual(db.verify_counters(), [])
+
+    def test_capacity_reservations(self):
+        for db in self._backends(disk_pool='1000'):
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                vm = {'vm_name': 'vm77app01', 'vcpu': 16, 'vram': 8, 'vhdd': 100}
+                # 72 vCPU на гипервизор: 4 места по 16 vCPU на каждом
+                self.assertEqual(db.reserve_capacity(vm, 9), (None, db.NO_CAPACITY_MESSAGE))
+                reservation_id, message = db.reserve_capacity(vm, 6, owner='test')
+                self.assertEqual(message, "")
+                self.assertEqual(db.get_reservations()[0]['slots'], {'s77hv01': 3, 's77hv02': 3})
+                # Места резерва недоступны обычному созданию ВМ, диск тоже удержан
+                self.assertEqual(db.try_create_vm(dict(vm, vm_name='vm77db01', vhdd=500)),
+                                 (False, db.DISK_FULL_MESSAGE))
+                self.assertEqual(db.check_invariants(), [])
+                
+                self.assertTrue(db.try_create_reserved_vm(reservation_id, vm)[0])
+                self.assertFalse(db.try_create_reserved_vm(reservation_id, dict(vm, vm_name='vm77app02', vcpu=8))[0])
+                self.assertEqual(db.release_reservation(reservation_id), 5)
+                self.assertEqual(db.try_create_reserved_vm(reservation_id, dict(vm, vm_name='vm77app02')),
+                                 (False, db.RESERVATION_MISSING_MESSAGE))
+                self.assertEqual(db.get_cluster_statistics()['total_vhdd'], 100)
+                
+                # Истекший резерв не используется и освобождается очисткой
+                reservation_id, _ = db.reserve_capacity(vm, 2, ttl=0.01)
+                time.sleep(0.05)
+                self.assertFalse(db.renew_reservation(reservation_id))
+                self.assertFalse(db.try_create_reserved_vm(reservation_id, dict(vm, vm_name='vm77app02'))[0])
+                self.assertEqual(db.release_expired_reservations(), 2)
+                self.assertEqual(db.get_reservations(), [])
+                self.assertEqual(db.check_invariants(), [])
+                self.assertEqual(db.verify_counters(), [])
+
+    def test_disk_pool_capacity_from_config(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "datacenter.db")
+            db = SQLiteDatabase(path, config={'disk_pool': '1000'})
+            db._conn.execute("UPDATE cluster_config SET config_value = '2000' WHERE config_key = 'disk_pool'")
+            db.close()
+            # Измененный disk_pool доходит до счетчика пула при следующем открытии
+            db = SQLiteDatabase(path)
+            try:
+                self.assertEqual(db.get_cluster_statistics()['disk_pool'], 2000)
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                self.assertTrue(db.create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 1500}))
+            finally:
+                db.close()
+
+    def test_overcommit_changed_by_other_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "datacenter.db")
+            gui, server = SQLiteDatabase(path), SQLiteDatabase(path)
+            try:
+                self.assertEqual(gui.get_overcommit(), (3.0, 1.0))
+                self.assertTrue(server.set_overcommit(4.0, 2.0)[0])
+                # Кэш конфигурации другого соединения не отдает старые коэффициенты
+                self.assertEqual(gui.get_overcommit(), (4.0, 2.0))
+                self.assertTrue(gui.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256}))
+                hv = server.get_all_hypervisors()[0]
+                self.assertEqual((hv['free_cpu'], hv['free_ram']), (96, 512))
+                self.assertEqual(server.check_invariants(), [])
+            finally:
+                gui.close()
+                server.close()
+
+@unittest.skipIf(not IMPORT_SUCCESS or not REBALANCER_IMPORTED, "Модули проекта или NumPy не найдены")
+class TestRebalancer(unittest.TestCase):
+    def _cluster(self, placement):
+        """Три гипервизора по 72 vCPU и ВМ на заданных гипервизорах"""
+        db = MemoryDatabase()
+        for i in range(1, 4):
+            db.add_hypervisor({'hv_name': f's77hv0{i}', 'cpu': 24, 'ram': 256})
+        for _, vm_name, vcpu, vram in placement:
+            db.create_vm({'vm_name': vm_name, 'vcpu': vcpu, 'vram': vram, 'vhdd': 40})
+        self.assertTrue(db.migrate_vms([(vm_name, hv_name) for hv_name, vm_name, _, _ in placement])[0])
+        return db
+    
+    def _check_applied(self, db, rebalancer, plan):
+        self.assertEqual(rebalancer.apply(plan), (True, ""))
+        self.assertTrue(all(hv['free_cpu'] >= 0 and hv['free_ram'] >= 0 for hv in db.get_all_hypervisors()))
+        self.assertEqual(db.check_invariants(), [])
+        self.assertEqual(db.get_placement_violations(), [])
+    
+    def test_largest_vm_with_pinned_group(self):
+        # На каждом гипервизоре свободно 40 vCPU: ВМ на 48 vCPU не помещается нигде
+        placement = [('s77hv01', 'vm77app01', 16, 8), ('s77hv01', 'vm77db01', 16, 8),
+                     ('s77hv02', 'vm77db02', 16, 8), ('s77hv02', 'vm77db03', 16, 8),
+                     ('s77hv03', 'vm77db04', 16, 8), ('s77hv03', 'vm77db05', 16, 8)]
+        db = self._cluster(placement)
+        self.assertTrue(db.add_placement_rule({'kind': 'pin', 'vm_prefix': 'vm77app', 'hosts': ['s77hv01']})[0])
+        rebalancer = ClusterRebalancer(db)
+        plan = rebalancer.plan('largest_vm', target_vcpu=48, target_vram=8)
+        
+        self.assertFalse(plan['before']['fits_target'])
+        self.assertTrue(plan['after']['fits_target'])
+        self.assertGreater(plan['after']['max_free_cpu'], plan['before']['max_free_cpu'])
+        # Закрепленная ВМ остается на месте, освобождается место переносом другой
+        self.assertEqual(plan['moves'], [('vm77db01', 's77hv01', 's77hv02')])
+        self._check_applied(db, rebalancer, plan)
+        self.assertEqual(max(hv['free_cpu'] for hv in db.get_all_hypervisors()), 56)
+    
+    def test_balance_with_rules(self):
+        # Все ВМ на первом гипервизоре: группа vm77db закреплена на нем, vm77app - spread
+        placement = [('s77hv01', name, 8, 16) for name in
+                     ['vm77db01', 'vm77db02'] + [f'vm77app0{i}' for i in range(1, 5)]]
+        db = self._cluster(placement)
+        self.assertTrue(db.add_placement_rule({'kind': 'pin', 'vm_prefix': 'vm77db', 'hosts': ['s77hv01']})[0])
+        self.assertTrue(db.add_placement_rule({'kind': 'spread', 'vm_prefix': 'vm77app'})[0])
+        rebalancer = ClusterRebalancer(db)
+        plan = rebalancer.plan('balance')
+        
+        self.assertLess(plan['after']['cpu_usage_std'], plan['before']['cpu_usage_std'])
+        self.assertLess(plan['after']['ram_usage_std'], plan['before']['ram_usage_std'])
+        self.assertTrue(all(vm_name.startswith('vm77app') for vm_name, _, _ in plan['moves']))
+        self._check_applied(db, rebalancer, plan)
+        # Повторный план после применения переносов не находит
+        self.assertEqual(rebalancer.plan('balance')['moves'], [])
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestClusters(unittest.TestCase):
+    def _cluster(self, hypervisors, delay=0.0, **config):
+        class SlowDatabase(MemoryDatabase):
+            def get_cluster_statistics(self):
+                time.sleep(delay)
+                return super().get_cluster_statistics()
+        
+        db = SlowDatabase(config=config)
+        for i in range(1, hypervisors + 1):
+            db.add_hypervisor({'hv_name': f's77hv0{i}', 'cpu': 24, 'ram': 256})
+        return db
+    
+    def test_global_statistics_in_parallel(self):
+        clusters = ClusterSet({f'site{i}': self._cluster(2, delay=0.2) for i in range(5)})
+        try:
+            started = time.perf_counter()
+            statistics = clusters.get_global_statistics()
+            # Кластеры опрашиваются одновременно: время одного запроса, а не пяти
+            self.assertLess(time.perf_counter() - started, 0.6)
+            self.assertEqual(len(statistics['clusters']), 5)
+            self.assertEqual(statistics['total']['total_hypervisors'], 10)
+            self.assertEqual(statistics['total']['vcpu_capacity'], 720)
+            self.assertEqual(statistics['unavailable'], {})
+        finally:
+            clusters.close()
+    
+    def test_create_vm_anywhere(self):
+        full = self._cluster(1, disk_pool='100')
+        free = self._cluster(2)
+        clusters = ClusterSet({'msk': full, 'spb': free})
+        try:
+            full.create_vm({'vm_name': 'vm77db01', 'vcpu': 2, 'vram': 4, 'vhdd': 80})
+            # В msk не хватает дискового пула, ВМ создается в spb
+            self.assertEqual([c['cluster'] for c in clusters.find_capacity(2, 4, 40)], ['spb'])
+            self.assertEqual(clusters.create_vm_anywhere({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40}),
+                             (True, 'spb/s77hv01'))
+            self.assertFalse(clusters.create_vm_anywhere({'vm_name': 'vm77app02', 'vcpu': 2, 'vram': 512,
+                                                          'vhdd': 40})[0])
+        finally:
+            clusters.close()
+    
+    def test_slow_and_unavailable_clusters(self):
+        clusters = ClusterSet({'msk': self._cluster(1), 'spb': self._cluster(1, delay=0.5)}, timeout=0.1,
+                              unavailable={'nsk': "нет подключения"})
+        try:
+            statistics = clusters.get_global_statistics()
+            self.assertEqual(list(statistics['clusters']), ['msk'])
+            self.assertEqual(statistics['unavailable'], {'spb': "нет ответа за 0.1 с", 'nsk': "нет подключения"})
+            # Зависший запрос spb еще выполняется: новый к нему не ставится, msk отвечает сразу
+            started = time.perf_counter()
+            statistics = clusters.get_global_statistics()
+            self.assertLess(time.perf_counter() - started, 0.1)
+            self.assertEqual(statistics['unavailable']['spb'], "не завершен предыдущий запрос")
+            self.assertEqual(statistics['total']['total_hypervisors'], 1)
+            # После завершения зависшего запроса кластер снова опрашивается
+            time.sleep(0.5)
+            self.assertEqual(clusters.get_global_statistics()['unavailable']['spb'], "нет ответа за 0.1 с")
+        finally:
+            clusters.close()
+    
+    def test_from_config_with_unavailable_cluster(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "clusters.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({'clusters': {'msk': {'backend': "memory"},
+                                        'spb': {'backend': "sqlite", 'path': os.path.join(tmp, "missing", "spb.db")}}}, f)
+            clusters = ClusterSet.from_config(path)
+        try:
+            self.assertEqual(list(clusters.clusters), ['msk'])
+            self.assertIn('spb', clusters.unavailable)
+            statistics = clusters.get_global_statistics()
+            self.assertEqual((list(statistics['clusters']), list(statistics['unavailable'])), (['msk'], ['spb']))
+        finally:
+            clusters.close()
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestDeployments(unittest.TestCase):
+    VM = {'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40}
+    
+    def test_cancel_stop_and_resume(self):
+        for db in (SQLiteDatabase(":memory:"), MemoryDatabase()):
+            with self.subTest(backend=type(db).__name__):
+                # 24 ядра x 3.0 = 72 vCPU: помещается 36 ВМ из 40
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                ops = AsyncOperations(db)
+                run_id = ops.start_deployment(self.VM, 40, chunk_size=4)['run_id']
+                
+                # Места под все ВМ резервируются заранее: остановка до создания первой ВМ
+                state = asyncio.run(ops.run_deployment(run_id))
+                self.assertEqual((state['status'], state['created'], state['message']),
+                                 ('stopped', 0, db.NO_CAPACITY_MESSAGE))
+                self.assertEqual(db.get_all_vms(), [])
+                
+                db.add_hypervisor({'hv_name': 's77hv02', 'cpu': 24, 'ram': 256})
+                
+                def cancel_after_two_chunks(state):
+                    if state['created'] >= 8:
+                        ops.cancel_deployment(run_id)
+                
+                state = asyncio.run(ops.resume_deployment(run_id, cancel_after_two_chunks))
+                self.assertEqual((state['status'], state['created']), ('cancelled', 8))
+                self.assertEqual(len(db.get_all_vms()), 8)
+                # Неиспользованные места резерва освобождены при отмене
+                self.assertEqual((state['reservation_id'], db.get_reservations()), (None, []))
+                self.assertEqual(db.check_invariants(), [])
+                
+                state = asyncio.run(ops.resume_deployment(run_id))
+                self.assertEqual((state['status'], state['created'], state['failed']), ('done', 40, {}))
+                self.assertEqual(db.get_cluster_statistics()['total_vms'], 40)
+                self.assertEqual(db.get_deploy_checkpoint(run_id)['status'], 'done')
+    
+    def test_resume_after_interrupted_chunk(self):
+        for db in (SQLiteDatabase(":memory:"), MemoryDatabase()):
+            with self.subTest(backend=type(db).__name__):
+                db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+                ops = AsyncOperations(db)
+                state = ops.start_deployment(self.VM, 5)
+                # Процесс завершился посреди пакета: создана одна ВМ из двух
+                db.create_vm(dict(self.VM, vm_name='vm77app01'))
+                state['in_flight'] = ['vm77app01', 'vm77app02']
+                db.save_deploy_checkpoint(state['run_id'], state)
+                
+                state = asyncio.run(ops.resume_deployment(state['run_id']))
+                self.assertEqual((state['status'], state['created']), ('done', 5))
+                self.assertEqual(len(db.get_all_vms()), 5)
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestDeployWorker(unittest.TestCase):
+    class QueueDatabase(MemoryDatabase):
+        """Хранилище в памяти с очередью задач одного задания (очередь PostgreSQL без базы)"""
+        def __init__(self, count):
+            super().__init__()
+            self.tasks = [{'job_id': 1, 'seq': seq, 'vm_name': f'vm77app{seq:02d}', 'attempts': 1, 'max_attempts': 3,
+                           'vcpu': 2, 'vram': 4, 'vhdd': 40, 'already_created': False, 'name_taken': False}
+                          for seq in range(1, count + 1)]
+            self.results = []
+        
+        def claim_deploy_tasks(self, worker, limit=10, lease=None):
+            tasks, self.tasks = self.tasks[:limit], self.tasks[limit:]
+            return tasks
+        
+        def finish_deploy_tasks(self, results, worker=None):
+            self.results.extend(results)
+    
+    def test_batch_reserves_capacity(self):
+        # 24 ядра x 3.0 = 72 vCPU: помещается 36 ВМ
+        db = self.QueueDatabase(40)
+        db.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+        worker = DeployWorker(db, batch_size=30)
+        self.assertEqual(worker.process_batch(), 30)
+        self.assertEqual([result[2] for result in db.results], ['done'] * 30)
+        
+        # Для пакета из 10 ВМ осталось 6 мест: пакет отклоняется целиком, а не на середине
+        self.assertEqual(worker.process_batch(), 10)
+        self.assertEqual({result[2:4] for result in db.results[30:]}, {('failed', db.NO_CAPACITY_MESSAGE)})
+        self.assertEqual(len(db.get_all_vms()), 30)
+        self.assertEqual(db.get_reservations(), [])
+        self.assertEqual(db.check_invariants(), [])
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestApiServer(unittest.TestCase):
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.reads = 0
+        get_all_vms = self.db.get_all_vms
+        
+        def counted_get_all_vms():
+            self.reads += 1
+            return get_all_vms()
+        
+        self.db.get_all_vms = counted_get_all_vms
+        # Сервер на свободном порту, цикл событий в фоновом потоке
+        self.server = ApiServer(self.db, port=0, max_age=0.0)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.start())
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.port}"
+    
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+    
+    def test_shared_cache_and_etag(self):
+        clients = [RemoteStorage(self.url) for _ in range(3)]
+        self.assertTrue(clients[0].add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256}))
+        self.assertEqual(clients[0].try_create_vm({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40}),
+                         (True, 's77hv01'))
+        
+        # Три клиента, по два опроса: одно чтение хранилища, повторные опросы - 304
+        for _ in range(2):
+            for client in clients:
+                vms = client.get_all_vms()
+                self.assertEqual([vm['vm_name'] for vm in vms], ['vm77app01'])
+                self.assertIsInstance(vms[0]['creation_date'], datetime)
+        self.assertEqual(self.reads, 1)
+        
+        # Изменение через сервис видно всем клиентам со следующего опроса
+        self.assertEqual(clients[1].delete_hypervisor('s77hv01')[0], False)
+        self.assertTrue(clients[1].delete_vm('vm77app01'))
+        self.assertEqual(clients[2].get_all_vms(), [])
+        self.assertEqual(self.reads, 2)
+        self.assertEqual(clients[0].get_cluster_statistics()['total_vms'], 0)
+    
+    def test_deployment_in_service(self):
+        client = RemoteStorage(self.url)
+        client.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+        job_id = client.submit_deploy_job({'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40}, 10)
+        self.assertIsNotNone(job_id)
+        for _ in range(100):
+            jobs = client.get_deploy_jobs()
+            if jobs[0]['status'] != 'running':
+                break
+            time.sleep(0.02)
+        self.assertEqual((jobs[0]['job_id'], jobs[0]['status'], jobs[0]['created']), (job_id, 'done', 10))
+        self.assertEqual(len(client.get_all_vms()), 10)
+    
+    def test_service_side_operations(self):
+        client = RemoteStorage(self.url)
+        client.add_hypervisor({'hv_name': 's77hv01', 'cpu': 24, 'ram': 256})
+        self.assertEqual(client.create_vms_bulk([{'vm_name': 'vm77app01', 'vcpu': 2, 'vram': 4, 'vhdd': 40,
+                                                   'hv_name': 's77hv01', 'creation_date': datetime(2024, 1, 1)}]), 1)
+        self.assertEqual(client.set_overcommit(2.0, 1.0), (True, ""))
+        self.assertEqual(self.db.get_overcommit(), (2.0, 1.0))
+        self.assertTrue(client.add_placement_rule({'kind': 'spread', 'vm_prefix': 'vm77app'})[0])
+        self.assertEqual(client.get_placement_counts(), self.db.get_placement_counts())
+        self.assertEqual(client.get_reservations(), [])
+        # Сверки выполняет сервис, операции его процесса отклоняются без исключений
+        self.assertEqual(client.check_invariants(), [])
+        self.assertEqual(client.verify_counters(), [])
+        self.assertEqual(client.reserve_capacity({'vm_name': 'vm77app02', 'vcpu': 2, 'vram': 4, 'vhdd': 40}, 2)[0],
+                         None)
+        self.assertEqual(client.record_utilization_sample(), 0)
+        self.assertEqual(client.get_deploy_checkpoints(), [])
+        self.assertIsNone(client.replay_journal())
+        self.assertFalse(client.restore_counters()[0])
+    
+    def test_cli_api_url(self):
+        import main
+        
+        args = main.parse_args(["--api-url", self.url, "jobs"])
+        self.assertIsInstance(main.open_storage(args), RemoteStorage)
+        # Локальное хранилище и команды, работающие с ним напрямую, с --api-url не совмещаются
+        for argv in (["--backend", "sqlite", "jobs"], ["--backend", "memory"], ["sample"], ["journal"],
+                     ["worker"], ["serve"], ["deploy", "--resume", "run1"]):
+            with self.subTest(argv=argv), self.assertRaises(SystemExit):
+                main.parse_args(["--api-url", self.url] + argv)
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestConnectionPool(unittest.TestCase):
+    class FakePool:
+        """Пул, который, как ThreadedConnectionPool, сразу падает при занятых соединениях"""
+        def __init__(self, size):
+            self.size, self.used, self.max_used = size, 0, 0
+            self.lock = threading.Lock()
+        
+        def getconn(self):
+            with self.lock:
+                if self.used >= self.size:
+                    raise RuntimeError("connection pool exhausted")
+                self.used += 1
+                self.max_used = max(self.max_used, self.used)
+                return object()
+        
+        def putconn(self, conn, close=False):
+            with self.lock:
+                self.used -= 1
+        
+        def closeall(self):
+            pass
+    
+    def test_callers_wait_for_connection(self):
+        fake = self.FakePool(3)
+        pool = BlockingConnectionPool(fake, 3)
+        errors = []
+        
+        def call():
+            try:
+                conn = pool.getconn()
+                time.sleep(0.01)
+                pool.putconn(conn)
+            except Exception as e:
+                errors.append(e)
+        
+        # Вызывающих в пять раз больше, чем соединений: все дожидаются своей очереди
+        threads = [threading.Thread(target=call) for _ in range(15)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual((fake.max_used, fake.used), (3, 0))
+    
+    def test_wait_timeout(self):
+        waits = []
+        pool = BlockingConnectionPool(self.FakePool(1), 1, timeout=0.05, on_wait=waits.append)
+        conn = pool.getconn()
+        with self.assertRaises(TimeoutError):
+            pool.getconn()
+        # Время ожидания места в пуле передается в метрику, в том числе неудачного
+        self.assertEqual(len(waits), 2)
+        self.assertGreaterEqual(waits[1], 0.05)
+        pool.putconn(conn)
+        pool.putconn(pool.getconn())
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestMetrics(unittest.TestCase):
+    def test_histogram_and_export(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_query_seconds", "Запросы", ("method",), buckets=(0.01, 0.1, 1.0))
+        for value in (0.005, 0.05, 0.05, 0.5):
+            histogram.observe(value, "get_all_vms")
+        registry.counter("test_vms_total", "ВМ", ("result",)).inc("created", amount=3)
+        # Повторная регистрация возвращает ту же метрику
+        self.assertIs(registry.histogram("test_query_seconds", "Запросы", ("method",)), histogram)
+        
+        row = histogram.snapshot()[0]
+        self.assertEqual((row['count'], row['labels']), (4, {'method': 'get_all_vms'}))
+        self.assertAlmostEqual(row['sum'], 0.605)
+        self.assertTrue(0.01 < row['p50'] <= 0.1)
+        self.assertTrue(0.1 < row['p95'] <= 0.5)
+        
+        text = registry.render_prometheus()
+        self.assertIn('test_query_seconds_bucket{method="get_all_vms",le="0.1"} 3', text)
+        self.assertIn('test_query_seconds_bucket{method="get_all_vms",le="+Inf"} 4', text)
+        self.assertIn('test_query_seconds_count{method="get_all_vms"} 4', text)
+        self.assertIn('test_vms_total{result="created"} 3', text)
+
+@unittest.skipIf(not IMPORT_SUCCESS, "Модули проекта не найдены")
+class TestSlowQueryLog(unittest.TestCase):
+    def test_fingerprint(self):
+        key, normalized = fingerprint("SELECT * FROM virtual_machines WHERE vm_name LIKE 'vm77app%' AND vcpu IN (%s, %s)")
+        self.assertEqual(normalized, "SELECT * FROM virtual_machines WHERE vm_name LIKE ? AND vcpu IN (...)")
+        other, _ = fingerprint("SELECT *  FROM virtual_machines\n WHERE vm_name LIKE 'vm77db%' AND vcpu IN (%s, %s, %s)")
+        self.assertEqual(key, other)
+    
+    def test_threshold_and_single_explain(self):
+        explained = []
+        
+        def explain(sql, params):
+            explained.append(sql)
+            return "Seq Scan on virtual_machines", True
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "slow.log")
+            log = SlowQueryLog(path, threshold_ms=50, explain=explain)
+            sql = "SELECT COUNT(*) FROM virtual_machines WHERE hv_name = %s"
+            self.assertFalse(log.record(sql, ('s77hv01',), 0.01, "delete_hypervisor"))
+            self.assertTrue(log.record(sql, ('s77hv01',), 0.2, "delete_hypervisor", 1))
+            self.assertTrue(log.record(sql, ('s77hv02',), 0.1, "delete_hypervisor", 1))
+            self.assertTrue(log.record("LOCK TABLE virtual_machines", None, 0.3, "add_placement_rule"))
+            log.close()
+            
+            # План строится один раз на отпечаток и только для запросов с данными
+            self.assertEqual(explained, [sql])
+            summary = SlowQueryLog.summarize(path)
+            self.assertEqual([group['count'] for group in summary], [2, 1])
+            self.assertAlmostEqual(summary[0]['max_ms'], 200.0)
+            self.assertEqual(summary[0]['plan']['plan'], "Seq Scan on virtual_machines")
+            self.assertIsNone(summary[1]['plan'])
+            # В журнал попадает форма параметров, а не значения
+            entries = SlowQueryLog.read(path)
+            self.assertEqual(entries[0]['params'], ['str'])
+            self.assertNotIn('s77hv01', open(path, encoding="utf-8").read())
 
 class TestAnalysis(unittest.TestCase):
     def test_usage_stats(self):
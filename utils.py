@@ -1,6 +1,7 @@
 import re
 from datetime import datetime
-from typing import Tuple, List, Dict, Any
+from decimal import Decimal
+from typing import Tuple, List, Dict, Any, Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -56,6 +57,24 @@ class Validator:
         if not (40 <= vhdd <= 4096):
             return False, "vHDD должно быть от 40 до 4096 ГБ"
         return True, ""
+    
+    @staticmethod
+    def validate_placement_rule(rule: Dict[str, Any]) -> Tuple[bool, str]:
+        """Валидация правила размещения"""
+        if rule.get('kind') not in PlacementIndex.RULE_KINDS:
+            return False, "Тип правила: spread (распределение), max_per_host (не более N на гипервизор) или pin (только указанные гипервизоры)"
+        if not re.match(r'^vm77(app|db|ts)\d*$', rule.get('vm_prefix') or ''):
+            return False, "Группа ВМ задается началом имени: vm77db, vm77app1 и т.п."
+        if rule['kind'] == 'max_per_host' and not (rule.get('max_per_host') or 0) >= 1:
+            return False, "Для правила max_per_host укажите количество ВМ на гипервизор (не менее 1)"
+        if rule['kind'] == 'pin':
+            if not rule.get('hosts'):
+                return False, "Для правила pin укажите список гипервизоров"
+            for hv_name in rule['hosts']:
+                is_valid, message = Validator.validate_hv_name(hv_name)
+                if not is_valid:
+                    return False, message
+        return True, ""
 
 
 class NameGenerator:
@@ -83,12 +102,28 @@ class NameGenerator:
             prefix = match.group(1)
             number = int(match.group(2))
         
+        taken = set(existing_names)
         while True:
             new_name = f"vm77{prefix}{number:02d}"
-            if new_name not in existing_names:
+            if new_name not in taken:
                 return new_name
             number += 1
     
+    @staticmethod
+    def generate_vm_names(base_name: str, existing_names: List[str], count: int) -> List[str]:
+        """Генерация count уникальных имен ВМ подряд от базового имени (один проход по номерам)"""
+        taken = set(existing_names)
+        match = re.match(r'^vm77(app|db|ts)(\d+)$', NameGenerator.generate_vm_name(base_name, []))
+        prefix, number = match.group(1), int(match.group(2))
+        
+        names = []
+        while len(names) < count:
+            name = f"vm77{prefix}{number:02d}"
+            if name not in taken:
+                names.append(name)
+            number += 1
+        return names
+    
     @staticmethod
     def get_next_hv_name(existing_names: List[str]) -> str:
         """Генерация следующего имени гипервизора"""
@@ -156,6 +191,12 @@ class ResourceCalculator:
         """Расчет требуемых физических CPU с учетом переподписки"""
         return vcpus / overcommit
     
+    @staticmethod
+    def calculate_capacity(physical: int, overcommit: float = 1.0) -> int:
+        """Расчет виртуальной емкости (vCPU/vRAM) с учетом переподписки.
+        Decimal дает тот же результат, что и FLOOR(x * ratio::numeric) в PostgreSQL"""
+        return int(Decimal(physical) * Decimal(str(overcommit)))
+    
     @staticmethod
     def check_minimum_resources(total_cpu: int, free_cpu: int, 
                                 total_ram: int, free_ram: int) -> Tuple[bool, str]:
@@ -174,6 +215,186 @@ class ResourceCalculator:
         return True, "Ресурсы в норме"
 
 
+class PlacementPolicy:
+    """Правила размещения ВМ на гипервизорах"""
+    
+    @staticmethod
+    def choose_hypervisor(hypervisors: List[Dict[str, Any]], vcpu: int,
+                          vram: int) -> Optional[Dict[str, Any]]:
+        """Выбор гипервизора по тем же правилам, что и в create_vm:
+        сначала меньше всего ВМ, затем больше всего свободных CPU"""
+        best = None
+        for hv in hypervisors:
+            if hv['free_cpu'] < vcpu or hv['free_ram'] < vram:
+                continue
+            if best is None or (hv['num_vms'], -hv['free_cpu']) < (best['num_vms'], -best['free_cpu']):
+                best = hv
+        return best
+
+
+class PlacementIndex:
+    """Битовые индексы правил размещения (affinity/anti-affinity) по гипервизорам.
+    Бит i маски соответствует гипервизору hosts[i], поэтому проверка правил при выборе
+    гипервизора - операции над масками (O(hosts/64) машинных слов). Счетчики ВМ группы
+    по гипервизорам обновляются инкрементально (add_vm) - для пакетного размещения.
+    
+    Правило: {'rule_id', 'kind', 'vm_prefix', 'max_per_host', 'hosts'}, группа ВМ - начало имени:
+    spread - ВМ группы на гипервизорах с наименьшим количеством ВМ этой группы,
+    max_per_host - не более max_per_host ВМ группы на гипервизоре,
+    pin - ВМ группы только на гипервизорах hosts"""
+    
+    RULE_KINDS = ('spread', 'max_per_host', 'pin')
+    
+    def __init__(self, hosts: List[str], rules: List[Dict[str, Any]], counts: Dict[Tuple[int, str], int]):
+        self.hosts = list(hosts)
+        self.position = {hv_name: i for i, hv_name in enumerate(self.hosts)}
+        self.all_mask = (1 << len(self.hosts)) - 1
+        self.rules = {rule['rule_id']: rule for rule in rules}
+        
+        # Количество ВМ группы правила на каждом гипервизоре
+        self.counts = {rule_id: [0] * len(self.hosts) for rule_id in self.rules}
+        for (rule_id, hv_name), count in counts.items():
+            if rule_id in self.counts and hv_name in self.position:
+                self.counts[rule_id][self.position[hv_name]] = count
+        
+        # pin: разрешенные гипервизоры; max_per_host: заполненные; spread: уровень -> гипервизоры
+        self.allowed = {}
+        self.full = {}
+        self.levels = {}
+        for rule_id, rule in self.rules.items():
+            if rule['kind'] == 'pin':
+                self.allowed[rule_id] = self.mask(rule['hosts'])
+            elif rule['kind'] == 'max_per_host':
+                self.full[rule_id] = self.mask(hv_name for hv_name, count in zip(self.hosts, self.counts[rule_id])
+                                               if count >= rule['max_per_host'])
+            else:
+                levels = {}
+                for i, count in enumerate(self.counts[rule_id]):
+                    levels[count] = levels.get(count, 0) | 1 << i
+                self.levels[rule_id] = levels
+    
+    def mask(self, hv_names) -> int:
+        """Маска гипервизоров по именам (неизвестные имена пропускаются)"""
+        result = 0
+        for hv_name in hv_names:
+            if hv_name in self.position:
+                result |= 1 << self.position[hv_name]
+        return result
+    
+    def matching_rules(self, vm_name: str) -> List[int]:
+        """Правила, группа которых включает ВМ"""
+        return [rule_id for rule_id, rule in self.rules.items() if vm_name.startswith(rule['vm_prefix'])]
+    
+    def candidates(self, vm_name: str, fit_mask: int) -> int:
+        """Гипервизоры из fit_mask, разрешенные правилами для ВМ (предпочтительные для spread)"""
+        mask = fit_mask
+        spread = []
+        for rule_id in self.matching_rules(vm_name):
+            if rule_id in self.allowed:
+                mask &= self.allowed[rule_id]
+            elif rule_id in self.full:
+                mask &= ~self.full[rule_id]
+            else:
+                spread.append(rule_id)
+        
+        # Предпочтение - наименьший уровень заполнения среди разрешенных гипервизоров
+        for rule_id in spread:
+            for level in sorted(self.levels[rule_id]):
+                preferred = mask & self.levels[rule_id][level]
+                if preferred:
+                    mask = preferred
+                    break
+        return mask
+    
+    def move_mask(self, vm_name: str, source: str) -> int:
+        """Гипервизоры, на которые ВМ можно перенести с source, не нарушив правил:
+        pin и max_per_host - как при размещении, spread - только туда, где ВМ группы
+        меньше, чем на source (разброс группы не растет)"""
+        src = self.position.get(source)
+        mask = self.all_mask if src is None else self.all_mask & ~(1 << src)
+        for rule_id in self.matching_rules(vm_name):
+            if rule_id in self.allowed:
+                mask &= self.allowed[rule_id]
+            elif rule_id in self.full:
+                mask &= ~self.full[rule_id]
+            elif src is not None:
+                below = 0
+                for level, hosts in self.levels[rule_id].items():
+                    if level < self.counts[rule_id][src]:
+                        below |= hosts
+                mask &= below
+        return mask
+
+    def choose(self, hypervisors: List[Dict[str, Any]], vcpu: int, vram: int,
+               vm_name: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Выбор гипервизора с учетом правил, затем по правилам PlacementPolicy.
+        Возвращает (гипервизор или None, отказ из-за правил размещения)"""
+        fit_mask = 0
+        by_position = {}
+        for hv in hypervisors:
+            if hv['hv_name'] in self.position and hv['free_cpu'] >= vcpu and hv['free_ram'] >= vram:
+                fit_mask |= 1 << self.position[hv['hv_name']]
+                by_position[self.position[hv['hv_name']]] = hv
+        
+        mask = self.candidates(vm_name, fit_mask)
+        if not mask:
+            return None, fit_mask != 0
+        
+        best = None
+        while mask:
+            low = mask & -mask
+            hv = by_position[low.bit_length() - 1]
+            if best is None or (hv['num_vms'], -hv['free_cpu']) < (best['num_vms'], -best['free_cpu']):
+                best = hv
+            mask ^= low
+        return best, False
+    
+    def add_vm(self, vm_name: str, hv_name: str, delta: int = 1):
+        """Учет размещения (delta=1) или удаления (delta=-1) ВМ в счетчиках и масках"""
+        if hv_name not in self.position:
+            return
+        i = self.position[hv_name]
+        bit = 1 << i
+        for rule_id in self.matching_rules(vm_name):
+            old = self.counts[rule_id][i]
+            new = old + delta
+            self.counts[rule_id][i] = new
+            rule = self.rules[rule_id]
+            if rule_id in self.full:
+                if new >= rule['max_per_host']:
+                    self.full[rule_id] |= bit
+                else:
+                    self.full[rule_id] &= ~bit
+            elif rule_id in self.levels:
+                levels = self.levels[rule_id]
+                levels[old] &= ~bit
+                if not levels[old]:
+                    del levels[old]
+                levels[new] = levels.get(new, 0) | bit
+    
+    def violations(self) -> List[str]:
+        """Нарушения правил текущим размещением ВМ"""
+        result = []
+        for rule_id, rule in self.rules.items():
+            counts = self.counts[rule_id]
+            group = f"ВМ группы {rule['vm_prefix']} (правило {rule_id})"
+            if rule['kind'] == 'pin':
+                outside = [hv_name for i, hv_name in enumerate(self.hosts)
+                           if counts[i] and not self.allowed[rule_id] >> i & 1]
+                if outside:
+                    result.append(f"{group} размещены вне разрешенных гипервизоров: {', '.join(outside)}")
+            elif rule['kind'] == 'max_per_host':
+                over = [f"{hv_name} ({counts[i]})" for i, hv_name in enumerate(self.hosts)
+                        if counts[i] > rule['max_per_host']]
+                if over:
+                    result.append(f"{group}: более {rule['max_per_host']} на гипервизорах {', '.join(over)}")
+            elif len(self.hosts) > 1 and max(counts) - min(counts) > 1:
+                most, least = counts.index(max(counts)), counts.index(min(counts))
+                result.append(f"{group} распределены неравномерно: {counts[most]} на {self.hosts[most]}, "
+                              f"{counts[least]} на {self.hosts[least]}")
+        return result
+
+
 class Formatter:
     """Класс для форматирования данных"""
     